@@ -1,23 +1,34 @@
 """
 API endpoints for the SwissAirDry platform.
 """
+import os
+import json
 import time
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from pydantic import BaseModel
+import uuid
+import zlib
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select, update, insert, bindparam
+from pydantic import BaseModel, TypeAdapter, ValidationError
 from datetime import datetime
 
-from database import get_db
+from database import get_db, get_async_db, get_read_db, get_async_read_db, database_stats, ASYNC_DB_ENABLED
 import models
-from device_manager import DeviceManager
-from mqtt_handler import get_mqtt_handler
-from ota_manager import OTAManager
+from device_manager import get_device_manager
+from device_state import get_device_state_store
+from ota_manager import get_ota_manager
 
 router = APIRouter()
-device_manager = DeviceManager(get_mqtt_handler())
-ota_manager = OTAManager(get_mqtt_handler())
+
+# Limits for the gateway batch ingest endpoint
+READINGS_BATCH_MAX_ITEMS = int(os.getenv("READINGS_BATCH_MAX_ITEMS", 5000))
+READINGS_BATCH_MAX_BYTES = int(os.getenv("READINGS_BATCH_MAX_BYTES", 8 * 1024 * 1024))
+
+# Limit for bulk provisioning and fleet-wide config updates
+DEVICES_BULK_MAX_ITEMS = int(os.getenv("DEVICES_BULK_MAX_ITEMS", 2000))
+
 
 # ----- Pydantic Models for request/response -----
 
@@ -63,12 +74,23 @@ class SensorReadingResponse(SensorReadingCreate):
     class Config:
         orm_mode = True
 
+class BatchSensorReading(SensorReadingCreate):
+    device_id: str
+    timestamp: Optional[datetime] = None
+
+class BatchIngestResponse(BaseModel):
+    accepted: int
+    rejected: int
+    unknown_devices: List[str]
+    per_device: Dict[str, int]
+
 class DeviceConfigBase(BaseModel):
     mqtt_topic: Optional[str] = None
     update_interval: Optional[int] = None
     display_type: Optional[str] = None
     has_sensors: Optional[bool] = None
     ota_enabled: Optional[bool] = None
+    log_sampling: Optional[Dict[str, float]] = None  # Fraction of log lines kept per level
 
 class DeviceConfigCreate(DeviceConfigBase):
     pass
@@ -83,6 +105,70 @@ class DeviceConfigResponse(DeviceConfigBase):
     class Config:
         orm_mode = True
 
+class DeviceBulkCreate(BaseModel):
+    devices: List[DeviceCreate]
+
+class DeviceBulkResult(BaseModel):
+    device_id: str
+    status: str  # created, exists, duplicate
+    id: Optional[int] = None
+
+class DeviceConfigBulkUpdate(BaseModel):
+    device_ids: Optional[List[str]] = None
+    device_type: Optional[str] = None
+    config: DeviceConfigUpdate
+
+class DeviceConfigBulkResult(BaseModel):
+    device_id: str
+    status: str  # updated, not_found, no_config
+    published: bool = False
+    command_id: Optional[str] = None
+
+class CommandStatus(BaseModel):
+    command_id: str
+    kind: str
+    transport: str
+    sent_at: datetime
+    complete: bool
+    counts: Dict[str, int]  # per ack status
+    members: Dict[str, Dict[str, Any]]
+
+class DeviceGroupBase(BaseModel):
+    name: str
+    kind: str = "site"  # site, room, job
+    description: Optional[str] = None
+
+class DeviceGroupCreate(DeviceGroupBase):
+    group_id: str
+    device_ids: List[str] = []
+
+class DeviceGroupUpdate(BaseModel):
+    name: Optional[str] = None
+    kind: Optional[str] = None
+    description: Optional[str] = None
+
+class DeviceGroupResponse(DeviceGroupBase):
+    id: int
+    group_id: str
+    created_at: datetime
+    device_ids: List[str]
+
+class DeviceGroupMembers(BaseModel):
+    device_ids: List[str]
+
+class GroupCommandResponse(BaseModel):
+    command_id: str
+    group_id: str
+    members: int
+
+class GroupCommandStatus(BaseModel):
+    command_id: str
+    group_id: str
+    sent_at: datetime
+    payload: Dict[str, Any]
+    counts: Dict[str, int]  # per ack status
+    acks: List[Dict[str, Any]]
+
 class OTAUpdateCreate(BaseModel):
     version: str
     device_type: str
@@ -98,19 +184,45 @@ class OTAUpdateResponse(OTAUpdateCreate):
     class Config:
         orm_mode = True
 
+class DeviceStateResponse(BaseModel):
+    device_id: str
+    name: Optional[str] = None
+    type: str
+    firmware_version: Optional[str] = None
+    is_online: bool
+    last_seen: Optional[datetime] = None
+    telemetry_at: Optional[datetime] = None
+    temperature: Optional[float] = None
+    humidity: Optional[float] = None
+    pressure: Optional[float] = None
+    fan_speed: Optional[int] = None
+    power_consumption: Optional[float] = None
+    power: Optional[bool] = None
+    rssi: Optional[int] = None
+
+def _live_states():
+    """
+    Return the device state store if it reflects all ingest in this process, else None.
+    """
+    store = get_device_state_store()
+    return store if store.live else None
+
 # ----- Device Endpoints -----
 
-@router.get("/devices", response_model=List[DeviceResponse])
 def get_devices(
     skip: int = 0, 
     limit: int = 100, 
     device_type: Optional[str] = None,
     is_online: Optional[bool] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get all devices with optional filtering.
     """
+    states = _live_states()
+    if states is not None:
+        return states.query(device_type=device_type, is_online=is_online, skip=skip, limit=limit)
+    
     query = db.query(models.Device)
     
     if device_type:
@@ -141,21 +253,86 @@ def create_device(device: DeviceCreate, db: Session = Depends(get_db)):
     db.refresh(db_device)
     
     # Create default config for the device
-    default_config = models.DeviceConfig(
-        device_id=db_device.id,
-        mqtt_topic=f"swissairdry/{device.device_id}",
-        update_interval=60,
-        display_type="64px" if "esp8266" in device.type.lower() else "128px",
-        has_sensors=True,
-        ota_enabled=True
-    )
+    default_config = models.DeviceConfig(**_default_config_values(db_device.id, device))
     db.add(default_config)
     db.commit()
     
+    get_device_state_store().upsert(db_device.device_id, id=db_device.id, **device.dict(exclude={"device_id"}))
     return db_device
 
+def _default_config_values(device_pk: int, device: DeviceCreate) -> dict:
+    """
+    Column values of the default configuration for a newly created device.
+    """
+    return {
+        "device_id": device_pk,
+        "mqtt_topic": f"swissairdry/{device.device_id}",
+        "update_interval": 60,
+        "display_type": "64px" if "esp8266" in device.type.lower() else "128px",
+        "has_sensors": True,
+        "ota_enabled": True,
+    }
+
+@router.post("/devices:batch", response_model=List[DeviceBulkResult], status_code=status.HTTP_201_CREATED)
+def create_devices_bulk(bulk: DeviceBulkCreate, db: Session = Depends(get_db)):
+    """
+    Create many devices and their default configs in a single transaction.
+    
+    Existing device ids (and repeats within the request) are skipped and
+    reported; everything else is inserted with INSERT ... RETURNING.
+    """
+    if len(bulk.devices) > DEVICES_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Bulk request contains {len(bulk.devices)} devices, maximum is {DEVICES_BULK_MAX_ITEMS}"
+        )
+    
+    requested_ids = [device.device_id for device in bulk.devices]
+    existing = {
+        device_id for (device_id,) in db.query(models.Device.device_id)
+        .filter(models.Device.device_id.in_(requested_ids))
+        .all()
+    } if requested_ids else set()
+    
+    results: Dict[str, dict] = {}
+    new_devices: Dict[str, DeviceCreate] = {}
+    report = []
+    for device in bulk.devices:
+        if device.device_id in existing:
+            report.append({"device_id": device.device_id, "status": "exists"})
+        elif device.device_id in new_devices:
+            report.append({"device_id": device.device_id, "status": "duplicate"})
+        else:
+            new_devices[device.device_id] = device
+            result = {"device_id": device.device_id, "status": "created"}
+            results[device.device_id] = result
+            report.append(result)
+    
+    if new_devices:
+        rows = db.execute(
+            insert(models.Device).returning(models.Device.id, models.Device.device_id),
+            [
+                {**device.dict(), "is_online": False, "last_seen": None}
+                for device in new_devices.values()
+            ]
+        ).all()
+        
+        configs = []
+        for device_pk, device_id in rows:
+            results[device_id]["id"] = device_pk
+            configs.append(_default_config_values(device_pk, new_devices[device_id]))
+        
+        db.execute(insert(models.DeviceConfig), configs)
+        db.commit()
+        
+        states = get_device_state_store()
+        for device_pk, device_id in rows:
+            states.upsert(device_id, id=device_pk, **new_devices[device_id].dict(exclude={"device_id"}))
+    
+    return report
+
 @router.get("/devices/{device_id}", response_model=DeviceResponse)
-def get_device(device_id: str, db: Session = Depends(get_db)):
+def get_device(device_id: str, db: Session = Depends(get_read_db)):
     """
     Get a specific device by its device_id.
     """
@@ -189,8 +366,60 @@ def update_device(device_id: str, device_update: DeviceUpdate, db: Session = Dep
     
     db.commit()
     db.refresh(db_device)
+    
+    get_device_state_store().upsert(
+        device_id,
+        id=db_device.id,
+        name=db_device.name,
+        firmware_version=db_device.firmware_version,
+        ip_address=db_device.ip_address,
+        mac_address=db_device.mac_address,
+        is_online=db_device.is_online,
+        last_seen=db_device.last_seen,
+    )
     return db_device
 
+@router.get("/devices/{device_id}/state", response_model=DeviceStateResponse)
+def get_device_state(device_id: str, db: Session = Depends(get_read_db)):
+    """
+    Get the current state of a device: online flag and latest telemetry.
+    
+    Served from the in-memory device states when this process owns ingest.
+    """
+    states = _live_states()
+    if states is not None:
+        state = states.get(device_id)
+        if state is not None and state["id"] is not None:
+            return state
+    
+    db_device = db.query(models.Device).filter(models.Device.device_id == device_id).first()
+    if not db_device:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Device with ID {device_id} not found"
+        )
+    reading = (
+        db.query(models.SensorReading)
+        .filter(models.SensorReading.device_id == db_device.id)
+        .order_by(models.SensorReading.timestamp.desc())
+        .first()
+    )
+    return {
+        "device_id": db_device.device_id,
+        "name": db_device.name,
+        "type": db_device.type,
+        "firmware_version": db_device.firmware_version,
+        "is_online": bool(db_device.is_online),
+        "last_seen": db_device.last_seen,
+        "telemetry_at": reading.timestamp if reading else None,
+        "temperature": reading.temperature if reading else None,
+        "humidity": reading.humidity if reading else None,
+        "pressure": reading.pressure if reading else None,
+        "fan_speed": reading.fan_speed if reading else None,
+        "power_consumption": reading.power_consumption if reading else None,
+        "rssi": db_device.ble_rssi,
+    }
+
 @router.delete("/devices/{device_id}", status_code=status.HTTP_204_NO_CONTENT)
 def delete_device(device_id: str, db: Session = Depends(get_db)):
     """
@@ -205,11 +434,11 @@ def delete_device(device_id: str, db: Session = Depends(get_db)):
     
     db.delete(db_device)
     db.commit()
+    get_device_state_store().remove(device_id)
     return None
 
 # ----- Sensor Reading Endpoints -----
 
-@router.post("/devices/{device_id}/readings", response_model=SensorReadingResponse)
 def create_sensor_reading(
     device_id: str, 
     reading: SensorReadingCreate, 
@@ -238,14 +467,14 @@ def create_sensor_reading(
     
     db.commit()
     db.refresh(db_reading)
+    get_device_state_store().update_telemetry(device_id, reading.dict(exclude_none=True), db_reading.timestamp)
     return db_reading
 
-@router.get("/devices/{device_id}/readings", response_model=List[SensorReadingResponse])
 def get_device_readings(
     device_id: str, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get sensor readings for a specific device.
@@ -265,10 +494,132 @@ def get_device_readings(
     
     return readings
 
+_batch_adapter = TypeAdapter(List[BatchSensorReading])
+
+async def _read_readings_batch(request: Request) -> List[BatchSensorReading]:
+    """
+    Read, decompress and validate the body of a batch ingest request.
+    
+    Bodies may be gzip-compressed (Content-Encoding: gzip). The whole array is
+    validated in one pass, so a rejected batch reports every invalid item.
+    """
+    body = await request.body()
+    
+    if request.headers.get("content-encoding", "").lower() == "gzip":
+        try:
+            decompressor = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            body = decompressor.decompress(body, READINGS_BATCH_MAX_BYTES + 1)
+        except zlib.error as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Invalid gzip payload: {e}"
+            )
+    
+    if len(body) > READINGS_BATCH_MAX_BYTES:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch payload exceeds {READINGS_BATCH_MAX_BYTES} bytes"
+        )
+    
+    try:
+        items = _batch_adapter.validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=json.loads(e.json(include_url=False))
+        )
+    
+    if len(items) > READINGS_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Batch contains {len(items)} readings, maximum is {READINGS_BATCH_MAX_ITEMS}"
+        )
+    
+    return items
+
+@router.post("/readings:batch", response_model=BatchIngestResponse)
+def create_sensor_readings_batch(
+    items: List[BatchSensorReading] = Depends(_read_readings_batch),
+    db: Session = Depends(get_db)
+):
+    """
+    Add sensor readings for many devices in one request (gateway ingest).
+    
+    Device ids are resolved in one query, all readings are inserted in one
+    statement and each device's last_seen is updated once per batch.
+    """
+    received_at = datetime.now()
+    device_ids = {item.device_id for item in items}
+    
+    id_map = dict(
+        db.query(models.Device.device_id, models.Device.id)
+        .filter(models.Device.device_id.in_(device_ids))
+        .all()
+    ) if device_ids else {}
+    
+    rows = []
+    telemetry = []
+    latest: Dict[int, datetime] = {}
+    per_device: Dict[str, int] = {}
+    unknown = set()
+    
+    for item in items:
+        device_pk = id_map.get(item.device_id)
+        if device_pk is None:
+            unknown.add(item.device_id)
+            continue
+        
+        timestamp = item.timestamp or received_at
+        if timestamp.tzinfo is not None:
+            timestamp = timestamp.astimezone().replace(tzinfo=None)
+        
+        rows.append({
+            "device_id": device_pk,
+            "timestamp": timestamp,
+            "temperature": item.temperature,
+            "humidity": item.humidity,
+            "pressure": item.pressure,
+            "fan_speed": item.fan_speed,
+            "power_consumption": item.power_consumption,
+        })
+        telemetry.append((timestamp, item))
+        if device_pk not in latest or timestamp > latest[device_pk]:
+            latest[device_pk] = timestamp
+        per_device[item.device_id] = per_device.get(item.device_id, 0) + 1
+    
+    # Readings are applied in timestamp order, so the newest values win; the
+    # normalized (naive) timestamps compare even when the batch mixes offsets
+    telemetry.sort(key=lambda entry: entry[0])
+    
+    if rows:
+        db.execute(insert(models.SensorReading), rows)
+        db.execute(
+            update(models.Device.__table__)
+            .where(models.Device.__table__.c.id == bindparam("b_id"))
+            .values(is_online=True, last_seen=bindparam("b_last_seen")),
+            [{"b_id": pk, "b_last_seen": ts} for pk, ts in latest.items()]
+        )
+        db.commit()
+        
+        states = get_device_state_store()
+        for timestamp, item in telemetry:
+            states.update_telemetry(
+                item.device_id,
+                item.dict(exclude_none=True, exclude={"device_id", "timestamp"}),
+                timestamp,
+            )
+    
+    return {
+        "accepted": len(rows),
+        "rejected": len(items) - len(rows),
+        "unknown_devices": sorted(unknown),
+        "per_device": per_device,
+    }
+
 # ----- Device Configuration Endpoints -----
 
 @router.get("/devices/{device_id}/config", response_model=DeviceConfigResponse)
-def get_device_config(device_id: str, db: Session = Depends(get_db)):
+def get_device_config(device_id: str, db: Session = Depends(get_read_db)):
     """
     Get configuration for a specific device.
     """
@@ -325,10 +676,304 @@ def update_device_config(
     db.refresh(config)
     
     # Publish updated config to the device via MQTT
-    device_manager.publish_config(db_device, config)
+    get_device_manager().publish_config(db_device, config)
     
     return config
 
+@router.patch("/devices/config:batch", response_model=List[DeviceConfigBulkResult])
+def update_device_configs_bulk(bulk: DeviceConfigBulkUpdate, db: Session = Depends(get_db)):
+    """
+    Apply one configuration patch to many devices in a single transaction.
+    
+    Targets are given as explicit device ids, a device type, or both. The
+    changed configs are published to the devices as one pipelined MQTT batch
+    and the result is reported per device.
+    """
+    if bulk.device_ids is None and bulk.device_type is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Either device_ids or device_type must be given"
+        )
+    
+    patch = bulk.config.dict(exclude_unset=True)
+    if not patch:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Configuration patch is empty"
+        )
+    
+    query = db.query(models.Device.id, models.Device.device_id)
+    if bulk.device_ids is not None:
+        if len(bulk.device_ids) > DEVICES_BULK_MAX_ITEMS:
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                detail=f"Bulk request contains {len(bulk.device_ids)} devices, maximum is {DEVICES_BULK_MAX_ITEMS}"
+            )
+        query = query.filter(models.Device.device_id.in_(bulk.device_ids))
+    if bulk.device_type is not None:
+        query = query.filter(models.Device.type == bulk.device_type)
+    device_map = dict(query.all())
+    
+    configs = {}
+    if device_map:
+        config_table = models.DeviceConfig.__table__
+        rows = db.execute(
+            update(config_table)
+            .where(config_table.c.device_id.in_(device_map.keys()))
+            .values(**patch)
+            .returning(*config_table.c)
+        ).all()
+        db.commit()
+        configs = {device_map[row.device_id]: row for row in rows}
+    
+    command_id = uuid.uuid4().hex
+    published = get_device_manager().publish_configs(configs, command_id=command_id) if configs else {}
+    
+    report = []
+    targets = bulk.device_ids if bulk.device_ids is not None else list(device_map.values())
+    found = set(device_map.values())
+    for device_id in targets:
+        if device_id not in found:
+            report.append({"device_id": device_id, "status": "not_found"})
+        elif device_id not in configs:
+            report.append({"device_id": device_id, "status": "no_config"})
+        else:
+            report.append({
+                "device_id": device_id,
+                "status": "updated",
+                "published": published.get(device_id, False),
+                "command_id": command_id,
+            })
+    
+    return report
+
+# ----- Device Group Endpoints -----
+
+GROUP_KINDS = ("site", "room", "job")
+
+def _group_response(group: models.DeviceGroup) -> Dict[str, Any]:
+    return {
+        "id": group.id,
+        "group_id": group.group_id,
+        "name": group.name,
+        "kind": group.kind,
+        "description": group.description,
+        "created_at": group.created_at,
+        "device_ids": sorted(device.device_id for device in group.devices),
+    }
+
+def _get_group_or_404(db: Session, group_id: str) -> models.DeviceGroup:
+    group = db.query(models.DeviceGroup).filter(models.DeviceGroup.group_id == group_id).first()
+    if not group:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Group with ID {group_id} not found"
+        )
+    return group
+
+def _check_group_kind(kind: Optional[str]) -> None:
+    if kind is not None and kind not in GROUP_KINDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Group kind must be one of {', '.join(GROUP_KINDS)}"
+        )
+
+def _load_members(db: Session, device_ids: List[str]) -> List[models.Device]:
+    if len(device_ids) > DEVICES_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"Request contains {len(device_ids)} devices, maximum is {DEVICES_BULK_MAX_ITEMS}"
+        )
+    devices = db.query(models.Device).filter(models.Device.device_id.in_(device_ids)).all()
+    missing = set(device_ids) - {device.device_id for device in devices}
+    if missing:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Devices not found: {', '.join(sorted(missing))}"
+        )
+    return devices
+
+@router.get("/groups", response_model=List[DeviceGroupResponse])
+def get_groups(kind: Optional[str] = None, db: Session = Depends(get_read_db)):
+    """
+    Get all device groups, optionally filtered by kind.
+    """
+    query = db.query(models.DeviceGroup).options(selectinload(models.DeviceGroup.devices))
+    if kind:
+        query = query.filter(models.DeviceGroup.kind == kind)
+    return [_group_response(group) for group in query.order_by(models.DeviceGroup.group_id).all()]
+
+@router.post("/groups", response_model=DeviceGroupResponse, status_code=status.HTTP_201_CREATED)
+def create_group(group: DeviceGroupCreate, db: Session = Depends(get_db)):
+    """
+    Create a device group and push the membership to its initial members.
+    """
+    _check_group_kind(group.kind)
+    if db.query(models.DeviceGroup).filter(models.DeviceGroup.group_id == group.group_id).first():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Group with ID {group.group_id} already exists"
+        )
+    
+    db_group = models.DeviceGroup(**group.dict(exclude={"device_ids"}))
+    db_group.devices = _load_members(db, group.device_ids)
+    db.add(db_group)
+    db.commit()
+    db.refresh(db_group)
+    
+    if group.device_ids:
+        get_device_manager().push_group_memberships(db, group.device_ids)
+    return _group_response(db_group)
+
+@router.get("/groups/{group_id}", response_model=DeviceGroupResponse)
+def get_group(group_id: str, db: Session = Depends(get_read_db)):
+    """
+    Get a device group with its members.
+    """
+    return _group_response(_get_group_or_404(db, group_id))
+
+@router.put("/groups/{group_id}", response_model=DeviceGroupResponse)
+def update_group(group_id: str, group: DeviceGroupUpdate, db: Session = Depends(get_db)):
+    """
+    Update the name, kind or description of a device group.
+    """
+    db_group = _get_group_or_404(db, group_id)
+    update_data = group.dict(exclude_unset=True)
+    _check_group_kind(update_data.get("kind"))
+    for key, value in update_data.items():
+        setattr(db_group, key, value)
+    db.commit()
+    db.refresh(db_group)
+    return _group_response(db_group)
+
+@router.delete("/groups/{group_id}", status_code=status.HTTP_204_NO_CONTENT)
+def delete_group(group_id: str, db: Session = Depends(get_db)):
+    """
+    Delete a device group; its former members are told to unsubscribe.
+    """
+    db_group = _get_group_or_404(db, group_id)
+    members = [device.device_id for device in db_group.devices]
+    db.delete(db_group)
+    db.commit()
+    
+    if members:
+        get_device_manager().push_group_memberships(db, members)
+    return None
+
+@router.put("/groups/{group_id}/members", response_model=DeviceGroupResponse)
+def set_group_members(group_id: str, members: DeviceGroupMembers, db: Session = Depends(get_db)):
+    """
+    Replace the members of a device group.
+    
+    Only devices that joined or left the group get their config republished.
+    """
+    db_group = _get_group_or_404(db, group_id)
+    before = {device.device_id for device in db_group.devices}
+    db_group.devices = _load_members(db, members.device_ids)
+    db.commit()
+    db.refresh(db_group)
+    
+    changed = before ^ set(members.device_ids)
+    if changed:
+        get_device_manager().push_group_memberships(db, sorted(changed))
+    return _group_response(db_group)
+
+@router.post("/groups/{group_id}/members", response_model=DeviceGroupResponse)
+def add_group_members(group_id: str, members: DeviceGroupMembers, db: Session = Depends(get_db)):
+    """
+    Add devices to a device group.
+    """
+    db_group = _get_group_or_404(db, group_id)
+    current = {device.device_id for device in db_group.devices}
+    added = [device for device in _load_members(db, members.device_ids) if device.device_id not in current]
+    db_group.devices.extend(added)
+    db.commit()
+    db.refresh(db_group)
+    
+    if added:
+        get_device_manager().push_group_memberships(db, [device.device_id for device in added])
+    return _group_response(db_group)
+
+@router.delete("/groups/{group_id}/members/{device_id}", response_model=DeviceGroupResponse)
+def remove_group_member(group_id: str, device_id: str, db: Session = Depends(get_db)):
+    """
+    Remove a device from a device group.
+    """
+    db_group = _get_group_or_404(db, group_id)
+    member = next((device for device in db_group.devices if device.device_id == device_id), None)
+    if member is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Device {device_id} is not a member of group {group_id}"
+        )
+    db_group.devices.remove(member)
+    db.commit()
+    db.refresh(db_group)
+    
+    get_device_manager().push_group_memberships(db, [device_id])
+    return _group_response(db_group)
+
+@router.post("/groups/{group_id}/control/power", response_model=GroupCommandResponse)
+def control_group_power(group_id: str, state: bool, db: Session = Depends(get_db)):
+    """
+    Turn all devices of a group on or off with one MQTT publish.
+    """
+    db_group = _get_group_or_404(db, group_id)
+    result = get_device_manager().control_group_power(db, db_group, state)
+    return {"group_id": group_id, **result}
+
+@router.post("/groups/{group_id}/control/fan", response_model=GroupCommandResponse)
+def control_group_fan(group_id: str, speed: int, db: Session = Depends(get_db)):
+    """
+    Set the fan speed of all devices of a group with one MQTT publish.
+    """
+    if speed < 0 or speed > 100:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Fan speed must be between 0 and 100"
+        )
+    db_group = _get_group_or_404(db, group_id)
+    result = get_device_manager().control_group_fan(db, db_group, speed)
+    return {"group_id": group_id, **result}
+
+@router.get("/groups/{group_id}/commands/{command_id}", response_model=GroupCommandStatus)
+def get_group_command_status(group_id: str, command_id: str, db: Session = Depends(get_read_db)):
+    """
+    Get the per-member acknowledgement state of a group command.
+    """
+    command = (
+        db.query(models.GroupCommand)
+        .join(models.DeviceGroup)
+        .filter(models.GroupCommand.command_id == command_id, models.DeviceGroup.group_id == group_id)
+        .first()
+    )
+    if not command:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Command {command_id} not found for group {group_id}"
+        )
+    
+    acks = (
+        db.query(models.GroupCommandAck)
+        .filter(models.GroupCommandAck.command_id == command_id)
+        .order_by(models.GroupCommandAck.device_id)
+        .all()
+    )
+    counts: Dict[str, int] = {}
+    for ack in acks:
+        counts[ack.status] = counts.get(ack.status, 0) + 1
+    return {
+        "command_id": command_id,
+        "group_id": group_id,
+        "sent_at": command.sent_at,
+        "payload": command.payload or {},
+        "counts": counts,
+        "acks": [
+            {"device_id": ack.device_id, "status": ack.status, "acked_at": ack.acked_at, "message": ack.message}
+            for ack in acks
+        ],
+    }
+
 # ----- OTA Update Endpoints -----
 
 @router.post("/ota-updates", response_model=OTAUpdateResponse, status_code=status.HTTP_201_CREATED)
@@ -348,7 +993,7 @@ def get_ota_updates(
     limit: int = 100, 
     device_type: Optional[str] = None,
     is_active: bool = True,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Get all OTA updates with optional filtering.
@@ -364,7 +1009,7 @@ def get_ota_updates(
     return query.order_by(models.OTAUpdate.release_date.desc()).offset(skip).limit(limit).all()
 
 @router.get("/ota-updates/latest/{device_type}", response_model=OTAUpdateResponse)
-def get_latest_ota_update(device_type: str, db: Session = Depends(get_db)):
+def get_latest_ota_update(device_type: str, db: Session = Depends(get_read_db)):
     """
     Get the latest OTA update for a specific device type.
     """
@@ -420,7 +1065,7 @@ def trigger_device_update(device_id: str, db: Session = Depends(get_db)):
         return {"message": f"Device {device_id} is already on the latest version {latest_update.version}"}
     
     # Trigger the update via OTA manager
-    result = ota_manager.trigger_update(db_device, latest_update)
+    result = get_ota_manager().trigger_update(db_device, latest_update)
     
     return {"message": f"OTA update to version {latest_update.version} triggered for device {device_id}"}
 
@@ -439,9 +1084,12 @@ def control_device_power(device_id: str, state: bool, db: Session = Depends(get_
         )
     
     # Send power control command to device
-    result = device_manager.control_power(db_device, state)
+    command_id = get_device_manager().control_power(db_device, state)
     
-    return {"message": f"Power {'on' if state else 'off'} command sent to device {device_id}"}
+    return {
+        "message": f"Power {'on' if state else 'off'} command sent to device {device_id}",
+        "command_id": command_id,
+    }
 
 @router.post("/devices/{device_id}/control/fan")
 def control_device_fan(device_id: str, speed: int, db: Session = Depends(get_db)):
@@ -462,18 +1110,62 @@ def control_device_fan(device_id: str, speed: int, db: Session = Depends(get_db)
         )
     
     # Send fan control command to device
-    result = device_manager.control_fan(db_device, speed)
+    command_id = get_device_manager().control_fan(db_device, speed)
+    
+    return {
+        "message": f"Fan speed set to {speed}% for device {device_id}",
+        "command_id": command_id,
+    }
+
+# ----- Command Tracking Endpoints -----
+
+COMMAND_WAIT_MAX = 60
+
+@router.get("/commands/stats")
+def get_command_stats():
+    """
+    Get command counters and round-trip latency histograms per device type and transport.
+    """
+    return get_device_manager().command_stats()
+
+@router.get("/commands/{command_id}", response_model=CommandStatus)
+def get_command_status(command_id: str, wait: float = 0):
+    """
+    Get the acknowledgement state of a command.
     
-    return {"message": f"Fan speed set to {speed}% for device {device_id}"}
+    With ``wait`` (seconds, at most 60) the request blocks until every target
+    acknowledged or timed out, or until the wait elapses.
+    """
+    if wait < 0 or wait > COMMAND_WAIT_MAX:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"wait must be between 0 and {COMMAND_WAIT_MAX} seconds"
+        )
+    try:
+        result = get_device_manager().command_status(command_id, wait=wait)
+    except TimeoutError:
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+            detail=f"Command tracker did not answer for {command_id}"
+        )
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Command {command_id} not found"
+        )
+    return result
 
-@router.get("/system/status")
-def get_system_status(db: Session = Depends(get_db)):
+def get_system_status(db: Session = Depends(get_read_db)):
     """
     Get overall system status.
     """
-    total_devices = db.query(func.count(models.Device.id)).scalar()
-    online_devices = db.query(func.count(models.Device.id)).filter(models.Device.is_online == True).scalar()
-    latest_readings = db.query(models.SensorReading).order_by(models.SensorReading.timestamp.desc()).limit(10).all()
+    states = _live_states()
+    if states is not None:
+        counts = states.counts()
+        total_devices, online_devices = counts["total"], counts["online"]
+    else:
+        total_devices = db.query(func.count(models.Device.id)).scalar()
+        online_devices = db.query(func.count(models.Device.id)).filter(models.Device.is_online == True).scalar()
     
     return {
         "total_devices": total_devices,
@@ -482,3 +1174,146 @@ def get_system_status(db: Session = Depends(get_db)):
         "system_time": datetime.now(),
         "uptime": time.time()  # This would be replaced with actual system uptime
     }
+
+@router.get("/system/database")
+def get_database_status():
+    """
+    Get connection pool usage and read replica health.
+    """
+    return database_stats()
+
+
+# ----- Async variants of the hot endpoints -----
+
+async def get_devices_async(
+    skip: int = 0, 
+    limit: int = 100, 
+    device_type: Optional[str] = None,
+    is_online: Optional[bool] = None,
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Get all devices with optional filtering (async engine).
+    """
+    states = _live_states()
+    if states is not None:
+        return states.query(device_type=device_type, is_online=is_online, skip=skip, limit=limit)
+    
+    query = select(models.Device)
+    
+    if device_type:
+        query = query.where(models.Device.type == device_type)
+    
+    if is_online is not None:
+        query = query.where(models.Device.is_online == is_online)
+    
+    result = await db.execute(query.offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def create_sensor_reading_async(
+    device_id: str, 
+    reading: SensorReadingCreate, 
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Add a new sensor reading for a device (async engine).
+    
+    The device lookup and the online/last_seen update are folded into a single
+    UPDATE ... RETURNING, so an ingest costs two statements instead of three.
+    """
+    result = await db.execute(
+        update(models.Device)
+        .where(models.Device.device_id == device_id)
+        .values(is_online=True, last_seen=func.now())
+        .returning(models.Device.id)
+    )
+    device_pk = result.scalar_one_or_none()
+    if device_pk is None:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Device with ID {device_id} not found"
+        )
+    
+    result = await db.execute(
+        insert(models.SensorReading)
+        .values(device_id=device_pk, **reading.dict())
+        .returning(models.SensorReading)
+    )
+    db_reading = result.scalar_one()
+    
+    await db.commit()
+    get_device_state_store().update_telemetry(device_id, reading.dict(exclude_none=True), db_reading.timestamp)
+    return db_reading
+
+async def get_device_readings_async(
+    device_id: str, 
+    skip: int = 0, 
+    limit: int = 100, 
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """
+    Get sensor readings for a specific device (async engine).
+    """
+    result = await db.execute(
+        select(models.Device.id).where(models.Device.device_id == device_id)
+    )
+    device_pk = result.scalar_one_or_none()
+    if device_pk is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Device with ID {device_id} not found"
+        )
+    
+    result = await db.execute(
+        select(models.SensorReading)
+        .where(models.SensorReading.device_id == device_pk)
+        .order_by(models.SensorReading.timestamp.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    return result.scalars().all()
+
+async def get_system_status_async(db: AsyncSession = Depends(get_async_read_db)):
+    """
+    Get overall system status (async engine).
+    """
+    states = _live_states()
+    if states is not None:
+        counts = states.counts()
+        total_devices, online_devices = counts["total"], counts["online"]
+    else:
+        result = await db.execute(
+            select(
+                func.count(models.Device.id),
+                func.count(models.Device.id).filter(models.Device.is_online == True),
+            )
+        )
+        total_devices, online_devices = result.one()
+    
+    return {
+        "total_devices": total_devices,
+        "online_devices": online_devices,
+        "offline_devices": total_devices - online_devices,
+        "system_time": datetime.now(),
+        "uptime": time.time()  # This would be replaced with actual system uptime
+    }
+
+# ----- Hot endpoint registration -----
+# The async variants are used whenever the asyncpg engine is available, so these
+# requests no longer hold a threadpool slot while Postgres works.
+
+_HOT_ROUTES = [
+    ("/devices", "GET", List[DeviceResponse], get_devices, get_devices_async),
+    ("/devices/{device_id}/readings", "POST", SensorReadingResponse, create_sensor_reading, create_sensor_reading_async),
+    ("/devices/{device_id}/readings", "GET", List[SensorReadingResponse], get_device_readings, get_device_readings_async),
+    ("/system/status", "GET", None, get_system_status, get_system_status_async),
+]
+
+for _path, _method, _response_model, _sync_endpoint, _async_endpoint in _HOT_ROUTES:
+    router.add_api_route(
+        _path,
+        _async_endpoint if ASYNC_DB_ENABLED else _sync_endpoint,
+        methods=[_method],
+        response_model=_response_model,
+    )
@@ -0,0 +1,137 @@
+"""
+Sensordaten aus BLE-Advertisements für die SwissAirDry Plattform.
+
+SwissAirDry-Geräte packen ihre aktuellen Messwerte in die herstellerspezifischen
+Daten (Manufacturer Specific Data) ihrer Advertisements. So können beliebig
+viele Geräte ohne GATT-Verbindung überwacht werden; Verbindungen bleiben
+Steuerbefehlen und Konfigurationsänderungen vorbehalten.
+
+Format (Version 1, Little Endian, 12 Bytes nach der Company-ID):
+
+    Offset  Typ     Feld
+    0       uint8   Version (1)
+    1       uint8   Flags (Bit 0: eingeschaltet)
+    2       uint8   Messzähler, wird bei jeder neuen Messung erhöht
+    3       int16   Temperatur in 0.01 °C
+    5       uint16  Luftfeuchtigkeit in 0.01 %
+    7       uint16  Luftdruck in 0.1 hPa
+    9       uint8   Lüftergeschwindigkeit in %
+    10      uint16  Leistungsaufnahme in 0.1 W
+
+Nicht vorhandene Werte werden mit dem Maximalwert des Typs (0x7FFF, 0xFFFF,
+0xFF) übertragen.
+"""
+
+import os
+import struct
+from collections import OrderedDict
+from typing import Any, Dict, Mapping, Optional
+
+# Bluetooth-SIG Company-ID im Advertisement (0xFFFF: nicht registriert / Tests)
+SWISSAIRDRY_COMPANY_ID = int(os.getenv("BLE_COMPANY_ID", "0xFFFF"), 0)
+
+ADVERTISEMENT_VERSION = 1
+
+_FORMAT = struct.Struct("<BBBhHHBH")
+
+# Feld -> (Skalierung, Wert für "nicht vorhanden")
+_FIELDS = (
+    ("temperature", 0.01, 0x7FFF),
+    ("humidity", 0.01, 0xFFFF),
+    ("pressure", 0.1, 0xFFFF),
+    ("fan_speed", 1, 0xFF),
+    ("power_consumption", 0.1, 0xFFFF),
+)
+
+FLAG_POWER = 0x01
+
+def decode_manufacturer_data(data: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Dekodiert die Messwerte aus den herstellerspezifischen Advertisement-Daten.
+
+    Args:
+        data: Bytes nach der Company-ID
+
+    Returns:
+        dict: Messwerte, Einschaltzustand und Messzähler, oder None bei
+        unbekanntem Format
+    """
+    if len(data) < _FORMAT.size or data[0] != ADVERTISEMENT_VERSION:
+        return None
+
+    version, flags, sequence, *raw_values = _FORMAT.unpack_from(data)
+
+    sensor_data: Dict[str, Any] = {"power": bool(flags & FLAG_POWER), "sequence": sequence}
+    for (field, scale, missing), raw in zip(_FIELDS, raw_values):
+        if raw == missing:
+            sensor_data[field] = None
+        elif scale == 1:
+            sensor_data[field] = raw
+        else:
+            sensor_data[field] = round(raw * scale, 2)
+    return sensor_data
+
+def encode_manufacturer_data(sensor_data: Mapping[str, Any], sequence: int = 0) -> bytes:
+    """
+    Kodiert Messwerte im Advertisement-Format (Gegenstück zur Firmware, für Tests).
+
+    Args:
+        sensor_data: Messwerte wie in decode_manufacturer_data
+        sequence: Messzähler (0-255)
+
+    Returns:
+        bytes: Daten für die Company-ID SWISSAIRDRY_COMPANY_ID
+    """
+    raw_values = []
+    for field, scale, missing in _FIELDS:
+        value = sensor_data.get(field)
+        raw_values.append(missing if value is None else int(round(value / scale)))
+    flags = FLAG_POWER if sensor_data.get("power") else 0
+    return _FORMAT.pack(ADVERTISEMENT_VERSION, flags, sequence & 0xFF, *raw_values)
+
+class AdvertisementDeduplicator:
+    """
+    Erkennt wiederholte Advertisements derselben Messung.
+
+    Geräte senden dieselbe Messung mehrmals pro Sekunde; neu ist ein
+    Advertisement erst, wenn sich Messzähler oder Nutzdaten ändern. Der
+    Speicher ist auf ``max_entries`` Geräte begrenzt (älteste zuerst entfernt).
+    """
+
+    def __init__(self, max_entries: int = 4096):
+        """
+        Initialisiert den Deduplizierer.
+
+        Args:
+            max_entries: Maximale Anzahl gemerkter Geräte
+        """
+        self.max_entries = max_entries
+        self._last: "OrderedDict[str, bytes]" = OrderedDict()
+        self.accepted = 0
+        self.duplicates = 0
+
+    def is_new(self, address: str, payload: bytes) -> bool:
+        """
+        Prüft, ob ein Advertisement eine neue Messung enthält, und merkt es sich.
+
+        Args:
+            address: BLE-Adresse des Geräts
+            payload: Herstellerspezifische Daten
+        """
+        if self._last.get(address) == payload:
+            self._last.move_to_end(address)
+            self.duplicates += 1
+            return False
+
+        self._last[address] = bytes(payload)
+        self._last.move_to_end(address)
+        if len(self._last) > self.max_entries:
+            self._last.popitem(last=False)
+        self.accepted += 1
+        return True
+
+    def forget(self, address: str):
+        """
+        Vergisst den letzten Stand eines Geräts.
+        """
+        self._last.pop(address, None)
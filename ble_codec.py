@@ -0,0 +1,278 @@
+"""
+Binärer Nutzdaten-Codec für die BLE-Charakteristiken der SwissAirDry Plattform.
+
+JSON-Nachrichten über GATT überschreiten oft die Standard-MTU (20 Byte Nutzlast)
+und erzwingen fragmentierte Übertragungen. Dieser Codec kodiert Sensordaten,
+Steuerbefehle und Konfigurationen als kompakte TLV-Rahmen:
+
+    Byte 0      0xA0 | Codec-Version (aktuell 1)
+    Byte 1      Nachrichtentyp (1 = Sensordaten, 2 = Befehl, 3 = Konfiguration)
+    danach      Einträge aus Tag (uint8), Länge (uint8) und Wert
+
+Zahlen sind Little Endian, Festkommawerte werden skaliert übertragen (z.B.
+Temperatur in 0.01 °C als int16), Zeitstempel als Unix-Sekunden (uint32),
+Korrelations-IDs (``command_id``, Hex-Text) als Rohbytes.
+Unbekannte Tags werden beim Dekodieren übersprungen, damit neuere Geräte mit
+älteren Servern kompatibel bleiben.
+
+JSON bleibt als Rückfallebene erhalten: Geräte melden den unterstützten Codec
+im Feld ``codec_version`` der Geräteinformation (DEVICE_INFO_CHAR_UUID); ohne
+Angabe wird JSON gesendet. Empfangene Daten werden am ersten Byte erkannt, da
+JSON-Objekte immer mit ``{`` beginnen.
+"""
+
+import json
+import struct
+from datetime import datetime
+from typing import Any, Dict, Mapping, Optional, Tuple
+
+CODEC_VERSION = 1
+FRAME_MARKER = 0xA0
+
+# Nachrichtentypen
+MSG_SENSOR = 1
+MSG_COMMAND = 2
+MSG_CONFIG = 3
+
+class CodecError(ValueError):
+    """
+    Nachricht kann nicht kodiert oder dekodiert werden.
+    """
+
+# Werttypen: Name -> (struct-Format, Skalierung); "str", "hex" und "time" werden gesondert behandelt
+_TYPES = {
+    "bool": ("<B", None),
+    "u8": ("<B", 1),
+    "u16": ("<H", 1),
+    "u32": ("<I", 1),
+    "i16/100": ("<h", 100),
+    "u16/100": ("<H", 100),
+    "u32/10": ("<I", 10),
+    "time": ("<I", None),
+}
+
+# Schema pro Nachrichtentyp: Feld -> (Tag, Werttyp)
+SCHEMAS: Dict[int, Dict[str, Tuple[int, str]]] = {
+    MSG_SENSOR: {
+        "temperature": (1, "i16/100"),
+        "humidity": (2, "u16/100"),
+        "pressure": (3, "u32/10"),
+        "fan_speed": (4, "u8"),
+        "power_consumption": (5, "u32/10"),
+        "power": (6, "bool"),
+        "timestamp": (7, "time"),
+    },
+    MSG_COMMAND: {
+        "power": (1, "bool"),
+        "fan_speed": (2, "u8"),
+        "action": (3, "str"),
+        "task_id": (4, "u32"),
+        "name": (5, "str"),
+        "duration": (6, "u16"),
+        "target_temperature": (7, "i16/100"),
+        "target_humidity": (8, "u16/100"),
+        "timestamp": (9, "time"),
+        "command_id": (10, "hex"),
+    },
+    MSG_CONFIG: {
+        "update_interval": (1, "u16"),
+        "display_type": (2, "str"),
+        "has_sensors": (3, "bool"),
+        "ota_enabled": (4, "bool"),
+        "ble_enabled": (5, "bool"),
+        "ble_advertise": (6, "bool"),
+        "ble_scan_interval": (7, "u16"),
+        "timestamp": (8, "time"),
+        "command_id": (9, "hex"),
+    },
+}
+
+# Umkehrung für das Dekodieren: Nachrichtentyp -> Tag -> (Feld, Werttyp)
+_TAGS = {
+    msg_type: {tag: (field, kind) for field, (tag, kind) in schema.items()}
+    for msg_type, schema in SCHEMAS.items()
+}
+
+def _encode_value(field: str, kind: str, value: Any) -> bytes:
+    if kind == "str":
+        raw = str(value).encode("utf-8")
+        if len(raw) > 255:
+            raise CodecError(f"{field}: Text länger als 255 Byte")
+        return raw
+    if kind == "hex":
+        try:
+            raw = bytes.fromhex(value)
+        except (TypeError, ValueError):
+            raise CodecError(f"{field}: Hex-Text erwartet")
+        if len(raw) > 255:
+            raise CodecError(f"{field}: länger als 255 Byte")
+        return raw
+
+    fmt, scale = _TYPES[kind]
+    if kind == "bool":
+        number = 1 if value else 0
+    elif kind == "time":
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        number = int(value.timestamp()) if isinstance(value, datetime) else int(value)
+    else:
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise CodecError(f"{field}: Zahl erwartet, {type(value).__name__} erhalten")
+        number = int(round(value * scale))
+
+    try:
+        return struct.pack(fmt, number)
+    except struct.error:
+        raise CodecError(f"{field}: Wert {value!r} außerhalb des Wertebereichs")
+
+def _decode_value(field: str, kind: str, raw: bytes) -> Any:
+    if kind == "str":
+        try:
+            return raw.decode("utf-8")
+        except UnicodeDecodeError:
+            raise CodecError(f"{field}: ungültiges UTF-8")
+    if kind == "hex":
+        return raw.hex()
+
+    fmt, scale = _TYPES[kind]
+    if len(raw) != struct.calcsize(fmt):
+        raise CodecError(f"{field}: Länge {len(raw)} passt nicht zum Typ {kind}")
+    (number,) = struct.unpack(fmt, raw)
+    if kind == "bool":
+        return bool(number)
+    if kind == "time":
+        return datetime.fromtimestamp(number).isoformat()
+    if scale == 1:
+        return number
+    return number / scale
+
+def encode(msg_type: int, message: Mapping[str, Any]) -> bytes:
+    """
+    Kodiert eine Nachricht als Binärrahmen.
+
+    Felder mit dem Wert None werden ausgelassen.
+
+    Args:
+        msg_type: MSG_SENSOR, MSG_COMMAND oder MSG_CONFIG
+        message: Nachricht als Dictionary
+
+    Returns:
+        bytes: Kodierter Rahmen
+
+    Raises:
+        CodecError: Bei unbekannten Feldern oder Werten außerhalb des Wertebereichs
+    """
+    schema = SCHEMAS.get(msg_type)
+    if schema is None:
+        raise CodecError(f"Unbekannter Nachrichtentyp {msg_type}")
+
+    frame = bytearray((FRAME_MARKER | CODEC_VERSION, msg_type))
+    for field, value in message.items():
+        if value is None:
+            continue
+        if field not in schema:
+            raise CodecError(f"Feld {field} ist im Binärformat nicht definiert")
+        tag, kind = schema[field]
+        raw = _encode_value(field, kind, value)
+        frame += bytes((tag, len(raw))) + raw
+    return bytes(frame)
+
+def decode(data: bytes) -> Tuple[int, Dict[str, Any]]:
+    """
+    Dekodiert einen Binärrahmen (Referenz-Decoder).
+
+    Args:
+        data: Empfangene Bytes
+
+    Returns:
+        tuple: Nachrichtentyp und Nachricht als Dictionary
+
+    Raises:
+        CodecError: Bei ungültigem oder abgeschnittenem Rahmen
+    """
+    if len(data) < 2:
+        raise CodecError("Rahmen zu kurz")
+    if data[0] & 0xF0 != FRAME_MARKER:
+        raise CodecError("Kein Binärrahmen")
+    if data[0] & 0x0F != CODEC_VERSION:
+        raise CodecError(f"Nicht unterstützte Codec-Version {data[0] & 0x0F}")
+
+    msg_type = data[1]
+    tags = _TAGS.get(msg_type)
+    if tags is None:
+        raise CodecError(f"Unbekannter Nachrichtentyp {msg_type}")
+
+    message: Dict[str, Any] = {}
+    offset = 2
+    while offset < len(data):
+        if offset + 2 > len(data):
+            raise CodecError("Abgeschnittener Eintrag")
+        tag, length = data[offset], data[offset + 1]
+        offset += 2
+        if offset + length > len(data):
+            raise CodecError(f"Eintrag mit Tag {tag} abgeschnitten")
+        raw = bytes(data[offset:offset + length])
+        offset += length
+
+        if tag not in tags:
+            # Unbekannte Felder neuerer Firmware überspringen
+            continue
+        field, kind = tags[tag]
+        message[field] = _decode_value(field, kind, raw)
+    return msg_type, message
+
+def is_binary(data: bytes) -> bool:
+    """
+    Prüft, ob empfangene Bytes ein Binärrahmen (und kein JSON) sind.
+    """
+    return len(data) > 0 and data[0] & 0xF0 == FRAME_MARKER
+
+def decode_payload(data: bytes, expected_type: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Dekodiert empfangene Nutzdaten im Binär- oder JSON-Format.
+
+    Args:
+        data: Empfangene Bytes
+        expected_type: Erwarteter Nachrichtentyp bei Binärrahmen
+
+    Returns:
+        dict: Dekodierte Nachricht
+
+    Raises:
+        CodecError: Bei ungültigen Daten oder unerwartetem Nachrichtentyp
+    """
+    if is_binary(data):
+        msg_type, message = decode(data)
+        if expected_type is not None and msg_type != expected_type:
+            raise CodecError(f"Nachrichtentyp {msg_type} statt {expected_type} empfangen")
+        return message
+
+    try:
+        message = json.loads(bytes(data).decode("utf-8"))
+    except (UnicodeDecodeError, ValueError) as e:
+        raise CodecError(f"Weder Binärrahmen noch JSON: {e}")
+    if not isinstance(message, dict):
+        raise CodecError("JSON-Nachricht ist kein Objekt")
+    return message
+
+def encode_payload(msg_type: int, message: Mapping[str, Any], codec_version: int = 0) -> bytes:
+    """
+    Kodiert eine Nachricht im vom Gerät unterstützten Format.
+
+    Nachrichten, die sich nicht binär darstellen lassen (z.B. zusätzliche
+    Felder), werden als JSON gesendet.
+
+    Args:
+        msg_type: MSG_SENSOR, MSG_COMMAND oder MSG_CONFIG
+        message: Nachricht als Dictionary
+        codec_version: Vom Gerät gemeldete Codec-Version (0 = nur JSON)
+
+    Returns:
+        bytes: Kodierte Nutzdaten
+    """
+    if codec_version >= CODEC_VERSION:
+        try:
+            return encode(msg_type, message)
+        except CodecError:
+            pass
+    return json.dumps(message).encode("utf-8")
@@ -0,0 +1,184 @@
+"""
+Befehlswarteschlange pro BLE-Gerät für die SwissAirDry Plattform.
+
+Schnelle Schieberegler-Bewegungen erzeugen Serien von Lüfterbefehlen, von denen
+nur der letzte zählt. Dieses Modul serialisiert GATT-Schreibvorgänge pro Gerät,
+fasst überholte Steuerbefehle zusammen (der letzte Wert gewinnt) und misst die
+Latenz jedes Befehls vom Einreihen bis zum abgeschlossenen Schreibvorgang.
+"""
+
+import time
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Logger für die Befehlswarteschlange
+logger = logging.getLogger("ble_commands")
+
+# Felder, bei denen nur der zuletzt gesendete Wert zählt
+COALESCE_FIELDS = ("power", "fan_speed")
+
+# Felder, die für das Zusammenfassen keine Rolle spielen
+_IGNORED_FIELDS = ("timestamp", "command_id")
+
+class _PendingCommand:
+    """
+    Eingereihter Befehl mit allen Aufrufern, die auf sein Ergebnis warten.
+    """
+    __slots__ = ("channel", "command", "require_ack", "waiters")
+
+    def __init__(self, channel: str, command: Dict[str, Any], require_ack: bool):
+        self.channel = channel
+        self.command = command
+        self.require_ack = require_ack
+        self.waiters: List[tuple] = []  # (Future, Einreihzeitpunkt)
+
+def coalesce_key(command: Dict[str, Any]) -> Optional[str]:
+    """
+    Bestimmt, welche eingereihten Befehle ein Befehl ersetzt.
+
+    Args:
+        command: Der Befehl
+
+    Returns:
+        str: Schlüssel für reine Steuerbefehle (z.B. "fan_speed"), sonst None
+    """
+    fields = [field for field in command if field not in _IGNORED_FIELDS]
+    if fields and all(field in COALESCE_FIELDS for field in fields):
+        return "+".join(sorted(fields))
+    return None
+
+class BLECommandQueue:
+    """
+    Serialisiert und bündelt Befehle pro Gerät.
+
+    Jedes Gerät hat eine eigene FIFO-Warteschlange, die von höchstens einem
+    Task abgearbeitet wird. Ein neuer Steuerbefehl ersetzt einen noch nicht
+    gesendeten Befehl mit demselben Schlüssel; dessen Aufrufer erhalten das
+    Ergebnis des neueren Befehls. Steuerbefehle werden ohne Bestätigung
+    (Write Without Response) geschrieben, andere Befehle mit Bestätigung.
+    """
+
+    def __init__(
+        self,
+        write: Callable[[str, str, Dict[str, Any], bool], Awaitable[bool]],
+        latency_window: int = 500
+    ):
+        """
+        Initialisiert die Befehlswarteschlange.
+
+        Args:
+            write: Coroutine (Adresse, Kanal, Nachricht, mit Bestätigung) -> Erfolg
+            latency_window: Anzahl gemerkter Latenzen pro Befehlsart
+        """
+        self._write = write
+        self._latency_window = latency_window
+        self._pending: Dict[str, "OrderedDict[Any, _PendingCommand]"] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._seq = itertools.count()
+        self._latencies: Dict[str, deque] = {}
+        self.metrics = {
+            "submitted": 0,
+            "written": 0,
+            "failed": 0,
+            "coalesced": 0,
+            "without_response": 0,
+        }
+
+    async def submit(
+        self,
+        address: str,
+        command: Dict[str, Any],
+        require_ack: Optional[bool] = None,
+        channel: str = "command"
+    ) -> bool:
+        """
+        Reiht einen Befehl ein und wartet auf den Schreibvorgang.
+
+        Args:
+            address: BLE-Adresse des Geräts
+            command: Der Befehl
+            require_ack: Mit Bestätigung schreiben (Standard: nur für Befehle,
+                die nicht zusammengefasst werden)
+            channel: Ziel des Schreibvorgangs ("command" oder "config")
+
+        Returns:
+            bool: Erfolg des Schreibvorgangs (bei zusammengefassten Befehlen
+            der des ersetzenden Befehls)
+        """
+        field_key = coalesce_key(command)
+        key = (channel, field_key) if field_key is not None else None
+        if require_ack is None:
+            require_ack = key is None
+
+        pending = self._pending.setdefault(address, OrderedDict())
+        future = asyncio.get_running_loop().create_future()
+        self.metrics["submitted"] += 1
+
+        if key is not None and key in pending:
+            # Letzter Wert gewinnt; Position in der Warteschlange bleibt erhalten
+            entry = pending[key]
+            entry.command = command
+            entry.require_ack = entry.require_ack or require_ack
+            self.metrics["coalesced"] += 1
+        else:
+            entry = _PendingCommand(channel, command, require_ack)
+            pending[key if key is not None else next(self._seq)] = entry
+        entry.waiters.append((future, time.perf_counter()))
+
+        if address not in self._workers:
+            self._workers[address] = asyncio.create_task(self._drain(address))
+        return await future
+
+    async def _drain(self, address: str):
+        """
+        Arbeitet die Warteschlange eines Geräts ab, bis sie leer ist.
+        """
+        pending = self._pending[address]
+        try:
+            while pending:
+                key, entry = pending.popitem(last=False)
+                try:
+                    success = await self._write(address, entry.channel, entry.command, entry.require_ack)
+                except Exception as e:
+                    logger.error(f"Fehler beim Schreiben des Befehls an {address}: {e}")
+                    success = False
+
+                self.metrics["written" if success else "failed"] += 1
+                if success and not entry.require_ack:
+                    self.metrics["without_response"] += 1
+
+                done = time.perf_counter()
+                kind = key[1] if isinstance(key, tuple) else str(entry.command.get("action", entry.channel))
+                latencies = self._latencies.setdefault(kind, deque(maxlen=self._latency_window))
+                for future, submitted_at in entry.waiters:
+                    latencies.append(done - submitted_at)
+                    if not future.done():
+                        future.set_result(success)
+        finally:
+            del self._workers[address]
+            if not pending:
+                del self._pending[address]
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Gibt Zähler und Latenzen (ms) pro Befehlsart zurück.
+        """
+        latency = {}
+        for kind, values in self._latencies.items():
+            ordered = sorted(values)
+            if not ordered:
+                continue
+            latency[kind] = {
+                "count": len(ordered),
+                "avg_ms": 1000.0 * sum(ordered) / len(ordered),
+                "p95_ms": 1000.0 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))],
+                "max_ms": 1000.0 * ordered[-1],
+            }
+        return {
+            **self.metrics,
+            "queued": sum(len(pending) for pending in self._pending.values()),
+            "latency": latency,
+        }
@@ -0,0 +1,327 @@
+"""
+BLE-Verbindungsverwaltung für die SwissAirDry Plattform.
+
+Bluetooth-Adapter halten nur wenige gleichzeitige GATT-Verbindungen. Dieses
+Modul begrenzt die Anzahl aktiver Verbindungen, arbeitet Verbindungswünsche
+nach Priorität ab und trennt bei Bedarf die am längsten ungenutzte Verbindung.
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Dict, List, Set, Tuple
+
+# Logger für die Verbindungsverwaltung
+logger = logging.getLogger("ble_connections")
+
+# Prioritäten (kleiner = wichtiger)
+PRIORITY_COMMAND = 0  # Ein Steuerbefehl wartet auf die Verbindung
+PRIORITY_TASK = 1     # Gerät mit laufender oder geplanter Aufgabe
+PRIORITY_DEFAULT = 2  # Neu entdecktes Gerät ohne Aufgabe
+
+class BLEConnectionManager:
+    """
+    Verwaltet eine begrenzte Zahl gleichzeitiger BLE-Verbindungen.
+
+    Verbindungswünsche landen in einer Prioritätswarteschlange. Ist die
+    Obergrenze erreicht, wird die am längsten ungenutzte Verbindung (LRU)
+    getrennt, sofern sie lange genug unbenutzt ist: für Steuerbefehle jede,
+    für Hintergrundverbindungen nur weniger wichtige, damit sich gleichrangige
+    Geräte nicht gegenseitig verdrängen. Unerwartete Abbrüche werden mit exponentieller Verzögerung
+    erneut eingereiht, statt eigene Wiederverbindungs-Tasks zu starten.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[str], Awaitable[bool]],
+        disconnect: Callable[[str], Awaitable[None]],
+        max_links: int = 4,
+        idle_timeout: float = 120.0,
+        max_attempts: int = 5
+    ):
+        """
+        Initialisiert die Verbindungsverwaltung.
+
+        Args:
+            connect: Coroutine, die eine Verbindung zu einer Adresse aufbaut
+            disconnect: Coroutine, die die Verbindung zu einer Adresse trennt
+            max_links: Maximale Anzahl gleichzeitiger Verbindungen
+            idle_timeout: Sekunden ohne Nutzung, ab denen eine Verbindung für
+                Hintergrundverbindungen verdrängt werden darf
+            max_attempts: Maximale Wiederverbindungsversuche nach Abbrüchen
+        """
+        self._connect = connect
+        self._disconnect = disconnect
+        self.max_links = max_links
+        self.idle_timeout = idle_timeout
+        self.max_attempts = max_attempts
+
+        self._links: "OrderedDict[str, float]" = OrderedDict()  # Adresse -> letzte Nutzung (LRU-Reihenfolge)
+        self._link_priority: Dict[str, int] = {}
+        self._connecting: Set[str] = set()
+        self._evicting: Set[str] = set()
+        self._queue: List[Tuple[int, int, str]] = []
+        self._queued: Dict[str, int] = {}  # Adresse -> beste eingereihte Priorität
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._attempts: Dict[str, int] = {}
+        self._seq = itertools.count()
+        self._wakeup: asyncio.Event = None
+        self._retry_at: float = None  # Zeitpunkt, ab dem eine Verbindung verdrängbar wird
+        self._task: asyncio.Task = None
+        self._open_tasks: Set[asyncio.Task] = set()
+
+        self._connect_times = deque(maxlen=1000)  # Zeitpunkte erfolgreicher Verbindungen
+        self.metrics = {
+            "connects": 0,
+            "connect_failures": 0,
+            "disconnects": 0,
+            "evictions": 0,
+            "reconnects_scheduled": 0,
+            "reconnects_abandoned": 0,
+            "connect_time_total": 0.0,
+        }
+
+    async def start(self):
+        """
+        Startet die Abarbeitung der Warteschlange auf dem aktuellen Event-Loop.
+        """
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Beendet die Abarbeitung; offene Warteanfragen werden mit False beendet.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for address in list(self._waiters):
+            self._resolve(address, False)
+        self._queue.clear()
+        self._queued.clear()
+
+    def is_connected(self, address: str) -> bool:
+        """
+        Prüft, ob eine Verbindung zu einer Adresse besteht.
+        """
+        return address in self._links
+
+    def request(self, address: str, priority: int = PRIORITY_DEFAULT):
+        """
+        Reiht einen Verbindungswunsch ein.
+
+        Args:
+            address: BLE-Adresse des Geräts
+            priority: Priorität (PRIORITY_COMMAND, PRIORITY_TASK, PRIORITY_DEFAULT)
+        """
+        if address in self._links or address in self._connecting:
+            return
+        if self._queued.get(address, priority + 1) <= priority:
+            return
+
+        self._queued[address] = priority
+        heapq.heappush(self._queue, (priority, next(self._seq), address))
+        if self._wakeup:
+            self._wakeup.set()
+
+    async def acquire(self, address: str, timeout: float = 10.0) -> bool:
+        """
+        Stellt sicher, dass eine Verbindung besteht, und markiert sie als benutzt.
+
+        Args:
+            address: BLE-Adresse des Geräts
+            timeout: Maximale Wartezeit auf den Verbindungsaufbau
+
+        Returns:
+            bool: True, wenn die Verbindung bereitsteht
+        """
+        if address in self._links:
+            self.touch(address)
+            return True
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(address, []).append(future)
+        self.request(address, PRIORITY_COMMAND)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            waiters = self._waiters.get(address)
+            if waiters and future in waiters:
+                waiters.remove(future)
+            return False
+
+    def touch(self, address: str):
+        """
+        Markiert eine Verbindung als zuletzt benutzt.
+        """
+        if address in self._links:
+            self._links[address] = time.monotonic()
+            self._links.move_to_end(address)
+
+    def release(self, address: str):
+        """
+        Meldet eine getrennte Verbindung.
+
+        Von der Verwaltung verdrängte Verbindungen werden nicht wiederhergestellt,
+        unerwartete Abbrüche werden mit Verzögerung erneut eingereiht.
+        """
+        self._links.pop(address, None)
+        priority = self._link_priority.pop(address, PRIORITY_DEFAULT)
+
+        if address in self._evicting:
+            self._evicting.discard(address)
+        elif self._task is not None:
+            self.metrics["disconnects"] += 1
+            self._schedule_reconnect(address, max(priority, PRIORITY_TASK))
+
+        if self._wakeup:
+            self._wakeup.set()
+
+    def forget(self, address: str):
+        """
+        Entfernt alle Wünsche und Wiederverbindungszustände einer Adresse.
+        """
+        self._queued.pop(address, None)
+        self._attempts.pop(address, None)
+
+    def _schedule_reconnect(self, address: str, priority: int):
+        attempt = self._attempts.get(address, 0) + 1
+        if attempt > self.max_attempts:
+            logger.warning(f"Alle Wiederverbindungsversuche zu {address} fehlgeschlagen")
+            self.metrics["reconnects_abandoned"] += 1
+            self._attempts.pop(address, None)
+            return
+
+        self._attempts[address] = attempt
+        self.metrics["reconnects_scheduled"] += 1
+        delay = 2 ** attempt
+        logger.info(f"Wiederverbindung zu {address} in {delay} Sekunden (Versuch {attempt}/{self.max_attempts})")
+        asyncio.get_running_loop().call_later(delay, self.request, address, priority)
+
+    async def _run(self):
+        """
+        Arbeitet die Warteschlange ab, solange Verbindungsplätze frei werden.
+        """
+        while True:
+            # Regelmäßig aufwachen, damit Verbindungen nach Ablauf von
+            # idle_timeout für Wartende verdrängt werden können; wartet ein
+            # Befehl, genau dann, wenn die älteste Verbindung verdrängbar wird
+            timeout = max(1.0, self.idle_timeout / 4)
+            if self._retry_at is not None:
+                timeout = min(timeout, max(0.05, self._retry_at - time.monotonic()))
+                self._retry_at = None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            while self._queue:
+                priority, seq, address = self._queue[0]
+                if self._queued.get(address) != priority or address in self._links:
+                    # Veralteter Eintrag (bessere Priorität eingereiht oder bereits verbunden)
+                    heapq.heappop(self._queue)
+                    continue
+
+                if len(self._links) + len(self._connecting) >= self.max_links:
+                    victim = self._pick_victim(priority)
+                    if victim is None:
+                        break
+                    await self._evict(victim)
+                    continue
+
+                heapq.heappop(self._queue)
+                del self._queued[address]
+                self._connecting.add(address)
+                task = asyncio.create_task(self._open(address, priority))
+                self._open_tasks.add(task)
+                task.add_done_callback(self._open_tasks.discard)
+
+    def _pick_victim(self, priority: int):
+        """
+        Wählt die am längsten ungenutzte verdrängbare Verbindung.
+        """
+        # Steuerbefehle dürfen jede kurz ungenutzte Verbindung verdrängen
+        is_command = priority == PRIORITY_COMMAND
+        min_idle = 1.0 if is_command else self.idle_timeout
+        now = time.monotonic()
+        for address, last_used in self._links.items():
+            if now - last_used < min_idle:
+                # LRU-Reihenfolge: alle weiteren wurden später benutzt
+                self._retry_at = last_used + min_idle
+                return None
+            if address in self._waiters:
+                continue
+            link_priority = self._link_priority.get(address, PRIORITY_DEFAULT)
+            if is_command or link_priority > priority:
+                return address
+        return None
+
+    async def _evict(self, address: str):
+        logger.info(f"Trenne ungenutzte BLE-Verbindung zu {address} (Verbindungslimit {self.max_links})")
+        self.metrics["evictions"] += 1
+        self._evicting.add(address)
+        self._links.pop(address, None)
+        self._link_priority.pop(address, None)
+        try:
+            await self._disconnect(address)
+        except Exception as e:
+            logger.error(f"Fehler beim Trennen von {address}: {e}")
+
+    async def _open(self, address: str, priority: int):
+        started = time.monotonic()
+        try:
+            connected = await self._connect(address)
+        except Exception as e:
+            logger.error(f"Fehler beim Verbinden mit {address}: {e}")
+            connected = False
+        finally:
+            self._connecting.discard(address)
+
+        if connected:
+            now = time.monotonic()
+            self._links[address] = now
+            # Für einen Befehl aufgebaute Verbindungen sind danach normale Verbindungen
+            self._link_priority[address] = PRIORITY_DEFAULT if priority == PRIORITY_COMMAND else priority
+            self._attempts.pop(address, None)
+            self._connect_times.append(now)
+            self.metrics["connects"] += 1
+            self.metrics["connect_time_total"] += now - started
+        else:
+            self.metrics["connect_failures"] += 1
+            if priority != PRIORITY_COMMAND:
+                self._schedule_reconnect(address, priority)
+
+        self._resolve(address, connected)
+        self._wakeup.set()
+
+    def _resolve(self, address: str, result: bool):
+        for future in self._waiters.pop(address, []):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Gibt Kennzahlen zu Verbindungen und Verbindungswechseln zurück.
+
+        Returns:
+            dict: Aktive Verbindungen, Warteschlange und Churn-Zähler
+        """
+        now = time.monotonic()
+        connects = self.metrics["connects"]
+        return {
+            "max_links": self.max_links,
+            "active_links": len(self._links),
+            "connecting": len(self._connecting),
+            "queued": len(self._queued),
+            "connects_last_minute": sum(1 for t in self._connect_times if now - t <= 60),
+            "avg_connect_seconds": self.metrics["connect_time_total"] / connects if connects else 0.0,
+            **{k: v for k, v in self.metrics.items() if k != "connect_time_total"},
+        }
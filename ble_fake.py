@@ -0,0 +1,418 @@
+"""
+Simuliertes BLE-Backend für Last- und Integrationstests der SwissAirDry Plattform.
+
+Ersetzt BleakScanner und BleakClient durch eine virtuelle Flotte von
+SwissAirDry-Geräten, die dieselben Service- und Charakteristik-UUIDs wie die
+Firmware verwenden. Advertisements, Verbindungen, Benachrichtigungen und
+Befehle laufen vollständig im Event-Loop, sodass Durchsatz und
+Datenbank-Schreibraten ohne Bluetooth-Adapter gemessen werden können.
+
+Aktivierung im Dienst über BLE_BACKEND=fake; die Flotte wird dann über
+BLE_FAKE_DEVICES, BLE_FAKE_NOTIFY_RATE, BLE_FAKE_LATENCY,
+BLE_FAKE_DISCONNECT_RATE, BLE_FAKE_CONNECT_FAILURE_RATE und
+BLE_FAKE_ADVERTISE_RATIO eingestellt.
+"""
+
+import os
+import json
+import random
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from bleak.backends.device import BLEDevice
+from bleak.backends.scanner import AdvertisementData
+
+from ble_advertisement import SWISSAIRDRY_COMPANY_ID, encode_manufacturer_data
+from ble_codec import CODEC_VERSION, MSG_COMMAND, MSG_CONFIG, MSG_SENSOR, decode_payload, encode_payload
+from ble_service import (
+    CONFIG_CHAR_UUID,
+    CONTROL_CHAR_UUID,
+    DEVICE_INFO_CHAR_UUID,
+    SENSOR_DATA_CHAR_UUID,
+    SWISSAIRDRY_SERVICE_UUID,
+)
+
+# Logger für das simulierte Backend
+logger = logging.getLogger("ble_fake")
+
+# Maximale Nutzlast für Write Without Response bei Standard-MTU
+DEFAULT_WRITE_WITHOUT_RESPONSE_SIZE = 20
+
+class VirtualPeripheral:
+    """
+    Ein simuliertes SwissAirDry-Gerät mit Messwerten und Steuerzustand.
+    """
+
+    def __init__(self, index: int, advertise: bool, codec_version: int, rng: random.Random):
+        self.address = "FA:CE:%02X:%02X:%02X:%02X" % (
+            (index >> 24) & 0xFF, (index >> 16) & 0xFF, (index >> 8) & 0xFF, index & 0xFF
+        )
+        self.device_id = f"virtual_{index:06d}"
+        self.name = f"SwissAirDry Virtual {index}"
+        self.advertise = advertise
+        self.codec_version = codec_version
+        self.rssi = rng.randint(-90, -40)
+        self.power = True
+        self.fan_speed = 50
+        self.sequence = 0
+        self.connected = False
+        self.commands: List[Dict[str, Any]] = []
+        self.configs: List[Dict[str, Any]] = []
+        self._rng = rng
+
+    def measure(self) -> Dict[str, Any]:
+        """
+        Erzeugt eine neue Messung.
+        """
+        self.sequence = (self.sequence + 1) & 0xFF
+        return {
+            "temperature": round(self._rng.uniform(15.0, 30.0), 2),
+            "humidity": round(self._rng.uniform(30.0, 80.0), 2),
+            "pressure": round(self._rng.uniform(980.0, 1030.0), 1),
+            "fan_speed": self.fan_speed,
+            "power_consumption": round(self._rng.uniform(200.0, 1500.0), 1) if self.power else 0.0,
+            "power": self.power,
+        }
+
+    def device_info(self) -> Dict[str, Any]:
+        """
+        Inhalt der Geräteinfo-Charakteristik.
+        """
+        info = {
+            "device_id": self.device_id,
+            "name": self.name,
+            "type": "virtual",
+            "firmware_version": "sim-1.0",
+            "hardware_version": "sim",
+        }
+        if self.codec_version:
+            info["codec_version"] = self.codec_version
+        return info
+
+    def apply(self, message: Dict[str, Any]):
+        """
+        Wendet einen empfangenen Steuerbefehl an.
+        """
+        self.commands.append(message)
+        if "power" in message:
+            self.power = bool(message["power"])
+        if "fan_speed" in message:
+            self.fan_speed = int(message["fan_speed"])
+
+class VirtualFleet:
+    """
+    Virtuelle Geräteflotte mit konfigurierbaren Raten, Latenzen und Fehlern.
+
+    ``scanner`` und ``client`` haben dieselben Signaturen wie BleakScanner und
+    BleakClient und werden dem BLEService als Backend übergeben.
+    """
+
+    def __init__(
+        self,
+        count: int = 10,
+        notify_rate: float = 1.0,
+        advert_rate: float = 2.0,
+        latency: float = 0.02,
+        disconnect_rate: float = 0.0,
+        connect_failure_rate: float = 0.0,
+        advertise_ratio: float = 0.5,
+        codec_version: int = CODEC_VERSION,
+        seed: int = 0
+    ):
+        """
+        Initialisiert die Flotte.
+
+        Args:
+            count: Anzahl virtueller Geräte
+            notify_rate: Sensordaten-Benachrichtigungen pro Sekunde und Verbindung
+            advert_rate: Advertisements pro Sekunde und Gerät
+            latency: Mittlere Latenz von Verbindungsaufbau und GATT-Operationen in Sekunden
+            disconnect_rate: Wahrscheinlichkeit eines Verbindungsabbruchs pro Sekunde und Verbindung
+            connect_failure_rate: Wahrscheinlichkeit, dass ein Verbindungsaufbau fehlschlägt
+            advertise_ratio: Anteil der Geräte mit Messwerten im Advertisement
+            codec_version: Vom Gerät gemeldete Codec-Version (0 = nur JSON)
+            seed: Startwert des Zufallsgenerators
+        """
+        self.notify_rate = notify_rate
+        self.advert_rate = advert_rate
+        self.latency = latency
+        self.disconnect_rate = disconnect_rate
+        self.connect_failure_rate = connect_failure_rate
+        self.rng = random.Random(seed)
+        self.peripherals: Dict[str, VirtualPeripheral] = {}
+        for index in range(count):
+            peripheral = VirtualPeripheral(index, self.rng.random() < advertise_ratio, codec_version, self.rng)
+            self.peripherals[peripheral.address] = peripheral
+
+        self.metrics = {
+            "adverts": 0,
+            "connects": 0,
+            "connect_failures": 0,
+            "disconnects": 0,
+            "fault_disconnects": 0,
+            "notifications": 0,
+            "writes": 0,
+            "writes_without_response": 0,
+            "reads": 0,
+        }
+
+    @classmethod
+    def from_env(cls) -> "VirtualFleet":
+        """
+        Erstellt eine Flotte aus den BLE_FAKE_*-Umgebungsvariablen.
+        """
+        return cls(
+            count=int(os.getenv("BLE_FAKE_DEVICES", 10)),
+            notify_rate=float(os.getenv("BLE_FAKE_NOTIFY_RATE", 1.0)),
+            advert_rate=float(os.getenv("BLE_FAKE_ADVERT_RATE", 2.0)),
+            latency=float(os.getenv("BLE_FAKE_LATENCY", 0.02)),
+            disconnect_rate=float(os.getenv("BLE_FAKE_DISCONNECT_RATE", 0.0)),
+            connect_failure_rate=float(os.getenv("BLE_FAKE_CONNECT_FAILURE_RATE", 0.0)),
+            advertise_ratio=float(os.getenv("BLE_FAKE_ADVERTISE_RATIO", 0.5)),
+        )
+
+    async def delay(self):
+        """
+        Simuliert die Funklatenz einer Operation (exponentiell verteilt).
+        """
+        if self.latency > 0:
+            await asyncio.sleep(self.rng.expovariate(1.0 / self.latency))
+
+    def scanner(self, detection_callback: Optional[Callable] = None, **kwargs) -> "FakeBleakScanner":
+        """
+        Ersatz für BleakScanner(...).
+        """
+        return FakeBleakScanner(self, detection_callback)
+
+    def client(self, device, disconnected_callback: Optional[Callable] = None, **kwargs) -> "FakeBleakClient":
+        """
+        Ersatz für BleakClient(...).
+        """
+        address = device if isinstance(device, str) else device.address
+        return FakeBleakClient(self, address, disconnected_callback)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Gibt die Zähler der Flotte zurück.
+        """
+        return {
+            "devices": len(self.peripherals),
+            "connected": sum(1 for p in self.peripherals.values() if p.connected),
+            **self.metrics,
+        }
+
+class FakeBleakScanner:
+    """
+    Sendet die Advertisements aller virtuellen Geräte an den Detection-Callback.
+    """
+
+    def __init__(self, fleet: VirtualFleet, detection_callback: Optional[Callable]):
+        self._fleet = fleet
+        self._callback = detection_callback
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        fleet = self._fleet
+        peripherals = list(fleet.peripherals.values())
+        if not peripherals or fleet.advert_rate <= 0:
+            return
+
+        # Advertisements gleichmäßig über ein Intervall verteilen
+        interval = 1.0 / fleet.advert_rate
+        step = interval / len(peripherals)
+        while True:
+            for peripheral in peripherals:
+                if self._callback:
+                    device, adv_data = self._advertisement(peripheral)
+                    self._callback(device, adv_data)
+                    fleet.metrics["adverts"] += 1
+                await asyncio.sleep(step)
+
+    def _advertisement(self, peripheral: VirtualPeripheral):
+        manufacturer_data = {}
+        if peripheral.advertise:
+            manufacturer_data[SWISSAIRDRY_COMPANY_ID] = encode_manufacturer_data(
+                peripheral.measure(), peripheral.sequence
+            )
+        rssi = peripheral.rssi + self._fleet.rng.randint(-4, 4)
+        adv_data = AdvertisementData(
+            local_name=peripheral.name,
+            manufacturer_data=manufacturer_data,
+            service_data={},
+            service_uuids=[] if peripheral.advertise else [SWISSAIRDRY_SERVICE_UUID],
+            tx_power=None,
+            rssi=rssi,
+            platform_data=(),
+        )
+        return BLEDevice(peripheral.address, peripheral.name, None), adv_data
+
+class _FakeCharacteristic:
+    """
+    Minimale Charakteristik mit den von BLEService genutzten Eigenschaften.
+    """
+    __slots__ = ("uuid", "properties", "max_write_without_response_size")
+
+    def __init__(self, uuid: str, properties: List[str]):
+        self.uuid = uuid
+        self.properties = properties
+        self.max_write_without_response_size = DEFAULT_WRITE_WITHOUT_RESPONSE_SIZE
+
+class _FakeServices:
+    """
+    GATT-Tabelle eines virtuellen Geräts.
+    """
+
+    def __init__(self):
+        self._characteristics = {
+            DEVICE_INFO_CHAR_UUID: _FakeCharacteristic(DEVICE_INFO_CHAR_UUID, ["read"]),
+            SENSOR_DATA_CHAR_UUID: _FakeCharacteristic(SENSOR_DATA_CHAR_UUID, ["read", "notify"]),
+            CONTROL_CHAR_UUID: _FakeCharacteristic(CONTROL_CHAR_UUID, ["write", "write-without-response"]),
+            CONFIG_CHAR_UUID: _FakeCharacteristic(CONFIG_CHAR_UUID, ["read", "write"]),
+        }
+
+    def get_characteristic(self, uuid: str) -> Optional[_FakeCharacteristic]:
+        return self._characteristics.get(str(uuid).lower())
+
+class FakeBleakClient:
+    """
+    Verbindung zu einem virtuellen Gerät mit Benachrichtigungen und Fehlersimulation.
+    """
+
+    def __init__(self, fleet: VirtualFleet, address: str, disconnected_callback: Optional[Callable]):
+        self._fleet = fleet
+        self.address = address
+        self._disconnected_callback = disconnected_callback
+        self._peripheral = fleet.peripherals.get(address)
+        self._tasks: List[asyncio.Task] = []
+        self.services = _FakeServices()
+        self.is_connected = False
+
+    async def connect(self, **kwargs) -> bool:
+        fleet = self._fleet
+        await fleet.delay()
+        if self._peripheral is None or self._peripheral.connected:
+            fleet.metrics["connect_failures"] += 1
+            raise ConnectionError(f"Gerät {self.address} nicht verbindbar")
+        if fleet.rng.random() < fleet.connect_failure_rate:
+            fleet.metrics["connect_failures"] += 1
+            raise TimeoutError(f"Simulierter Verbindungsfehler bei {self.address}")
+
+        self.is_connected = True
+        self._peripheral.connected = True
+        fleet.metrics["connects"] += 1
+        if fleet.disconnect_rate > 0:
+            self._tasks.append(asyncio.create_task(self._fault_loop()))
+        return True
+
+    async def disconnect(self) -> bool:
+        if self.is_connected:
+            self._fleet.metrics["disconnects"] += 1
+        self._drop()
+        return True
+
+    def _drop(self):
+        for task in self._tasks:
+            if task is not asyncio.current_task():
+                task.cancel()
+        self._tasks.clear()
+        self.is_connected = False
+        if self._peripheral:
+            self._peripheral.connected = False
+
+    async def _fault_loop(self):
+        """
+        Bricht die Verbindung zufällig ab (Poisson-Prozess mit disconnect_rate).
+        """
+        fleet = self._fleet
+        await asyncio.sleep(fleet.rng.expovariate(fleet.disconnect_rate))
+        fleet.metrics["fault_disconnects"] += 1
+        self._drop()
+        if self._disconnected_callback:
+            self._disconnected_callback(self)
+
+    def _require_connection(self):
+        if not self.is_connected:
+            raise ConnectionError(f"Nicht mit {self.address} verbunden")
+
+    async def read_gatt_char(self, char_uuid: str, **kwargs) -> bytearray:
+        self._require_connection()
+        await self._fleet.delay()
+        self._fleet.metrics["reads"] += 1
+        if char_uuid == DEVICE_INFO_CHAR_UUID:
+            return bytearray(json.dumps(self._peripheral.device_info()).encode("utf-8"))
+        if char_uuid == SENSOR_DATA_CHAR_UUID:
+            return bytearray(self._sensor_payload())
+        raise ValueError(f"Charakteristik {char_uuid} nicht lesbar")
+
+    async def write_gatt_char(self, char_uuid: str, data: bytes, response: bool = True):
+        self._require_connection()
+        fleet = self._fleet
+        characteristic = self.services.get_characteristic(char_uuid)
+        if characteristic is None:
+            raise ValueError(f"Unbekannte Charakteristik {char_uuid}")
+        if not response:
+            if len(data) > characteristic.max_write_without_response_size:
+                raise ValueError("Nutzlast zu groß für Write Without Response")
+            fleet.metrics["writes_without_response"] += 1
+        else:
+            # Mit Bestätigung wartet der Client auf die Antwort des Geräts
+            await fleet.delay()
+        fleet.metrics["writes"] += 1
+
+        if char_uuid == CONTROL_CHAR_UUID:
+            self._peripheral.apply(decode_payload(bytes(data), MSG_COMMAND))
+        elif char_uuid == CONFIG_CHAR_UUID:
+            self._peripheral.configs.append(decode_payload(bytes(data), MSG_CONFIG))
+
+    async def start_notify(self, char_uuid: str, callback: Callable, **kwargs):
+        self._require_connection()
+        await self._fleet.delay()
+        if char_uuid == SENSOR_DATA_CHAR_UUID and self._fleet.notify_rate > 0:
+            self._tasks.append(asyncio.create_task(self._notify_loop(callback)))
+
+    async def stop_notify(self, char_uuid: str):
+        pass
+
+    def _sensor_payload(self) -> bytes:
+        return encode_payload(MSG_SENSOR, self._peripheral.measure(), self._peripheral.codec_version)
+
+    async def _notify_loop(self, callback: Callable):
+        fleet = self._fleet
+        interval = 1.0 / fleet.notify_rate
+        # Versatz, damit nicht alle Geräte gleichzeitig senden
+        await asyncio.sleep(fleet.rng.uniform(0, interval))
+        while self.is_connected:
+            fleet.metrics["notifications"] += 1
+            callback(SENSOR_DATA_CHAR_UUID, bytearray(self._sensor_payload()))
+            await asyncio.sleep(interval)
+
+def use_fake_backend(service, fleet: Optional[VirtualFleet] = None) -> VirtualFleet:
+    """
+    Stellt einen BLEService auf die virtuelle Flotte um.
+
+    Args:
+        service: Der BLEService (vor dem Start)
+        fleet: Die Flotte (Standard: aus den Umgebungsvariablen)
+
+    Returns:
+        VirtualFleet: Die verwendete Flotte
+    """
+    fleet = fleet or VirtualFleet.from_env()
+    service.scanner_factory = fleet.scanner
+    service.client_factory = fleet.client
+    service.fake_fleet = fleet
+    logger.warning(f"BLE-Service verwendet simuliertes Backend mit {len(fleet.peripherals)} Geräten")
+    return fleet
@@ -0,0 +1,277 @@
+"""
+RSSI- und Anwesenheitsverfolgung für BLE-Geräte der SwissAirDry Plattform.
+
+Jedes Advertisement liefert einen RSSI-Wert; ein UPDATE pro Advertisement
+würde die Tabelle ``devices`` überlasten. Der Tracker hält pro Adresse einen
+gleitenden RSSI-Mittelwert im Speicher und schreibt ``ble_rssi``,
+``ble_last_seen`` und ``ble_connected`` nur bei nennenswerten Änderungen
+(Hysterese) und gebündelt in regelmäßigen Stapel-UPDATEs.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import concurrent.futures
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import bindparam, update
+
+from database import get_db
+import models
+
+# Logger für die Anwesenheitsverfolgung
+logger = logging.getLogger("ble_presence")
+
+# Glättungsfaktor des gleitenden RSSI-Mittelwerts
+BLE_RSSI_ALPHA = float(os.getenv("BLE_RSSI_ALPHA", 0.3))
+# Minimale Änderung des gemittelten RSSI (dB), die gespeichert wird
+BLE_RSSI_HYSTERESIS = float(os.getenv("BLE_RSSI_HYSTERESIS", 5))
+# Auflösung von ble_last_seen in Sekunden
+BLE_LAST_SEEN_RESOLUTION = float(os.getenv("BLE_LAST_SEEN_RESOLUTION", 60))
+# Sekunden zwischen zwei Stapel-UPDATEs
+BLE_PRESENCE_FLUSH_INTERVAL = float(os.getenv("BLE_PRESENCE_FLUSH_INTERVAL", 10))
+
+class _Presence:
+    """
+    Anwesenheitszustand einer Adresse, aktuell und zuletzt gespeichert.
+    """
+    __slots__ = (
+        "rssi", "last_seen", "connected",
+        "stored_rssi", "stored_seen", "stored_connected", "dirty",
+    )
+
+    def __init__(self, rssi: Optional[float]):
+        self.rssi = rssi
+        self.last_seen = time.time()
+        self.connected = False
+        self.stored_rssi: Optional[int] = None
+        self.stored_seen = float("-inf")
+        self.stored_connected: Optional[bool] = None
+        self.dirty = True
+
+class BLEPresenceTracker:
+    """
+    Verfolgt RSSI und Anwesenheit im Speicher und speichert sie gebündelt.
+
+    ``observe`` und ``set_connected`` laufen auf dem BLE-Event-Loop und
+    greifen nie auf die Datenbank zu. Ein Eintrag wird zum Speichern
+    vorgemerkt, wenn sich der gemittelte RSSI um mindestens
+    ``rssi_hysteresis`` dB gegenüber dem gespeicherten Wert ändert, die
+    gespeicherte Sichtung älter als ``last_seen_resolution`` ist oder sich
+    der Verbindungsstatus ändert.
+    """
+
+    def __init__(
+        self,
+        alpha: float = BLE_RSSI_ALPHA,
+        rssi_hysteresis: float = BLE_RSSI_HYSTERESIS,
+        last_seen_resolution: float = BLE_LAST_SEEN_RESOLUTION,
+        flush_interval: float = BLE_PRESENCE_FLUSH_INTERVAL
+    ):
+        """
+        Initialisiert den Tracker.
+
+        Args:
+            alpha: Glättungsfaktor des gleitenden RSSI-Mittelwerts
+            rssi_hysteresis: Minimale gespeicherte RSSI-Änderung in dB
+            last_seen_resolution: Auflösung von ble_last_seen in Sekunden
+            flush_interval: Sekunden zwischen zwei Stapel-UPDATEs
+        """
+        self.alpha = alpha
+        self.rssi_hysteresis = rssi_hysteresis
+        self.last_seen_resolution = last_seen_resolution
+        self.flush_interval = flush_interval
+        self._devices: Dict[str, _Presence] = {}
+        self._orphans: Dict[str, Dict[str, Any]] = {}  # Vergessene Adressen mit ungespeicherten Änderungen
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ble-presence")
+        self._task: asyncio.Task = None
+
+        self.metrics = {
+            "observations": 0,
+            "marked": 0,
+            "rows_written": 0,
+            "flushes": 0,
+            "failed": 0,
+        }
+
+    async def start(self):
+        """
+        Startet die regelmäßige Speicherung auf dem aktuellen Event-Loop.
+        """
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Beendet die regelmäßige Speicherung und schreibt ausstehende Änderungen.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def observe(self, address: str, rssi: Optional[float]) -> Optional[float]:
+        """
+        Verarbeitet ein Advertisement.
+
+        Args:
+            address: BLE-Adresse des Geräts
+            rssi: RSSI des Advertisements (None, falls unbekannt)
+
+        Returns:
+            float: Gleitender RSSI-Mittelwert
+        """
+        self.metrics["observations"] += 1
+        presence = self._devices.get(address)
+        if presence is None:
+            presence = self._devices[address] = _Presence(rssi)
+            self.metrics["marked"] += 1
+            return rssi
+
+        presence.last_seen = time.time()
+        if rssi is not None:
+            if presence.rssi is None:
+                presence.rssi = rssi
+            else:
+                presence.rssi += self.alpha * (rssi - presence.rssi)
+
+        if not presence.dirty and self._changed(presence):
+            presence.dirty = True
+            self.metrics["marked"] += 1
+        return presence.rssi
+
+    def set_connected(self, address: str, connected: bool):
+        """
+        Meldet eine aufgebaute oder getrennte GATT-Verbindung.
+        """
+        presence = self._devices.get(address)
+        if presence is None:
+            presence = self._devices[address] = _Presence(None)
+            self.metrics["marked"] += 1
+        presence.connected = connected
+        if connected:
+            presence.last_seen = time.time()
+        if not presence.dirty and presence.stored_connected != connected:
+            presence.dirty = True
+            self.metrics["marked"] += 1
+
+    def rssi(self, address: str) -> Optional[float]:
+        """
+        Gibt den gleitenden RSSI-Mittelwert einer Adresse zurück.
+        """
+        presence = self._devices.get(address)
+        return presence.rssi if presence else None
+
+    def forget(self, address: str):
+        """
+        Entfernt eine Adresse; ungespeicherte Änderungen werden noch geschrieben.
+        """
+        presence = self._devices.pop(address, None)
+        if presence is not None and presence.dirty:
+            self._orphans[address] = self._row(address, presence)
+
+    def _changed(self, presence: _Presence) -> bool:
+        if presence.connected != presence.stored_connected:
+            return True
+        if presence.last_seen - presence.stored_seen >= self.last_seen_resolution:
+            return True
+        if presence.rssi is None:
+            return False
+        if presence.stored_rssi is None:
+            return True
+        return abs(presence.rssi - presence.stored_rssi) >= self.rssi_hysteresis
+
+    def _row(self, address: str, presence: _Presence) -> Dict[str, Any]:
+        return {
+            "b_address": address,
+            "b_rssi": None if presence.rssi is None else int(round(presence.rssi)),
+            "b_last_seen": datetime.fromtimestamp(presence.last_seen),
+            "b_connected": presence.connected,
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """
+        Schreibt alle vorgemerkten Einträge in einem Stapel-UPDATE.
+        """
+        snapshot = {}
+        orphans = self._orphans
+        self._orphans = {}
+        rows: List[Dict[str, Any]] = list(orphans.values())
+        for address, presence in self._devices.items():
+            if presence.dirty:
+                row = self._row(address, presence)
+                rows.append(row)
+                snapshot[address] = (presence, row)
+                presence.dirty = False
+        if not rows:
+            return
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write_rows, rows)
+        except Exception as e:
+            self.metrics["failed"] += len(rows)
+            logger.error(f"Fehler beim Speichern von {len(rows)} BLE-Anwesenheitsdaten: {e}")
+            # Beim nächsten Lauf erneut versuchen
+            for presence, _ in snapshot.values():
+                presence.dirty = True
+            for address, row in orphans.items():
+                self._orphans.setdefault(address, row)
+            return
+
+        for presence, row in snapshot.values():
+            presence.stored_rssi = row["b_rssi"]
+            presence.stored_seen = row["b_last_seen"].timestamp()
+            presence.stored_connected = row["b_connected"]
+            # Zwischenzeitliche Änderungen erneut prüfen
+            if not presence.dirty and self._changed(presence):
+                presence.dirty = True
+        self.metrics["flushes"] += 1
+        self.metrics["rows_written"] += len(rows)
+
+    def _write_rows(self, rows: List[Dict[str, Any]]):
+        """
+        Führt das Stapel-UPDATE aus (läuft im Schreib-Thread).
+        """
+        devices = models.Device.__table__
+        statement = (
+            update(devices)
+            .where(devices.c.ble_address == bindparam("b_address"))
+            .values(
+                ble_rssi=bindparam("b_rssi"),
+                ble_last_seen=bindparam("b_last_seen"),
+                ble_connected=bindparam("b_connected"),
+            )
+        )
+        db = next(get_db())
+        try:
+            db.execute(statement, rows)
+            db.commit()
+            logger.debug(f"{len(rows)} BLE-Anwesenheitsdaten gespeichert")
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Gibt Kennzahlen zu Beobachtungen und geschriebenen Zeilen zurück.
+        """
+        observations = self.metrics["observations"]
+        return {
+            "tracked": len(self._devices),
+            "pending": sum(1 for p in self._devices.values() if p.dirty) + len(self._orphans),
+            "write_ratio": self.metrics["rows_written"] / observations if observations else 0.0,
+            **self.metrics,
+        }
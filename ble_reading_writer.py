@@ -0,0 +1,226 @@
+"""
+Gebündelte Speicherung von BLE-Sensordaten für die SwissAirDry Plattform.
+
+Sensordaten aus Benachrichtigungen und Advertisements werden auf dem
+BLE-Event-Loop nur in eine begrenzte Warteschlange gelegt. Ein Schreib-Task
+fasst sie zu Stapeln zusammen und speichert jeden Stapel in einem eigenen
+Thread, damit synchrone Datenbankzugriffe den Event-Loop nie blockieren.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import concurrent.futures
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+
+from database import get_db
+import models
+
+# Logger für die Sensordaten-Speicherung
+logger = logging.getLogger("ble_reading_writer")
+
+# Größe der Warteschlange und der Schreibstapel
+BLE_READING_QUEUE_SIZE = int(os.getenv("BLE_READING_QUEUE_SIZE", 10000))
+BLE_READING_BATCH_SIZE = int(os.getenv("BLE_READING_BATCH_SIZE", 500))
+BLE_READING_FLUSH_INTERVAL = float(os.getenv("BLE_READING_FLUSH_INTERVAL", 1.0))
+
+# In SensorReading gespeicherte Felder
+READING_FIELDS = ("temperature", "humidity", "pressure", "fan_speed", "power_consumption")
+
+class BLEReadingWriter:
+    """
+    Schreibt BLE-Sensordaten stapelweise in die Datenbank.
+
+    Ist die Warteschlange voll, wird der älteste Eintrag verworfen (neuere
+    Messwerte sind wertvoller) und als ``dropped`` gezählt. Die Zuordnung
+    BLE-Adresse -> Geräte-ID wird zwischengespeichert, sodass pro Stapel
+    höchstens eine Abfrage für unbekannte Adressen nötig ist.
+    """
+
+    def __init__(
+        self,
+        max_queue: int = BLE_READING_QUEUE_SIZE,
+        batch_size: int = BLE_READING_BATCH_SIZE,
+        flush_interval: float = BLE_READING_FLUSH_INTERVAL,
+        executor: Optional[concurrent.futures.Executor] = None
+    ):
+        """
+        Initialisiert den Schreiber.
+
+        Args:
+            max_queue: Maximale Anzahl wartender Messwerte
+            batch_size: Maximale Anzahl Messwerte pro Datenbank-Transaktion
+            flush_interval: Maximale Wartezeit in Sekunden, bis ein
+                unvollständiger Stapel geschrieben wird
+            executor: Thread für die Schreibzugriffe (Standard: eigener Thread)
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        # Wird erst in start() auf dem laufenden Event-Loop angelegt
+        self._queue: Optional[asyncio.Queue] = None
+        self._executor = executor or concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ble-writer")
+        self._task: asyncio.Task = None
+        self._device_ids: Dict[str, int] = {}  # BLE-Adresse -> devices.id
+
+        self.metrics = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "unknown_device": 0,
+            "failed": 0,
+            "batches": 0,
+            "queue_high_water": 0,
+            "write_time_total": 0.0,
+            "write_time_max": 0.0,
+        }
+
+    async def start(self):
+        """
+        Startet den Schreib-Task auf dem aktuellen Event-Loop.
+
+        Die Warteschlange wird hier angelegt, damit sie an den laufenden
+        Event-Loop gebunden ist und nicht an den beim Erzeugen aktiven.
+        """
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Beendet den Schreib-Task und schreibt alle noch wartenden Messwerte.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        remaining = []
+        if self._queue is not None:
+            while not self._queue.empty():
+                remaining.append(self._queue.get_nowait())
+            self._queue = None
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    def submit(self, address: str, sensor_data: Dict[str, Any]):
+        """
+        Legt Sensordaten zur Speicherung ab, ohne zu blockieren.
+
+        Args:
+            address: BLE-Adresse des Geräts
+            sensor_data: Dekodierte Sensordaten
+        """
+        if self._queue is None:
+            # Nicht gestartet: ohne Schreib-Task würde der Messwert nie gespeichert
+            self.metrics["dropped"] += 1
+            return
+        item = (address, datetime.now(), sensor_data)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Ältesten Eintrag verwerfen, damit aktuelle Messwerte durchkommen
+            self._queue.get_nowait()
+            self._queue.put_nowait(item)
+            self.metrics["dropped"] += 1
+
+        self.metrics["enqueued"] += 1
+        depth = self._queue.qsize()
+        if depth > self.metrics["queue_high_water"]:
+            self.metrics["queue_high_water"] = depth
+
+    async def _run(self):
+        """
+        Sammelt Messwerte zu Stapeln und schreibt sie außerhalb des Event-Loops.
+        """
+        while True:
+            batch = [await self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+
+            while len(batch) < self.batch_size:
+                # Bereits wartende Einträge ohne erneutes Warten übernehmen
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                remaining = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[str, datetime, Dict[str, Any]]]):
+        if not batch:
+            return
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write_batch, batch)
+        except Exception as e:
+            self.metrics["failed"] += len(batch)
+            logger.error(f"Fehler beim Speichern von {len(batch)} Sensordatensätzen: {e}")
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics["batches"] += 1
+            self.metrics["write_time_total"] += elapsed
+            self.metrics["write_time_max"] = max(self.metrics["write_time_max"], elapsed)
+
+    def _write_batch(self, batch: List[Tuple[str, datetime, Dict[str, Any]]]):
+        """
+        Speichert einen Stapel in einer Transaktion (läuft im Schreib-Thread).
+        """
+        db = next(get_db())
+        try:
+            unknown = {address for address, _, _ in batch if address not in self._device_ids}
+            if unknown:
+                rows = (
+                    db.query(models.Device.ble_address, models.Device.id)
+                    .filter(models.Device.ble_address.in_(unknown))
+                    .all()
+                )
+                self._device_ids.update(rows)
+
+            values = []
+            for address, received_at, sensor_data in batch:
+                device_pk = self._device_ids.get(address)
+                if device_pk is None:
+                    self.metrics["unknown_device"] += 1
+                    continue
+                row = {field: sensor_data.get(field) for field in READING_FIELDS}
+                row["device_id"] = device_pk
+                row["timestamp"] = received_at
+                values.append(row)
+
+            if values:
+                db.execute(insert(models.SensorReading.__table__), values)
+                db.commit()
+            self.metrics["written"] += len(values)
+            logger.debug(f"{len(values)} BLE-Sensordatensätze gespeichert")
+        except Exception:
+            db.rollback()
+            # Zuordnungen könnten veraltet sein (z.B. gelöschtes Gerät)
+            self._device_ids.clear()
+            raise
+        finally:
+            db.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Gibt Kennzahlen zu Warteschlange, verworfenen und geschriebenen Messwerten zurück.
+        """
+        batches = self.metrics["batches"]
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_queue,
+            "avg_write_ms": 1000.0 * self.metrics["write_time_total"] / batches if batches else 0.0,
+            "max_write_ms": 1000.0 * self.metrics["write_time_max"],
+            **{k: v for k, v in self.metrics.items() if k not in ("write_time_total", "write_time_max")},
+        }
@@ -4,11 +4,17 @@ BLE (Bluetooth Low Energy) Service für die SwissAirDry Plattform.
 Dieser Dienst ermöglicht das Scannen und Verbinden mit SwissAirDry-Geräten über BLE.
 """
 
+import os
 import asyncio
 import logging
 import json
-from typing import Dict, List, Optional, Callable, Any
+import threading
+import uuid
+import concurrent.futures
+from typing import Dict, List, Optional, Callable, Any, Coroutine
+from collections import OrderedDict
 import time
+from datetime import datetime
 
 import bleak
 from bleak import BleakScanner, BleakClient
@@ -16,6 +22,13 @@ from bleak.backends.device import BLEDevice
 
 from database import get_db
 import models
+from ble_connections import BLEConnectionManager, PRIORITY_DEFAULT, PRIORITY_TASK
+from ble_reading_writer import BLEReadingWriter
+from ble_commands import BLECommandQueue
+from ble_presence import BLEPresenceTracker
+from command_tracker import get_command_tracker
+from ble_codec import MSG_SENSOR, MSG_COMMAND, MSG_CONFIG, decode_payload, encode_payload
+from ble_advertisement import SWISSAIRDRY_COMPANY_ID, AdvertisementDeduplicator, decode_manufacturer_data
 
 # Logger für BLE Service
 logger = logging.getLogger("ble_service")
@@ -27,6 +40,31 @@ SENSOR_DATA_CHAR_UUID = "8cc6d3c8-0002-4af8-a0a8-d942d46aa1c5"     # Sensordaten
 CONTROL_CHAR_UUID = "8cc6d3c8-0003-4af8-a0a8-d942d46aa1c5"         # Steuerungs-Charakteristik
 CONFIG_CHAR_UUID = "8cc6d3c8-0004-4af8-a0a8-d942d46aa1c5"          # Konfigurations-Charakteristik
 
+# Verbindungsgrenzen des Adapters
+BLE_MAX_CONNECTIONS = int(os.getenv("BLE_MAX_CONNECTIONS", 4))
+BLE_IDLE_TIMEOUT = float(os.getenv("BLE_IDLE_TIMEOUT", 120))
+BLE_CONNECT_TIMEOUT = float(os.getenv("BLE_CONNECT_TIMEOUT", 10))
+
+# Kontinuierlicher Scan
+BLE_DEVICE_TTL = float(os.getenv("BLE_DEVICE_TTL", 300))  # Sekunden ohne Advertisement bis zum Vergessen
+BLE_MAX_TRACKED_DEVICES = int(os.getenv("BLE_MAX_TRACKED_DEVICES", 1024))
+BLE_DEFAULT_SCAN_INTERVAL = float(os.getenv("BLE_DEFAULT_SCAN_INTERVAL", 5))  # Für Geräte ohne Konfiguration
+SWEEP_INTERVAL = 5.0  # Sekunden zwischen Bereinigungsläufen
+INTERVAL_REFRESH = 60.0  # Sekunden zwischen dem Neuladen der Scan-Intervalle und aktiven Aufgaben
+
+# "bleak" (Adapter) oder "fake" (virtuelle Flotte aus ble_fake, für Lasttests)
+BLE_BACKEND = os.getenv("BLE_BACKEND", "bleak").lower()
+
+class _SeenDevice:
+    """
+    Zuletzt gesehener Zustand eines Geräts im kontinuierlichen Scan.
+    """
+    __slots__ = ("last_seen", "last_processed")
+
+    def __init__(self):
+        self.last_seen = 0.0
+        self.last_processed = float("-inf")
+
 class BLEService:
     """
     Bluetooth Low Energy Service für die SwissAirDry-Plattform.
@@ -38,18 +76,46 @@ class BLEService:
         Initialisiert den BLE-Service.
         
         Args:
-            scan_interval: Intervall in Sekunden für den Scan nach neuen Geräten
+            scan_interval: Wartezeit in Sekunden vor einem erneuten Scan-Versuch,
+                wenn der Adapter nicht verfügbar ist
         """
         self.scan_interval = scan_interval
         self.devices: Dict[str, BLEDevice] = {}  # Gefundene BLE-Geräte
+        self._seen: "OrderedDict[str, _SeenDevice]" = OrderedDict()  # Nach letzter Sichtung sortiert
+        self._scan_intervals: Dict[str, float] = {}  # Adresse -> ble_scan_interval aus DeviceConfig
+        self._task_addresses = set()  # Adressen von Geräten mit geplanten oder laufenden Aufgaben
+        self._intervals_loaded = 0.0
+        # Datenbankzugriffe laufen nie auf dem BLE-Event-Loop; ein gemeinsamer
+        # Thread mit dem Messwert-Schreiber hält Registrierung vor Messwerten
+        self._db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ble-db")
         self.connected_devices: Dict[str, BleakClient] = {}  # Verbundene Clients
+        self.scanner_factory: Callable = BleakScanner  # Austauschbar, siehe ble_fake
+        self.client_factory: Callable = BleakClient
         self.running = False
         self.scan_task = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None  # Dauerhafter BLE-Event-Loop
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
+        self.connections = BLEConnectionManager(
+            self._open_connection,
+            self._close_connection,
+            max_links=BLE_MAX_CONNECTIONS,
+            idle_timeout=BLE_IDLE_TIMEOUT,
+        )
+        self.reading_writer = BLEReadingWriter(executor=self._db_executor)
+        self.commands = BLECommandQueue(self._write_message)
+        self.presence = BLEPresenceTracker()  # RSSI, ble_last_seen und ble_connected
+        self._device_addresses: Dict[str, str] = {}  # device_id -> BLE-Adresse
+        self.device_codecs: Dict[str, int] = {}  # Adresse -> unterstützte Codec-Version (0 = JSON)
+        self.advert_dedup = AdvertisementDeduplicator()
+        self.advertising_devices = set()  # Geräte, die Messwerte im Advertisement senden
+        self._registered_addresses = set()  # Geräte mit Datenbankeintrag
         self._callbacks: Dict[str, List[Callable]] = {
             "device_found": [],
             "device_connected": [],
             "device_disconnected": [],
             "sensor_data": [],
+            "device_lost": [],
         }
     
     async def start(self):
@@ -58,6 +124,9 @@ class BLEService:
         """
         logger.info("BLE-Service wird gestartet")
         self.running = True
+        await self.connections.start()
+        await self.reading_writer.start()
+        await self.presence.start()
         self.scan_task = asyncio.create_task(self._scan_loop())
     
     async def stop(self):
@@ -74,13 +143,115 @@ class BLEService:
             except asyncio.CancelledError:
                 pass
         
+        await self.connections.stop()
+        await self.reading_writer.stop()
+        
         # Alle Verbindungen trennen
         for addr, client in list(self.connected_devices.items()):
             try:
                 await client.disconnect()
             except Exception as e:
                 logger.error(f"Fehler beim Trennen der Verbindung zu {addr}: {e}")
+            self.presence.set_connected(addr, False)
         self.connected_devices.clear()
+        await self.presence.stop()
+    
+    def start_loop_thread(self) -> asyncio.AbstractEventLoop:
+        """
+        Startet den dauerhaften BLE-Event-Loop in einem eigenen Thread.
+        
+        Alle bleak-Clients leben auf diesem Loop; andere Threads übergeben
+        Coroutinen über run_coroutine() bzw. submit().
+        
+        Returns:
+            asyncio.AbstractEventLoop: Der laufende BLE-Event-Loop
+        """
+        with self._loop_lock:
+            if self.loop is not None and self._loop_thread and self._loop_thread.is_alive():
+                return self.loop
+            
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            
+            def run_loop():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                try:
+                    loop.run_forever()
+                finally:
+                    # Verbleibende Tasks abbrechen, bevor der Loop geschlossen wird
+                    pending = asyncio.all_tasks(loop)
+                    for task in pending:
+                        task.cancel()
+                    if pending:
+                        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+                    loop.close()
+                    logger.info("BLE-Event-Loop beendet")
+            
+            self.loop = loop
+            self._loop_thread = threading.Thread(target=run_loop, name="ble-event-loop", daemon=True)
+            self._loop_thread.start()
+            ready.wait()
+            logger.info("BLE-Event-Loop gestartet")
+            return loop
+    
+    def submit(self, coro: Coroutine) -> concurrent.futures.Future:
+        """
+        Übergibt eine Coroutine an den BLE-Event-Loop, ohne auf sie zu warten.
+        
+        Args:
+            coro: Die auszuführende Coroutine
+            
+        Returns:
+            concurrent.futures.Future: Future mit dem Ergebnis der Coroutine
+        """
+        loop = self.start_loop_thread()
+        return asyncio.run_coroutine_threadsafe(coro, loop)
+    
+    def run_coroutine(self, coro: Coroutine, timeout: float = 5.0) -> Any:
+        """
+        Führt eine Coroutine threadsicher auf dem BLE-Event-Loop aus und wartet auf das Ergebnis.
+        
+        Läuft die Coroutine länger als ``timeout``, wird sie auf dem Loop
+        abgebrochen und ein TimeoutError ausgelöst.
+        
+        Args:
+            coro: Die auszuführende Coroutine
+            timeout: Maximale Wartezeit in Sekunden
+            
+        Returns:
+            Any: Rückgabewert der Coroutine
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise TimeoutError(f"BLE-Operation nach {timeout} Sekunden abgebrochen")
+    
+    def stop_loop_thread(self, timeout: float = 10.0):
+        """
+        Stoppt den BLE-Service und beendet anschließend den BLE-Event-Loop.
+        
+        Args:
+            timeout: Maximale Wartezeit in Sekunden für das Herunterfahren
+        """
+        with self._loop_lock:
+            loop, thread = self.loop, self._loop_thread
+        if loop is None or thread is None or not thread.is_alive():
+            return
+        
+        try:
+            asyncio.run_coroutine_threadsafe(self.stop(), loop).result(timeout)
+        except Exception as e:
+            logger.error(f"Fehler beim Stoppen des BLE-Service: {e}")
+        
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        
+        with self._loop_lock:
+            self.loop = None
+            self._loop_thread = None
     
     def register_callback(self, event_type: str, callback: Callable):
         """
@@ -106,66 +277,371 @@ class BLEService:
     
     async def _scan_loop(self):
         """
-        Scannt kontinuierlich nach BLE-Geräten im festgelegten Intervall.
+        Scannt dauerhaft und verarbeitet Advertisements sofort im Detection-Callback.
+        
+        Die Schleife selbst räumt nur regelmäßig veraltete Geräte ab und lädt die
+        Scan-Intervalle neu; fällt der Adapter aus, wird der Scan neu gestartet.
         """
         while self.running:
+            scanner = None
             try:
-                await self._scan_for_devices()
+                # Advertisements mit Messwerten haben keinen Platz für die 128-Bit-Service-UUID,
+                # daher wird im Callback nach Service-UUID oder Company-ID gefiltert
+                scanner = self.scanner_factory(detection_callback=self._on_detection)
+                await scanner.start()
+                logger.debug("Kontinuierlicher BLE-Scan gestartet")
+                
+                while self.running:
+                    await self._refresh_device_cache()
+                    self._evict_stale_devices()
+                    await asyncio.sleep(SWEEP_INTERVAL)
             except FileNotFoundError:
                 logger.error("BLE-Hardware nicht verfügbar oder nicht unterstützt. BLE-Funktionalität ist eingeschränkt. In Docker- oder virtuellen Umgebungen ohne physischen Bluetooth-Adapter wird diese Meldung erwartet.")
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
                 logger.error(f"Fehler beim Scannen nach BLE-Geräten: {e}")
+            finally:
+                if scanner is not None:
+                    try:
+                        await scanner.stop()
+                    except Exception:
+                        pass
             
-            # Warte bis zum nächsten Scan
-            await asyncio.sleep(self.scan_interval)
+            if self.running:
+                # Warte vor dem nächsten Startversuch
+                await asyncio.sleep(self.scan_interval)
+    
+    def _on_detection(self, device: BLEDevice, adv_data):
+        """
+        Detection-Callback des Scanners, pro empfangenem Advertisement aufgerufen.
+        
+        Aktualisiert Sichtungszeit und gleitenden RSSI-Mittelwert und verarbeitet
+        ein Gerät höchstens einmal pro Scan-Intervall (ble_scan_interval aus der
+        Gerätekonfiguration); neue Geräte werden sofort verarbeitet.
+        
+        Args:
+            device: Das BLE-Gerät
+            adv_data: Advertisement-Daten
+        """
+        if not self._is_swissairdry(adv_data):
+            return
+        
+        now = time.monotonic()
+        address = device.address
+        seen = self._seen.get(address)
+        if seen is None:
+            seen = self._seen[address] = _SeenDevice()
+        else:
+            self._seen.move_to_end(address)
+        seen.last_seen = now
+        rssi = self.presence.observe(address, adv_data.rssi)
+        
+        if len(self._seen) > BLE_MAX_TRACKED_DEVICES:
+            self._forget_device(next(iter(self._seen)))
+        
+        interval = self._scan_intervals.get(address, BLE_DEFAULT_SCAN_INTERVAL)
+        if now - seen.last_processed < interval:
+            return
+        seen.last_processed = now
+        
+        try:
+            self._process_detection(device, adv_data, rssi)
+        except Exception as e:
+            logger.error(f"Fehler beim Verarbeiten des Advertisements von {address}: {e}")
     
-    async def _scan_for_devices(self):
+    async def _refresh_device_cache(self):
         """
-        Führt einen Scan nach SwissAirDry-BLE-Geräten durch.
+        Lädt Scan-Intervalle und Geräte mit aktiven Aufgaben im Datenbank-Thread neu.
+        
+        Detection-Callback und Verbindungspriorität lesen nur diese
+        Zwischenspeicher und greifen nie selbst auf die Datenbank zu.
         """
-        logger.debug("Scanne nach BLE-Geräten...")
+        if time.monotonic() - self._intervals_loaded < INTERVAL_REFRESH:
+            return
+        self._intervals_loaded = time.monotonic()
         
-        # Scanne spezifisch nach SwissAirDry-Service UUID
-        devices = await BleakScanner.discover(
-            return_adv=True,
-            service_uuids=[SWISSAIRDRY_SERVICE_UUID]
+        loop = asyncio.get_running_loop()
+        try:
+            intervals, task_addresses = await loop.run_in_executor(self._db_executor, self._load_device_cache)
+        except Exception as e:
+            logger.error(f"Fehler beim Laden der BLE-Scan-Intervalle: {e}")
+            return
+        self._scan_intervals = intervals
+        self._task_addresses = task_addresses
+    
+    def _load_device_cache(self):
+        """
+        Fragt Scan-Intervalle und Adressen mit aktiven Aufgaben ab (läuft im Datenbank-Thread).
+        
+        Returns:
+            Tuple[Dict[str, float], set]: Adresse -> Scan-Intervall und die
+            Adressen der Geräte mit geplanten oder laufenden Aufgaben
+        """
+        db = next(get_db())
+        try:
+            rows = (
+                db.query(models.Device.ble_address, models.DeviceConfig.ble_scan_interval)
+                .join(models.DeviceConfig, models.DeviceConfig.device_id == models.Device.id)
+                .filter(models.Device.ble_address.isnot(None), models.DeviceConfig.ble_scan_interval.isnot(None))
+                .all()
+            )
+            task_rows = (
+                db.query(models.Device.ble_address)
+                .join(models.TaskAssignment, models.TaskAssignment.device_id == models.Device.id)
+                .filter(
+                    models.Device.ble_address.isnot(None),
+                    models.TaskAssignment.status.in_(("scheduled", "running")),
+                )
+                .distinct()
+                .all()
+            )
+            return (
+                {address: float(interval) for address, interval in rows},
+                {address for (address,) in task_rows},
+            )
+        finally:
+            db.close()
+    
+    def _evict_stale_devices(self):
+        """
+        Vergisst Geräte, die länger als BLE_DEVICE_TTL nicht gesehen wurden.
+        """
+        cutoff = time.monotonic() - BLE_DEVICE_TTL
+        # _seen ist nach letzter Sichtung sortiert, die ältesten stehen vorne
+        while self._seen:
+            address, seen = next(iter(self._seen.items()))
+            if seen.last_seen >= cutoff:
+                break
+            self._forget_device(address)
+    
+    def _forget_device(self, address: str):
+        """
+        Entfernt alle Zustände eines nicht mehr gesehenen Geräts.
+        
+        Verbundene Geräte bleiben bekannt, nur ihre Sichtungsdaten werden entfernt.
+        """
+        self._seen.pop(address, None)
+        if address in self.connected_devices:
+            return
+        
+        device = self.devices.pop(address, None)
+        self.advert_dedup.forget(address)
+        self.advertising_devices.discard(address)
+        self.device_codecs.pop(address, None)
+        self._registered_addresses.discard(address)
+        self.connections.forget(address)
+        self.presence.forget(address)
+        
+        if device:
+            logger.info(f"BLE-Gerät {device.name} ({address}) nicht mehr gesehen, entfernt")
+            for callback in self._callbacks["device_lost"]:
+                callback(device)
+    
+    def rssi(self, address: str) -> Optional[float]:
+        """
+        Gibt den geglätteten RSSI eines Geräts zurück.
+        """
+        return self.presence.rssi(address)
+    
+    def _process_detection(self, device: BLEDevice, adv_data, rssi: Optional[float]):
+        """
+        Verarbeitet ein (entprelltes) Advertisement eines SwissAirDry-Geräts.
+        """
+        is_new = device.address not in self.devices
+        self.devices[device.address] = device
+        
+        if is_new:
+            logger.info(f"Neues SwissAirDry-Gerät gefunden: {device.name} ({device.address})")
+            
+            # Callback für neue Geräte aufrufen
+            for callback in self._callbacks["device_found"]:
+                callback(device)
+        
+        # Geräte mit Messwerten im Advertisement brauchen keine Dauerverbindung;
+        # sie werden nur für Befehle verbunden (siehe _get_client)
+        if self._handle_advertisement(device, adv_data, rssi):
+            return
+        
+        # Verbindungswunsch einreihen; verdrängte oder aufgegebene Geräte erhalten
+        # einen Platz, sobald einer frei wird
+        if not self.connections.is_connected(device.address):
+            self.connections.request(device.address, self._connection_priority(device.address))
+    
+    def _is_swissairdry(self, adv_data) -> bool:
+        """
+        Prüft, ob ein Advertisement von einem SwissAirDry-Gerät stammt.
+        """
+        service_uuids = [uuid.lower() for uuid in (adv_data.service_uuids or [])]
+        return (
+            SWISSAIRDRY_SERVICE_UUID in service_uuids
+            or SWISSAIRDRY_COMPANY_ID in (adv_data.manufacturer_data or {})
         )
+    
+    def _handle_advertisement(self, device: BLEDevice, adv_data, rssi: Optional[float] = None) -> bool:
+        """
+        Verarbeitet Messwerte aus den herstellerspezifischen Advertisement-Daten.
         
-        for device, adv_data in devices.values():
-            if device.address not in self.devices:
-                logger.info(f"Neues SwissAirDry-Gerät gefunden: {device.name} ({device.address})")
-                self.devices[device.address] = device
-                
-                # Callback für neue Geräte aufrufen
-                for callback in self._callbacks["device_found"]:
-                    callback(device)
-                
-                # Versuche eine Verbindung herzustellen
-                asyncio.create_task(self._connect_to_device(device))
-            else:
-                # Gerät ist bereits bekannt, aktualisiere es
-                self.devices[device.address] = device
+        Args:
+            device: Das BLE-Gerät
+            adv_data: Advertisement-Daten des Scanners
+            rssi: Geglätteter RSSI (Standard: RSSI dieses Advertisements)
+            
+        Returns:
+            bool: True, wenn das Gerät Messwerte im Advertisement sendet
+        """
+        payload = adv_data.manufacturer_data.get(SWISSAIRDRY_COMPANY_ID) if adv_data else None
+        if not payload:
+            return False
+        
+        sensor_data = decode_manufacturer_data(payload)
+        if sensor_data is None:
+            return False
+        
+        self.advertising_devices.add(device.address)
+        
+        # Dieselbe Messung wird mehrfach pro Sekunde gesendet
+        if not self.advert_dedup.is_new(device.address, payload):
+            return True
+        
+        if device.address not in self._registered_addresses:
+            self._register_advertising_device(device)
+        
+        sensor_data["rssi"] = round(rssi if rssi is not None else adv_data.rssi)
+        self._handle_sensor_data(device.address, sensor_data)
+        return True
     
-    async def _connect_to_device(self, device: BLEDevice):
+    def _register_advertising_device(self, ble_device: BLEDevice):
+        """
+        Legt ein nur über Advertisements bekanntes Gerät in der Datenbank an.
+        
+        Die Registrierung läuft im Datenbank-Thread; die Adresse gilt sofort
+        als registriert, damit jedes Gerät nur einmal eingereiht wird, und wird
+        bei einem Fehler wieder freigegeben. Die vollständigen
+        Geräteinformationen werden bei der ersten Verbindung ergänzt (siehe
+        _register_device_in_db).
+        
+        Args:
+            ble_device: Das BLE-Gerät
+        """
+        address = ble_device.address
+        self._registered_addresses.add(address)
+        future = asyncio.get_running_loop().run_in_executor(
+            self._db_executor, self._store_advertising_device, address, ble_device.name
+        )
+        
+        def done(future: asyncio.Future):
+            if future.cancelled() or not future.result():
+                # Beim nächsten neuen Advertisement erneut versuchen
+                self._registered_addresses.discard(address)
+        
+        future.add_done_callback(done)
+    
+    def _store_advertising_device(self, address: str, name: Optional[str]) -> bool:
+        """
+        Speichert ein Gerät aus einem Advertisement (läuft im Datenbank-Thread).
+        
+        Args:
+            address: BLE-Adresse des Geräts
+            name: Im Advertisement gemeldeter Name
+            
+        Returns:
+            bool: True, wenn das Gerät in der Datenbank vorhanden ist
+        """
+        db = next(get_db())
+        try:
+            device = db.query(models.Device).filter_by(ble_address=address).first()
+            if not device:
+                device_id = f"ble_{address.replace(':', '')}"
+                device = models.Device(
+                    device_id=device_id,
+                    name=name or f"SwissAirDry {device_id[-6:]}",
+                    type="unknown",
+                    is_online=True,
+                    last_seen=datetime.now(),
+                    ble_address=address
+                )
+                db.add(device)
+                db.commit()
+                logger.info(f"Gerät aus Advertisement registriert: {device.name} ({address})")
+            return True
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Fehler beim Registrieren des Geräts {address}: {e}")
+            return False
+        finally:
+            db.close()
+    
+    def _connection_priority(self, address: str) -> int:
+        """
+        Bestimmt die Verbindungspriorität: Geräte mit aktiven Aufgaben zuerst.
+        
+        Liest nur den Zwischenspeicher aus _refresh_device_cache.
+        
+        Args:
+            address: BLE-Adresse des Geräts
+        """
+        return PRIORITY_TASK if address in self._task_addresses else PRIORITY_DEFAULT
+    
+    async def _open_connection(self, address: str) -> bool:
+        """
+        Verbindet mit einem bekannten Gerät (aufgerufen von der Verbindungsverwaltung).
+        """
+        device = self.devices.get(address)
+        if device is None:
+            logger.warning(f"Unbekanntes BLE-Gerät {address}, Verbindung nicht möglich")
+            return False
+        return await self._connect_to_device(device)
+    
+    async def _close_connection(self, address: str):
+        """
+        Trennt eine Verbindung (aufgerufen von der Verbindungsverwaltung).
+        """
+        client = self.connected_devices.get(address)
+        if client:
+            await client.disconnect()
+            # Nicht jedes Backend meldet absichtliche Trennungen über den Callback
+            self._handle_disconnect(address)
+    
+    async def _get_client(self, address: str) -> Optional[BleakClient]:
+        """
+        Gibt einen verbundenen Client zurück und baut die Verbindung bei Bedarf auf.
+        
+        Args:
+            address: BLE-Adresse des Geräts
+        """
+        if await self.connections.acquire(address, timeout=BLE_CONNECT_TIMEOUT):
+            return self.connected_devices.get(address)
+        return None
+    
+    async def _connect_to_device(self, device: BLEDevice) -> bool:
         """
         Stellt eine Verbindung zu einem BLE-Gerät her.
         
         Args:
             device: Das zu verbindende BLE-Gerät
+            
+        Returns:
+            bool: True, wenn die Verbindung besteht
         """
         if device.address in self.connected_devices:
             logger.debug(f"Bereits verbunden mit {device.name} ({device.address})")
-            return
+            return True
         
         logger.info(f"Verbinde mit Gerät: {device.name} ({device.address})")
         
         try:
-            client = BleakClient(device)
+            # Verbindungsstatus überwachen
+            client = self.client_factory(
+                device,
+                disconnected_callback=lambda c: self._handle_disconnect(device.address)
+            )
             await client.connect()
             logger.info(f"Verbunden mit {device.name} ({device.address})")
             
             # Verbindung speichern
             self.connected_devices[device.address] = client
+            self.presence.set_connected(device.address, True)
             
             # Callback für verbundene Geräte aufrufen
             for callback in self._callbacks["device_connected"]:
@@ -176,14 +652,11 @@ class BLEService:
             
             # Geräteinformationen abrufen und in der Datenbank speichern
             await self._register_device_in_db(client, device)
-            
-            # Überwache Verbindungsstatus
-            client.set_disconnected_callback(
-                lambda c: self._handle_disconnect(device.address)
-            )
+            return True
             
         except Exception as e:
             logger.error(f"Fehler beim Verbinden mit {device.name} ({device.address}): {e}")
+            return False
     
     def _handle_disconnect(self, address: str):
         """
@@ -198,38 +671,15 @@ class BLEService:
             
             # Entferne Client aus aktiven Verbindungen
             client = self.connected_devices.pop(address, None)
+            self.presence.set_connected(address, False)
             
             # Callback für getrennte Geräte aufrufen
             if device:
                 for callback in self._callbacks["device_disconnected"]:
                     callback(device)
             
-            # Versuche nach kurzer Verzögerung erneut zu verbinden
-            if device:
-                asyncio.create_task(self._reconnect_with_backoff(device))
-    
-    async def _reconnect_with_backoff(self, device: BLEDevice, max_attempts: int = 5):
-        """
-        Versucht, die Verbindung zu einem Gerät mit exponentieller Verzögerung wiederherzustellen.
-        
-        Args:
-            device: Das wiederzuverbindende Gerät
-            max_attempts: Maximale Anzahl von Wiederverbindungsversuchen
-        """
-        for attempt in range(1, max_attempts + 1):
-            # Warte mit exponentieller Verzögerung
-            delay = 2 ** attempt
-            logger.info(f"Wiederverbindung zu {device.name} in {delay} Sekunden (Versuch {attempt}/{max_attempts})")
-            await asyncio.sleep(delay)
-            
-            try:
-                await self._connect_to_device(device)
-                logger.info(f"Erfolgreich wiederverbunden mit {device.name}")
-                return
-            except Exception as e:
-                logger.error(f"Wiederverbindungsversuch {attempt} zu {device.name} fehlgeschlagen: {e}")
-        
-        logger.warning(f"Alle Wiederverbindungsversuche zu {device.name} fehlgeschlagen")
+            # Die Verwaltung reiht unerwartete Abbrüche mit Verzögerung neu ein
+            self.connections.release(address)
     
     async def _setup_notifications(self, client: BleakClient):
         """
@@ -247,18 +697,21 @@ class BLEService:
         except Exception as e:
             logger.error(f"Fehler beim Einrichten von Benachrichtigungen: {e}")
     
-    def _handle_sensor_data(self, address: str, data: bytearray):
+    def _handle_sensor_data(self, address: str, data):
         """
         Verarbeitet empfangene Sensordaten von einem Gerät.
         
         Args:
             address: MAC-Adresse des Geräts
-            data: Empfangene Datenbytes
+            data: Empfangene Datenbytes (GATT-Benachrichtigung) oder bereits
+                dekodierte Messwerte (Advertisement)
         """
         try:
-            # Datenbytes in JSON dekodieren
-            json_str = data.decode('utf-8')
-            sensor_data = json.loads(json_str)
+            if isinstance(data, dict):
+                sensor_data = data
+            else:
+                # Binärrahmen oder JSON, am ersten Byte erkannt
+                sensor_data = decode_payload(data, MSG_SENSOR)
             
             logger.debug(f"Sensordaten empfangen von {address}: {sensor_data}")
             
@@ -266,8 +719,8 @@ class BLEService:
             for callback in self._callbacks["sensor_data"]:
                 callback(address, sensor_data)
             
-            # Speichere Sensordaten in der Datenbank
-            asyncio.create_task(self._save_sensor_reading(address, sensor_data))
+            # Speicherung gebündelt und außerhalb des Event-Loops
+            self.reading_writer.submit(address, sensor_data)
             
         except Exception as e:
             logger.error(f"Fehler beim Verarbeiten von Sensordaten von {address}: {e}")
@@ -285,6 +738,12 @@ class BLEService:
             device_info_bytes = await client.read_gatt_char(DEVICE_INFO_CHAR_UUID)
             device_info = json.loads(device_info_bytes.decode('utf-8'))
             
+            # Codec-Aushandlung: ohne Angabe versteht das Gerät nur JSON
+            try:
+                self.device_codecs[ble_device.address] = int(device_info.get("codec_version", 0))
+            except (TypeError, ValueError):
+                self.device_codecs[ble_device.address] = 0
+            
             # Extrahiere Geräteinformationen
             device_id = device_info.get("device_id", f"ble_{ble_device.address.replace(':', '')}")
             device_name = device_info.get("name", ble_device.name or f"SwissAirDry {device_id[-6:]}")
@@ -292,134 +751,225 @@ class BLEService:
             firmware_version = device_info.get("firmware_version")
             hardware_version = device_info.get("hardware_version")
             
-            # Speichere in Datenbank
-            db = next(get_db())
-            try:
-                # Prüfe, ob Gerät bereits existiert
-                device = db.query(models.Device).filter_by(device_id=device_id).first()
-                
-                if device:
-                    # Aktualisiere bestehendes Gerät
-                    device.name = device_name
-                    device.firmware_version = firmware_version
-                    device.hardware_version = hardware_version
-                    device.is_online = True
-                    device.last_seen = time.time()
-                    device.ble_address = ble_device.address
-                else:
-                    # Erstelle neues Gerät
-                    device = models.Device(
-                        device_id=device_id,
-                        name=device_name,
-                        type=device_type,
-                        firmware_version=firmware_version,
-                        hardware_version=hardware_version,
-                        is_online=True,
-                        last_seen=time.time(),
-                        ble_address=ble_device.address
-                    )
-                    db.add(device)
-                
-                # Gerätekonfiguration
-                if not device.config:
-                    config = models.DeviceConfig(
-                        device=device,
-                        display_type=device_info.get("display_type", "none"),
-                        has_sensors=True,
-                        ota_enabled=True,
-                        ble_enabled=True
-                    )
-                    db.add(config)
-                
-                db.commit()
+            # Speichere in Datenbank (im Datenbank-Thread)
+            loop = asyncio.get_running_loop()
+            stored = await loop.run_in_executor(
+                self._db_executor,
+                self._store_connected_device,
+                ble_device.address,
+                device_id,
+                device_name,
+                device_type,
+                firmware_version,
+                hardware_version,
+                device_info.get("display_type", "none"),
+            )
+            if stored:
+                self._device_addresses[device_id] = ble_device.address
                 logger.info(f"Gerät in Datenbank registriert/aktualisiert: {device_name} ({device_id})")
                 
-            except Exception as db_error:
-                db.rollback()
-                logger.error(f"Datenbankfehler beim Registrieren des Geräts: {db_error}")
-            finally:
-                db.close()
-                
         except Exception as e:
             logger.error(f"Fehler beim Abrufen von Geräteinformationen: {e}")
     
-    async def _save_sensor_reading(self, address: str, sensor_data: Dict[str, Any]):
+    def _store_connected_device(
+        self,
+        address: str,
+        device_id: str,
+        device_name: str,
+        device_type: str,
+        firmware_version: Optional[str],
+        hardware_version: Optional[str],
+        display_type: str
+    ) -> bool:
         """
-        Speichert Sensordaten in der Datenbank.
+        Legt ein verbundenes Gerät an oder aktualisiert es (läuft im Datenbank-Thread).
         
-        Args:
-            address: MAC-Adresse des Geräts
-            sensor_data: Die empfangenen Sensordaten
+        Returns:
+            bool: True, wenn das Gerät gespeichert wurde
         """
         db = next(get_db())
         try:
-            # Finde das zugehörige Gerät
-            device = db.query(models.Device).filter_by(ble_address=address).first()
-            
-            if not device:
-                logger.warning(f"Kein Gerät mit BLE-Adresse {address} in der Datenbank gefunden")
-                return
-            
-            # Erstelle neuen Sensordatensatz
-            reading = models.SensorReading(
-                device_id=device.id,
-                temperature=sensor_data.get("temperature"),
-                humidity=sensor_data.get("humidity"),
-                pressure=sensor_data.get("pressure"),
-                fan_speed=sensor_data.get("fan_speed"),
-                power_consumption=sensor_data.get("power_consumption")
+            # Prüfe, ob Gerät bereits existiert (auch aus einem Advertisement)
+            device = (
+                db.query(models.Device).filter_by(device_id=device_id).first()
+                or db.query(models.Device).filter_by(ble_address=address).first()
             )
             
-            db.add(reading)
+            if device:
+                # Aktualisiere bestehendes Gerät
+                device.device_id = device_id
+                device.type = device_type if device.type == "unknown" else device.type
+                device.name = device_name
+                device.firmware_version = firmware_version
+                device.hardware_version = hardware_version
+                device.is_online = True
+                device.last_seen = datetime.now()
+                device.ble_address = address
+            else:
+                # Erstelle neues Gerät
+                device = models.Device(
+                    device_id=device_id,
+                    name=device_name,
+                    type=device_type,
+                    firmware_version=firmware_version,
+                    hardware_version=hardware_version,
+                    is_online=True,
+                    last_seen=datetime.now(),
+                    ble_address=address
+                )
+                db.add(device)
+            
+            # Gerätekonfiguration
+            if not device.config:
+                config = models.DeviceConfig(
+                    device=device,
+                    display_type=display_type,
+                    has_sensors=True,
+                    ota_enabled=True,
+                    ble_enabled=True
+                )
+                db.add(config)
+            
             db.commit()
-            logger.debug(f"Sensordaten für Gerät {device.name} gespeichert")
+            return True
             
-        except Exception as e:
+        except Exception as db_error:
             db.rollback()
-            logger.error(f"Fehler beim Speichern von Sensordaten: {e}")
+            logger.error(f"Datenbankfehler beim Registrieren des Geräts: {db_error}")
+            return False
+        finally:
+            db.close()
+    
+    async def _resolve_address(self, device_id: str) -> Optional[str]:
+        """
+        Gibt die BLE-Adresse eines Geräts zurück (zwischengespeichert).
+        
+        Nicht zwischengespeicherte Adressen werden im Datenbank-Thread gelesen.
+        
+        Args:
+            device_id: Die ID des Geräts
+        """
+        address = self._device_addresses.get(device_id)
+        if address:
+            return address
+        
+        loop = asyncio.get_running_loop()
+        address = await loop.run_in_executor(self._db_executor, self._load_address, device_id)
+        if address:
+            self._device_addresses[device_id] = address
+        return address
+    
+    def _load_address(self, device_id: str) -> Optional[str]:
+        """
+        Liest die BLE-Adresse eines Geräts (läuft im Datenbank-Thread).
+        """
+        db = next(get_db())
+        try:
+            device = db.query(models.Device).filter_by(device_id=device_id).first()
+            return device.ble_address if device else None
         finally:
             db.close()
     
-    async def send_command(self, device_id: str, command: Dict[str, Any]) -> bool:
+    def _supports_write_without_response(self, client: BleakClient, char_uuid: str, size: int) -> bool:
+        """
+        Prüft, ob eine Charakteristik Write Without Response für diese Nutzlast erlaubt.
+        """
+        try:
+            characteristic = client.services.get_characteristic(char_uuid)
+        except Exception:
+            return False
+        if characteristic is None or "write-without-response" not in characteristic.properties:
+            return False
+        return size <= characteristic.max_write_without_response_size
+    
+    async def _write_message(self, address: str, channel: str, message: Dict[str, Any], require_ack: bool) -> bool:
+        """
+        Schreibt eine Nachricht aus der Befehlswarteschlange an ein Gerät.
+        
+        Args:
+            address: BLE-Adresse des Geräts
+            channel: "command" (Steuerung) oder "config" (Konfiguration)
+            message: Die zu sendende Nachricht
+            require_ack: Mit Bestätigung schreiben
+            
+        Returns:
+            bool: Erfolg der Operation
+        """
+        # Verbindung bei Bedarf über die Verbindungsverwaltung aufbauen
+        client = await self._get_client(address)
+        if not client:
+            logger.warning(f"Keine aktive BLE-Verbindung zu Gerät {address}")
+            return False
+        
+        # Nachricht im vom Gerät unterstützten Format kodieren
+        msg_type, char_uuid = (MSG_CONFIG, CONFIG_CHAR_UUID) if channel == "config" else (MSG_COMMAND, CONTROL_CHAR_UUID)
+        payload = encode_payload(msg_type, message, self.device_codecs.get(address, 0))
+        
+        # Ohne Bestätigung nur, wenn das Gerät es für diese Nutzlast unterstützt
+        response = require_ack or not self._supports_write_without_response(client, char_uuid, len(payload))
+        await client.write_gatt_char(char_uuid, payload, response=response)
+        self.connections.touch(address)
+        return True
+    
+    async def send_command(self, device_id: str, command: Dict[str, Any], require_ack: Optional[bool] = None) -> bool:
         """
         Sendet einen Befehl an ein Gerät über BLE.
         
+        Befehle werden pro Gerät nacheinander geschrieben; noch nicht gesendete
+        Leistungs- oder Lüfterbefehle werden durch neuere ersetzt.
+        
         Args:
             device_id: Die ID des Zielgeräts
             command: Der zu sendende Befehl
+            require_ack: Mit Bestätigung schreiben (Standard: nur für Befehle,
+                die nicht zusammengefasst werden)
             
         Returns:
             bool: Erfolg der Operation
         """
-        db = next(get_db())
         try:
-            # Finde das Gerät in der Datenbank
-            device = db.query(models.Device).filter_by(device_id=device_id).first()
-            
-            if not device or not device.ble_address:
+            address = await self._resolve_address(device_id)
+            if not address:
                 logger.warning(f"Kein Gerät mit ID {device_id} oder BLE-Adresse gefunden")
                 return False
             
-            # Prüfe, ob Gerät verbunden ist
-            client = self.connected_devices.get(device.ble_address)
-            if not client:
-                logger.warning(f"Keine aktive BLE-Verbindung zu Gerät {device.name} ({device_id})")
-                return False
-            
-            # Befehl als JSON serialisieren
-            command_json = json.dumps(command)
-            command_bytes = command_json.encode('utf-8')
-            
-            # Befehl senden
-            await client.write_gatt_char(CONTROL_CHAR_UUID, command_bytes)
-            logger.info(f"Befehl an Gerät {device.name} gesendet: {command}")
-            return True
+            success = await self._tracked_submit(device_id, "control", address, command, require_ack)
+            if success:
+                logger.info(f"Befehl an Gerät {device_id} gesendet: {command}")
+            return success
             
         except Exception as e:
             logger.error(f"Fehler beim Senden des Befehls an {device_id}: {e}")
             return False
+    
+    async def _tracked_submit(
+        self,
+        device_id: str,
+        kind: str,
+        address: str,
+        message: Dict[str, Any],
+        require_ack: Optional[bool],
+        channel: str = "command"
+    ) -> bool:
+        """
+        Schreibt über die Befehlswarteschlange und erfasst die Umlaufzeit im Befehls-Tracker.
+        
+        Die Korrelations-ID wird wie bei MQTT als ``command_id`` in die
+        Nachricht geschrieben; das Ergebnis des GATT-Schreibvorgangs gilt als
+        Bestätigung. Ersetzt ein neuerer Steuerbefehl den Befehl in der
+        Warteschlange, wird nur dessen ID gesendet und beide erhalten sein
+        Ergebnis.
+        """
+        tracker = get_command_tracker()
+        command_id = uuid.uuid4().hex
+        message = {**message, "command_id": command_id}
+        tracker.track(command_id, {device_id: None}, kind, transport="ble")
+        success = False
+        try:
+            success = await self.commands.submit(address, message, require_ack, channel=channel)
+            return success
         finally:
-            db.close()
+            tracker.ack(device_id, command_id, status="success" if success else "error")
     
     async def update_config(self, device_id: str, config: Dict[str, Any]) -> bool:
         """
@@ -432,31 +982,35 @@ class BLEService:
         Returns:
             bool: Erfolg der Operation
         """
-        db = next(get_db())
         try:
-            # Finde das Gerät in der Datenbank
-            device = db.query(models.Device).filter_by(device_id=device_id).first()
-            
-            if not device or not device.ble_address:
+            address = await self._resolve_address(device_id)
+            if not address:
                 logger.warning(f"Kein Gerät mit ID {device_id} oder BLE-Adresse gefunden")
                 return False
             
-            # Prüfe, ob Gerät verbunden ist
-            client = self.connected_devices.get(device.ble_address)
-            if not client:
-                logger.warning(f"Keine aktive BLE-Verbindung zu Gerät {device.name} ({device_id})")
+            # Konfiguration über die Warteschlange des Geräts senden (mit Bestätigung)
+            if not await self._tracked_submit(device_id, "config", address, config, True, channel="config"):
                 return False
-            
-            # Konfiguration als JSON serialisieren
-            config_json = json.dumps(config)
-            config_bytes = config_json.encode('utf-8')
-            
-            # Konfiguration senden
-            await client.write_gatt_char(CONFIG_CHAR_UUID, config_bytes)
-            logger.info(f"Konfiguration für Gerät {device.name} aktualisiert")
-            
-            # Aktualisiere auch in der Datenbank
-            device_config = db.query(models.DeviceConfig).filter_by(device_id=device.id).first()
+            logger.info(f"Konfiguration für Gerät {device_id} aktualisiert")
+        except Exception as e:
+            logger.error(f"Fehler beim Aktualisieren der Konfiguration für {device_id}: {e}")
+            return False
+        
+        # Aktualisiere auch in der Datenbank (im Datenbank-Thread)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._db_executor, self._store_config, device_id, config)
+    
+    def _store_config(self, device_id: str, config: Dict[str, Any]) -> bool:
+        """
+        Übernimmt eine gesendete Konfiguration in die Datenbank (läuft im Datenbank-Thread).
+        
+        Returns:
+            bool: Erfolg der Operation
+        """
+        db = next(get_db())
+        try:
+            device = db.query(models.Device).filter_by(device_id=device_id).first()
+            device_config = device.config if device else None
             if device_config:
                 if "update_interval" in config:
                     device_config.update_interval = config["update_interval"]
@@ -475,6 +1029,23 @@ class BLEService:
             return False
         finally:
             db.close()
+    
+    def submit_db_task(self, func: Callable[..., Any], *args: Any) -> concurrent.futures.Future:
+        """
+        Führt eine Datenbankaufgabe im Datenbank-Thread des Dienstes aus.
+        
+        Für Callbacks, die im BLE-Event-Loop aufgerufen werden; die Aufgaben
+        laufen in der Reihenfolge ihrer Übergabe nach den bereits
+        eingereihten Zugriffen des Dienstes.
+        
+        Args:
+            func: Auszuführende Funktion
+            *args: Argumente der Funktion
+            
+        Returns:
+            concurrent.futures.Future: Ergebnis der Aufgabe
+        """
+        return self._db_executor.submit(func, *args)
 
 # Singleton-Instanz des BLE-Service
 _ble_service_instance = None
@@ -486,4 +1057,7 @@ def get_ble_service() -> BLEService:
     global _ble_service_instance
     if _ble_service_instance is None:
         _ble_service_instance = BLEService()
+        if BLE_BACKEND == "fake":
+            from ble_fake import use_fake_backend
+            use_fake_backend(_ble_service_instance)
     return _ble_service_instance
\ No newline at end of file
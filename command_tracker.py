@@ -0,0 +1,381 @@
+"""
+Command acknowledgement tracking for the SwissAirDry platform.
+
+Every outbound command (control, config, status requests, group commands,
+BLE writes) carries a correlation id. The tracker keeps one pending entry per
+command and target device, matches acknowledgements in O(1), expires
+unanswered entries through a timing wheel and records the round-trip latency
+in histograms per device type and per transport.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from device_state import get_device_state_store
+from timing_wheel import TimingWheel
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Global tracker instance
+_command_tracker = None
+
+# Seconds to wait for an acknowledgement before a command counts as timed out
+COMMAND_ACK_TIMEOUT = float(os.getenv("COMMAND_ACK_TIMEOUT", 30))
+# Number of commands whose results stay queryable
+COMMAND_RESULT_RETENTION = int(os.getenv("COMMAND_RESULT_RETENTION", 10000))
+
+# Upper bounds of the latency histogram buckets in milliseconds
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class LatencyHistogram:
+    """
+    Fixed-bucket histogram of round-trip latencies.
+    """
+    __slots__ = ("counts", "count", "sum_ms", "max_ms", "errors", "timeouts")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+        self.timeouts = 0
+
+    def observe(self, latency_ms: float) -> None:
+        index = 0
+        while index < len(LATENCY_BUCKETS_MS) and latency_ms > LATENCY_BUCKETS_MS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.sum_ms += latency_ms
+        self.max_ms = max(self.max_ms, latency_ms)
+
+    def percentile(self, pct: float) -> Optional[float]:
+        """
+        Return the upper bound of the bucket containing the percentile.
+        """
+        if not self.count:
+            return None
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return float(LATENCY_BUCKETS_MS[index]) if index < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def to_dict(self) -> Dict[str, Any]:
+        buckets = {f"le_{bound}": count for bound, count in zip(LATENCY_BUCKETS_MS, self.counts)}
+        buckets["le_inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "avg_ms": self.sum_ms / self.count if self.count else None,
+            "p50_ms": self.percentile(50),
+            "p95_ms": self.percentile(95),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max_ms if self.count else None,
+            "buckets": buckets,
+        }
+
+class _Pending:
+    """
+    Pending acknowledgement of one device for one command.
+    """
+    __slots__ = ("command_id", "device_id", "kind", "transport", "device_type", "sent_at")
+
+    def __init__(self, command_id: str, device_id: str, kind: str, transport: str, device_type: str, sent_at: float):
+        self.command_id = command_id
+        self.device_id = device_id
+        self.kind = kind
+        self.transport = transport
+        self.device_type = device_type
+        self.sent_at = sent_at
+
+class CommandTracker:
+    """
+    Thread-safe table of pending command acknowledgements.
+
+    Entries are keyed by (command_id, device_id), so a command sent to a group
+    or as a config batch is tracked per member under one correlation id.
+    Devices that acknowledge without an id (older firmware) are matched to
+    their newest pending command of the same kind. Results of finished
+    commands are kept for the most recent ``retention`` commands.
+    """
+
+    def __init__(
+        self,
+        timeout: float = COMMAND_ACK_TIMEOUT,
+        retention: int = COMMAND_RESULT_RETENTION,
+        tick: float = 0.5,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Initialize the tracker.
+
+        Args:
+            timeout: Default seconds until an unanswered command times out
+            retention: Number of commands whose results stay queryable
+            tick: Resolution of the timeout wheel in seconds
+            clock: Monotonic time source for the timeouts and latencies
+        """
+        self.timeout = timeout
+        self.retention = retention
+        self._clock = clock
+        self._wheel = TimingWheel(tick=tick, clock=clock)
+        self._pending: Dict[Tuple[str, str], _Pending] = {}
+        self._latest: Dict[Tuple[str, str], str] = {}  # (device_id, kind) -> newest pending command_id
+        self._commands: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._by_type: Dict[str, LatencyHistogram] = {}
+        self._by_transport: Dict[str, LatencyHistogram] = {}
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.metrics = {
+            "tracked": 0,
+            "acked": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "unmatched": 0,
+        }
+
+    # ----- Lifecycle -----
+
+    def start(self) -> None:
+        """
+        Start the thread expiring unanswered commands.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="command-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the expiry thread; pending entries stay until the next start.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    @property
+    def running(self) -> bool:
+        """
+        Whether the expiry thread runs, i.e. this process owns ingest and receives the acks.
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._wheel.tick):
+            try:
+                self.expire()
+            except Exception as e:
+                logger.error(f"Error expiring commands: {e}")
+
+    # ----- Tracking -----
+
+    def track(
+        self,
+        command_id: str,
+        members: Dict[str, Optional[str]],
+        kind: str,
+        transport: str = "mqtt",
+        timeout: Optional[float] = None
+    ) -> int:
+        """
+        Register a sent command.
+
+        Args:
+            command_id: Correlation id carried in the command payload
+            members: Mapping of target device_id to its device type (None
+                looks the type up in the device states)
+            kind: Command kind (control, group, config, command)
+            transport: Transport the command was sent over (mqtt, ble)
+            timeout: Seconds until the command times out (default: tracker timeout)
+
+        Returns:
+            int: Number of tracked targets
+        """
+        timeout = self.timeout if timeout is None else timeout
+        states = get_device_state_store()
+        entry = {
+            "command_id": command_id,
+            "kind": kind,
+            "transport": transport,
+            "sent_at": datetime.now().isoformat(),
+            "members": {},
+        }
+        sent_at = self._clock()
+        with self._condition:
+            for device_id, device_type in members.items():
+                if device_type is None:
+                    state = states.get(device_id)
+                    device_type = state["type"] if state else "unknown"
+                key = (command_id, device_id)
+                self._pending[key] = _Pending(command_id, device_id, kind, transport, device_type, sent_at)
+                self._latest[(device_id, kind)] = command_id
+                self._wheel.schedule(key, timeout)
+                entry["members"][device_id] = {"status": "pending", "latency_ms": None}
+            self._commands[command_id] = entry
+            while len(self._commands) > self.retention:
+                self._commands.popitem(last=False)
+            self.metrics["tracked"] += len(members)
+        return len(members)
+
+    def ack(
+        self,
+        device_id: str,
+        command_id: Optional[str] = None,
+        kind: Optional[str] = None,
+        status: str = "success",
+        message: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Match an acknowledgement to its pending command.
+
+        Args:
+            device_id: Acknowledging device
+            command_id: Correlation id from the ack (None: newest pending
+                command of ``kind`` for the device)
+            kind: Command kind, used to match acks without an id
+            status: Reported result (success or error)
+            message: Optional message from the device
+
+        Returns:
+            Optional[str]: Kind of the matched command, None if nothing matched
+        """
+        now = self._clock()
+        with self._condition:
+            if command_id is None and kind is not None:
+                command_id = self._latest.get((device_id, kind))
+            pending = self._pending.pop((command_id, device_id), None)
+            if pending is None:
+                self.metrics["unmatched"] += 1
+                return None
+            self._wheel.cancel((command_id, device_id))
+            self._forget_latest(pending)
+
+            latency_ms = (now - pending.sent_at) * 1000.0
+            failed = status != "success"
+            for histogram in self._histograms(pending):
+                histogram.observe(latency_ms)
+                if failed:
+                    histogram.errors += 1
+            self.metrics["errors" if failed else "acked"] += 1
+            self._finish(pending, status, latency_ms, message)
+            self._condition.notify_all()
+        return pending.kind
+
+    def expire(self) -> List[Tuple[str, str]]:
+        """
+        Mark the commands whose deadline passed as timed out.
+
+        Returns:
+            List[Tuple[str, str]]: Expired (command_id, device_id) keys
+        """
+        expired = self._wheel.advance()
+        if not expired:
+            return []
+        with self._condition:
+            for key in expired:
+                pending = self._pending.pop(key, None)
+                if pending is None:
+                    continue
+                self._forget_latest(pending)
+                for histogram in self._histograms(pending):
+                    histogram.timeouts += 1
+                self.metrics["timeouts"] += 1
+                self._finish(pending, "timeout", None, None)
+            self._condition.notify_all()
+        return expired
+
+    def _histograms(self, pending: _Pending) -> Tuple[LatencyHistogram, LatencyHistogram]:
+        by_type = self._by_type.get(pending.device_type)
+        if by_type is None:
+            by_type = self._by_type[pending.device_type] = LatencyHistogram()
+        by_transport = self._by_transport.get(pending.transport)
+        if by_transport is None:
+            by_transport = self._by_transport[pending.transport] = LatencyHistogram()
+        return by_type, by_transport
+
+    def _forget_latest(self, pending: _Pending) -> None:
+        key = (pending.device_id, pending.kind)
+        if self._latest.get(key) == pending.command_id:
+            del self._latest[key]
+
+    def _finish(self, pending: _Pending, status: str, latency_ms: Optional[float], message: Optional[str]) -> None:
+        entry = self._commands.get(pending.command_id)
+        if entry is None:
+            return
+        entry["members"][pending.device_id] = {
+            "status": status,
+            "latency_ms": latency_ms,
+            "message": message,
+        }
+
+    # ----- Reads -----
+
+    def status(self, command_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the state of a command per target device, or None if it is unknown.
+        """
+        with self._condition:
+            entry = self._commands.get(command_id)
+            if entry is None:
+                return None
+            counts: Dict[str, int] = {}
+            for member in entry["members"].values():
+                counts[member["status"]] = counts.get(member["status"], 0) + 1
+            return {
+                **entry,
+                "members": {device_id: dict(member) for device_id, member in entry["members"].items()},
+                "counts": counts,
+                "complete": "pending" not in counts,
+            }
+
+    def wait(self, command_id: str, timeout: float = 10.0) -> Optional[Dict[str, Any]]:
+        """
+        Block until every target acknowledged (or timed out) or ``timeout`` passes.
+
+        Returns:
+            Optional[Dict[str, Any]]: The command state as returned by ``status``
+        """
+        def done():
+            entry = self._commands.get(command_id)
+            return entry is None or all(
+                member["status"] != "pending" for member in entry["members"].values()
+            )
+
+        with self._condition:
+            self._condition.wait_for(done, timeout=timeout)
+        return self.status(command_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Return counters and latency histograms per device type and per transport.
+        """
+        with self._condition:
+            return {
+                "pending": len(self._pending),
+                **self.metrics,
+                "by_device_type": {name: h.to_dict() for name, h in self._by_type.items()},
+                "by_transport": {name: h.to_dict() for name, h in self._by_transport.items()},
+            }
+
+def get_command_tracker() -> CommandTracker:
+    """
+    Get the global command tracker instance.
+    """
+    global _command_tracker
+    if _command_tracker is None:
+        _command_tracker = CommandTracker()
+    return _command_tracker
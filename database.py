@@ -2,9 +2,19 @@
 Database connection handling for the SwissAirDry platform.
 """
 import os
-from sqlalchemy import create_engine
+import time
+import logging
+import itertools
+import threading
+from typing import Any, Dict, List, Optional
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
 
 # Get PostgreSQL connection details from environment variables
 DATABASE_URL = os.getenv(
@@ -12,12 +22,84 @@ DATABASE_URL = os.getenv(
     f"postgresql://{os.getenv('PGUSER', 'postgres')}:{os.getenv('PGPASSWORD', 'postgres')}@{os.getenv('PGHOST', 'localhost')}:{os.getenv('PGPORT', '5432')}/{os.getenv('PGDATABASE', 'swissairdry')}"
 )
 
-# Create SQLAlchemy engine
-engine = create_engine(
-    DATABASE_URL,
-    pool_pre_ping=True,
-    pool_recycle=300,
-)
+# Comma-separated read replica URLs; reads fall back to the primary without them
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# Replicas lagging more than this many seconds behind the primary are skipped
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 5))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 5))
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long checkouts wait for a free connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except SQLAlchemyError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+def _engine_options(url: str) -> Dict[str, Any]:
+    """
+    Build engine keyword arguments for a database role.
+    """
+    options = {"pool_pre_ping": True, "pool_recycle": 300}
+    if make_url(url).get_backend_name() != "sqlite":
+        options.update(
+            poolclass=TimedQueuePool,
+            pool_size=int(os.getenv("DB_POOL_SIZE", 5)),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", 10)),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", 30)),
+        )
+    return options
+
+def pool_stats(bind: Engine) -> Dict[str, Any]:
+    """
+    Report connection pool usage of an engine.
+
+    Returns:
+        dict: Pool size, checked-out and idle connections, overflow and,
+        for TimedQueuePool, checkout wait statistics in milliseconds
+    """
+    pool = bind.pool
+    stats: Dict[str, Any] = {"pool": type(pool).__name__, "status": pool.status()}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(0, pool.overflow()),
+        )
+    if isinstance(pool, TimedQueuePool):
+        with pool._stats_lock:
+            stats.update(
+                checkouts=pool.checkouts,
+                timeouts=pool.timeouts,
+                wait_avg_ms=1000.0 * pool.wait_total / pool.checkouts if pool.checkouts else 0.0,
+                wait_max_ms=1000.0 * pool.wait_max,
+            )
+    return stats
+
+# Create SQLAlchemy engine (primary: all writes, and reads without replicas)
+engine = create_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -35,3 +117,197 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# ----- Read replicas -----
+
+class ReplicaRouter:
+    """
+    Routes read-only sessions to healthy replicas.
+
+    A background thread measures each replica's replication lag every
+    ``check_interval`` seconds; replicas that are unreachable or lag more than
+    ``max_lag`` seconds are skipped, and reads fall back to the primary when
+    no replica qualifies. Request handlers never wait for a lag check.
+    """
+
+    def __init__(self, urls: List[str], max_lag: float = 5.0, check_interval: float = 5.0):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.replicas = [
+            {
+                "url": make_url(url).render_as_string(hide_password=True),
+                "engine": create_engine(url, **_engine_options(url)),
+                "async_engine": None,
+                "lag": None,
+                "healthy": False,
+                "error": None,
+                "checked_at": None,
+            }
+            for url in urls
+        ]
+        self.fallbacks = 0
+        self._next = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def _ensure_monitor(self) -> None:
+        if self._thread is not None or not self.replicas:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._monitor, name="replica-lag", daemon=True)
+                self._thread.start()
+
+    def _monitor(self) -> None:
+        while True:
+            for replica in self.replicas:
+                self.check(replica)
+            time.sleep(self.check_interval)
+
+    def check(self, replica: Dict[str, Any]) -> None:
+        """
+        Measure the replication lag of one replica.
+        """
+        try:
+            with replica["engine"].connect() as conn:
+                # An idle replica that has replayed everything it received is not lagging,
+                # no matter how old the last replayed transaction is
+                lag = conn.execute(text(
+                    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                )).scalar()
+            replica["lag"] = float(lag)
+            replica["healthy"] = replica["lag"] <= self.max_lag
+            replica["error"] = None
+        except Exception as e:
+            if replica["error"] != str(e):
+                logger.warning(f"Replica {replica['url']} unavailable: {e}")
+            replica["healthy"] = False
+            replica["error"] = str(e)
+        replica["checked_at"] = time.time()
+
+    def pick(self, use_async: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Pick a healthy replica round-robin, or None to use the primary.
+        """
+        self._ensure_monitor()
+        candidates = [
+            replica for replica in self.replicas
+            if replica["healthy"] and (not use_async or replica["async_engine"] is not None)
+        ]
+        if not candidates:
+            if self.replicas:
+                self.fallbacks += 1
+            return None
+        return candidates[next(self._next) % len(candidates)]
+
+    def status(self) -> List[Dict[str, Any]]:
+        """
+        Describe replica health, lag and pool usage.
+        """
+        return [
+            {
+                "url": replica["url"],
+                "healthy": replica["healthy"],
+                "lag_seconds": replica["lag"],
+                "error": replica["error"],
+                "checked_at": replica["checked_at"],
+                "pool": pool_stats(replica["engine"]),
+                "async_pool": pool_stats(replica["async_engine"].sync_engine) if replica["async_engine"] else None,
+            }
+            for replica in self.replicas
+        ]
+
+replica_router = ReplicaRouter(DATABASE_REPLICA_URLS, REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL)
+
+def get_read_db():
+    """
+    Dependency function to get a read-only database session.
+    Uses a replica within the allowed lag, otherwise the primary.
+    """
+    replica = replica_router.pick()
+    db = SessionLocal(bind=replica["engine"]) if replica else SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def database_stats() -> Dict[str, Any]:
+    """
+    Pool statistics of the primary and replica health for the admin endpoint.
+    """
+    return {
+        "primary": pool_stats(engine),
+        "primary_async": pool_stats(async_engine.sync_engine) if async_engine is not None else None,
+        "replicas": replica_router.status(),
+        "replica_fallbacks": replica_router.fallbacks,
+        "max_lag_seconds": replica_router.max_lag,
+    }
+
+# ----- Optional async engine (asyncpg) -----
+
+def _to_async_url(url: str) -> str:
+    """
+    Convert a synchronous PostgreSQL URL into its asyncpg equivalent.
+    """
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            return "postgresql+asyncpg://" + url[len(prefix):]
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _to_async_url(DATABASE_URL))
+
+# The async engine is on by default when asyncpg is installed; ASYNC_DB_ENABLED=0 turns it off
+async_engine = None
+AsyncSessionLocal = None
+
+if os.getenv("ASYNC_DB_ENABLED", "1").lower() not in ("0", "false", "no"):
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        async_engine = create_async_engine(
+            ASYNC_DATABASE_URL,
+            pool_pre_ping=True,
+            pool_recycle=300,
+            pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", 20)),
+            max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", 20)),
+        )
+        AsyncSessionLocal = async_sessionmaker(
+            bind=async_engine,
+            autoflush=False,
+            expire_on_commit=False,
+        )
+        for replica, url in zip(replica_router.replicas, DATABASE_REPLICA_URLS):
+            replica["async_engine"] = create_async_engine(
+                _to_async_url(url),
+                pool_pre_ping=True,
+                pool_recycle=300,
+                pool_size=int(os.getenv("ASYNC_DB_POOL_SIZE", 20)),
+                max_overflow=int(os.getenv("ASYNC_DB_MAX_OVERFLOW", 20)),
+            )
+    except (ImportError, SQLAlchemyError) as e:
+        logger.info(f"Async database engine not available ({e}), using synchronous sessions only")
+
+ASYNC_DB_ENABLED = AsyncSessionLocal is not None
+
+async def get_async_db():
+    """
+    Async dependency function to get a database session.
+    Yields an AsyncSession and ensures it's closed when done.
+    """
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database engine is not configured (install asyncpg)")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def get_async_read_db():
+    """
+    Async dependency function to get a read-only database session.
+    Uses a replica within the allowed lag, otherwise the primary.
+    """
+    if AsyncSessionLocal is None:
+        raise RuntimeError("Async database engine is not configured (install asyncpg)")
+    replica = replica_router.pick(use_async=True)
+    session = AsyncSessionLocal(bind=replica["async_engine"]) if replica else AsyncSessionLocal()
+    async with session as db:
+        yield db
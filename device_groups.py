@@ -0,0 +1,195 @@
+"""
+Device groups for the SwissAirDry platform.
+
+Devices belong to any number of groups (site, room, job). Each member
+subscribes to ``swissairdry/group/{group_id}/control`` based on the group
+list in its config, so a command reaches the whole group with one publish.
+Members acknowledge group commands on ``swissairdry/{device_id}/control/ack``;
+the acknowledgements are recorded per member and written in batches.
+"""
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import bindparam, update
+
+import models
+from database import get_db
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Global recorder instance
+_group_ack_recorder = None
+
+# Seconds between batched acknowledgement writes
+GROUP_ACK_FLUSH_INTERVAL = float(os.getenv("GROUP_ACK_FLUSH_INTERVAL", 1))
+
+def group_topic(group_id: str, channel: str = "control") -> str:
+    """
+    Return the MQTT topic of a group channel.
+    """
+    return f"swissairdry/group/{group_id}/{channel}"
+
+def load_memberships(db, device_ids: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Return the group ids of each given device (devices without groups map to []).
+
+    Args:
+        db: Database session
+        device_ids: Device ids (Device.device_id)
+
+    Returns:
+        Dict[str, List[str]]: Mapping of device_id to its sorted group ids
+    """
+    device_ids = list(device_ids)
+    memberships: Dict[str, List[str]] = {device_id: [] for device_id in device_ids}
+    if not device_ids:
+        return memberships
+    rows = (
+        db.query(models.Device.device_id, models.DeviceGroup.group_id)
+        .join(models.device_group_members, models.device_group_members.c.device_id == models.Device.id)
+        .join(models.DeviceGroup, models.DeviceGroup.id == models.device_group_members.c.group_id)
+        .filter(models.Device.device_id.in_(device_ids))
+        .order_by(models.DeviceGroup.group_id)
+        .all()
+    )
+    for device_id, group_id in rows:
+        memberships[device_id].append(group_id)
+    return memberships
+
+class GroupAckRecorder:
+    """
+    Buffers member acknowledgements of group commands and writes them in batches.
+
+    ``record`` is called from the MQTT thread and never touches the database;
+    a background thread writes the buffered acknowledgements with one
+    executemany UPDATE per flush interval. Only pending members are updated,
+    so duplicate or late acknowledgements do not overwrite the first one.
+    """
+
+    def __init__(self, flush_interval: float = GROUP_ACK_FLUSH_INTERVAL):
+        """
+        Initialize the recorder.
+
+        Args:
+            flush_interval: Seconds between batched database writes
+        """
+        self.flush_interval = flush_interval
+        self._pending: Dict[Tuple[str, str], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.metrics = {
+            "received": 0,
+            "rows_written": 0,
+            "flushes": 0,
+            "failed": 0,
+        }
+
+    def start(self) -> None:
+        """
+        Start the background writer.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="group-acks", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background writer and write the buffered acknowledgements.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def record(self, device_id: str, command_id: str, status: str = "success", message: Optional[str] = None) -> None:
+        """
+        Buffer the acknowledgement of a group member.
+
+        Args:
+            device_id: Acknowledging device
+            command_id: Id of the group command
+            status: Reported result (success or error)
+            message: Optional message from the device
+        """
+        with self._lock:
+            self.metrics["received"] += 1
+            self._pending.setdefault((command_id, device_id), {
+                "b_command_id": command_id,
+                "b_device_id": device_id,
+                "b_status": status,
+                "b_acked_at": datetime.now(),
+                "b_message": message,
+            })
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Write the buffered acknowledgements in one batched UPDATE.
+
+        Returns:
+            int: Number of acknowledgements written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        rows = list(pending.values())
+        acks = models.GroupCommandAck.__table__
+        statement = (
+            update(acks)
+            .where(acks.c.command_id == bindparam("b_command_id"))
+            .where(acks.c.device_id == bindparam("b_device_id"))
+            .where(acks.c.status == "pending")
+            .values(
+                status=bindparam("b_status"),
+                acked_at=bindparam("b_acked_at"),
+                message=bindparam("b_message"),
+            )
+        )
+        db = next(get_db())
+        try:
+            db.execute(statement, rows)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            self.metrics["failed"] += len(rows)
+            logger.error(f"Error writing {len(rows)} group command acks: {e}")
+            with self._lock:
+                for key, row in pending.items():
+                    self._pending.setdefault(key, row)
+            return 0
+        finally:
+            db.close()
+
+        self.metrics["flushes"] += 1
+        self.metrics["rows_written"] += len(rows)
+        return len(rows)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return counters of received and written acknowledgements.
+        """
+        with self._lock:
+            return {"pending": len(self._pending), **self.metrics}
+
+def get_group_ack_recorder() -> GroupAckRecorder:
+    """
+    Get the global group acknowledgement recorder instance.
+    """
+    global _group_ack_recorder
+    if _group_ack_recorder is None:
+        _group_ack_recorder = GroupAckRecorder()
+    return _group_ack_recorder
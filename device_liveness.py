@@ -0,0 +1,335 @@
+"""
+Heartbeat-based online/offline detection for the SwissAirDry platform.
+
+Every telemetry or status message counts as a heartbeat. A device is flipped
+offline when it misses several heartbeats in a row, based on the
+``update_interval`` of its DeviceConfig. Deadlines are kept in a timing wheel
+instead of scanning ``last_seen`` across all devices, and the resulting
+``is_online`` changes are written to the database in batches.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+from sqlalchemy import bindparam, update
+
+import models
+from database import get_db
+from device_state import get_device_state_store
+from timing_wheel import TimingWheel
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Global tracker instance
+_liveness_tracker = None
+
+# Number of update intervals without a heartbeat before a device is offline
+DEVICE_MISSED_HEARTBEATS = float(os.getenv("DEVICE_MISSED_HEARTBEATS", 3))
+# Heartbeat interval in seconds for devices without a DeviceConfig
+DEVICE_DEFAULT_UPDATE_INTERVAL = float(os.getenv("DEVICE_DEFAULT_UPDATE_INTERVAL", 60))
+# Seconds between batched is_online writes
+DEVICE_LIVENESS_FLUSH_INTERVAL = float(os.getenv("DEVICE_LIVENESS_FLUSH_INTERVAL", 5))
+
+class LivenessTracker:
+    """
+    Tracks device liveness with one timing-wheel timer per online device.
+
+    ``heartbeat`` restarts the timer of a device and ``offline`` (e.g. for an
+    MQTT last will) flips it offline at once. A background thread advances
+    the wheel once per tick, flips expired devices offline and writes pending
+    ``is_online`` changes in one executemany UPDATE per flush interval.
+    Listeners are called as ``listener(device_id, online)`` on every change.
+    """
+
+    def __init__(
+        self,
+        missed_heartbeats: float = DEVICE_MISSED_HEARTBEATS,
+        default_interval: float = DEVICE_DEFAULT_UPDATE_INTERVAL,
+        flush_interval: float = DEVICE_LIVENESS_FLUSH_INTERVAL,
+        tick: float = 1.0,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Initialize the tracker.
+
+        Args:
+            missed_heartbeats: Update intervals without heartbeat before a device is offline
+            default_interval: Heartbeat interval for devices without a configuration
+            flush_interval: Seconds between batched database writes
+            tick: Resolution of the timing wheel in seconds
+            clock: Monotonic time source of the timing wheel
+        """
+        self.missed_heartbeats = missed_heartbeats
+        self.default_interval = default_interval
+        self.flush_interval = flush_interval
+        self.states = get_device_state_store()
+        self._wheel = TimingWheel(tick=tick, clock=clock)
+        self._intervals: Dict[str, float] = {}
+        self._online: Set[str] = set()
+        self._pending: Dict[str, bool] = {}
+        self._listeners: List[Callable[[str, bool], None]] = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.metrics = {
+            "heartbeats": 0,
+            "went_online": 0,
+            "went_offline": 0,
+            "timeouts": 0,
+            "rows_written": 0,
+            "flushes": 0,
+            "failed": 0,
+        }
+
+    def add_listener(self, listener: Callable[[str, bool], None]) -> None:
+        """
+        Register a callback for online/offline changes.
+        """
+        self._listeners.append(listener)
+
+    # ----- Lifecycle -----
+
+    def start(self) -> None:
+        """
+        Load the online devices and their intervals, then start the tick thread.
+
+        Devices the database reports as online get a full timeout from now, so
+        they are flipped offline if they stay silent after a failover.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        try:
+            self.load_intervals(get_db, arm_online=True)
+        except Exception as e:
+            logger.warning(f"Could not load device update intervals: {e}")
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="device-liveness", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the tick thread and write the pending changes.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def load_intervals(self, get_session, arm_online: bool = False) -> int:
+        """
+        Load the update interval of every device from the database.
+
+        Args:
+            get_session: get_db style session generator
+            arm_online: Also start timers for devices stored as online
+
+        Returns:
+            int: Number of devices loaded
+        """
+        db = next(get_session())
+        try:
+            rows = (
+                db.query(models.Device.device_id, models.Device.is_online, models.DeviceConfig.update_interval)
+                .outerjoin(models.DeviceConfig, models.DeviceConfig.device_id == models.Device.id)
+                .all()
+            )
+        finally:
+            db.close()
+
+        with self._lock:
+            self._intervals = {
+                row.device_id: float(row.update_interval)
+                for row in rows if row.update_interval
+            }
+            if arm_online:
+                for row in rows:
+                    if row.is_online and row.device_id not in self._wheel:
+                        self._online.add(row.device_id)
+                        self._wheel.schedule(row.device_id, self._timeout(row.device_id))
+        return len(rows)
+
+    def set_interval(self, device_id: str, interval: Optional[float]) -> None:
+        """
+        Update the heartbeat interval of a device; it applies from the next heartbeat.
+        """
+        with self._lock:
+            if interval:
+                self._intervals[device_id] = float(interval)
+            else:
+                self._intervals.pop(device_id, None)
+
+    def _timeout(self, device_id: str) -> float:
+        return self._intervals.get(device_id, self.default_interval) * self.missed_heartbeats
+
+    # ----- Signals -----
+
+    def heartbeat(self, device_id: str) -> None:
+        """
+        Record a message from a device and restart its timeout.
+        """
+        with self._lock:
+            self.metrics["heartbeats"] += 1
+            self._wheel.schedule(device_id, self._timeout(device_id))
+            changed = device_id not in self._online
+            if changed:
+                self._online.add(device_id)
+                self._pending[device_id] = True
+                self.metrics["went_online"] += 1
+        if changed:
+            self._notify(device_id, True)
+
+    def offline(self, device_id: str) -> None:
+        """
+        Flip a device offline at once, e.g. on its MQTT last will.
+        """
+        with self._lock:
+            self._wheel.cancel(device_id)
+            changed = self._set_offline(device_id)
+        if changed:
+            self._notify(device_id, False)
+
+    def forget(self, device_id: str) -> None:
+        """
+        Stop tracking a deleted device.
+        """
+        with self._lock:
+            self._wheel.cancel(device_id)
+            self._online.discard(device_id)
+            self._intervals.pop(device_id, None)
+            self._pending.pop(device_id, None)
+
+    def is_online(self, device_id: str) -> bool:
+        """
+        Return whether a device is currently considered online.
+        """
+        return device_id in self._online
+
+    def _set_offline(self, device_id: str) -> bool:
+        if device_id not in self._online:
+            return False
+        self._online.discard(device_id)
+        self._pending[device_id] = False
+        self.metrics["went_offline"] += 1
+        return True
+
+    def _notify(self, device_id: str, online: bool) -> None:
+        # The store follows the same transitions; it already set itself online
+        # for the message that triggered the heartbeat
+        self.states.set_online(device_id, online)
+        logger.info(f"Device {device_id} is {'online' if online else 'offline'}")
+        for listener in self._listeners:
+            try:
+                listener(device_id, online)
+            except Exception as e:
+                logger.error(f"Error in liveness listener: {e}")
+
+    # ----- Background work -----
+
+    def _run(self) -> None:
+        next_flush = time.monotonic() + self.flush_interval
+        while not self._stopped.wait(self._wheel.tick):
+            try:
+                self.tick()
+                if time.monotonic() >= next_flush:
+                    self.flush()
+                    next_flush = time.monotonic() + self.flush_interval
+            except Exception as e:
+                logger.error(f"Error in liveness tick: {e}")
+
+    def tick(self) -> List[str]:
+        """
+        Advance the timing wheel and flip the expired devices offline.
+
+        Returns:
+            List[str]: Devices that went offline
+        """
+        expired = self._wheel.advance()
+        if not expired:
+            return []
+        with self._lock:
+            self.metrics["timeouts"] += len(expired)
+            changed = [device_id for device_id in expired if self._set_offline(device_id)]
+        for device_id in changed:
+            self._notify(device_id, False)
+        return changed
+
+    def flush(self) -> int:
+        """
+        Write the pending is_online changes in one batched UPDATE.
+
+        Returns:
+            int: Number of rows written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        now = datetime.now()
+        rows = [
+            {"b_device_id": device_id, "b_online": online, "b_last_seen": now}
+            for device_id, online in pending.items()
+        ]
+        devices = models.Device.__table__
+        db = next(get_db())
+        try:
+            online_rows = [row for row in rows if row["b_online"]]
+            offline_rows = [row for row in rows if not row["b_online"]]
+            if online_rows:
+                db.execute(
+                    update(devices)
+                    .where(devices.c.device_id == bindparam("b_device_id"))
+                    .values(is_online=True, last_seen=bindparam("b_last_seen")),
+                    online_rows,
+                )
+            if offline_rows:
+                # last_seen keeps the time of the last message
+                db.execute(
+                    update(devices)
+                    .where(devices.c.device_id == bindparam("b_device_id"))
+                    .values(is_online=False),
+                    offline_rows,
+                )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            self.metrics["failed"] += len(rows)
+            logger.error(f"Error writing {len(rows)} liveness changes: {e}")
+            # Retry with the next flush unless a newer change superseded it
+            with self._lock:
+                for device_id, online in pending.items():
+                    self._pending.setdefault(device_id, online)
+            return 0
+        finally:
+            db.close()
+
+        self.metrics["flushes"] += 1
+        self.metrics["rows_written"] += len(rows)
+        return len(rows)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return counters of heartbeats, transitions and database writes.
+        """
+        with self._lock:
+            return {
+                "tracked": len(self._wheel),
+                "online": len(self._online),
+                "pending": len(self._pending),
+                **self.metrics,
+            }
+
+def get_liveness_tracker() -> LivenessTracker:
+    """
+    Get the global liveness tracker instance.
+    """
+    global _liveness_tracker
+    if _liveness_tracker is None:
+        _liveness_tracker = LivenessTracker()
+    return _liveness_tracker
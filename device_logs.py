@@ -0,0 +1,397 @@
+"""
+Device log ingestion for the SwissAirDry platform.
+
+A device stuck in an error loop can emit thousands of identical lines per
+minute. Repeats of a line within a window are collapsed into one DeviceLog
+row with a count and first/last-seen timestamps, new lines pass a per-device
+token bucket and a per-device sampling rate by level, and the accepted lines
+are written in batches by a background thread.
+"""
+import os
+import time
+import random
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import bindparam, insert, update
+
+import models
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Sustained log lines per second and device
+DEVICE_LOG_RATE = float(os.getenv("DEVICE_LOG_RATE", 5))
+# Log lines a device may send in a burst
+DEVICE_LOG_BURST = float(os.getenv("DEVICE_LOG_BURST", 50))
+# Seconds in which repeats of a line are counted instead of stored again
+DEVICE_LOG_DEDUPE_WINDOW = float(os.getenv("DEVICE_LOG_DEDUPE_WINDOW", 60))
+# Seconds between batched log writes
+DEVICE_LOG_FLUSH_INTERVAL = float(os.getenv("DEVICE_LOG_FLUSH_INTERVAL", 2))
+# Seconds between reloads of the per-device sampling rates
+DEVICE_LOG_SAMPLING_REFRESH = float(os.getenv("DEVICE_LOG_SAMPLING_REFRESH", 60))
+
+# Fraction of lines kept per level for devices without own sampling rates,
+# e.g. "debug=0.1,info=1"; levels not listed are always kept
+DEFAULT_LOG_SAMPLING = {
+    level.strip(): float(rate)
+    for level, rate in (
+        item.split("=", 1) for item in os.getenv("DEVICE_LOG_SAMPLING", "debug=0.1").split(",") if "=" in item
+    )
+}
+
+# Message of the row counting the lines dropped by the rate limit
+RATE_LIMITED_MESSAGE = "Log lines dropped by rate limit"
+
+class _LogGroup:
+    """
+    One stored log line and the repeats counted into it.
+    """
+    __slots__ = ("device_id", "level", "message", "first_seen", "last_seen", "count", "written", "row_id")
+
+    def __init__(self, device_id: str, level: str, message: str, seen: datetime):
+        self.device_id = device_id
+        self.level = level
+        self.message = message
+        self.first_seen = seen
+        self.last_seen = seen
+        self.count = 1
+        self.written = 0
+        self.row_id: Optional[int] = None
+
+class DeviceLogIngestor:
+    """
+    Deduplicates, rate limits, samples and batches device log lines.
+
+    ``submit`` is called from the MQTT thread and only touches memory. A line
+    repeating an open group (same device, level and message within the
+    dedupe window) only raises the count of that group. Other lines are
+    sampled by level and must take a token from the device's bucket; lines
+    dropped by the bucket are counted in a rate-limit row of their own. The
+    background thread inserts new groups and updates the counts of written
+    ones with one executemany statement each per flush. A group replaced by a
+    new window before all of its repeats were written is kept aside until a
+    flush has written it.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Any]],
+        rate: float = DEVICE_LOG_RATE,
+        burst: float = DEVICE_LOG_BURST,
+        window: float = DEVICE_LOG_DEDUPE_WINDOW,
+        flush_interval: float = DEVICE_LOG_FLUSH_INTERVAL,
+        default_sampling: Optional[Dict[str, float]] = None
+    ):
+        """
+        Initialize the ingestor.
+
+        Args:
+            session_factory: Returns a new database session (None only
+                deduplicates and limits the lines without storing them)
+            rate: Sustained log lines per second and device
+            burst: Log lines a device may send in a burst
+            window: Seconds in which repeats of a line are counted
+            flush_interval: Seconds between batched database writes
+            default_sampling: Fraction of lines kept per level for devices
+                without own rates (default: DEVICE_LOG_SAMPLING)
+        """
+        self.session_factory = session_factory
+        self.rate = rate
+        self.burst = burst
+        self.window = window
+        self.flush_interval = flush_interval
+        self.default_sampling = DEFAULT_LOG_SAMPLING if default_sampling is None else default_sampling
+        self._groups: Dict[Tuple[str, str, str], _LogGroup] = {}
+        self._closed: List[_LogGroup] = []  # Replaced groups with unwritten counts
+        self._buckets: Dict[str, List[float]] = {}  # device_id -> [tokens, updated]
+        self._sampling: Dict[str, Dict[str, float]] = {}
+        self._device_pks: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.metrics = {
+            "received": 0,
+            "accepted": 0,
+            "deduplicated": 0,
+            "sampled_out": 0,
+            "rate_limited": 0,
+            "rows_inserted": 0,
+            "rows_updated": 0,
+            "unknown_device": 0,
+            "flushes": 0,
+            "failed": 0,
+        }
+
+    # ----- Lifecycle -----
+
+    def start(self) -> None:
+        """
+        Load the sampling rates and start the background writer.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._load_sampling()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="device-logs", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background writer and write the buffered lines.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def _run(self) -> None:
+        next_reload = time.monotonic() + DEVICE_LOG_SAMPLING_REFRESH
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+                if time.monotonic() >= next_reload:
+                    self._load_sampling()
+                    next_reload = time.monotonic() + DEVICE_LOG_SAMPLING_REFRESH
+            except Exception as e:
+                logger.error(f"Error writing device logs: {e}")
+
+    # ----- Sampling -----
+
+    def _load_sampling(self) -> None:
+        if self.session_factory is None:
+            return
+        db = self.session_factory()
+        try:
+            rows = (
+                db.query(models.Device.device_id, models.DeviceConfig.log_sampling)
+                .join(models.DeviceConfig, models.DeviceConfig.device_id == models.Device.id)
+                .filter(models.DeviceConfig.log_sampling.isnot(None))
+                .all()
+            )
+        except Exception as e:
+            logger.warning(f"Could not load device log sampling rates: {e}")
+            return
+        finally:
+            db.close()
+        with self._lock:
+            self._sampling = {row.device_id: self._normalize(row.log_sampling) for row in rows}
+
+    def set_sampling(self, device_id: str, rates: Optional[Dict[str, float]]) -> None:
+        """
+        Set the sampling rates of a device; None restores the defaults.
+
+        Args:
+            device_id: Device to configure
+            rates: Fraction of lines kept per level (0 drops, 1 keeps all)
+        """
+        with self._lock:
+            if rates is None:
+                self._sampling.pop(device_id, None)
+            else:
+                self._sampling[device_id] = self._normalize(rates)
+
+    @staticmethod
+    def _normalize(rates: Dict[str, Any]) -> Dict[str, float]:
+        return {str(level).lower(): min(max(float(rate), 0.0), 1.0) for level, rate in rates.items()}
+
+    # ----- Ingestion -----
+
+    def submit(self, device_id: str, level: str, message: str) -> str:
+        """
+        Offer a log line of a device.
+
+        Args:
+            device_id: Sending device
+            level: Log level (debug, info, warning, error)
+            message: Log message
+
+        Returns:
+            str: accepted, deduplicated, sampled_out or rate_limited
+        """
+        level = (level or "info").lower()
+        now = datetime.now()
+        with self._lock:
+            self.metrics["received"] += 1
+            if self._count_repeat((device_id, level, message), now):
+                self.metrics["deduplicated"] += 1
+                return "deduplicated"
+
+            rates = self._sampling.get(device_id, self.default_sampling)
+            if random.random() >= rates.get(level, 1.0):
+                self.metrics["sampled_out"] += 1
+                return "sampled_out"
+
+            if not self._take_token(device_id):
+                self.metrics["rate_limited"] += 1
+                key = (device_id, "warning", RATE_LIMITED_MESSAGE)
+                if not self._count_repeat(key, now):
+                    self._open_group(key, _LogGroup(device_id, "warning", RATE_LIMITED_MESSAGE, now))
+                return "rate_limited"
+
+            self._open_group((device_id, level, message), _LogGroup(device_id, level, message, now))
+            self.metrics["accepted"] += 1
+        return "accepted"
+
+    def _open_group(self, key: Tuple[str, str, str], group: _LogGroup) -> None:
+        previous = self._groups.get(key)
+        if previous is not None and previous.count > previous.written:
+            # Its window closed before the last repeats were written
+            self._closed.append(previous)
+        self._groups[key] = group
+
+    def _count_repeat(self, key: Tuple[str, str, str], now: datetime) -> bool:
+        group = self._groups.get(key)
+        if group is None or (now - group.first_seen).total_seconds() >= self.window:
+            return False
+        group.count += 1
+        group.last_seen = now
+        return True
+
+    def _take_token(self, device_id: str) -> bool:
+        now = time.monotonic()
+        bucket = self._buckets.get(device_id)
+        if bucket is None:
+            bucket = self._buckets[device_id] = [self.burst, now]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1.0:
+            return False
+        bucket[0] -= 1.0
+        return True
+
+    # ----- Writing -----
+
+    def flush(self) -> int:
+        """
+        Insert new log groups and update the counts of written ones.
+
+        Returns:
+            int: Number of rows inserted or updated
+        """
+        with self._flush_lock:
+            return self._flush()
+
+    def _flush(self) -> int:
+        with self._lock:
+            groups = self._closed + list(self._groups.values())
+            new = [(group, group.count, group.last_seen) for group in groups if group.row_id is None]
+            changed = [
+                (group, group.count, group.last_seen)
+                for group in groups
+                if group.row_id is not None and group.count > group.written
+            ]
+        if self.session_factory is None:
+            with self._lock:
+                for group in groups:
+                    group.written = group.count
+            written = 0
+        elif new or changed:
+            written = self._write(new, changed)
+        else:
+            written = 0
+
+        # Groups whose window closed are complete once written
+        now = datetime.now()
+        with self._lock:
+            for key, group in list(self._groups.items()):
+                if (now - group.first_seen).total_seconds() >= self.window and group.written == group.count:
+                    del self._groups[key]
+            # Closed groups no longer receive repeats
+            self._closed = [group for group in self._closed if group.written < group.count]
+        return written
+
+    def _write(self, new: List[Tuple[_LogGroup, int, datetime]], changed: List[Tuple[_LogGroup, int, datetime]]) -> int:
+        logs = models.DeviceLog.__table__
+        db = self.session_factory()
+        try:
+            pks = self._resolve_devices(db, {group.device_id for group, _, _ in new})
+            known = [entry for entry in new if entry[0].device_id in pks]
+            if len(known) < len(new):
+                unknown = [group for group, _, _ in new if group.device_id not in pks]
+                with self._lock:
+                    self.metrics["unknown_device"] += len(unknown)
+                    for group in unknown:
+                        # Keep the group as written so repeats are still dropped
+                        group.row_id = -1
+                        group.written = group.count
+                logger.warning(f"Dropped logs of unknown devices: {sorted({group.device_id for group in unknown})}")
+
+            rows = [
+                {
+                    "device_id": pks[group.device_id],
+                    "timestamp": group.first_seen,
+                    "level": group.level,
+                    "message": group.message,
+                    "count": count,
+                    "first_seen": group.first_seen,
+                    "last_seen": last_seen,
+                }
+                for group, count, last_seen in known
+            ]
+            ids = self._insert(db, rows) if rows else []
+            update_rows = [
+                {"b_id": group.row_id, "b_count": count, "b_last_seen": last_seen}
+                for group, count, last_seen in changed if group.row_id > 0
+            ]
+            if update_rows:
+                db.execute(
+                    update(logs)
+                    .where(logs.c.id == bindparam("b_id"))
+                    .values(count=bindparam("b_count"), last_seen=bindparam("b_last_seen")),
+                    update_rows,
+                )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            # A cached device may have been deleted; resolve again on retry
+            self._device_pks.clear()
+            with self._lock:
+                self.metrics["failed"] += len(new) + len(changed)
+            logger.error(f"Error writing {len(new) + len(changed)} device log rows: {e}")
+            return 0
+        finally:
+            db.close()
+
+        with self._lock:
+            for (group, count, _), row_id in zip(known, ids):
+                group.row_id = row_id
+                group.written = count
+            for group, count, _ in changed:
+                group.written = max(group.written, count)
+            self.metrics["rows_inserted"] += len(rows)
+            self.metrics["rows_updated"] += len(update_rows)
+            self.metrics["flushes"] += 1
+        return len(rows) + len(update_rows)
+
+    def _insert(self, db, rows: List[Dict[str, Any]]) -> List[int]:
+        """
+        Insert log rows and return their ids in row order.
+        """
+        logs = models.DeviceLog.__table__
+        if db.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+            result = db.execute(insert(logs).returning(logs.c.id, sort_by_parameter_order=True), rows)
+            return [row.id for row in result]
+        return [db.execute(insert(logs).values(**row)).inserted_primary_key[0] for row in rows]
+
+    def _resolve_devices(self, db, device_ids) -> Dict[str, int]:
+        missing = [device_id for device_id in device_ids if device_id not in self._device_pks]
+        if missing:
+            self._device_pks.update(
+                db.query(models.Device.device_id, models.Device.id)
+                .filter(models.Device.device_id.in_(missing))
+                .all()
+            )
+        return {device_id: self._device_pks[device_id] for device_id in device_ids if device_id in self._device_pks}
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return counters of received, dropped and written log lines.
+        """
+        with self._lock:
+            return {"open_groups": len(self._groups), "closed_groups": len(self._closed), **self.metrics}
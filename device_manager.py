@@ -4,21 +4,40 @@ Device Manager for the SwissAirDry platform.
 This module handles device management operations including
 device discovery, control, and status updates via MQTT and BLE.
 """
+import os
 import logging
 import json
+import uuid
 import asyncio
+import threading
 from typing import Dict, Any, Optional, List
 from datetime import datetime, timedelta 
+from sqlalchemy import insert
 from sqlalchemy.orm import Session
 
 import models
-from mqtt_handler import MQTTHandler
-from ble_service import get_ble_service, BLEService
+from mqtt_handler import MQTTHandler, get_mqtt_handler
 from database import get_db
+from telemetry_stream import STREAM_RELAY_HEARTBEAT, TelemetryRelay, get_telemetry_stream
+from device_state import get_device_state_store
+from device_liveness import get_liveness_tracker
+from device_groups import group_topic, load_memberships, get_group_ack_recorder
+from command_tracker import get_command_tracker
+from discovery import DiscoveryCoalescer, WelcomeScheduler
+from device_logs import DeviceLogIngestor
+from task_scheduler import TaskScheduler, task_command, task_fields
+from leader_election import get_leader_election, LeaderUnavailable
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Topic filter covering all device messages handled by the ingest owner
+INGEST_TOPIC = "swissairdry/#"
+
+# Seconds between merges of the database into the in-memory device states,
+# picking up devices created or deleted by other workers
+DEVICE_STATE_REFRESH_INTERVAL = float(os.getenv("DEVICE_STATE_REFRESH_INTERVAL", 60))
+
 class DeviceManager:
     """
     Manages SwissAirDry devices connected to the platform.
@@ -46,7 +65,7 @@ class DeviceManager:
         try:
             db_device = db.query(models.Device).filter_by(ble_address=device.address).first()
             if db_device:
-                db_device.ble_connected = True
+                # ble_connected speichert der Anwesenheits-Tracker des BLE-Service
                 db_device.is_online = True
                 db_device.last_seen = datetime.now()
                 db.commit()
@@ -63,19 +82,8 @@ class DeviceManager:
         """
         logger.info(f"BLE-Gerät getrennt: {device.name} ({device.address})")
         
-        # Aktualisiere Verbindungsstatus in der Datenbank
-        db = next(get_db())
-        try:
-            db_device = db.query(models.Device).filter_by(ble_address=device.address).first()
-            if db_device:
-                db_device.ble_connected = False
-                db.commit()
-                logger.debug(f"BLE-Verbindungsstatus für {db_device.name} aktualisiert")
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Fehler beim Aktualisieren des BLE-Verbindungsstatus: {e}")
-        finally:
-            db.close()
+        # Der Verbindungsstatus wird vom Anwesenheits-Tracker des BLE-Service
+        # gebündelt gespeichert (siehe ble_presence)
             
     def _handle_ble_sensor_data(self, address: str, sensor_data: Dict[str, Any]):
         """
@@ -91,29 +99,155 @@ class DeviceManager:
         Initialize DeviceManager with MQTT handler.
         """
         self.mqtt = mqtt_handler
-        self.ble_service = get_ble_service()
+        self._ble_service = None  # Created on first use, see ble_service
+        self._ble_lock = threading.Lock()
         self.ble_initialized = False
+        self.stream = get_telemetry_stream()
+        self.states = get_device_state_store()
+        self.liveness = get_liveness_tracker()
+        self.liveness.add_listener(self._handle_liveness_change)
+        self.group_acks = get_group_ack_recorder()
+        self.commands = get_command_tracker()
+        # Discoveries are stored by the MQTT bridge; here they only update the
+        # device states and are welcomed
+        self.discovery = DiscoveryCoalescer(None, on_stored=self._handle_discovered)
+        self.welcomes = WelcomeScheduler(self._send_welcome)
+        # Logs are stored by the MQTT bridge; here they are only deduplicated
+        # and rate limited before being echoed
+        self.logs = DeviceLogIngestor(None)
+        self.tasks = TaskScheduler(self._send_task_commands)
+        self.tasks.add_listener(self._handle_task_change)
+        
+        # The pending command table lives in the ingest owner, which receives
+        # the acks; other workers reach it over the election command socket
+        election = get_leader_election()
+        election.register_command("command_track", self.commands.track)
+        election.register_command("command_status", self.commands.status)
+        election.register_command("command_wait", lambda command_id, wait: self.commands.wait(command_id, wait))
+        election.register_command("command_stats", self.commands.stats)
+        # Live events are published where ingest runs; followers relay them
+        # so /api/stream works on every worker
+        election.register_feed("stream_events", self.stream.tail)
+        self.stream_relay = TelemetryRelay(
+            self.stream,
+            lambda: election.follow("stream_events", timeout=3 * STREAM_RELAY_HEARTBEAT),
+            lambda: election.is_leader,
+        )
+        self._ingest_stopped = threading.Event()
         
         # Register callbacks for device topics
         self.mqtt.register_callback("swissairdry/+/status", self._handle_status_update)
         self.mqtt.register_callback("swissairdry/+/telemetry", self._handle_telemetry)
         self.mqtt.register_callback("swissairdry/+/discovery", self._handle_discovery)
         self.mqtt.register_callback("swissairdry/+/log", self._handle_device_log)
+        self.mqtt.register_callback("swissairdry/+/control/ack", self._handle_control_ack)
+        self.mqtt.register_callback("swissairdry/+/config/ack", self._handle_config_ack)
+        self.mqtt.register_callback("swissairdry/+/command/ack", self._handle_command_ack)
+        
+        logger.info("DeviceManager initialized")
+    
+    def start_ingest(self) -> None:
+        """
+        Subscribe to the device topics.
+        
+        Only the process owning ingest (see leader_election) calls this, so each
+        device message is processed once no matter how many workers run. The
+        device states are loaded first, so the store is complete before the
+        first message updates it.
+        """
+        self._ingest_stopped.clear()
+        try:
+            self.states.refresh(get_db)
+            self.states.live = True
+        except Exception as e:
+            logger.warning(f"Could not load device states, reads fall back to the database: {e}")
+        threading.Thread(target=self._refresh_states, name="device-state-refresh", daemon=True).start()
+        self.liveness.start()
+        self.group_acks.start()
+        self.commands.start()
+        self.discovery.start()
+        self.welcomes.start()
+        self.logs.start()
+        self.tasks.start()
         
-        # Subscribe to necessary topics - use synchronous method now
         try:
-            self.mqtt.subscribe_sync("swissairdry/#")
+            self.mqtt.subscribe_sync(INGEST_TOPIC)
         except Exception as e:
             logger.warning(f"Could not subscribe to MQTT topics: {e}")
             # Non-critical, the application will continue without MQTT initially
+    
+    def stop_ingest(self) -> None:
+        """
+        Unsubscribe from the device topics after losing ingest ownership.
+        """
+        self.mqtt.unsubscribe_sync(INGEST_TOPIC)
+        self.states.live = False
+        self._ingest_stopped.set()
+        self.liveness.stop()
+        self.group_acks.stop()
+        self.commands.stop()
+        self.discovery.stop()
+        self.welcomes.stop()
+        self.logs.stop()
+        self.tasks.stop()
+    
+    def _refresh_states(self) -> None:
+        """
+        Periodically merge the database into the device states while owning ingest.
+        """
+        while not self._ingest_stopped.wait(DEVICE_STATE_REFRESH_INTERVAL):
+            try:
+                self.states.refresh(get_db)
+                self.states.live = True
+                self.liveness.load_intervals(get_db)
+            except Exception as e:
+                logger.warning(f"Could not refresh device states: {e}")
+    
+    def _send_task_commands(self, messages: List[Any]) -> List[bool]:
+        """
+        Send the due task commands of the scheduler as one pipelined MQTT batch.
+        
+        Args:
+            messages: List of (device_id, command) tuples
             
-        # Register BLE callbacks
-        self.ble_service.register_callback("device_found", self._handle_ble_device_found)
-        self.ble_service.register_callback("device_connected", self._handle_ble_device_connected)
-        self.ble_service.register_callback("device_disconnected", self._handle_ble_device_disconnected)
-        self.ble_service.register_callback("sensor_data", self._handle_ble_sensor_data)
+        Returns:
+            List[bool]: Per-command delivery result
+        """
+        return self.mqtt.publish_many_sync(
+            [(f"swissairdry/{device_id}/task", command) for device_id, command in messages]
+        )
+    
+    def _handle_task_change(self, device_id: str, assignment: Dict[str, Any]) -> None:
+        """
+        Forward task status and progress changes to live clients.
+        """
+        self.stream.publish(device_id, "task", assignment)
+    
+    def _handle_liveness_change(self, device_id: str, online: bool) -> None:
+        """
+        Forward online/offline changes detected by the liveness tracker to live clients.
+        """
+        self.stream.publish(device_id, "presence", {"online": online})
+    
+    @property
+    def ble_service(self):
+        """
+        BLE-Service, beim ersten Zugriff importiert und mit den Callbacks verbunden.
         
-        logger.info("DeviceManager initialized")
+        Der Import von bleak wird so erst bezahlt, wenn BLE tatsächlich genutzt wird.
+        """
+        if self._ble_service is None:
+            with self._ble_lock:
+                if self._ble_service is None:
+                    from ble_service import get_ble_service
+                    
+                    ble_service = get_ble_service()
+                    ble_service.register_callback("device_found", self._handle_ble_device_found)
+                    ble_service.register_callback("device_connected", self._handle_ble_device_connected)
+                    ble_service.register_callback("device_disconnected", self._handle_ble_device_disconnected)
+                    ble_service.register_callback("sensor_data", self._handle_ble_sensor_data)
+                    self._ble_service = ble_service
+        return self._ble_service
         
     async def initialize_ble(self):
         """
@@ -139,7 +273,7 @@ class DeviceManager:
             except Exception as e:
                 logger.error(f"Fehler beim Stoppen des BLE-Service: {e}")
     
-    def control_power(self, device: models.Device, state: bool) -> bool:
+    def control_power(self, device: models.Device, state: bool) -> Optional[str]:
         """
         Control the power state of a device.
         
@@ -148,24 +282,26 @@ class DeviceManager:
             state: True for on, False for off
             
         Returns:
-            bool: Success status
+            Optional[str]: Correlation id of the command, None if it was not sent
         """
         if not device:
             logger.error("Cannot control power: Device is None")
-            return False
+            return None
         
         topic = f"swissairdry/{device.device_id}/control"
+        command_id = self.track_command({device.device_id: device.type}, "control")
         payload = {
             "power": state,
+            "command_id": command_id,
             "timestamp": datetime.now().isoformat()
         }
         
         # Use synchronous method
         self.mqtt.publish_sync(topic, payload)
         logger.info(f"Power control command sent to {device.device_id}: {'ON' if state else 'OFF'}")
-        return True
+        return command_id
     
-    def control_fan(self, device: models.Device, speed: int) -> bool:
+    def control_fan(self, device: models.Device, speed: int) -> Optional[str]:
         """
         Control the fan speed of a device.
         
@@ -174,24 +310,26 @@ class DeviceManager:
             speed: Fan speed (0-100%)
             
         Returns:
-            bool: Success status
+            Optional[str]: Correlation id of the command, None if it was not sent
         """
         if not device:
             logger.error("Cannot control fan: Device is None")
-            return False
+            return None
         
         topic = f"swissairdry/{device.device_id}/control"
+        command_id = self.track_command({device.device_id: device.type}, "control")
         payload = {
             "fan_speed": speed,
+            "command_id": command_id,
             "timestamp": datetime.now().isoformat()
         }
         
         # Use synchronous method
         self.mqtt.publish_sync(topic, payload)
         logger.info(f"Fan control command sent to {device.device_id}: {speed}%")
-        return True
+        return command_id
     
-    def publish_config(self, device: models.Device, config: models.DeviceConfig) -> bool:
+    def publish_config(self, device: models.Device, config: models.DeviceConfig) -> Optional[str]:
         """
         Publish configuration to a device.
         
@@ -200,27 +338,154 @@ class DeviceManager:
             config: Device configuration
             
         Returns:
-            bool: Success status
+            Optional[str]: Correlation id of the config, None if it was not sent
         """
         if not device or not config:
             logger.error("Cannot publish config: Device or config is None")
-            return False
+            return None
         
         topic = f"swissairdry/{device.device_id}/config"
-        payload = {
+        command_id = self.track_command({device.device_id: device.type}, "config")
+        payload = self._config_payload(config, sorted(group.group_id for group in device.groups), command_id)
+        
+        # Use synchronous method
+        self.mqtt.publish_sync(topic, payload, retain=True)
+        self.liveness.set_interval(device.device_id, config.update_interval)
+        self.logs.set_sampling(device.device_id, config.log_sampling)
+        logger.info(f"Configuration published to {device.device_id}")
+        return command_id
+    
+    def publish_configs(
+        self,
+        configs: Dict[str, Any],
+        groups: Optional[Dict[str, List[str]]] = None,
+        command_id: Optional[str] = None
+    ) -> Dict[str, bool]:
+        """
+        Publish configurations to many devices as one pipelined batch.
+        
+        All configs of the batch carry the same correlation id; their acks are
+        tracked per device.
+        
+        Args:
+            configs: Mapping of device_id to its configuration (any object with
+                the DeviceConfig attributes, e.g. an ORM instance or result row)
+            groups: Mapping of device_id to its group ids (loaded if omitted)
+            command_id: Correlation id of the batch (generated if omitted)
+            
+        Returns:
+            Dict[str, bool]: Per-device delivery result
+        """
+        device_ids = list(configs)
+        command_id = self.track_command(dict.fromkeys(device_ids), "config", command_id=command_id)
+        if groups is None:
+            db = next(get_db())
+            try:
+                groups = load_memberships(db, device_ids)
+            finally:
+                db.close()
+        messages = [
+            (
+                f"swissairdry/{device_id}/config",
+                self._config_payload(configs[device_id], groups.get(device_id, []), command_id),
+            )
+            for device_id in device_ids
+        ]
+        
+        results = self.mqtt.publish_many_sync(messages, retain=True)
+        for device_id in device_ids:
+            self.liveness.set_interval(device_id, configs[device_id].update_interval)
+            self.logs.set_sampling(device_id, configs[device_id].log_sampling)
+        logger.info(f"Configuration published to {sum(results)}/{len(device_ids)} devices")
+        return dict(zip(device_ids, results))
+    
+    def _config_payload(self, config: Any, groups: List[str], command_id: str) -> Dict[str, Any]:
+        """
+        Build the MQTT config payload for a device configuration.
+        
+        The config is published retained, so it always carries the full group
+        list; devices subscribe to the control topic of each listed group.
+        """
+        return {
             "update_interval": config.update_interval,
             "display_type": config.display_type,
             "has_sensors": config.has_sensors,
             "ota_enabled": config.ota_enabled,
+            "groups": groups,
+            "command_id": command_id,
             "timestamp": datetime.now().isoformat()
         }
+    
+    def push_group_memberships(self, db: Session, device_ids: List[str]) -> Dict[str, bool]:
+        """
+        Republish the configs of devices whose group membership changed.
         
-        # Use synchronous method
-        self.mqtt.publish_sync(topic, payload, retain=True)
-        logger.info(f"Configuration published to {device.device_id}")
-        return True
+        Args:
+            db: Database session
+            device_ids: Devices to update
+            
+        Returns:
+            Dict[str, bool]: Per-device delivery result
+        """
+        rows = (
+            db.query(models.Device.device_id, models.DeviceConfig)
+            .join(models.DeviceConfig, models.DeviceConfig.device_id == models.Device.id)
+            .filter(models.Device.device_id.in_(device_ids))
+            .all()
+        )
+        if not rows:
+            return {}
+        configs = {device_id: config for device_id, config in rows}
+        return self.publish_configs(configs, load_memberships(db, configs))
+    
+    # === Group commands ===
+    
+    def send_group_command(self, db: Session, group: models.DeviceGroup, command: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Publish a control command to all members of a group with one publish.
+        
+        A pending acknowledgement is stored per member before publishing, so
+        acknowledgements can be matched no matter which process receives them.
+        
+        Args:
+            db: Database session
+            group: The target group
+            command: Control fields (power, fan_speed)
+            
+        Returns:
+            Dict[str, Any]: command_id and the number of members
+        """
+        devices = {device.device_id: device.type for device in group.devices}
+        members = list(devices)
+        command_id = self.track_command(devices, "group")
+        payload = {**command, "command_id": command_id, "timestamp": datetime.now().isoformat()}
+        
+        db.add(models.GroupCommand(command_id=command_id, group_id=group.id, payload=payload))
+        db.flush()
+        if members:
+            db.execute(
+                insert(models.GroupCommandAck),
+                [{"command_id": command_id, "device_id": device_id} for device_id in members],
+            )
+        db.commit()
+        
+        self.mqtt.publish_sync(group_topic(group.group_id), payload)
+        logger.info(f"Group command {command_id} sent to group {group.group_id} ({len(members)} devices): {command}")
+        return {"command_id": command_id, "members": len(members)}
+    
+    def control_group_power(self, db: Session, group: models.DeviceGroup, state: bool) -> Dict[str, Any]:
+        """
+        Turn all devices of a group on or off.
+        """
+        return self.send_group_command(db, group, {"power": state})
+    
+    def control_group_fan(self, db: Session, group: models.DeviceGroup, speed: int) -> Dict[str, Any]:
+        """
+        Set the fan speed of all devices of a group.
+        """
+        return self.send_group_command(db, group, {"fan_speed": speed})
     
-    def request_status(self, device: models.Device) -> bool:
+    def request_status(self, device: models.Device) -> Optional[str]:
         """
         Request a status update from a device.
         
@@ -228,22 +493,91 @@ class DeviceManager:
             device: The device to query
             
         Returns:
-            bool: Success status
+            Optional[str]: Correlation id of the request, None if it was not sent
         """
         if not device:
             logger.error("Cannot request status: Device is None")
-            return False
+            return None
         
         topic = f"swissairdry/{device.device_id}/command"
+        command_id = self.track_command({device.device_id: device.type}, "command")
         payload = {
             "action": "status_update",
+            "command_id": command_id,
             "timestamp": datetime.now().isoformat()
         }
         
         # Use synchronous method
         self.mqtt.publish_sync(topic, payload)
         logger.info(f"Status update requested from {device.device_id}")
-        return True
+        return command_id
+    
+    # === Command tracking ===
+    
+    def track_command(
+        self,
+        members: Dict[str, Optional[str]],
+        kind: str,
+        transport: str = "mqtt",
+        command_id: Optional[str] = None
+    ) -> str:
+        """
+        Stamp a command with a correlation id and register it as pending.
+        
+        The pending table lives in the ingest owner. If it cannot be reached
+        the command is only tracked locally when this process owns ingest
+        itself (acks arrive and entries expire only there); otherwise it is
+        sent untracked.
+        
+        Args:
+            members: Mapping of target device_id to its device type (or None)
+            kind: Command kind (control, config, command)
+            transport: Transport the command is sent over
+            command_id: Correlation id (generated if omitted)
+            
+        Returns:
+            str: The correlation id
+        """
+        command_id = command_id or uuid.uuid4().hex
+        try:
+            get_leader_election().call(
+                "command_track", timeout=2,
+                command_id=command_id, members=members, kind=kind, transport=transport,
+            )
+        except (LeaderUnavailable, TimeoutError, RuntimeError, ValueError) as e:
+            if self.commands.running:
+                logger.debug(f"Tracking command {command_id} locally: {e}")
+                self.commands.track(command_id, members, kind, transport)
+            else:
+                logger.debug(f"Sending command {command_id} untracked: {e}")
+        return command_id
+    
+    def command_status(self, command_id: str, wait: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        Return the acknowledgement state of a command, optionally waiting for all acks.
+        
+        Args:
+            command_id: Correlation id of the command
+            wait: Seconds to wait for outstanding acks
+            
+        Returns:
+            Optional[Dict[str, Any]]: Command state, None if the command is unknown
+        """
+        try:
+            if wait > 0:
+                return get_leader_election().call("command_wait", timeout=wait + 2, command_id=command_id, wait=wait)
+            return get_leader_election().call("command_status", timeout=2, command_id=command_id)
+        except (LeaderUnavailable, RuntimeError, ValueError):
+            return self.commands.wait(command_id, wait) if wait > 0 else self.commands.status(command_id)
+    
+    def command_stats(self) -> Dict[str, Any]:
+        """
+        Return command counters and round-trip latency histograms.
+        """
+        try:
+            return get_leader_election().call("command_stats", timeout=2)
+        except (LeaderUnavailable, TimeoutError, RuntimeError, ValueError):
+            return self.commands.stats()
     
     def _handle_status_update(self, topic: str, payload: Any) -> None:
         """
@@ -259,12 +593,21 @@ class DeviceManager:
             device_id = parts[1]
             logger.debug(f"Status update from {device_id}: {payload}")
             
-            # This would update the device status in the database
-            # In a real implementation, this would use a database session
-            # and update the device record
+            # Devices publish a plain "offline"/"online" status as their last will
+            if isinstance(payload, str) and payload.strip().lower() in ("online", "offline"):
+                payload = {"online": payload.strip().lower() == "online"}
             
-            # For this example, we'll just log the status
             if isinstance(payload, dict):
+                if payload.get('online') is False:
+                    self.liveness.offline(device_id)
+                else:
+                    self.liveness.heartbeat(device_id)
+                self.states.update_status(
+                    device_id,
+                    online=payload.get('online'),
+                    firmware_version=payload.get('firmware_version'),
+                )
+                self.stream.publish(device_id, "status", payload)
                 if 'online' in payload:
                     logger.info(f"Device {device_id} is {'online' if payload['online'] else 'offline'}")
                 if 'firmware_version' in payload:
@@ -286,12 +629,11 @@ class DeviceManager:
             device_id = parts[1]
             logger.debug(f"Telemetry from {device_id}: {payload}")
             
-            # This would update the device telemetry in the database
-            # In a real implementation, this would use a database session
-            # and add a new sensor reading record
-            
-            # For this example, we'll just log the telemetry
             if isinstance(payload, dict):
+                self.liveness.heartbeat(device_id)
+                self.states.update_telemetry(device_id, payload)
+                self.stream.publish(device_id, "telemetry", payload)
+                self.tasks.observe(device_id, payload)
                 if 'temperature' in payload:
                     logger.info(f"Device {device_id} temperature: {payload['temperature']}°C")
                 if 'humidity' in payload:
@@ -302,6 +644,13 @@ class DeviceManager:
     def _handle_discovery(self, topic: str, payload: Any) -> None:
         """
         Handle device discovery messages.
+        
+        Discoveries are retained, so a reconnect delivers the whole fleet at
+        once. The MQTT bridge is the only process storing them; here
+        unchanged payloads are skipped and changed ones update the device
+        states in batches. Every discovery is welcomed, also an unchanged one
+        from a reconnecting device; the welcome scheduler spreads the replies
+        with jitter and a rate limit.
         """
         try:
             # Extract device_id from topic
@@ -311,27 +660,118 @@ class DeviceManager:
                 return
             
             device_id = parts[1]
-            logger.info(f"Discovery message from {device_id}: {payload}")
+            if not isinstance(payload, dict):
+                logger.warning(f"Invalid discovery payload from {device_id}: {payload}")
+                return
             
-            # This would register or update the device in the database
-            # In a real implementation, this would use a database session
+            logger.debug(f"Discovery message from {device_id}: {payload}")
+            self.liveness.heartbeat(device_id)
             
-            # For this example, we'll just log the discovery
-            if isinstance(payload, dict):
-                device_type = payload.get('type', 'unknown')
-                firmware = payload.get('firmware_version', 'unknown')
-                logger.info(f"Device discovered: {device_id}, type: {device_type}, firmware: {firmware}")
-                
-                # Send a welcome message back to the device
-                welcome_topic = f"swissairdry/{device_id}/welcome"
-                welcome_payload = {
-                    "message": "Welcome to SwissAirDry!",
-                    "server_time": datetime.now().isoformat()
-                }
-                self.mqtt.publish_sync(welcome_topic, welcome_payload)
+            # A device deleted since its last discovery must be registered again
+            if self.states.live and self.states.get(device_id) is None:
+                self.discovery.forget(device_id)
+            self.discovery.submit({**payload, "device_id": device_id})
+            self.welcomes.schedule(device_id)
         except Exception as e:
             logger.error(f"Error handling discovery: {e}")
     
+    def _handle_discovered(self, rows: List[Dict[str, Any]]) -> None:
+        """
+        Update the device states after the coalescer processed a batch of discoveries.
+        
+        New devices stay unregistered in the store (no primary key) until the
+        periodic state refresh reads the row the MQTT bridge stored.
+        """
+        for row in rows:
+            # Name and type are only taken for new devices, as in the database
+            known = self.states.get(row["device_id"]) is not None
+            attributes = {
+                column: row[column]
+                for column in ("firmware_version", "ip_address", "mac_address")
+                if row[column] is not None
+            }
+            if not known:
+                attributes.update(name=row["name"], type=row["type"])
+            if row["id"] is not None:
+                attributes["id"] = row["id"]
+            self.states.upsert(
+                row["device_id"],
+                is_online=True,
+                last_seen=row["last_seen"],
+                **attributes
+            )
+        logger.debug(f"Registered {len(rows)} discovered devices")
+    
+    def _send_welcome(self, device_id: str) -> None:
+        """
+        Send the welcome message to a discovered device.
+        """
+        welcome_topic = f"swissairdry/{device_id}/welcome"
+        welcome_payload = {
+            "message": "Welcome to SwissAirDry!",
+            "server_time": datetime.now().isoformat()
+        }
+        self.mqtt.publish_sync(welcome_topic, welcome_payload)
+    
+    def _handle_control_ack(self, topic: str, payload: Any) -> None:
+        """
+        Handle acknowledgements of control and group commands.
+        """
+        kind = self._handle_ack(topic, payload, "control")
+        # Group acks are also stored per member; acks that matched no pending
+        # command may belong to a group command tracked elsewhere
+        if kind in ("group", None) and isinstance(payload, dict) and payload.get('command_id'):
+            self.group_acks.record(
+                topic.split('/')[1],
+                str(payload['command_id']),
+                status=payload.get('status', 'success'),
+                message=payload.get('message'),
+            )
+    
+    def _handle_config_ack(self, topic: str, payload: Any) -> None:
+        """
+        Handle acknowledgements of config updates.
+        """
+        self._handle_ack(topic, payload, "config")
+    
+    def _handle_command_ack(self, topic: str, payload: Any) -> None:
+        """
+        Handle acknowledgements of general commands.
+        """
+        self._handle_ack(topic, payload, "command")
+    
+    def _handle_ack(self, topic: str, payload: Any, kind: str) -> Optional[str]:
+        """
+        Match an acknowledgement to its pending command.
+        
+        Acks without a command_id (older firmware) are matched to the newest
+        pending command of the same kind.
+        
+        Returns:
+            Optional[str]: Kind of the matched command, None if nothing matched
+        """
+        try:
+            parts = topic.split('/')
+            if len(parts) < 4:
+                logger.error(f"Invalid topic format: {topic}")
+                return None
+            
+            device_id = parts[1]
+            self.liveness.heartbeat(device_id)
+            if not isinstance(payload, dict):
+                payload = {}
+            command_id = payload.get('command_id')
+            return self.commands.ack(
+                device_id,
+                str(command_id) if command_id else None,
+                kind=kind,
+                status=payload.get('status', 'success'),
+                message=payload.get('message'),
+            )
+        except Exception as e:
+            logger.error(f"Error handling {kind} ack: {e}")
+            return None
+    
     def _handle_device_log(self, topic: str, payload: Any) -> None:
         """
         Handle log messages from devices.
@@ -345,14 +785,16 @@ class DeviceManager:
             
             device_id = parts[1]
             
-            # This would add the log to the database
-            # In a real implementation, this would use a database session
-            
-            # For this example, we'll just log the message
+            # Plain text payloads are info lines
             if isinstance(payload, dict):
-                level = payload.get('level', 'info').upper()
-                message = payload.get('message', '')
-                logger.info(f"Device {device_id} [{level}]: {message}")
+                level = str(payload.get('level', 'info'))
+                message = str(payload.get('message', ''))
+            else:
+                level, message = 'info', str(payload)
+            
+            # Repeats, sampled and rate-limited lines are not echoed
+            if self.logs.submit(device_id, level, message) == "accepted":
+                logger.info(f"Device {device_id} [{level.upper()}]: {message}")
         except Exception as e:
             logger.error(f"Error handling device log: {e}")
             
@@ -373,15 +815,30 @@ class DeviceManager:
         """
         logger.info(f"BLE-Gerät verbunden: {device.name} ({device.address})")
         
-        # Aktualisiere Verbindungsstatus in der Datenbank
+        # Läuft im BLE-Event-Loop; die Datenbank wird im Datenbank-Thread des
+        # BLE-Service aktualisiert
+        self.ble_service.submit_db_task(self._store_ble_connected, device.address)
+    
+    def _store_ble_connected(self, address: str) -> None:
+        """
+        Speichert den Verbindungsstatus eines BLE-Geräts (läuft im Datenbank-Thread).
+        """
         db = next(get_db())
         try:
-            db_device = db.query(models.Device).filter_by(ble_address=device.address).first()
+            db_device = db.query(models.Device).filter_by(ble_address=address).first()
             if db_device:
-                db_device.ble_connected = True
+                # ble_connected speichert der Anwesenheits-Tracker des BLE-Service
                 db_device.is_online = True
                 db_device.last_seen = datetime.now()
                 db.commit()
+                self.states.upsert(
+                    db_device.device_id,
+                    id=db_device.id,
+                    ble_address=address,
+                    is_online=True,
+                    last_seen=db_device.last_seen,
+                )
+                self.liveness.heartbeat(db_device.device_id)
                 logger.debug(f"BLE-Verbindungsstatus für {db_device.name} aktualisiert")
         except Exception as e:
             db.rollback()
@@ -395,28 +852,28 @@ class DeviceManager:
         """
         logger.info(f"BLE-Gerät getrennt: {device.name} ({device.address})")
         
-        # Aktualisiere Verbindungsstatus in der Datenbank
-        db = next(get_db())
-        try:
-            db_device = db.query(models.Device).filter_by(ble_address=device.address).first()
-            if db_device:
-                db_device.ble_connected = False
-                db.commit()
-                logger.debug(f"BLE-Verbindungsstatus für {db_device.name} aktualisiert")
-        except Exception as e:
-            db.rollback()
-            logger.error(f"Fehler beim Aktualisieren des BLE-Verbindungsstatus: {e}")
-        finally:
-            db.close()
+        # Der Verbindungsstatus wird vom Anwesenheits-Tracker des BLE-Service
+        # gebündelt gespeichert (siehe ble_presence)
             
     def _handle_ble_sensor_data(self, address: str, sensor_data: Dict[str, Any]):
         """
         Callback für Sensordaten von BLE-Geräten.
         """
-        logger.info(f"BLE-Sensordaten von {address}: {sensor_data}")
+        logger.debug(f"BLE-Sensordaten von {address}: {sensor_data}")
+        
+        # Aktuellen Zustand im Speicher nachführen; Geräte ohne bekannte Zuordnung
+        # tragen die ID, unter der der BLE-Service sie registriert
+        device_id = self.states.resolve_ble(address)
+        if device_id is None:
+            device_id = f"ble_{address.replace(':', '')}"
+            self.states.upsert(device_id, ble_address=address)
+        self.liveness.heartbeat(device_id)
+        self.states.update_telemetry(device_id, sensor_data)
+        self.tasks.observe(device_id, sensor_data)
         
         # Die Daten werden bereits vom BLE-Service in der Datenbank gespeichert,
-        # wir müssen hier nichts zusätzlich tun.
+        # hier werden sie nur an verbundene Live-Clients weitergereicht.
+        self.stream.publish(address, "ble_telemetry", sensor_data)
         
     # === BLE-spezifische Methoden ===
     
@@ -548,9 +1005,11 @@ class DeviceManager:
                 logger.error(f"Gerät {device_id} oder Aufgabe {task_id} nicht gefunden")
                 return False
                 
-            # Startzeit festlegen
+            # Startzeit festlegen; gespeichert und verglichen wird naive Ortszeit
             if not start_time:
                 start_time = datetime.now()
+            elif start_time.tzinfo is not None:
+                start_time = start_time.astimezone().replace(tzinfo=None)
                 
             # Endzeit berechnen
             end_time = start_time + timedelta(minutes=task.duration_minutes)
@@ -568,36 +1027,33 @@ class DeviceManager:
             db.add(assignment)
             db.commit()
             
-            # Aufgabenparameter an das Gerät senden
-            task_command = {
-                "action": "start_task",
-                "task_id": task.id,
-                "name": task.name,
-                "duration": task.duration_minutes,
-                "fan_speed": task.fan_speed,
-                "timestamp": datetime.now().isoformat()
-            }
+            # Spätere Starts übernimmt der Aufgabenplaner zum Startzeitpunkt
+            fields = task_fields(task)
+            if start_time > datetime.now():
+                self.tasks.add(assignment.id, device.device_id, fields, start_time, end_time)
+                logger.info(f"Aufgabe {task.name} für Gerät {device.name} auf {start_time.isoformat()} geplant")
+                return True
             
-            if task.target_temperature:
-                task_command["target_temperature"] = task.target_temperature
-                
-            if task.target_humidity:
-                task_command["target_humidity"] = task.target_humidity
+            # Aufgabenparameter an das Gerät senden
+            start_command = task_command("start_task", assignment.id, fields)
             
             # Über BLE oder MQTT senden, je nach Verfügbarkeit
             success = False
             
             if device.ble_address and self.ble_initialized:
                 try:
-                    success = await self.ble_service.send_command(device.device_id, task_command)
+                    success = await self.ble_service.send_command(device.device_id, start_command)
                 except Exception as e:
                     logger.error(f"Fehler beim Senden der Aufgabe über BLE: {e}")
             
             if not success:
                 # Fallback auf MQTT
                 topic = f"swissairdry/{device.device_id}/task"
-                self.mqtt.publish_sync(topic, task_command)
+                self.mqtt.publish_sync(topic, start_command)
                 success = True
+            
+            # Der Planer setzt die Zuweisung auf "running" und stoppt sie am Ende
+            self.tasks.add(assignment.id, device.device_id, fields, start_time, end_time, started=True)
                 
             logger.info(f"Aufgabe {task.name} wurde Gerät {device.name} zugewiesen")
             return success
@@ -608,3 +1064,18 @@ class DeviceManager:
             return False
         finally:
             db.close()
+
+# Singleton-Instanz des DeviceManagers
+_device_manager_instance = None
+_device_manager_lock = threading.Lock()
+
+def get_device_manager() -> DeviceManager:
+    """
+    Get the process-wide DeviceManager instance (created on first use).
+    """
+    global _device_manager_instance
+    if _device_manager_instance is None:
+        with _device_manager_lock:
+            if _device_manager_instance is None:
+                _device_manager_instance = DeviceManager(get_mqtt_handler())
+    return _device_manager_instance
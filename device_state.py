@@ -0,0 +1,394 @@
+"""
+In-memory device state store for the SwissAirDry platform.
+
+Keeps the current state of every device (latest telemetry, online flag,
+firmware, last_seen) in compact per-device records that the MQTT and BLE
+ingest handlers update in place. Reads of "current state" are answered from
+memory instead of querying the database.
+"""
+import bisect
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import func
+
+import models
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Global store instance
+_device_state_store = None
+
+# Telemetry values kept per device
+TELEMETRY_FIELDS = ("temperature", "humidity", "pressure", "fan_speed", "power_consumption", "power", "rssi")
+
+# Device attributes mirrored from the devices table
+DEVICE_FIELDS = ("id", "name", "type", "firmware_version", "ip_address", "mac_address", "ble_address")
+
+# Filtered results up to 1/QUERY_SORT_RATIO of the fleet are sorted directly
+# instead of walking the sorted device index
+QUERY_SORT_RATIO = 8
+
+class DeviceState:
+    """
+    Current state of one device.
+    """
+    __slots__ = ("device_id", "is_online", "last_seen", "telemetry_at") + DEVICE_FIELDS + TELEMETRY_FIELDS
+
+    def __init__(self, device_id: str):
+        self.device_id = device_id
+        self.is_online = False
+        self.last_seen: Optional[datetime] = None
+        self.telemetry_at: Optional[datetime] = None
+        for field in DEVICE_FIELDS + TELEMETRY_FIELDS:
+            setattr(self, field, None)
+        self.type = "unknown"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Return a snapshot of the record.
+        """
+        return {field: getattr(self, field) for field in self.__slots__}
+
+class DeviceStateStore:
+    """
+    Thread-safe store of per-device state with secondary indexes.
+
+    Records are indexed by device type, online state and BLE address, and
+    device ids are kept in a sorted list maintained on insert and remove.
+    Devices that sent messages but have no database row yet are kept as
+    unregistered records and excluded from reads by default. The store is
+    ``live`` while this process owns ingest (see leader_election); only then
+    is it guaranteed to reflect every device message, and callers should fall
+    back to the database otherwise.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._states: Dict[str, DeviceState] = {}
+        self._order: List[str] = []  # Sorted device ids
+        self._by_type: Dict[str, Set[str]] = {}
+        self._online: Set[str] = set()
+        self._by_ble: Dict[str, str] = {}
+        self._unregistered: Set[str] = set()
+        self.loaded = False
+        self.live = False
+
+    # ----- Loading -----
+
+    def load(self, db) -> int:
+        """
+        Merge the devices and their latest reading from the database.
+
+        Device attributes are always taken from the database. Telemetry and
+        the online flag are only taken for new records, or for all records
+        while the store is not live; a live store is newer than the database.
+        Registered records whose device row was deleted are removed.
+
+        Args:
+            db: Database session
+
+        Returns:
+            int: Number of devices loaded
+        """
+        latest = (
+            db.query(
+                models.SensorReading.device_id.label("device_pk"),
+                func.max(models.SensorReading.timestamp).label("timestamp"),
+            )
+            .group_by(models.SensorReading.device_id)
+            .subquery()
+        )
+        readings = {
+            reading.device_id: reading
+            for reading in db.query(models.SensorReading).join(
+                latest,
+                (models.SensorReading.device_id == latest.c.device_pk)
+                & (models.SensorReading.timestamp == latest.c.timestamp),
+            )
+        }
+        devices = db.query(
+            models.Device.device_id,
+            models.Device.is_online,
+            models.Device.last_seen,
+            models.Device.ble_rssi,
+            *(getattr(models.Device, field) for field in DEVICE_FIELDS),
+        ).all()
+
+        with self._lock:
+            present = set()
+            for row in devices:
+                present.add(row.device_id)
+                state = self._states.get(row.device_id)
+                is_new = state is None
+                if is_new:
+                    state = self._add(row.device_id)
+                else:
+                    self._unindex(state)
+                for field in DEVICE_FIELDS:
+                    setattr(state, field, getattr(row, field))
+                state.type = row.type or "unknown"
+                self._index(state)
+
+                if is_new or not self.live:
+                    state.last_seen = row.last_seen
+                    state.rssi = row.ble_rssi
+                    reading = readings.get(row.id)
+                    if reading is not None:
+                        for field in TELEMETRY_FIELDS:
+                            if hasattr(reading, field):
+                                setattr(state, field, getattr(reading, field))
+                        state.telemetry_at = reading.timestamp
+                    self._set_online(state, bool(row.is_online))
+
+            deleted = [
+                device_id for device_id, state in self._states.items()
+                if state.id is not None and device_id not in present
+            ]
+            for device_id in deleted:
+                self.remove(device_id)
+            self.loaded = True
+
+        logger.info(f"Device state store loaded {len(devices)} devices")
+        return len(devices)
+
+    def refresh(self, get_session) -> int:
+        """
+        Merge the database state using a session from ``get_session`` (a get_db style generator).
+        """
+        db = next(get_session())
+        try:
+            return self.load(db)
+        finally:
+            db.close()
+
+    # ----- Updates -----
+
+    def _add(self, device_id: str) -> DeviceState:
+        state = self._states[device_id] = DeviceState(device_id)
+        bisect.insort(self._order, device_id)
+        return state
+
+    def _get_or_create(self, device_id: str) -> DeviceState:
+        state = self._states.get(device_id)
+        if state is None:
+            state = self._add(device_id)
+            self._index(state)
+        return state
+
+    def _index(self, state: DeviceState) -> None:
+        self._by_type.setdefault(state.type, set()).add(state.device_id)
+        if state.ble_address:
+            self._by_ble[state.ble_address] = state.device_id
+        if state.id is None:
+            self._unregistered.add(state.device_id)
+
+    def _unindex(self, state: DeviceState) -> None:
+        members = self._by_type.get(state.type)
+        if members is not None:
+            members.discard(state.device_id)
+            if not members:
+                del self._by_type[state.type]
+        if state.ble_address and self._by_ble.get(state.ble_address) == state.device_id:
+            del self._by_ble[state.ble_address]
+        self._unregistered.discard(state.device_id)
+
+    def _set_online(self, state: DeviceState, online: bool) -> bool:
+        if state.is_online == online:
+            return False
+        state.is_online = online
+        if online:
+            self._online.add(state.device_id)
+        else:
+            self._online.discard(state.device_id)
+        return True
+
+    def update_telemetry(self, device_id: str, data: Dict[str, Any], seen_at: Optional[datetime] = None) -> None:
+        """
+        Record a telemetry message; the device counts as online.
+
+        Args:
+            device_id: Device that sent the telemetry
+            data: Telemetry payload, unknown keys are ignored
+            seen_at: Receive time (default: now)
+        """
+        seen_at = seen_at or datetime.now()
+        with self._lock:
+            state = self._get_or_create(device_id)
+            for field in TELEMETRY_FIELDS:
+                if field in data:
+                    setattr(state, field, data[field])
+            state.telemetry_at = seen_at
+            state.last_seen = seen_at
+            self._set_online(state, True)
+
+    def update_status(
+        self,
+        device_id: str,
+        online: Optional[bool] = None,
+        firmware_version: Optional[str] = None,
+        seen_at: Optional[datetime] = None
+    ) -> bool:
+        """
+        Record a status message.
+
+        Args:
+            device_id: Device that sent the status
+            online: Reported online flag (None keeps the current value)
+            firmware_version: Reported firmware version
+            seen_at: Receive time (default: now)
+
+        Returns:
+            bool: True if the online flag changed
+        """
+        with self._lock:
+            state = self._get_or_create(device_id)
+            if firmware_version is not None:
+                state.firmware_version = firmware_version
+            if online is not False:
+                state.last_seen = seen_at or datetime.now()
+            return self._set_online(state, True if online is None else bool(online))
+
+    def set_online(self, device_id: str, online: bool) -> bool:
+        """
+        Set the online flag of a known device.
+
+        Returns:
+            bool: True if the flag changed
+        """
+        with self._lock:
+            state = self._states.get(device_id)
+            return state is not None and self._set_online(state, online)
+
+    def upsert(self, device_id: str, **attributes: Any) -> None:
+        """
+        Create or update the device attributes of a record (e.g. after an API write).
+
+        Args:
+            device_id: Device to update
+            **attributes: Values for DEVICE_FIELDS, is_online or last_seen
+        """
+        with self._lock:
+            state = self._get_or_create(device_id)
+            self._unindex(state)
+            online = attributes.pop("is_online", None)
+            for field, value in attributes.items():
+                if field in DEVICE_FIELDS or field == "last_seen":
+                    setattr(state, field, value)
+            state.type = state.type or "unknown"
+            self._index(state)
+            if online is not None:
+                self._set_online(state, bool(online))
+
+    def remove(self, device_id: str) -> None:
+        """
+        Remove a deleted device.
+        """
+        with self._lock:
+            state = self._states.pop(device_id, None)
+            if state is not None:
+                self._unindex(state)
+                self._online.discard(device_id)
+                index = bisect.bisect_left(self._order, device_id)
+                del self._order[index]
+
+    def resolve_ble(self, address: str) -> Optional[str]:
+        """
+        Return the device_id registered for a BLE address.
+        """
+        return self._by_ble.get(address)
+
+    # ----- Reads -----
+
+    def get(self, device_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Return a snapshot of one device, or None if it is unknown.
+        """
+        with self._lock:
+            state = self._states.get(device_id)
+            return state.to_dict() if state is not None else None
+
+    def query(
+        self,
+        device_type: Optional[str] = None,
+        is_online: Optional[bool] = None,
+        device_ids: Optional[Iterable[str]] = None,
+        skip: int = 0,
+        limit: Optional[int] = None,
+        registered_only: bool = True
+    ) -> List[Dict[str, Any]]:
+        """
+        Return snapshots of the devices matching all given filters, ordered by device_id.
+
+        The type and online filters are answered from the indexes. A result
+        that is small compared to the fleet is sorted directly; otherwise the
+        sorted device index is walked only until the requested page is full,
+        so neither path sorts the whole fleet.
+        """
+        with self._lock:
+            required: List[Set[str]] = []
+            excluded: List[Set[str]] = []
+            if device_ids is not None:
+                required.append(set(device_ids))
+            if device_type is not None:
+                required.append(self._by_type.get(device_type, set()))
+            if is_online is True:
+                required.append(self._online)
+            elif is_online is False:
+                excluded.append(self._online)
+            if registered_only and self._unregistered:
+                excluded.append(self._unregistered)
+
+            def matches(device_id: str) -> bool:
+                return all(device_id in ids for ids in required) and not any(device_id in ids for ids in excluded)
+
+            end = None if limit is None else skip + limit
+            smallest = min(required, key=len) if required else None
+            if smallest is not None and len(smallest) * QUERY_SORT_RATIO <= len(self._order):
+                ids = sorted(
+                    device_id for device_id in smallest
+                    if device_id in self._states and matches(device_id)
+                )[skip:end]
+            else:
+                ids = []
+                position = 0
+                for device_id in self._order:
+                    if not matches(device_id):
+                        continue
+                    if position >= skip:
+                        ids.append(device_id)
+                    position += 1
+                    if end is not None and position >= end:
+                        break
+            return [self._states[device_id].to_dict() for device_id in ids]
+
+    def counts(self) -> Dict[str, Any]:
+        """
+        Return totals of registered devices overall, online and per type.
+        """
+        with self._lock:
+            unregistered = self._unregistered
+            total = len(self._states) - len(unregistered)
+            online = len(self._online) - len(self._online & unregistered)
+            by_type = {
+                device_type: len(ids) - len(ids & unregistered)
+                for device_type, ids in self._by_type.items()
+            }
+            return {
+                "total": total,
+                "online": online,
+                "offline": total - online,
+                "by_type": {device_type: count for device_type, count in by_type.items() if count},
+            }
+
+def get_device_state_store() -> DeviceStateStore:
+    """
+    Get the global device state store instance.
+    """
+    global _device_state_store
+    if _device_state_store is None:
+        _device_state_store = DeviceStateStore()
+    return _device_state_store
@@ -0,0 +1,418 @@
+"""
+Discovery handling for the SwissAirDry platform.
+
+Devices publish their discovery message retained, so after a broker restart
+or a subscriber reconnect the whole fleet's discoveries arrive at once. This
+module keeps that stampede cheap: unchanged payloads are skipped by hash,
+changed ones are coalesced into batched ``INSERT ... ON CONFLICT`` upserts,
+and welcome replies are spread out with jitter under a rate limit.
+"""
+import os
+import json
+import time
+import heapq
+import random
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import func, insert
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Maximum number of devices per upsert statement
+DISCOVERY_BATCH_SIZE = int(os.getenv("DISCOVERY_BATCH_SIZE", 500))
+# Seconds a discovery may wait for more to join its batch
+DISCOVERY_BATCH_WINDOW = float(os.getenv("DISCOVERY_BATCH_WINDOW", 0.5))
+# Welcome replies per second, and the maximum random delay before each
+DISCOVERY_WELCOME_RATE = float(os.getenv("DISCOVERY_WELCOME_RATE", 50))
+DISCOVERY_WELCOME_JITTER = float(os.getenv("DISCOVERY_WELCOME_JITTER", 2.0))
+
+# Payload fields that change without the device changing
+VOLATILE_FIELDS = frozenset(("timestamp", "uptime", "rssi", "free_heap"))
+
+# Device columns taken from a discovery payload; existing values are kept
+# when the payload omits them
+DISCOVERY_COLUMNS = ("firmware_version", "hardware_version", "ip_address", "mac_address")
+
+def discovery_hash(payload: Dict[str, Any]) -> str:
+    """
+    Return a stable hash of a discovery payload, ignoring volatile fields.
+    """
+    stable = {key: value for key, value in payload.items() if key not in VOLATILE_FIELDS}
+    encoded = json.dumps(stable, sort_keys=True, separators=(",", ":"), default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+class DiscoveryCoalescer:
+    """
+    Coalesces discovery messages into batched device upserts.
+
+    ``submit`` is called from the MQTT thread and only touches memory. A
+    background thread writes the collected devices when the batch is full or
+    the batch window has passed, with one upsert per batch. Payloads whose
+    hash matches the last stored one for the device are skipped entirely.
+    """
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Any]],
+        batch_size: int = DISCOVERY_BATCH_SIZE,
+        window: float = DISCOVERY_BATCH_WINDOW,
+        on_stored: Optional[Callable[[List[Dict[str, Any]]], None]] = None
+    ):
+        """
+        Initialize the coalescer.
+
+        Args:
+            session_factory: Returns a new database session (None only
+                coalesces the discoveries and reports them without storing
+                them, for processes where another one is the writer)
+            batch_size: Maximum number of devices per upsert
+            window: Seconds a discovery may wait for more to join its batch
+            on_stored: Called with the stored rows (including the device
+                primary key as ``id``, None when not storing) after each
+                successful batch
+        """
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.window = window
+        self.on_stored = on_stored
+        self._hashes: Dict[str, str] = {}
+        self._batch: Dict[str, Dict[str, Any]] = {}
+        self._batch_hashes: Dict[str, str] = {}
+        self._batch_started: Optional[float] = None
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.metrics = {
+            "received": 0,
+            "unchanged": 0,
+            "coalesced": 0,
+            "stored": 0,
+            "batches": 0,
+            "failed": 0,
+        }
+
+    def start(self) -> None:
+        """
+        Start the background writer.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="discovery-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background writer and write the collected devices.
+        """
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+
+    def submit(self, payload: Dict[str, Any]) -> bool:
+        """
+        Queue a discovery payload for the next batch.
+
+        Args:
+            payload: Discovery payload with at least device_id and type
+
+        Returns:
+            bool: True if the payload was queued, False if it was invalid or unchanged
+        """
+        device_id = payload.get("device_id")
+        device_type = payload.get("type")
+        if not device_id or not device_type:
+            logger.warning(f"Discovery payload without device_id or type: {payload}")
+            return False
+
+        digest = discovery_hash(payload)
+        with self._condition:
+            self.metrics["received"] += 1
+            if self._batch_hashes.get(device_id, self._hashes.get(device_id)) == digest:
+                self.metrics["unchanged"] += 1
+                return False
+            if device_id in self._batch:
+                self.metrics["coalesced"] += 1
+
+            row = {
+                "device_id": device_id,
+                "name": payload.get("name") or f"SwissAirDry {device_type}-{device_id}",
+                "type": device_type,
+            }
+            for column in DISCOVERY_COLUMNS:
+                row[column] = payload.get(column)
+            self._batch[device_id] = row
+            self._batch_hashes[device_id] = digest
+            if self._batch_started is None:
+                self._batch_started = time.monotonic()
+            if len(self._batch) >= self.batch_size:
+                self._condition.notify_all()
+        return True
+
+    def forget(self, device_id: str) -> None:
+        """
+        Drop the stored hash of a device so its next discovery is written again.
+        """
+        with self._condition:
+            self._hashes.pop(device_id, None)
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            with self._condition:
+                if self._batch_started is None:
+                    self._condition.wait(self.window)
+                    continue
+                remaining = self._batch_started + self.window - time.monotonic()
+                if remaining > 0 and len(self._batch) < self.batch_size:
+                    self._condition.wait(remaining)
+                    continue
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error writing discovery batch: {e}")
+
+    def flush(self) -> int:
+        """
+        Upsert the collected devices, ``batch_size`` rows per statement.
+
+        Without a session factory the devices are only reported to
+        ``on_stored``.
+
+        Returns:
+            int: Number of devices written
+        """
+        with self._condition:
+            batch, self._batch = self._batch, {}
+            hashes, self._batch_hashes = self._batch_hashes, {}
+            self._batch_started = None
+        if not batch:
+            return 0
+
+        rows = list(batch.values())
+        now = datetime.now()
+        if self.session_factory is None:
+            stored = [{**row, "is_online": True, "last_seen": now, "id": None} for row in rows]
+        else:
+            stored = self._store(batch, hashes, rows, now)
+            if stored is None:
+                return 0
+
+        with self._condition:
+            self._hashes.update(hashes)
+            self.metrics["stored"] += len(rows)
+            self.metrics["batches"] += 1
+
+        if self.on_stored:
+            try:
+                self.on_stored(stored)
+            except Exception as e:
+                logger.error(f"Error in discovery callback: {e}")
+        return len(rows)
+
+    def _store(
+        self,
+        batch: Dict[str, Dict[str, Any]],
+        hashes: Dict[str, str],
+        rows: List[Dict[str, Any]],
+        now: datetime
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Upsert a batch; on failure it is queued again and None is returned.
+        """
+        stored: List[Dict[str, Any]] = []
+        db = self.session_factory()
+        try:
+            for start in range(0, len(rows), self.batch_size):
+                chunk = [{**row, "is_online": True, "last_seen": now} for row in rows[start:start + self.batch_size]]
+                ids = self._upsert(db, chunk)
+                stored.extend({**row, "id": ids.get(row["device_id"])} for row in chunk)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error storing {len(rows)} discovered devices: {e}")
+            with self._condition:
+                self.metrics["failed"] += len(rows)
+                # Keep newer submissions, retry the rest with the next batch
+                for device_id, row in batch.items():
+                    if device_id not in self._batch:
+                        self._batch[device_id] = row
+                        self._batch_hashes[device_id] = hashes[device_id]
+                if self._batch and self._batch_started is None:
+                    self._batch_started = time.monotonic()
+            return None
+        finally:
+            db.close()
+        logger.info(f"Stored {len(rows)} discovered devices")
+        return stored
+
+    def _upsert(self, db, rows: List[Dict[str, Any]]) -> Dict[str, int]:
+        """
+        Insert new devices and update known ones in one statement.
+
+        Name and type are only set on insert, so renamed devices keep their
+        name. Returns the primary keys by device_id.
+        """
+        devices = models.Device.__table__
+        dialect = db.get_bind().dialect.name
+        if dialect not in ("postgresql", "sqlite"):
+            return self._upsert_fallback(db, rows)
+
+        dialect_insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = dialect_insert(devices).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[devices.c.device_id],
+            set_={
+                **{
+                    column: func.coalesce(statement.excluded[column], devices.c[column])
+                    for column in DISCOVERY_COLUMNS
+                },
+                "is_online": statement.excluded.is_online,
+                "last_seen": statement.excluded.last_seen,
+            },
+        ).returning(devices.c.id, devices.c.device_id)
+        return {device_id: pk for pk, device_id in db.execute(statement)}
+
+    def _upsert_fallback(self, db, rows: List[Dict[str, Any]]) -> Dict[str, int]:
+        # Databases without ON CONFLICT: one lookup for the batch, then bulk insert
+        devices = models.Device.__table__
+        known = dict(
+            db.query(models.Device.device_id, models.Device.id)
+            .filter(models.Device.device_id.in_([row["device_id"] for row in rows]))
+            .all()
+        )
+        new_rows = [row for row in rows if row["device_id"] not in known]
+        if new_rows:
+            db.execute(insert(devices), new_rows)
+        for row in rows:
+            if row["device_id"] in known:
+                values = {column: row[column] for column in DISCOVERY_COLUMNS if row[column] is not None}
+                db.query(models.Device).filter(models.Device.id == known[row["device_id"]]).update(
+                    {**values, "is_online": True, "last_seen": row["last_seen"]}
+                )
+        return dict(
+            db.query(models.Device.device_id, models.Device.id)
+            .filter(models.Device.device_id.in_([row["device_id"] for row in rows]))
+            .all()
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return counters of received, skipped and stored discoveries.
+        """
+        with self._condition:
+            return {"queued": len(self._batch), **self.metrics}
+
+class WelcomeScheduler:
+    """
+    Sends welcome replies spread out by random jitter and a rate limit.
+
+    Each device has at most one pending welcome. Replies are sent by a
+    background thread in due order, at most ``rate`` per second.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[str], None],
+        rate: float = DISCOVERY_WELCOME_RATE,
+        jitter: float = DISCOVERY_WELCOME_JITTER
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            publish: Sends the welcome to a device_id
+            rate: Maximum welcomes per second
+            jitter: Maximum random delay in seconds before a welcome
+        """
+        self.publish = publish
+        self.rate = rate
+        self.jitter = jitter
+        self._heap: List = []
+        self._queued = set()
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.metrics = {"scheduled": 0, "sent": 0, "deduplicated": 0}
+
+    def start(self) -> None:
+        """
+        Start the sender thread.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="discovery-welcome", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the sender thread; pending welcomes are dropped.
+        """
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        with self._condition:
+            self._heap.clear()
+            self._queued.clear()
+
+    def schedule(self, device_id: str) -> bool:
+        """
+        Schedule a welcome for a device unless one is already pending.
+
+        Returns:
+            bool: True if a welcome was scheduled
+        """
+        with self._condition:
+            if device_id in self._queued:
+                self.metrics["deduplicated"] += 1
+                return False
+            self._queued.add(device_id)
+            heapq.heappush(self._heap, (time.monotonic() + random.uniform(0, self.jitter), device_id))
+            self.metrics["scheduled"] += 1
+            self._condition.notify()
+        return True
+
+    def _run(self) -> None:
+        interval = 1.0 / self.rate if self.rate > 0 else 0.0
+        next_send = time.monotonic()
+        while not self._stopped.is_set():
+            with self._condition:
+                if not self._heap:
+                    self._condition.wait(1.0)
+                    continue
+                due = max(self._heap[0][0], next_send)
+                wait = due - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                _, device_id = heapq.heappop(self._heap)
+                self._queued.discard(device_id)
+            try:
+                self.publish(device_id)
+                self.metrics["sent"] += 1
+            except Exception as e:
+                logger.error(f"Error sending welcome to {device_id}: {e}")
+            next_send = max(next_send + interval, time.monotonic() - 1.0)
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return counters of scheduled and sent welcomes.
+        """
+        with self._condition:
+            return {"pending": len(self._heap), **self.metrics}
@@ -69,6 +69,9 @@ OneButton button(BUTTON_PIN, true);
 float currentPressure = 0.0;
 float currentConsumption = 0.0;
 
+// Group control topics from the last config (swissairdry/group/<id>/control)
+std::vector<String> groupTopics;
+
 // Function prototypes
 void setupWiFi();
 void setupSensors();
@@ -449,7 +452,7 @@ void handleMqttMessage(char* topic, byte* payload, unsigned int length) {
 void handleConfigMessage(String message) {
   Serial.println("Handling config message");
   
-  DynamicJsonDocument doc(512);
+  DynamicJsonDocument doc(1024);
   DeserializationError error = deserializeJson(doc, message);
   
   if (error) {
@@ -479,6 +482,20 @@ void handleConfigMessage(String message) {
     config.otaEnabled = doc["ota_enabled"];
   }
   
+  // Follow group membership: the config always carries the full group list
+  if (doc.containsKey("groups")) {
+    for (auto& topic : groupTopics) {
+      mqtt.unsubscribe(topic);
+    }
+    groupTopics.clear();
+    for (JsonVariant group : doc["groups"].as<JsonArray>()) {
+      String topic = "swissairdry/group/" + group.as<String>() + "/control";
+      mqtt.subscribe(topic);
+      groupTopics.push_back(topic);
+    }
+    Serial.println("Group subscriptions: " + String(groupTopics.size()));
+  }
+  
   // Save updated configuration
   config.saveToSPIFFS();
   
@@ -488,6 +505,9 @@ void handleConfigMessage(String message) {
   DynamicJsonDocument ackDoc(256);
   ackDoc["status"] = "success";
   ackDoc["message"] = "Configuration updated";
+  if (doc.containsKey("command_id")) {
+    ackDoc["command_id"] = doc["command_id"];
+  }
   
   String ackPayload;
   serializeJson(ackDoc, ackPayload);
@@ -535,6 +555,18 @@ void handleControlMessage(String message) {
     Serial.println("Power set to " + String(power ? "ON" : "OFF"));
   }
   
+  // Acknowledge commands that carry an id (group commands)
+  if (doc.containsKey("command_id")) {
+    DynamicJsonDocument ackDoc(256);
+    ackDoc["command_id"] = doc["command_id"];
+    ackDoc["status"] = "success";
+    
+    String ackPayload;
+    serializeJson(ackDoc, ackPayload);
+    
+    mqtt.publish("swissairdry/" + config.deviceId + "/control/ack", ackPayload.c_str());
+  }
+  
   // Publish updated status
   publishStatus();
 }
@@ -551,6 +583,18 @@ void handleCommandMessage(String message) {
     return;
   }
   
+  // Acknowledge before acting, reboot and reset do not return
+  if (doc.containsKey("command_id")) {
+    DynamicJsonDocument ackDoc(256);
+    ackDoc["command_id"] = doc["command_id"];
+    ackDoc["status"] = "success";
+    
+    String ackPayload;
+    serializeJson(ackDoc, ackPayload);
+    
+    mqtt.publish("swissairdry/" + config.deviceId + "/command/ack", ackPayload.c_str());
+  }
+  
   // Handle status_update command
   if (doc.containsKey("action") && doc["action"] == "status_update") {
     publishStatus();
@@ -0,0 +1,131 @@
+"""
+Rendered fragment cache for the SwissAirDry web interface.
+
+This module caches rendered HTML fragments (e.g. the device table) so page
+renders don't have to query and template the whole fleet on every request.
+"""
+import time
+import logging
+import threading
+from itertools import chain
+from typing import Callable, Dict, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Global cache instance
+_fragment_cache = None
+
+
+class FragmentCache:
+    """
+    Thread-safe cache of rendered fragments with explicit invalidation.
+
+    Fragments are invalidated when a transaction of this process that wrote
+    the underlying rows commits (see register_model_invalidation) and expire
+    after ``ttl`` seconds as a backstop for changes made by other processes
+    (ingest leader, MQTT bridge).
+    """
+
+    def __init__(self, ttl: float = 15.0):
+        """
+        Initialize the cache.
+
+        Args:
+            ttl: Maximum age of a cached fragment in seconds
+        """
+        self.ttl = ttl
+        self._fragments: Dict[str, Tuple[float, int, str]] = {}
+        self._versions: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Session.info key collecting the fragments to invalidate on commit
+        self._pending_key = ("fragment_cache", id(self))
+        self._session_hooks = False
+
+    def get_or_render(self, name: str, render: Callable[[], str]) -> str:
+        """
+        Return a cached fragment, rendering it if missing, stale or invalidated.
+
+        Args:
+            name: Fragment name
+            render: Function producing the fragment HTML
+
+        Returns:
+            str: Rendered fragment
+        """
+        now = time.monotonic()
+        with self._lock:
+            version = self._versions.get(name, 0)
+            cached = self._fragments.get(name)
+            if cached and cached[1] == version and now - cached[0] < self.ttl:
+                return cached[2]
+
+        html = render()
+
+        with self._lock:
+            # Only store if nothing invalidated the fragment while rendering
+            if self._versions.get(name, 0) == version:
+                self._fragments[name] = (now, version, html)
+        return html
+
+    def invalidate(self, name: str) -> None:
+        """
+        Invalidate a fragment.
+        """
+        with self._lock:
+            self._versions[name] = self._versions.get(name, 0) + 1
+            self._fragments.pop(name, None)
+        logger.debug(f"Fragment {name} invalidated")
+
+    def register_model_invalidation(self, model, name: str) -> None:
+        """
+        Invalidate a fragment after every commit that wrote rows of a model.
+
+        Covers ORM flushes as well as Core and bulk INSERT, UPDATE and DELETE
+        statements executed through a Session. The fragment is invalidated
+        only once the transaction committed, so a render running meanwhile
+        cannot cache rows that are not visible yet.
+        """
+        table = model.__table__
+
+        def _mark(session: Session) -> None:
+            session.info.setdefault(self._pending_key, set()).add(name)
+
+        def after_flush(session, flush_context):
+            if any(isinstance(obj, model) for obj in chain(session.new, session.dirty, session.deleted)):
+                _mark(session)
+
+        def do_orm_execute(state):
+            if state.is_insert or state.is_update or state.is_delete:
+                target = getattr(state.statement, "table", None)
+                if getattr(target, "name", None) == table.name:
+                    _mark(state.session)
+
+        event.listen(Session, "after_flush", after_flush)
+        event.listen(Session, "do_orm_execute", do_orm_execute)
+        if not self._session_hooks:
+            event.listen(Session, "after_commit", self._after_commit)
+            event.listen(Session, "after_rollback", self._after_rollback)
+            self._session_hooks = True
+
+    def _after_commit(self, session: Session) -> None:
+        for name in session.info.pop(self._pending_key, ()):
+            self.invalidate(name)
+
+    def _after_rollback(self, session: Session) -> None:
+        session.info.pop(self._pending_key, None)
+
+def get_fragment_cache() -> FragmentCache:
+    """
+    Get the global fragment cache instance.
+    """
+    global _fragment_cache
+    if _fragment_cache is None:
+        _fragment_cache = FragmentCache()
+        _fragment_cache.register_model_invalidation(models.Device, "device_table")
+    return _fragment_cache
@@ -0,0 +1,503 @@
+"""
+Leader election for the SwissAirDry platform.
+
+Under gunicorn every worker process imports the application. Only one of them
+may own device ingest (the MQTT subscriptions) and the Bluetooth adapter; this
+module elects that process and lets the other workers forward BLE commands to
+it over a local Unix socket. The same socket carries feeds: long-lived
+streams the leader pushes to followers, e.g. the live telemetry events.
+"""
+import os
+import json
+import time
+import zlib
+import socket
+import logging
+import threading
+import socketserver
+import tempfile
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from sqlalchemy import text
+
+from database import engine
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Global election instance
+_leader_election = None
+
+class LeaderUnavailable(RuntimeError):
+    """
+    Raised when a command cannot be forwarded because no leader is reachable.
+    """
+
+class _CommandHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one forwarded command: a JSON line in, a JSON line out.
+
+    Feed requests get a status line followed by one JSON line per item until
+    the follower disconnects or this process stops being leader.
+    """
+
+    def handle(self):
+        election = self.server.election
+        try:
+            request = json.loads(self.rfile.readline())
+            if "feed" in request:
+                self._stream(election, request)
+                return
+            result = election.dispatch(request["command"], request.get("args") or {})
+            response = {"ok": True, "result": result}
+        except TimeoutError as e:
+            response = {"ok": False, "timeout": True, "error": str(e)}
+        except Exception as e:
+            logger.error(f"Forwarded command failed: {e}")
+            response = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(response, default=str).encode() + b"\n")
+
+    def _stream(self, election: "LeaderElection", request: Dict[str, Any]):
+        try:
+            items = election.open_feed(request["feed"], request.get("args") or {})
+        except Exception as e:
+            self.wfile.write(json.dumps({"ok": False, "error": str(e)}).encode() + b"\n")
+            return
+        try:
+            self.wfile.write(b'{"ok": true}\n')
+            for item in items:
+                if not election.is_leader:
+                    break
+                self.wfile.write(json.dumps(item, default=str).encode() + b"\n")
+        except OSError:
+            # Follower went away
+            pass
+        finally:
+            items.close()
+
+class _CommandServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class LeaderElection:
+    """
+    Elects one process as owner of ingest, MQTT subscriptions and BLE.
+
+    On PostgreSQL the leader holds a session-level advisory lock on a dedicated
+    connection; if the process dies or the connection drops, the lock is
+    released and the next follower to poll takes over. Other databases (SQLite
+    in development) fall back to an exclusive lock file. The leader heartbeats
+    into ``leader.json`` in the runtime directory, which followers read to
+    report the leader identity and to measure the failover gap.
+    """
+
+    def __init__(
+        self,
+        name: str = "swissairdry-ingest",
+        heartbeat: float = 5.0,
+        runtime_dir: Optional[str] = None,
+        enabled: bool = True
+    ):
+        """
+        Initialize the election.
+
+        Args:
+            name: Name of the owned role, hashed into the advisory lock key
+            heartbeat: Seconds between lock checks and acquisition attempts
+            runtime_dir: Directory for the command socket and leader file
+            enabled: Without election every process acts as leader
+                (single-process deployments)
+        """
+        self.name = name
+        self.heartbeat = heartbeat
+        self.enabled = enabled
+        self.identity = f"{socket.gethostname()}:{os.getpid()}"
+        # pg_try_advisory_lock takes a signed 64-bit key
+        self.lock_key = zlib.crc32(name.encode())
+        self.runtime_dir = runtime_dir or os.path.join(tempfile.gettempdir(), "swissairdry")
+        self.socket_path = os.path.join(self.runtime_dir, f"{name}.sock")
+        self.info_path = os.path.join(self.runtime_dir, f"{name}.json")
+        self.backend = "postgres" if engine.dialect.name == "postgresql" else "file"
+
+        self.is_leader = False
+        self.leader_since: Optional[float] = None
+        self.terms = 0
+        self.last_failover_seconds: Optional[float] = None
+
+        self._lock_conn = None
+        self._lock_file = None
+        self._server: Optional[_CommandServer] = None
+        self._handlers: Dict[str, Callable[..., Any]] = {}
+        self._feeds: Dict[str, Callable[..., Iterator[Any]]] = {}
+        self._on_elected: List[Callable[[], None]] = []
+        self._on_demoted: List[Callable[[], None]] = []
+        self._state_lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    # ----- Registration -----
+
+    def register_command(self, command: str, handler: Callable[..., Any]) -> None:
+        """
+        Register a command the leader executes on behalf of any worker.
+
+        Args:
+            command: Command name
+            handler: Called with the command arguments as keyword arguments;
+                must return a JSON-serializable result
+        """
+        self._handlers[command] = handler
+
+    def register_feed(self, feed: str, source: Callable[..., Iterator[Any]]) -> None:
+        """
+        Register a feed the leader streams to any worker that follows it.
+
+        Args:
+            feed: Feed name
+            source: Called with the follow arguments as keyword arguments;
+                returns a generator of JSON-serializable items. It should
+                yield None at least every few seconds while idle, so a
+                vanished follower or a lost leadership is noticed.
+        """
+        self._feeds[feed] = source
+
+    def on_elected(self, callback: Callable[[], None]) -> None:
+        """
+        Register a callback run when this process becomes leader.
+        """
+        self._on_elected.append(callback)
+
+    def on_demoted(self, callback: Callable[[], None]) -> None:
+        """
+        Register a callback run when this process loses leadership.
+        """
+        self._on_demoted.append(callback)
+
+    # ----- Lifecycle -----
+
+    def start(self) -> None:
+        """
+        Run the first election round synchronously and keep polling in the background.
+        """
+        os.makedirs(self.runtime_dir, exist_ok=True)
+        if not self.enabled:
+            self._promote()
+            return
+
+        self._tick()
+        self._thread = threading.Thread(target=self._run, name="leader-election", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop polling and release leadership.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=self.heartbeat + 1)
+        with self._state_lock:
+            if self.is_leader:
+                self._demote()
+
+    def _run(self) -> None:
+        """
+        Election loop: leaders verify their lock, followers try to acquire it.
+        """
+        while not self._stop.wait(self.heartbeat):
+            self._tick()
+
+    def _tick(self) -> None:
+        with self._state_lock:
+            try:
+                if self.is_leader:
+                    if self._lock_alive():
+                        self._write_info()
+                    else:
+                        logger.warning("Leader lock lost, stepping down")
+                        self._demote()
+                elif self._try_acquire():
+                    self._promote()
+            except Exception as e:
+                logger.error(f"Leader election round failed: {e}")
+                if self.is_leader:
+                    self._demote()
+
+    # ----- Lock backends -----
+
+    def _try_acquire(self) -> bool:
+        if self.backend == "postgres":
+            conn = engine.connect()
+            try:
+                acquired = conn.execute(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": self.lock_key}
+                ).scalar()
+                # End the implicit transaction; the session-level lock stays held
+                conn.commit()
+            except Exception:
+                conn.close()
+                raise
+            if acquired:
+                self._lock_conn = conn
+                return True
+            conn.close()
+            return False
+
+        import fcntl
+
+        lock_file = open(os.path.join(self.runtime_dir, f"{self.name}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _lock_alive(self) -> bool:
+        if not self.enabled:
+            return True
+        if self._lock_conn is None:
+            return self._lock_file is not None
+        try:
+            # The advisory lock lives exactly as long as this session
+            self._lock_conn.execute(text("SELECT 1"))
+            self._lock_conn.commit()
+            return True
+        except Exception:
+            return False
+
+    def _release(self) -> None:
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": self.lock_key})
+                self._lock_conn.commit()
+            except Exception:
+                pass
+            # Invalidate instead of returning to the pool, so a lock that
+            # failed to unlock can never leak into another checkout
+            self._lock_conn.invalidate()
+            self._lock_conn.close()
+            self._lock_conn = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    # ----- Transitions -----
+
+    def _promote(self) -> None:
+        previous = self.read_leader_info()
+        now = time.time()
+        if previous and previous.get("identity") != self.identity and previous.get("heartbeat"):
+            # Gap between the last sign of life of the old leader and takeover
+            self.last_failover_seconds = now - previous["heartbeat"]
+
+        self.is_leader = True
+        self.leader_since = now
+        self.terms += 1
+        self._start_server()
+        self._write_info()
+        logger.info(
+            f"{self.identity} elected leader for {self.name}"
+            + (f" (failover after {self.last_failover_seconds:.1f}s)" if self.last_failover_seconds else "")
+        )
+
+        for callback in self._on_elected:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in on_elected callback: {e}")
+
+    def _demote(self) -> None:
+        self.is_leader = False
+        self.leader_since = None
+        self._stop_server()
+        self._release()
+        logger.info(f"{self.identity} is no longer leader for {self.name}")
+
+        for callback in self._on_demoted:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"Error in on_demoted callback: {e}")
+
+    def _write_info(self) -> None:
+        info = {
+            "identity": self.identity,
+            "pid": os.getpid(),
+            "since": self.leader_since,
+            "heartbeat": time.time(),
+            "socket": self.socket_path,
+        }
+        tmp_path = f"{self.info_path}.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self.info_path)
+
+    def read_leader_info(self) -> Optional[Dict[str, Any]]:
+        """
+        Read the identity and last heartbeat published by the current leader.
+        """
+        try:
+            with open(self.info_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # ----- Command channel -----
+
+    def _start_server(self) -> None:
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self._server = _CommandServer(self.socket_path, _CommandHandler)
+        self._server.election = self
+        threading.Thread(
+            target=self._server.serve_forever, name="leader-commands", daemon=True
+        ).start()
+
+    def _stop_server(self) -> None:
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    def dispatch(self, command: str, args: Dict[str, Any]) -> Any:
+        """
+        Execute a registered command in this (leader) process.
+        """
+        handler = self._handlers.get(command)
+        if handler is None:
+            raise ValueError(f"Unknown command: {command}")
+        return handler(**args)
+
+    def call(self, command: str, timeout: float = 10.0, **args) -> Any:
+        """
+        Run a command on the leader, locally or over the command socket.
+
+        Args:
+            command: Registered command name
+            timeout: Seconds to wait for the leader's reply
+            **args: JSON-serializable command arguments
+
+        Returns:
+            Any: Result returned by the command handler
+
+        Raises:
+            LeaderUnavailable: If no leader accepts the command
+            TimeoutError: If the command timed out on the leader
+        """
+        if self.is_leader:
+            return self.dispatch(command, args)
+
+        request = json.dumps({"command": command, "args": args}, default=str).encode() + b"\n"
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(request)
+                with sock.makefile("rb") as reader:
+                    line = reader.readline()
+        except socket.timeout:
+            raise TimeoutError(f"Leader did not answer {command} within {timeout}s")
+        except OSError as e:
+            raise LeaderUnavailable(f"No leader reachable for {command}: {e}")
+
+        if not line:
+            raise LeaderUnavailable(f"Leader closed the connection during {command}")
+        response = json.loads(line)
+        if response.get("ok"):
+            return response.get("result")
+        if response.get("timeout"):
+            raise TimeoutError(response.get("error"))
+        raise RuntimeError(response.get("error"))
+
+    def open_feed(self, feed: str, args: Dict[str, Any]) -> Iterator[Any]:
+        """
+        Start a registered feed in this (leader) process.
+        """
+        source = self._feeds.get(feed)
+        if source is None:
+            raise ValueError(f"Unknown feed: {feed}")
+        return source(**args)
+
+    def follow(self, feed: str, timeout: float = 30.0, **args) -> Iterator[Any]:
+        """
+        Stream the items of a leader feed over the command socket.
+
+        Keep-alive items (None) are passed through so the caller can check
+        its own state while the feed is idle.
+
+        Args:
+            feed: Registered feed name
+            timeout: Seconds without any line (item or keep-alive) after which
+                the leader is considered gone
+            **args: JSON-serializable feed arguments
+
+        Yields:
+            Any: Feed items in the order the leader produced them
+
+        Raises:
+            LeaderUnavailable: If no leader is reachable or the feed ends
+            RuntimeError: If the leader rejected the feed
+        """
+        request = json.dumps({"feed": feed, "args": args}, default=str).encode() + b"\n"
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(request)
+            with sock.makefile("rb") as reader:
+                status = None
+                while True:
+                    try:
+                        line = reader.readline()
+                    except socket.timeout:
+                        raise LeaderUnavailable(f"Leader feed {feed} silent for {timeout}s")
+                    if not line:
+                        raise LeaderUnavailable(f"Leader closed feed {feed}")
+                    item = json.loads(line)
+                    if status is None:
+                        status = item
+                        if not status.get("ok"):
+                            raise RuntimeError(status.get("error"))
+                        continue
+                    yield item
+        except OSError as e:
+            raise LeaderUnavailable(f"No leader reachable for feed {feed}: {e}")
+        finally:
+            sock.close()
+
+    # ----- Introspection -----
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Describe this process's role and the current leader.
+        """
+        info = self.read_leader_info() or {}
+        heartbeat = info.get("heartbeat")
+        return {
+            "identity": self.identity,
+            "is_leader": self.is_leader,
+            "backend": self.backend if self.enabled else "disabled",
+            "leader": info.get("identity"),
+            "leader_since": info.get("since"),
+            "leader_heartbeat_age": time.time() - heartbeat if heartbeat else None,
+            "terms": self.terms,
+            "last_failover_seconds": self.last_failover_seconds,
+        }
+
+def get_leader_election() -> LeaderElection:
+    """
+    Get the global leader election instance.
+    """
+    global _leader_election
+    if _leader_election is None:
+        _leader_election = LeaderElection(
+            heartbeat=float(os.getenv("LEADER_HEARTBEAT", 5)),
+            runtime_dir=os.getenv("LEADER_RUNTIME_DIR"),
+            enabled=os.getenv("LEADER_ELECTION", "1").lower() not in ("0", "false", "no"),
+        )
+    return _leader_election
@@ -7,19 +7,26 @@ and controlling drying devices with ESP8266/ESP32 hardware via MQTT and BLE.
 import os
 import logging
 import atexit
-import asyncio
 import threading
 from datetime import datetime
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash, session
+from typing import Optional
+from markupsafe import Markup
+from sqlalchemy import func
+from sqlalchemy.orm import raiseload
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, flash, session, stream_with_context
 # Use existing SQLAlchemy setup from the database module
 
-from database import engine, get_db
+from database import engine, get_db, get_read_db
 import models
-from mqtt_handler import MQTTHandler
-from device_manager import DeviceManager
-from ble_service import get_ble_service
-from cloudflare_manager import get_cloudflare_manager
-import domain_manager
+from mqtt_handler import get_mqtt_handler
+from device_manager import get_device_manager
+from device_state import get_device_state_store
+from telemetry_stream import get_telemetry_stream
+from fragment_cache import get_fragment_cache
+from leader_election import get_leader_election, LeaderUnavailable
+
+# Optional subsystems (BLE via bleak, domain management via Cloudflare) are
+# imported where they are used, so importing this module stays cheap.
 
 # Configure logging
 logging.basicConfig(
@@ -28,50 +35,82 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Initialize Flask app
-app = Flask(__name__)
-app.secret_key = os.environ.get("FLASK_SECRET_KEY") or "swissairdry-secret-key"
+# Maximale Wartezeit einer Flask-Route auf einen BLE-Befehl
+BLE_COMMAND_TIMEOUT = float(os.getenv("BLE_COMMAND_TIMEOUT", 5))
 
-# Configure database
-app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
-app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
-    "pool_recycle": 300,
-    "pool_pre_ping": True,
-}
+# BLE can be switched off entirely, e.g. in containers without an adapter
+BLE_ENABLED = os.getenv("BLE_ENABLED", "1").lower() not in ("0", "false", "no")
 
-# Create database tables
-models.Base.metadata.create_all(bind=engine)
+# Routes are collected at import time and registered on each app in create_app()
+_routes = []
 
-# Initialize MQTT handler
-mqtt_handler = MQTTHandler(
-    broker=os.getenv("MQTT_BROKER", "localhost"),
-    port=int(os.getenv("MQTT_PORT", 1883)),
-    username=os.getenv("MQTT_USERNAME", ""),
-    password=os.getenv("MQTT_PASSWORD", ""),
-)
+def route(rule: str, **options):
+    """Register a view function for every app built by create_app()."""
+    def decorator(view_func):
+        _routes.append((rule, view_func, options))
+        return view_func
+    return decorator
 
-# Initialize device manager
-device_manager = DeviceManager(mqtt_handler)
+# ----- Service lifecycle -----
+
+_services_lock = threading.Lock()
+_services_started = False
+
+def init_services():
+    """
+    Initialize the database schema, MQTT, the device manager and BLE.
+    
+    Runs once per process, on the first request instead of at import time, so
+    every gunicorn worker (and every test) only pays for it when it serves.
+    Every worker can publish over MQTT; ingest subscriptions and BLE are owned
+    by the elected leader process only.
+    """
+    global _services_started
+    if _services_started:
+        return
+    
+    with _services_lock:
+        if _services_started:
+            return
+        
+        # Create database tables and add columns missing in older databases
+        models.upgrade_schema(engine)
+        
+        connect_mqtt()
+        get_device_manager()
+        
+        election = get_leader_election()
+        election.register_command("ble_power", ble_power_command)
+        election.register_command("ble_fan", ble_fan_command)
+        election.register_command("ble_assign_task", ble_assign_task_command)
+        election.register_command("ble_connection_stats", ble_connection_stats_command)
+        for command, handler in DEVICE_STATE_COMMANDS.items():
+            election.register_command(command, handler)
+        election.on_elected(start_ownership)
+        election.on_demoted(stop_ownership)
+        election.start()
+        # Follows the leader's live events while this worker is not leader
+        get_device_manager().stream_relay.start()
+        
+        atexit.register(shutdown_all)
+        _services_started = True
+        logger.info("Services initialized")
 
 # Connect MQTT handler
 def connect_mqtt():
     """Start MQTT client on first request."""
     try:
-        mqtt_handler.connect_sync()
+        get_mqtt_handler().connect_sync()
         logger.info("MQTT client initialized")
     except Exception as e:
         logger.warning(f"MQTT connection failed: {e}")
         logger.info("Application will run without MQTT connectivity")
 
-# Register connect_mqtt to run on app startup
-with app.app_context():
-    connect_mqtt()
-
 # Initialize BLE service asynchronously 
 async def initialize_ble():
     """Starte den BLE-Service."""
     try:
-        await device_manager.initialize_ble()
+        await get_device_manager().initialize_ble()
         logger.info("BLE-Service initialisiert")
     except Exception as e:
         logger.warning(f"Fehler bei der BLE-Initialisierung: {e}")
@@ -79,25 +118,143 @@ async def initialize_ble():
 
 # Schedule BLE service initialization
 def start_ble_service():
-    """Starte den BLE-Service in einem asynchronen Context."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+    """Starte den BLE-Service auf seinem dauerhaften Event-Loop."""
     try:
-        loop.run_until_complete(initialize_ble())
+        get_device_manager().ble_service.submit(initialize_ble())
     except Exception as e:
         logger.error(f"Fehler beim Starten des BLE-Service: {e}")
+
+def run_ble_command(coro, timeout: float = BLE_COMMAND_TIMEOUT):
+    """
+    Führe eine BLE-Coroutine auf dem Event-Loop des BLE-Service aus.
+    
+    Die Coroutine nutzt dort die bestehenden bleak-Verbindungen; nach Ablauf
+    von ``timeout`` wird sie abgebrochen und ein TimeoutError ausgelöst.
+    """
+    return get_device_manager().ble_service.run_coroutine(coro, timeout=timeout)
+
+def start_ownership():
+    """Übernimm Ingest und BLE, nachdem dieser Prozess Leader geworden ist."""
+    get_device_manager().start_ingest()
+    
+    if BLE_ENABLED:
+        # Importing bleak and starting the loop happens off the request path
+        threading.Thread(target=start_ble_service, name="ble-startup", daemon=True).start()
+
+def stop_ownership():
+    """Gib Ingest und BLE ab, wenn dieser Prozess nicht mehr Leader ist."""
+    get_device_manager().stop_ingest()
+    
+    if not BLE_ENABLED:
+        return
+    
+    # BLE wird auf seinem eigenen Event-Loop heruntergefahren
+    try:
+        run_ble_command(shutdown_ble(), timeout=10)
+    except Exception as e:
+        logger.error(f"Fehler beim Herunterfahren des BLE-Service: {e}")
+    finally:
+        get_device_manager().ble_service.stop_loop_thread()
+
+# ----- BLE-Befehle (werden im Leader-Prozess ausgeführt) -----
+
+def ble_power_command(device_id: str, state: bool) -> bool:
+    """Schalte ein Gerät über BLE ein oder aus."""
+    db = next(get_db())
+    try:
+        device = db.query(models.Device).filter_by(device_id=device_id).first()
+        return bool(run_ble_command(get_device_manager().control_power_ble(device, state)))
+    finally:
+        db.close()
+
+def ble_fan_command(device_id: str, speed: int) -> bool:
+    """Setze die Lüftergeschwindigkeit eines Geräts über BLE."""
+    db = next(get_db())
+    try:
+        device = db.query(models.Device).filter_by(device_id=device_id).first()
+        return bool(run_ble_command(get_device_manager().control_fan_ble(device, speed)))
     finally:
-        loop.close()
+        db.close()
+
+def ble_assign_task_command(device_id: str, task_id: int, start_time: Optional[str] = None) -> bool:
+    """Weise einem Gerät eine Aufgabe zu und konfiguriere es über BLE."""
+    start = datetime.fromisoformat(start_time) if start_time else None
+    return bool(run_ble_command(
+        get_device_manager().assign_task_to_device(device_id, task_id, start),
+        timeout=2 * BLE_COMMAND_TIMEOUT
+    ))
+
+def ble_connection_stats_command() -> dict:
+    """Kennzahlen der BLE-Verbindungsverwaltung."""
+    if not BLE_ENABLED:
+        return {}
+    
+    async def collect():
+        # Auf dem BLE-Event-Loop lesen, damit sich die Zähler nicht während des Lesens ändern
+        ble_service = get_device_manager().ble_service
+        return {
+            **ble_service.connections.stats(),
+            "advertising_devices": len(ble_service.advertising_devices),
+            "adverts_accepted": ble_service.advert_dedup.accepted,
+            "adverts_duplicate": ble_service.advert_dedup.duplicates,
+            "readings": ble_service.reading_writer.stats(),
+            "commands": ble_service.commands.stats(),
+            "presence": ble_service.presence.stats(),
+        }
+    
+    return run_ble_command(collect())
+
+# ----- Device state (served from the leader's in-memory store) -----
+
+def _serializable(state: dict) -> dict:
+    """Convert datetimes in a state snapshot to ISO strings."""
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in state.items()}
+
+def device_states_command(device_type: Optional[str] = None, is_online: Optional[bool] = None) -> list:
+    """Current device states from the in-memory store."""
+    states = get_device_state_store().query(device_type=device_type, is_online=is_online)
+    return [_serializable(state) for state in states]
 
-# Start BLE service in a separate thread to not block the main thread
-ble_thread = threading.Thread(target=start_ble_service, daemon=True)
-ble_thread.start()
+def device_counts_command() -> dict:
+    """Device totals from the in-memory store."""
+    return get_device_state_store().counts()
+
+DEVICE_STATE_COMMANDS = {
+    "device_states": device_states_command,
+    "device_counts": device_counts_command,
+}
+
+def query_device_states(command: str, **args):
+    """
+    Answer a device state query from the in-memory store.
+    
+    The store is only live in the leader process; other workers forward the
+    query to the leader. Returns None if no live store is reachable, so the
+    caller can fall back to the database.
+    """
+    if get_device_state_store().live:
+        return DEVICE_STATE_COMMANDS[command](**args)
+    try:
+        return get_leader_election().call(command, timeout=2, **args)
+    except (TimeoutError, LeaderUnavailable) as e:
+        logger.debug(f"Device state query {command} unavailable: {e}")
+        return None
+
+def dispatch_ble_command(command: str, timeout: float = BLE_COMMAND_TIMEOUT, **args) -> bool:
+    """
+    Führe einen BLE-Befehl im Leader-Prozess aus.
+    
+    Im Leader läuft der Befehl direkt, andere Worker leiten ihn über den
+    lokalen Socket weiter. Die Wartezeit enthält einen Puffer für die
+    Weiterleitung, damit der Timeout des Leaders zuerst greift.
+    """
+    return get_leader_election().call(command, timeout=timeout + 2, **args)
 
 # Shutdown handlers
 def disconnect_mqtt():
     """Disconnect MQTT client on application shutdown."""
     try:
-        mqtt_handler.disconnect_sync()
+        get_mqtt_handler().disconnect_sync()
         logger.info("MQTT client disconnected")
     except Exception as e:
         logger.warning(f"Error disconnecting MQTT client: {e}")
@@ -105,79 +262,129 @@ def disconnect_mqtt():
 async def shutdown_ble():
     """Stoppe den BLE-Service."""
     try:
-        await device_manager.shutdown_ble()
+        await get_device_manager().shutdown_ble()
         logger.info("BLE-Service gestoppt")
     except Exception as e:
         logger.warning(f"Fehler beim Stoppen des BLE-Service: {e}")
 
 def shutdown_all():
     """Fahre alle Services herunter."""
+    get_device_manager().stream_relay.stop()
+    # Gibt als Leader auch Ingest und BLE ab (stop_ownership)
+    get_leader_election().stop()
     disconnect_mqtt()
+
+# ----- Application factory -----
+
+def create_app(start_services: Optional[bool] = None) -> Flask:
+    """
+    Create and configure the Flask application.
     
-    # Für BLE brauchen wir einen Event-Loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        loop.run_until_complete(shutdown_ble())
-    except Exception as e:
-        logger.error(f"Fehler beim Herunterfahren des BLE-Service: {e}")
-    finally:
-        loop.close()
+    Args:
+        start_services: Initialize MQTT/BLE/database on the first request.
+            Defaults to the SWISSAIRDRY_START_SERVICES environment variable
+            (enabled unless set to 0); tests pass False to get a bare app.
+    """
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("FLASK_SECRET_KEY") or "swissairdry-secret-key"
+    
+    # Configure database
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+        "pool_recycle": 300,
+        "pool_pre_ping": True,
+    }
+    
+    for rule, view_func, options in _routes:
+        app.add_url_rule(rule, view_func=view_func, **options)
+    
+    if start_services is None:
+        start_services = os.getenv("SWISSAIRDRY_START_SERVICES", "1").lower() not in ("0", "false", "no")
+    if start_services:
+        app.before_request(init_services)
+    
+    return app
+
+# Columns needed for the device table; pages never load full Device objects
+DEVICE_TABLE_COLUMNS = (
+    models.Device.device_id,
+    models.Device.name,
+    models.Device.type,
+    models.Device.firmware_version,
+    models.Device.is_online,
+)
+
+# Guards against lazily loading whole reading/log histories when Device
+# entities are loaded for listings
+DEVICE_LIST_GUARDS = (
+    raiseload(models.Device.readings),
+    raiseload(models.Device.logs),
+    raiseload(models.Device.assignments),
+)
 
-atexit.register(shutdown_all)
+def render_device_table(db):
+    """Render the device table fragment, served from cache while devices are unchanged."""
+    def render():
+        rows = db.query(*DEVICE_TABLE_COLUMNS).order_by(models.Device.name).all()
+        return render_template("_device_table.html", devices=rows)
+    
+    return Markup(get_fragment_cache().get_or_render("device_table", render))
 
 # Main dashboard route
-@app.route("/")
+@route("/")
 def root():
     """Render the main dashboard."""
-    db = next(get_db())
+    db = next(get_read_db())
     try:
-        devices = db.query(models.Device).all()
-        return render_template("index.html", devices=devices)
+        return render_template("index.html", device_table=render_device_table(db))
     finally:
         db.close()
 
 # Devices management page
-@app.route("/devices")
+@route("/devices")
 def devices_page():
     """Render the devices management page."""
-    db = next(get_db())
+    db = next(get_read_db())
     try:
-        devices = db.query(models.Device).all()
-        return render_template("devices.html", devices=devices)
+        return render_template("devices.html", device_table=render_device_table(db))
     finally:
         db.close()
 
 # System status page
-@app.route("/status")
+@route("/status")
 def status_page():
     """Render the system status page."""
-    db = next(get_db())
-    try:
-        devices = db.query(models.Device).all()
-        device_count = len(devices)
-        online_count = sum(1 for device in devices if device.is_online)
-        
-        return render_template(
-            "status.html", 
-            device_count=device_count,
-            online_count=online_count,
-            offline_count=device_count - online_count
-        )
-    finally:
-        db.close()
+    counts = query_device_states("device_counts")
+    if counts is not None:
+        device_count, online_count = counts["total"], counts["online"]
+    else:
+        db = next(get_read_db())
+        try:
+            device_count, online_count = db.query(
+                func.count(models.Device.id),
+                func.count(models.Device.id).filter(models.Device.is_online == True),
+            ).one()
+        finally:
+            db.close()
+    
+    return render_template(
+        "status.html", 
+        device_count=device_count,
+        online_count=online_count,
+        offline_count=device_count - online_count
+    )
 
 # Settings page
-@app.route("/settings")
+@route("/settings")
 def settings_page():
     """Render the settings page."""
     return render_template("settings.html")
 
 # BLE devices page
-@app.route("/ble-devices")
+@route("/ble-devices")
 def ble_devices_page():
     """Render the BLE devices page."""
-    db = next(get_db())
+    db = next(get_read_db())
     try:
         tasks = db.query(models.Task).filter_by(is_active=True).all()
         return render_template("ble_devices.html", tasks=tasks)
@@ -185,12 +392,17 @@ def ble_devices_page():
         db.close()
 
 # BLE-spezifische Routen
-@app.route("/api/ble/devices")
+@route("/api/ble/devices")
 def get_ble_devices_api():
     """Liste aller BLE-Geräte abrufen."""
-    db = next(get_db())
+    db = next(get_read_db())
     try:
-        devices = db.query(models.Device).filter(models.Device.ble_address.isnot(None)).all()
+        devices = (
+            db.query(models.Device)
+            .options(*DEVICE_LIST_GUARDS)
+            .filter(models.Device.ble_address.isnot(None))
+            .all()
+        )
         
         # Konvertiere Geräte in JSON-Objekte
         devices_json = []
@@ -215,7 +427,7 @@ def get_ble_devices_api():
     finally:
         db.close()
 
-@app.route("/api/ble/device/<device_id>/power", methods=["POST"])
+@route("/api/ble/device/<device_id>/power", methods=["POST"])
 def control_ble_power_api(device_id):
     """Steuere den Power-Status eines Geräts über BLE."""
     data = request.json
@@ -230,21 +442,13 @@ def control_ble_power_api(device_id):
         if not device:
             return jsonify({"success": False, "error": f"Gerät mit ID {device_id} nicht gefunden"}), 404
         
-        # Führe asynchrone Operation in eigenem Thread aus
-        loop = asyncio.new_event_loop()
-        result = False
-        
-        def execute_ble_control():
-            nonlocal result
-            asyncio.set_event_loop(loop)
-            try:
-                result = loop.run_until_complete(device_manager.control_power_ble(device, state))
-            finally:
-                loop.close()
-        
-        thread = threading.Thread(target=execute_ble_control)
-        thread.start()
-        thread.join(timeout=5)  # Warte maximal 5 Sekunden
+        # Der Leader-Prozess führt den Befehl über die bestehende Verbindung aus
+        try:
+            result = dispatch_ble_command("ble_power", device_id=device_id, state=state)
+        except TimeoutError:
+            return jsonify({"success": False, "error": "Zeitüberschreitung beim BLE-Befehl"}), 504
+        except LeaderUnavailable:
+            return jsonify({"success": False, "error": "BLE-Service nicht verfügbar"}), 503
         
         if result:
             return jsonify({"success": True, "message": f"Power-Befehl ({state}) erfolgreich gesendet"})
@@ -257,7 +461,7 @@ def control_ble_power_api(device_id):
     finally:
         db.close()
 
-@app.route("/api/ble/device/<device_id>/fan", methods=["POST"])
+@route("/api/ble/device/<device_id>/fan", methods=["POST"])
 def control_ble_fan_api(device_id):
     """Steuere die Lüftergeschwindigkeit eines Geräts über BLE."""
     data = request.json
@@ -274,21 +478,13 @@ def control_ble_fan_api(device_id):
         if not device:
             return jsonify({"success": False, "error": f"Gerät mit ID {device_id} nicht gefunden"}), 404
         
-        # Führe asynchrone Operation in eigenem Thread aus
-        loop = asyncio.new_event_loop()
-        result = False
-        
-        def execute_ble_control():
-            nonlocal result
-            asyncio.set_event_loop(loop)
-            try:
-                result = loop.run_until_complete(device_manager.control_fan_ble(device, speed))
-            finally:
-                loop.close()
-        
-        thread = threading.Thread(target=execute_ble_control)
-        thread.start()
-        thread.join(timeout=5)  # Warte maximal 5 Sekunden
+        # Der Leader-Prozess führt den Befehl über die bestehende Verbindung aus
+        try:
+            result = dispatch_ble_command("ble_fan", device_id=device_id, speed=speed)
+        except TimeoutError:
+            return jsonify({"success": False, "error": "Zeitüberschreitung beim BLE-Befehl"}), 504
+        except LeaderUnavailable:
+            return jsonify({"success": False, "error": "BLE-Service nicht verfügbar"}), 503
         
         if result:
             return jsonify({"success": True, "message": f"Fan-Speed-Befehl ({speed}%) erfolgreich gesendet"})
@@ -301,7 +497,7 @@ def control_ble_fan_api(device_id):
     finally:
         db.close()
         
-@app.route("/api/ble/device/<device_id>/assign_task", methods=["POST"])
+@route("/api/ble/device/<device_id>/assign_task", methods=["POST"])
 def assign_task_api(device_id):
     """Weise einem Gerät eine Aufgabe zu."""
     data = request.json
@@ -316,31 +512,79 @@ def assign_task_api(device_id):
         except ValueError:
             return jsonify({"success": False, "error": "Ungültiges Datumsformat für 'start_time'"}), 400
     
-    # Führe asynchrone Operation in eigenem Thread aus
-    loop = asyncio.new_event_loop()
-    result = False
-    
-    def execute_assign_task():
-        nonlocal result
-        asyncio.set_event_loop(loop)
-        try:
-            result = loop.run_until_complete(device_manager.assign_task_to_device(device_id, task_id, start_time))
-        finally:
-            loop.close()
-    
-    thread = threading.Thread(target=execute_assign_task)
-    thread.start()
-    thread.join(timeout=10)  # Warte maximal 10 Sekunden
+    # Führe die Zuweisung im Leader-Prozess aus
+    try:
+        result = dispatch_ble_command(
+            "ble_assign_task",
+            timeout=2 * BLE_COMMAND_TIMEOUT,
+            device_id=device_id,
+            task_id=task_id,
+            start_time=start_time.isoformat() if start_time else None
+        )
+    except TimeoutError:
+        return jsonify({"success": False, "error": "Zeitüberschreitung bei der Aufgabenzuweisung"}), 504
+    except LeaderUnavailable:
+        return jsonify({"success": False, "error": "BLE-Service nicht verfügbar"}), 503
     
     if result:
         return jsonify({"success": True, "message": f"Aufgabe {task_id} erfolgreich zugewiesen"})
     else:
         return jsonify({"success": False, "error": "Aufgabe konnte nicht zugewiesen werden"}), 500
 
+@route("/api/ble/connections")
+def ble_connections_api():
+    """Kennzahlen zu BLE-Verbindungen und Verbindungswechseln abrufen."""
+    try:
+        stats = dispatch_ble_command("ble_connection_stats")
+    except (TimeoutError, LeaderUnavailable) as e:
+        return jsonify({"success": False, "error": str(e)}), 503
+    return jsonify({"success": True, "connections": stats})
+
+# Current device states
+@route("/api/devices/state")
+def device_states_api():
+    """Current state (online flag, latest telemetry) of all devices."""
+    device_type = request.args.get("type")
+    online = request.args.get("online")
+    is_online = None if online is None else online.lower() in ("1", "true", "yes")
+    
+    states = query_device_states("device_states", device_type=device_type, is_online=is_online)
+    if states is None:
+        return jsonify({"success": False, "error": "Device state not available"}), 503
+    return jsonify({"success": True, "devices": states})
+
+# Leader status
+@route("/api/system/leader")
+def leader_status_api():
+    """Report which worker owns ingest and BLE, and the last failover time."""
+    return jsonify({"success": True, "leader": get_leader_election().status()})
+
+# Live telemetry stream
+@route("/api/stream")
+def telemetry_stream_api():
+    """Stream live device updates as Server-Sent Events."""
+    def split_param(name):
+        value = request.args.get(name)
+        return {item.strip() for item in value.split(",") if item.strip()} if value else None
+    
+    frames = get_telemetry_stream().subscribe(
+        devices=split_param("devices"),
+        topics=split_param("topics"),
+        last_event_id=request.headers.get("Last-Event-ID") or request.args.get("last_event_id"),
+        max_rate=request.args.get("max_rate", type=float),
+    )
+    return Response(
+        stream_with_context(frames),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # Domain Management Routes
-@app.route("/domains")
+@route("/domains")
 def domains_page():
     """Render the domain management page."""
+    import domain_manager
+    
     db = next(get_db())
     try:
         # Get domain status
@@ -366,9 +610,11 @@ def domains_page():
     finally:
         db.close()
 
-@app.route("/domains/connect")
+@route("/domains/connect")
 def domains_connect_cloudflare():
     """Connect to Cloudflare to manage domains."""
+    from cloudflare_manager import get_cloudflare_manager
+    
     cf_manager = get_cloudflare_manager()
     
     # Check if token is already validated
@@ -395,9 +641,11 @@ def domains_connect_cloudflare():
     
     return redirect(url_for("domains_page"))
 
-@app.route("/domains/import")
+@route("/domains/import")
 def domains_import():
     """Import domains from Cloudflare."""
+    import domain_manager
+    
     db = next(get_db())
     try:
         # Import domains from Cloudflare
@@ -420,7 +668,7 @@ def domains_import():
     finally:
         db.close()
 
-@app.route("/domains/view/<int:zone_id>")
+@route("/domains/view/<int:zone_id>")
 def domains_view(zone_id):
     """View detailed information about a domain zone."""
     db = next(get_db())
@@ -446,7 +694,7 @@ def domains_view(zone_id):
     finally:
         db.close()
 
-@app.route("/domains/dns/<int:zone_id>")
+@route("/domains/dns/<int:zone_id>")
 def domains_dns_records(zone_id):
     """View DNS records for a domain zone."""
     db = next(get_db())
@@ -470,9 +718,11 @@ def domains_dns_records(zone_id):
     finally:
         db.close()
 
-@app.route("/domains/configure-services/<int:zone_id>", methods=["GET", "POST"])
+@route("/domains/configure-services/<int:zone_id>", methods=["GET", "POST"])
 def domains_configure_services(zone_id):
     """Configure services for a domain zone."""
+    import domain_manager
+    
     db = next(get_db())
     try:
         zone = db.query(models.DomainZone).filter_by(id=zone_id).first()
@@ -525,7 +775,7 @@ def domains_configure_services(zone_id):
     finally:
         db.close()
 
-@app.route("/domains/delete/<int:zone_id>", methods=["POST"])
+@route("/domains/delete/<int:zone_id>", methods=["POST"])
 def domains_delete(zone_id):
     """Delete a domain zone from the database."""
     db = next(get_db())
@@ -549,7 +799,7 @@ def domains_delete(zone_id):
     finally:
         db.close()
 
-@app.route("/domains/delete-mapping", methods=["POST"])
+@route("/domains/delete-mapping", methods=["POST"])
 def domains_delete_mapping():
     """Delete a service mapping."""
     service_name = request.args.get("service")
@@ -588,7 +838,7 @@ def domains_delete_mapping():
     finally:
         db.close()
 
-@app.route("/domains/edit-mapping/<service>/<zone_name>", methods=["GET", "POST"])
+@route("/domains/edit-mapping/<service>/<zone_name>", methods=["GET", "POST"])
 def domains_edit_mapping(service, zone_name):
     """Edit a service mapping."""
     db = next(get_db())
@@ -640,6 +890,9 @@ def domains_edit_mapping(service, zone_name):
 
 # API routes can be added here or in a separate Blueprint
 
+# Module-level app for gunicorn (main:app); services start on the first request
+app = create_app()
+
 if __name__ == "__main__":
     # Run the Flask app
     app.run(
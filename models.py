@@ -1,12 +1,28 @@
 """
 Database models for the SwissAirDry platform.
 """
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, func, JSON
+from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, Table, func, JSON, inspect, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# Columns added to existing tables after their first release. create_all only
+# creates missing tables, so upgrade_schema adds these to older databases;
+# the value names a column to copy into existing rows, if any.
+ADDED_COLUMNS = {
+    "device_logs": {"count": None, "first_seen": "timestamp", "last_seen": "timestamp"},
+    "device_configs": {"log_sampling": None},
+}
+
+# Many-to-many link between devices and device groups
+device_group_members = Table(
+    "device_group_members",
+    Base.metadata,
+    Column("group_id", Integer, ForeignKey("device_groups.id", ondelete="CASCADE"), primary_key=True),
+    Column("device_id", Integer, ForeignKey("devices.id", ondelete="CASCADE"), primary_key=True, index=True),
+)
+
 class Device(Base):
     """
     Device model representing physical SwissAirDry hardware units.
@@ -33,6 +49,57 @@ class Device(Base):
     logs = relationship("DeviceLog", back_populates="device", cascade="all, delete")
     config = relationship("DeviceConfig", uselist=False, back_populates="device", cascade="all, delete")
     assignments = relationship("TaskAssignment", back_populates="device", cascade="all, delete")
+    groups = relationship("DeviceGroup", secondary=device_group_members, back_populates="devices")
+
+class DeviceGroup(Base):
+    """
+    DeviceGroup model for addressing a site, room or job with one MQTT publish.
+    """
+    __tablename__ = "device_groups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    group_id = Column(String(50), unique=True, index=True, nullable=False)  # Used in swissairdry/group/{group_id}/...
+    name = Column(String(100), nullable=False)
+    kind = Column(String(20), nullable=False, default="site")  # site, room, job
+    description = Column(Text)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+    
+    # Relationships
+    devices = relationship("Device", secondary=device_group_members, back_populates="groups")
+    commands = relationship("GroupCommand", back_populates="group", cascade="all, delete")
+
+class GroupCommand(Base):
+    """
+    GroupCommand model for a command published to a device group.
+    """
+    __tablename__ = "group_commands"
+
+    id = Column(Integer, primary_key=True, index=True)
+    command_id = Column(String(32), unique=True, index=True, nullable=False)
+    group_id = Column(Integer, ForeignKey("device_groups.id", ondelete="CASCADE"), index=True)
+    payload = Column(JSON)
+    sent_at = Column(DateTime, default=func.now(), nullable=False)
+    
+    # Relationships
+    group = relationship("DeviceGroup", back_populates="commands")
+    acks = relationship("GroupCommandAck", back_populates="command", cascade="all, delete")
+
+class GroupCommandAck(Base):
+    """
+    GroupCommandAck model tracking the acknowledgement of one group member.
+    """
+    __tablename__ = "group_command_acks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    command_id = Column(String(32), ForeignKey("group_commands.command_id", ondelete="CASCADE"), index=True, nullable=False)
+    device_id = Column(String(50), nullable=False)  # Device.device_id as used in the ack topic
+    status = Column(String(20), nullable=False, default="pending")  # pending, success, error
+    acked_at = Column(DateTime)
+    message = Column(Text)
+    
+    # Relationships
+    command = relationship("GroupCommand", back_populates="acks")
 
 class SensorReading(Base):
     """
@@ -63,6 +130,9 @@ class DeviceLog(Base):
     timestamp = Column(DateTime, default=func.now(), nullable=False)
     level = Column(String(10), nullable=False)  # info, warning, error
     message = Column(Text, nullable=False)
+    count = Column(Integer, default=1, nullable=False)  # Repeats within the dedupe window
+    first_seen = Column(DateTime)
+    last_seen = Column(DateTime)
     
     # Relationships
     device = relationship("Device", back_populates="logs")
@@ -83,6 +153,7 @@ class DeviceConfig(Base):
     ble_enabled = Column(Boolean, default=True)  # BLE-Unterstützung aktiviert
     ble_scan_interval = Column(Integer, default=30)  # BLE-Scan-Intervall in Sekunden
     ble_advertise = Column(Boolean, default=True)  # BLE-Werbung (Advertising) aktiviert
+    log_sampling = Column(JSON)  # Fraction of log lines kept per level, e.g. {"debug": 0.1}
     
     # Relationships
     device = relationship("Device", back_populates="config")
@@ -202,3 +273,39 @@ class DomainServiceMapping(Base):
     # Relationships
     zone = relationship("DomainZone", back_populates="service_mappings")
     dns_record = relationship("DNSRecord", foreign_keys=[dns_record_id])
+
+def upgrade_schema(bind) -> None:
+    """
+    Create missing tables and add the columns in ADDED_COLUMNS to existing ones.
+
+    Safe to run from several processes at startup: on PostgreSQL the columns
+    are added with IF NOT EXISTS, elsewhere (SQLite, single process) after
+    checking the table.
+
+    Args:
+        bind: Engine of the application database
+    """
+    Base.metadata.create_all(bind=bind)
+    inspector = inspect(bind)
+    preparer = bind.dialect.identifier_preparer
+    if_not_exists = "IF NOT EXISTS " if bind.dialect.name == "postgresql" else ""
+
+    with bind.begin() as conn:
+        for table_name, columns in ADDED_COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table_name)}
+            table = Base.metadata.tables[table_name]
+            for name, backfill in columns.items():
+                if name in existing:
+                    continue
+                column = table.c[name]
+                ddl = f"{preparer.quote(name)} {column.type.compile(dialect=bind.dialect)}"
+                if column.default is not None and column.default.is_scalar:
+                    ddl += f" DEFAULT {column.default.arg!r}"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                conn.execute(text(f"ALTER TABLE {preparer.quote(table_name)} ADD COLUMN {if_not_exists}{ddl}"))
+                if backfill:
+                    conn.execute(text(
+                        f"UPDATE {preparer.quote(table_name)} SET {preparer.quote(name)} = {preparer.quote(backfill)} "
+                        f"WHERE {preparer.quote(name)} IS NULL"
+                    ))
@@ -10,15 +10,16 @@ import logging
 import threading
 from typing import Optional, Dict, Any
 import paho.mqtt.client as mqtt
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, func
 from sqlalchemy.orm import sessionmaker
 import sys
 import os
 
 # Add the parent directory to the path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from models import Device, SensorReading, DeviceLog
-from database import Base
+from models import Device, SensorReading, DeviceLog, upgrade_schema
+from discovery import DiscoveryCoalescer
+from device_logs import DeviceLogIngestor
 
 # Configure logging
 logging.basicConfig(
@@ -40,8 +41,8 @@ engine = create_engine(
     pool_recycle=300,
 )
 
-# Create database schema if it doesn't exist
-Base.metadata.create_all(engine)
+# Create the database schema and add columns missing in older databases
+upgrade_schema(engine)
 
 # Create a session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -70,7 +71,10 @@ class MQTTBridge:
             "swissairdry/+/status",     # Device status
             "swissairdry/+/logs",       # Device logs
             "swissairdry/discovery",    # Device discovery
+            "swissairdry/+/discovery",  # Device discovery (retained, per device)
         ]
+        self.discovery = DiscoveryCoalescer(SessionLocal)
+        self.logs = DeviceLogIngestor(SessionLocal)
         
     def connect(self) -> None:
         """
@@ -89,6 +93,10 @@ class MQTTBridge:
             if self.username and self.password:
                 self.client.username_pw_set(self.username, self.password)
             
+            # Store discoveries in batches; retained discoveries arrive all at once on connect
+            self.discovery.start()
+            self.logs.start()
+            
             # Connect to broker
             self.client.connect_async(self.broker, self.port)
             
@@ -112,6 +120,8 @@ class MQTTBridge:
                     self.client.disconnect()
                 self.connected = False
                 logger.info("Disconnected from MQTT broker")
+                self.discovery.stop()
+                self.logs.stop()
             except Exception as e:
                 logger.error(f"Error disconnecting from MQTT broker: {e}")
                 self.connected = False
@@ -278,33 +288,25 @@ class MQTTBridge:
                     "message": payload_str
                 }
                 
-            # Create database session
-            db = SessionLocal()
-            try:
-                # Find device
-                device = db.query(Device).filter(Device.device_id == device_id).first()
-                if not device:
-                    logger.warning(f"Device not found: {device_id}")
-                    return
-                    
-                # Create log entry
-                log = DeviceLog(
-                    device_id=device.id,
-                    level=data.get("level", "info"),
-                    message=data.get("message", ""),
-                )
+            if not isinstance(data, dict):
+                data = {
+                    "level": "info",
+                    "message": payload_str
+                }
                 
-                db.add(log)
-                db.commit()
-                logger.debug(f"Stored log for device {device_id}")
-            finally:
-                db.close()
+            # Repeats are counted and lines are rate limited and sampled;
+            # accepted lines are written in batches
+            result = self.logs.submit(device_id, str(data.get("level", "info")), str(data.get("message", "")))
+            logger.debug(f"Log for device {device_id}: {result}")
         except Exception as e:
             logger.error(f"Error processing log: {e}")
             
     def _process_discovery(self, topic, payload_str):
         """
         Process device discovery and register new devices.
+        
+        Unchanged discoveries are skipped; new and changed devices are
+        upserted in batches by the discovery coalescer.
         """
         try:
             # Parse payload
@@ -313,55 +315,17 @@ class MQTTBridge:
             except json.JSONDecodeError:
                 logger.warning(f"Invalid JSON in discovery: {payload_str}")
                 return
-                
-            # Check required fields
-            device_id = data.get("device_id")
-            if not device_id:
-                logger.warning("Missing device_id in discovery payload")
-                return
-                
-            device_type = data.get("type")
-            if not device_type:
-                logger.warning("Missing type in discovery payload")
+            
+            if not isinstance(data, dict):
+                logger.warning(f"Invalid discovery payload: {payload_str}")
                 return
                 
-            name = data.get("name", f"SwissAirDry {device_type}-{device_id}")
-                
-            # Create database session
-            db = SessionLocal()
-            try:
-                # Check if device exists
-                device = db.query(Device).filter(Device.device_id == device_id).first()
+            # Devices publishing on their own topic may omit the device_id
+            parts = topic.split("/")
+            if len(parts) == 3 and not data.get("device_id"):
+                data["device_id"] = parts[1]
                 
-                if device:
-                    # Update existing device
-                    device.is_online = True
-                    device.last_seen = func.now()
-                    device.firmware_version = data.get("firmware_version", device.firmware_version)
-                    device.hardware_version = data.get("hardware_version", device.hardware_version)
-                    device.ip_address = data.get("ip_address", device.ip_address)
-                    device.mac_address = data.get("mac_address", device.mac_address)
-                    
-                    logger.info(f"Updated existing device: {device_id}")
-                else:
-                    # Create new device
-                    device = Device(
-                        device_id=device_id,
-                        name=name,
-                        type=device_type,
-                        firmware_version=data.get("firmware_version"),
-                        hardware_version=data.get("hardware_version"),
-                        ip_address=data.get("ip_address"),
-                        mac_address=data.get("mac_address"),
-                        is_online=True,
-                    )
-                    
-                    db.add(device)
-                    logger.info(f"Registered new device: {device_id}")
-                    
-                db.commit()
-            finally:
-                db.close()
+            self.discovery.submit(data)
         except Exception as e:
             logger.error(f"Error processing discovery: {e}")
 
@@ -5,10 +5,11 @@ This module provides MQTT communication functionality for device connectivity.
 """
 import os
 import json
+import time
 import logging
 import asyncio
 import threading
-from typing import Optional, Dict, Any, List, Callable
+from typing import Optional, Dict, Any, List, Callable, Tuple
 
 # For Flask version (synchronous)
 import paho.mqtt.client as paho_mqtt
@@ -93,6 +94,7 @@ class MQTTHandler:
         Subscribe to an MQTT topic (synchronous version for Flask).
         """
         # Always track the topic for future subscription or reconnection
+        already_subscribed = topic in self.subscribed_topics
         self.subscribed_topics.add(topic)
         
         # If client isn't connected, we'll subscribe when it connects
@@ -102,7 +104,7 @@ class MQTTHandler:
         
         # Don't attempt to resubscribe if we're already subscribed
         # but keep it in the set for reconnection purposes
-        if topic in self.subscribed_topics:
+        if already_subscribed:
             logger.debug(f"Already subscribed to {topic}")
             return
         
@@ -112,6 +114,21 @@ class MQTTHandler:
         except Exception as e:
             logger.warning(f"Error subscribing to topic {topic}: {e}")
 
+    def unsubscribe_sync(self, topic: str) -> None:
+        """
+        Unsubscribe from an MQTT topic (synchronous version for Flask).
+        """
+        self.subscribed_topics.discard(topic)
+        
+        if not self.paho_client or not self.connected:
+            return
+        
+        try:
+            self.paho_client.unsubscribe(topic)
+            logger.info(f"Unsubscribed from topic: {topic}")
+        except Exception as e:
+            logger.warning(f"Error unsubscribing from topic {topic}: {e}")
+
     def publish_sync(self, topic: str, payload: Any, retain: bool = False) -> None:
         """
         Publish a message to an MQTT topic (synchronous version for Flask).
@@ -130,6 +147,56 @@ class MQTTHandler:
         except Exception as e:
             logger.warning(f"Error publishing to topic {topic}: {e}")
 
+    def publish_many_sync(
+        self,
+        messages: List[Tuple[str, Any]],
+        retain: bool = False,
+        timeout: float = 10.0
+    ) -> List[bool]:
+        """
+        Publish a batch of messages in one pipelined burst (synchronous version for Flask).
+        
+        All messages are handed to the network loop first and only then awaited,
+        so the broker round-trips overlap instead of running one after another.
+        
+        Args:
+            messages: List of (topic, payload) tuples
+            retain: Retain flag applied to every message
+            timeout: Overall time in seconds to wait for the broker acknowledgements
+            
+        Returns:
+            List[bool]: Per-message delivery result, in input order
+        """
+        if not self.paho_client or not self.connected:
+            logger.warning(f"Cannot publish {len(messages)} messages: MQTT client not connected")
+            return [False] * len(messages)
+        
+        infos = []
+        for topic, payload in messages:
+            try:
+                if isinstance(payload, dict):
+                    payload = json.dumps(payload)
+                infos.append(self.paho_client.publish(topic, payload, qos=1, retain=retain))
+            except Exception as e:
+                logger.warning(f"Error publishing to topic {topic}: {e}")
+                infos.append(None)
+        
+        deadline = time.monotonic() + timeout
+        results = []
+        for info in infos:
+            if info is None or info.rc != paho_mqtt.MQTT_ERR_SUCCESS:
+                results.append(False)
+                continue
+            try:
+                info.wait_for_publish(max(0.0, deadline - time.monotonic()))
+                results.append(info.is_published())
+            except (RuntimeError, ValueError) as e:
+                logger.debug(f"Publish not confirmed: {e}")
+                results.append(False)
+        
+        logger.debug(f"Published batch of {len(messages)} messages, {sum(results)} confirmed")
+        return results
+
     # Paho MQTT Callback methods
     def _paho_on_connect(self, client, userdata, flags, rc):
         """
@@ -141,7 +208,7 @@ class MQTTHandler:
             
             # Re-subscribe to topics
             for topic in self.subscribed_topics:
-                self.subscribe_sync(topic)
+                client.subscribe(topic, qos=1)
         else:
             logger.error(f"Failed to connect to MQTT broker with code: {rc}")
 
@@ -9,11 +9,14 @@ from typing import Dict, Any, Optional
 from datetime import datetime
 
 import models
-from mqtt_handler import MQTTHandler
+from mqtt_handler import MQTTHandler, get_mqtt_handler
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Global OTA manager instance
+_ota_manager = None
+
 class OTAManager:
     """
     Manages OTA updates for SwissAirDry devices.
@@ -133,3 +136,12 @@ class OTAManager:
                 logger.info(f"Device {device_id} OTA update progress: {progress}%")
         except Exception as e:
             logger.error(f"Error handling OTA progress: {e}")
+
+def get_ota_manager() -> OTAManager:
+    """
+    Get the global OTA manager instance (created on first use).
+    """
+    global _ota_manager
+    if _ota_manager is None:
+        _ota_manager = OTAManager(get_mqtt_handler())
+    return _ota_manager
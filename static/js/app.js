@@ -8,9 +8,23 @@
 const app = {
     devices: [],
     selectedDevice: null,
+    readings: [],
     refreshInterval: null,
+    eventSource: null,
+    renderPending: false,
+    deviceReloadTimer: null,
+    unknownDevices: new Map(),
 };
 
+// Polling interval used only while the live stream is unavailable
+const POLL_INTERVAL_MS = 30000;
+
+// Delay that coalesces device list reloads triggered by unknown devices
+const DEVICE_RELOAD_DELAY_MS = 1000;
+
+// Devices still unknown after a reload trigger another one only after this time
+const UNKNOWN_DEVICE_RETRY_MS = 30000;
+
 // DOM elements
 const elements = {
     deviceList: document.getElementById('device-list'),
@@ -36,11 +50,8 @@ function initializeApp() {
     loadDevices();
     loadSystemStatus();
     
-    // Set up auto-refresh (every 30 seconds)
-    app.refreshInterval = setInterval(() => {
-        loadDevices();
-        loadSystemStatus();
-    }, 30000);
+    // Live updates via Server-Sent Events, polling only as fallback
+    startLiveUpdates();
 
     // Check if we're on the device detail page
     const urlParams = new URLSearchParams(window.location.search);
@@ -50,6 +61,156 @@ function initializeApp() {
     }
 }
 
+/**
+ * Subscribe to the live telemetry stream
+ */
+function startLiveUpdates() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    
+    const source = new EventSource('/api/stream?topics=telemetry,status,presence,task');
+    app.eventSource = source;
+    
+    source.addEventListener('open', () => {
+        stopPolling();
+    });
+    
+    source.addEventListener('telemetry', (event) => handleLiveUpdate('telemetry', event));
+    source.addEventListener('status', (event) => handleLiveUpdate('status', event));
+    source.addEventListener('presence', (event) => handleLiveUpdate('presence', event));
+    source.addEventListener('task', (event) => handleLiveUpdate('task', event));
+    
+    source.addEventListener('error', () => {
+        // EventSource reconnects on its own (resuming via Last-Event-ID);
+        // keep the data fresh by polling until the stream is back
+        startPolling();
+    });
+}
+
+/**
+ * Start fallback polling (no-op if already running)
+ */
+function startPolling() {
+    if (app.refreshInterval) return;
+    
+    app.refreshInterval = setInterval(() => {
+        loadDevices();
+        loadSystemStatus();
+    }, POLL_INTERVAL_MS);
+}
+
+/**
+ * Stop fallback polling
+ */
+function stopPolling() {
+    if (!app.refreshInterval) return;
+    
+    clearInterval(app.refreshInterval);
+    app.refreshInterval = null;
+}
+
+/**
+ * Apply a live update from the telemetry stream
+ */
+function handleLiveUpdate(topic, event) {
+    let update;
+    try {
+        update = JSON.parse(event.data);
+    } catch (error) {
+        console.error('Invalid live update:', error);
+        return;
+    }
+    
+    const device = app.devices.find(d => d.device_id === update.device_id);
+    if (!device) {
+        // Unknown device, e.g. newly discovered
+        handleUnknownDevice(update.device_id);
+        return;
+    }
+    
+    // Online/offline changes from the liveness tracker arrive as 'presence'
+    if ((topic === 'status' || topic === 'presence') && 'online' in update.data) {
+        device.is_online = Boolean(update.data.online);
+    }
+    
+    if (topic === 'task') {
+        // Finished assignments drop out of the list view
+        const active = ['scheduled', 'running'].includes(update.data.status);
+        device.task = active ? update.data : null;
+    }
+    
+    if (topic === 'telemetry') {
+        device.is_online = true;
+        device.last_seen = new Date(update.timestamp * 1000).toISOString();
+        
+        if (app.selectedDevice && app.selectedDevice.device_id === update.device_id) {
+            app.readings.unshift({
+                timestamp: device.last_seen,
+                temperature: update.data.temperature ?? null,
+                humidity: update.data.humidity ?? null,
+                pressure: update.data.pressure ?? null,
+                fan_speed: update.data.fan_speed ?? null,
+                power_consumption: update.data.power_consumption ?? update.data.power ?? null,
+            });
+            app.readings = app.readings.slice(0, 20);
+        }
+    }
+    
+    scheduleRender();
+}
+
+/**
+ * Reload the device list for an unknown device, at most once per retry period
+ */
+function handleUnknownDevice(deviceId) {
+    const lastTried = app.unknownDevices.get(deviceId);
+    if (lastTried !== undefined && Date.now() - lastTried < UNKNOWN_DEVICE_RETRY_MS) return;
+    
+    app.unknownDevices.set(deviceId, Date.now());
+    scheduleDeviceReload();
+}
+
+/**
+ * Reload the device list once for all unknown devices seen within the delay
+ */
+function scheduleDeviceReload() {
+    if (app.deviceReloadTimer) return;
+    
+    app.deviceReloadTimer = setTimeout(async () => {
+        try {
+            await loadDevices();
+        } finally {
+            app.deviceReloadTimer = null;
+        }
+    }, DEVICE_RELOAD_DELAY_MS);
+}
+
+/**
+ * Re-render live views at most once per animation frame
+ */
+function scheduleRender() {
+    if (app.renderPending) return;
+    app.renderPending = true;
+    
+    requestAnimationFrame(() => {
+        app.renderPending = false;
+        renderDeviceList(app.devices);
+        
+        const online = app.devices.filter(d => d.is_online).length;
+        renderSystemStatus({
+            total_devices: app.devices.length,
+            online_devices: online,
+            offline_devices: app.devices.length - online,
+        });
+        
+        if (app.selectedDevice) {
+            renderDeviceReadings(app.readings);
+        }
+    });
+}
+
 /**
  * Set up event listeners
  */
@@ -98,6 +259,12 @@ async function loadDevices() {
         }
         
         const devices = await response.json();
+        // Task progress only arrives live; keep it across reloads
+        const tasks = new Map(app.devices.map(d => [d.device_id, d.task]));
+        devices.forEach(d => {
+            d.task = tasks.get(d.device_id) || null;
+            app.unknownDevices.delete(d.device_id);
+        });
         app.devices = devices;
         
         // Update the UI
@@ -163,6 +330,7 @@ async function loadDeviceReadings(deviceId) {
         }
         
         const readings = await response.json();
+        app.readings = readings;
         
         // Update the UI
         renderDeviceReadings(readings);
@@ -304,6 +472,7 @@ function renderDeviceList(devices) {
                 <p><strong>ID:</strong> ${device.device_id}</p>
                 <p><strong>Type:</strong> ${device.type}</p>
                 <p><strong>Firmware:</strong> ${device.firmware_version || 'Unknown'}</p>
+                ${device.task ? `<p><strong>Task:</strong> ${device.task.status} (${device.task.progress}%)</p>` : ''}
             </div>
             <div class="device-controls">
                 <button class="power-toggle" data-device-id="${device.device_id}" data-state="${device.is_online}">
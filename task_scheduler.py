@@ -0,0 +1,573 @@
+"""
+Task assignment scheduling for the SwissAirDry platform.
+
+Task assignments carry a start and end time. The scheduler keeps one timer
+per pending start or stop in a timing wheel, sends the due start_task and
+stop_task commands in one batch per tick and writes the resulting status
+transitions of ``task_assignments`` in batches. On start it recovers its
+state from the database, so assignments survive restarts and failovers.
+
+Progress of running assignments is derived from the elapsed time and from
+incoming humidity readings approaching the task's target humidity; an
+assignment whose target is reached is stopped early.
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, update
+
+import models
+from database import get_db
+from timing_wheel import TimingWheel
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds between batched status writes
+TASK_STATUS_FLUSH_INTERVAL = float(os.getenv("TASK_STATUS_FLUSH_INTERVAL", 2))
+# Seconds between reloads of assignments created outside the scheduler
+TASK_SCHEDULER_RELOAD_INTERVAL = float(os.getenv("TASK_SCHEDULER_RELOAD_INTERVAL", 300))
+# Seconds until a start command that could not be sent is retried
+TASK_DISPATCH_RETRY = float(os.getenv("TASK_DISPATCH_RETRY", 10))
+# Weight of a new humidity reading in the smoothed humidity (0..1)
+TASK_HUMIDITY_SMOOTHING = float(os.getenv("TASK_HUMIDITY_SMOOTHING", 0.3))
+# Consecutive readings at or below the target humidity that complete a task
+TASK_TARGET_CONFIRMATIONS = int(os.getenv("TASK_TARGET_CONFIRMATIONS", 3))
+
+# Assignment states the scheduler still acts on
+ACTIVE_STATES = ("scheduled", "running")
+
+def task_command(action: str, assignment_id: int, task: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the start_task or stop_task command of an assignment.
+
+    Args:
+        action: start_task or stop_task
+        assignment_id: Id of the TaskAssignment
+        task: Task fields (id, name, duration_minutes, fan_speed, targets)
+
+    Returns:
+        Dict[str, Any]: Command payload for the device
+    """
+    command = {
+        "action": action,
+        "task_id": task["id"],
+        "assignment_id": assignment_id,
+        "timestamp": datetime.now().isoformat(),
+    }
+    if action == "start_task":
+        command.update(name=task["name"], duration=task["duration_minutes"], fan_speed=task["fan_speed"])
+        if task.get("target_temperature"):
+            command["target_temperature"] = task["target_temperature"]
+        if task.get("target_humidity"):
+            command["target_humidity"] = task["target_humidity"]
+    return command
+
+def task_fields(task: Any) -> Dict[str, Any]:
+    """
+    Return the Task fields the scheduler keeps in memory.
+    """
+    return {
+        "id": task.id,
+        "name": task.name,
+        "duration_minutes": task.duration_minutes,
+        "fan_speed": task.fan_speed,
+        "target_temperature": task.target_temperature,
+        "target_humidity": task.target_humidity,
+    }
+
+class ScheduledAssignment:
+    """
+    In-memory state of one scheduled or running assignment.
+    """
+    __slots__ = (
+        "id", "device_id", "task", "start_time", "end_time", "status", "progress",
+        "baseline_humidity", "humidity", "confirmations",
+    )
+
+    def __init__(
+        self,
+        assignment_id: int,
+        device_id: str,
+        task: Dict[str, Any],
+        start_time: datetime,
+        end_time: datetime,
+        status: str = "scheduled",
+        progress: int = 0
+    ):
+        self.id = assignment_id
+        self.device_id = device_id
+        self.task = task
+        self.start_time = start_time
+        self.end_time = end_time
+        self.status = status
+        self.progress = progress or 0
+        self.baseline_humidity: Optional[float] = None  # First reading while running
+        self.humidity: Optional[float] = None  # Smoothed humidity
+        self.confirmations = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "assignment_id": self.id,
+            "task_id": self.task["id"],
+            "status": self.status,
+            "progress": self.progress,
+            "humidity": self.humidity,
+            "target_humidity": self.task.get("target_humidity"),
+        }
+
+class TaskScheduler:
+    """
+    Starts and stops task assignments at their scheduled times.
+
+    Timers live in a timing wheel keyed by ("start", id) or ("stop", id), so
+    each tick only touches the assignments that are due, no matter how many
+    are pending. ``dispatch`` receives the due commands of a tick as one list
+    of (device_id, command) tuples and returns the per-command delivery
+    result. Status and progress changes are buffered and written with one
+    executemany UPDATE per flush interval. Listeners are called as
+    ``listener(device_id, snapshot)`` on every status or progress change.
+    """
+
+    def __init__(
+        self,
+        dispatch: Callable[[List[Tuple[str, Dict[str, Any]]]], List[bool]],
+        flush_interval: float = TASK_STATUS_FLUSH_INTERVAL,
+        tick: float = 1.0,
+        clock: Callable[[], float] = time.monotonic,
+        now: Callable[[], datetime] = datetime.now
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            dispatch: Sends a batch of (device_id, command) tuples
+            flush_interval: Seconds between batched status writes
+            tick: Resolution of the timing wheel in seconds
+            clock: Monotonic time source of the timing wheel in seconds
+            now: Local wall-clock time (naive), compared with the
+                assignment start and end times
+        """
+        self.dispatch = dispatch
+        self.flush_interval = flush_interval
+        self._wheel = TimingWheel(tick=tick, clock=clock)
+        self._now = now
+        self._assignments: Dict[int, ScheduledAssignment] = {}
+        self._running: Dict[str, Set[int]] = {}  # device_id -> running assignment ids
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+        self._pending: Dict[int, Dict[str, Any]] = {}
+        self._finished: Optional[Set[int]] = None  # Ids finished while a load runs
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.metrics = {
+            "started": 0,
+            "completed": 0,
+            "failed": 0,
+            "loaded": 0,
+            "dispatch_errors": 0,
+            "readings": 0,
+            "targets_reached": 0,
+            "rows_written": 0,
+            "flushes": 0,
+            "write_errors": 0,
+        }
+
+    def add_listener(self, listener: Callable[[str, Dict[str, Any]], None]) -> None:
+        """
+        Register a callback for status and progress changes.
+        """
+        self._listeners.append(listener)
+
+    # ----- Lifecycle -----
+
+    def start(self) -> None:
+        """
+        Recover the active assignments from the database and start the tick thread.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        try:
+            self.load()
+        except Exception as e:
+            logger.warning(f"Could not load task assignments: {e}")
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="task-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the tick thread, write the pending changes and drop the timers.
+
+        The next start recovers the state from the database again.
+        """
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        with self._lock:
+            for assignment_id in self._assignments:
+                self._wheel.cancel(("start", assignment_id))
+                self._wheel.cancel(("stop", assignment_id))
+            self._assignments.clear()
+            self._running.clear()
+
+    def _run(self) -> None:
+        next_flush = time.monotonic() + self.flush_interval
+        next_reload = time.monotonic() + TASK_SCHEDULER_RELOAD_INTERVAL
+        while not self._stopped.wait(self._wheel.tick):
+            try:
+                self.tick()
+                now = time.monotonic()
+                if now >= next_flush:
+                    self.flush()
+                    next_flush = now + self.flush_interval
+                if now >= next_reload:
+                    self.load()
+                    next_reload = now + TASK_SCHEDULER_RELOAD_INTERVAL
+            except Exception as e:
+                logger.error(f"Error in task scheduler tick: {e}")
+
+    def load(self) -> int:
+        """
+        Add the active assignments of the database that the scheduler does not know.
+
+        Scheduled assignments are armed for their start, or started at once
+        if their start passed while no scheduler ran. Running assignments are
+        armed for their end. Assignments whose end already passed are
+        completed (running) or failed (never started).
+
+        Returns:
+            int: Number of assignments added
+        """
+        db = next(get_db())
+        # Transitions not yet written, or finished while the query runs, may
+        # still be active in the rows; they must not be armed again
+        with self._lock:
+            skip = set(self._pending)
+            self._finished = set()
+        try:
+            rows = (
+                db.query(models.TaskAssignment, models.Device.device_id, models.Task)
+                .join(models.Device, models.TaskAssignment.device_id == models.Device.id)
+                .join(models.Task, models.TaskAssignment.task_id == models.Task.id)
+                .filter(models.TaskAssignment.status.in_(ACTIVE_STATES))
+                .all()
+            )
+            entries = []
+            for assignment, device_id, task in rows:
+                start_time = assignment.start_time or assignment.created_at
+                end_time = assignment.end_time or start_time + timedelta(minutes=task.duration_minutes)
+                entries.append(ScheduledAssignment(
+                    assignment.id,
+                    device_id,
+                    task_fields(task),
+                    start_time,
+                    end_time,
+                    assignment.status,
+                    assignment.progress,
+                ))
+        except Exception:
+            with self._lock:
+                self._finished = None
+            raise
+        finally:
+            db.close()
+
+        added: List[ScheduledAssignment] = []
+        with self._lock:
+            skip |= self._finished
+            self._finished = None
+            for entry in entries:
+                if entry.id in self._assignments or entry.id in self._pending or entry.id in skip:
+                    continue
+                self._register(entry)
+                added.append(entry)
+            self.metrics["loaded"] += len(added)
+        for entry in added:
+            self._schedule(entry)
+        if added:
+            logger.info(f"Loaded {len(added)} task assignments")
+        return len(added)
+
+    # ----- Scheduling -----
+
+    def add(
+        self,
+        assignment_id: int,
+        device_id: str,
+        task: Dict[str, Any],
+        start_time: datetime,
+        end_time: datetime,
+        started: bool = False
+    ) -> None:
+        """
+        Schedule a new assignment.
+
+        Args:
+            assignment_id: Id of the TaskAssignment
+            device_id: Target device (Device.device_id)
+            task: Task fields as returned by task_fields
+            start_time: When the task starts
+            end_time: When the task ends
+            started: The start command was already sent; only the stop is scheduled
+        """
+        entry = ScheduledAssignment(assignment_id, device_id, task, start_time, end_time)
+        if started:
+            self._transition(entry, "running")
+        self._arm(entry)
+
+    def _arm(self, entry: ScheduledAssignment) -> None:
+        with self._lock:
+            self._register(entry)
+        self._schedule(entry)
+
+    def _register(self, entry: ScheduledAssignment) -> None:
+        # Caller holds the lock
+        self._assignments[entry.id] = entry
+        if entry.status == "running":
+            self._running.setdefault(entry.device_id, set()).add(entry.id)
+
+    def _schedule(self, entry: ScheduledAssignment) -> None:
+        now = self._now()
+        if entry.status == "running":
+            self._wheel.schedule(("stop", entry.id), (entry.end_time - now).total_seconds())
+        elif entry.end_time and entry.end_time <= now:
+            # The whole time slot passed without a start
+            self._finish(entry, "failed")
+        else:
+            self._wheel.schedule(("start", entry.id), (entry.start_time - now).total_seconds())
+
+    def _transition(self, entry: ScheduledAssignment, status: str) -> None:
+        with self._lock:
+            entry.status = status
+            if status == "completed":
+                entry.progress = 100
+            running = self._running.setdefault(entry.device_id, set())
+            if status == "running":
+                running.add(entry.id)
+            else:
+                running.discard(entry.id)
+                if not running:
+                    del self._running[entry.device_id]
+            self._pending[entry.id] = {"b_id": entry.id, "b_status": status, "b_progress": entry.progress}
+            snapshot = entry.snapshot()
+        self._notify(entry.device_id, snapshot)
+
+    def _notify(self, device_id: str, snapshot: Dict[str, Any]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(device_id, snapshot)
+            except Exception as e:
+                logger.error(f"Error in task listener: {e}")
+
+    def _finish(self, entry: ScheduledAssignment, status: str) -> None:
+        self._transition(entry, status)
+        with self._lock:
+            self._assignments.pop(entry.id, None)
+            if self._finished is not None:
+                self._finished.add(entry.id)
+            self.metrics[status] += 1
+        self._wheel.cancel(("start", entry.id))
+        self._wheel.cancel(("stop", entry.id))
+        logger.info(f"Task assignment {entry.id} on {entry.device_id} {status}")
+
+    def tick(self) -> int:
+        """
+        Send the start and stop commands that are due and apply their transitions.
+
+        Returns:
+            int: Number of commands sent
+        """
+        expired = self._wheel.advance()
+        if not expired:
+            return 0
+
+        due: List[Tuple[str, ScheduledAssignment]] = []
+        with self._lock:
+            for action, assignment_id in expired:
+                entry = self._assignments.get(assignment_id)
+                if entry is not None:
+                    due.append((action, entry))
+        if not due:
+            return 0
+
+        messages = [
+            (entry.device_id, task_command(f"{action}_task", entry.id, entry.task))
+            for action, entry in due
+        ]
+        try:
+            results = self.dispatch(messages)
+        except Exception as e:
+            logger.error(f"Error sending {len(messages)} task commands: {e}")
+            results = [False] * len(messages)
+
+        now = self._now()
+        for (action, entry), sent in zip(due, results):
+            if not sent:
+                with self._lock:
+                    self.metrics["dispatch_errors"] += 1
+            if action == "start":
+                if sent:
+                    self._transition(entry, "running")
+                    with self._lock:
+                        self.metrics["started"] += 1
+                    self._wheel.schedule(("stop", entry.id), (entry.end_time - now).total_seconds())
+                elif (entry.end_time - now).total_seconds() > TASK_DISPATCH_RETRY:
+                    self._wheel.schedule(("start", entry.id), TASK_DISPATCH_RETRY)
+                else:
+                    self._finish(entry, "failed")
+            else:
+                # The device also stops on its own after the task duration
+                if not sent:
+                    logger.warning(f"Could not send stop of task assignment {entry.id} to {entry.device_id}")
+                self._finish(entry, "completed")
+        return sum(1 for sent in results if sent)
+
+    # ----- Progress -----
+
+    def observe(self, device_id: str, telemetry: Dict[str, Any]) -> int:
+        """
+        Update the progress of the device's running assignments from a reading.
+
+        Progress is the larger of the elapsed share of the time slot and the
+        share of the way from the first humidity reading to the target
+        humidity, based on a smoothed humidity, so no history is needed.
+        It never decreases. After TASK_TARGET_CONFIRMATIONS consecutive
+        readings at or below the target the stop is sent with the next tick.
+
+        Args:
+            device_id: Sending device
+            telemetry: Telemetry payload (humidity is used if present)
+
+        Returns:
+            int: Number of assignments whose progress changed
+        """
+        if device_id not in self._running:
+            return 0
+        humidity = telemetry.get("humidity")
+        if not isinstance(humidity, (int, float)) or isinstance(humidity, bool):
+            humidity = None
+        now = self._now()
+        changed: List[Dict[str, Any]] = []
+        reached: List[int] = []
+        with self._lock:
+            for assignment_id in self._running.get(device_id, ()):
+                entry = self._assignments[assignment_id]
+                self.metrics["readings"] += 1
+                progress, target_reached = self._progress(entry, now, humidity)
+                if target_reached:
+                    reached.append(entry.id)
+                if progress > entry.progress:
+                    entry.progress = progress
+                    self._pending[entry.id] = {"b_id": entry.id, "b_status": entry.status, "b_progress": progress}
+                    changed.append(entry.snapshot())
+            self.metrics["targets_reached"] += len(reached)
+        for assignment_id in reached:
+            # The tick thread sends the stop; the MQTT thread must not wait for it
+            self._wheel.schedule(("stop", assignment_id), 0)
+            logger.info(f"Task assignment {assignment_id} on {device_id} reached its target humidity")
+        for snapshot in changed:
+            self._notify(device_id, snapshot)
+        return len(changed)
+
+    def _progress(self, entry: ScheduledAssignment, now: datetime, humidity: Optional[float]) -> Tuple[int, bool]:
+        span = (entry.end_time - entry.start_time).total_seconds()
+        elapsed = (now - entry.start_time).total_seconds()
+        progress = elapsed / span * 100 if span > 0 else 100
+
+        target = entry.task.get("target_humidity")
+        target_reached = False
+        if target is not None and humidity is not None:
+            if entry.humidity is None:
+                entry.baseline_humidity = entry.humidity = float(humidity)
+            else:
+                entry.humidity += TASK_HUMIDITY_SMOOTHING * (humidity - entry.humidity)
+            if entry.baseline_humidity > target:
+                share = (entry.baseline_humidity - entry.humidity) / (entry.baseline_humidity - target)
+                progress = max(progress, share * 100)
+            entry.confirmations = entry.confirmations + 1 if entry.humidity <= target else 0
+            target_reached = entry.confirmations == TASK_TARGET_CONFIRMATIONS
+
+        # 100 is reserved for completion
+        return int(min(max(progress, 0), 99)), target_reached
+
+    # ----- Writing -----
+
+    def flush(self) -> int:
+        """
+        Write the pending status transitions in one batched UPDATE.
+
+        Returns:
+            int: Number of rows written
+        """
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+
+        rows = list(pending.values())
+        assignments = models.TaskAssignment.__table__
+        db = next(get_db())
+        try:
+            db.execute(
+                update(assignments)
+                .where(assignments.c.id == bindparam("b_id"))
+                .values(status=bindparam("b_status"), progress=bindparam("b_progress")),
+                rows,
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Error writing {len(rows)} task status changes: {e}")
+            # Retry with the next flush unless a newer transition superseded it
+            with self._lock:
+                self.metrics["write_errors"] += len(rows)
+                for assignment_id, row in pending.items():
+                    self._pending.setdefault(assignment_id, row)
+            return 0
+        finally:
+            db.close()
+
+        with self._lock:
+            self.metrics["flushes"] += 1
+            self.metrics["rows_written"] += len(rows)
+        return len(rows)
+
+    # ----- Reads -----
+
+    def get(self, assignment_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Return the in-memory state of an active assignment, or None.
+        """
+        with self._lock:
+            entry = self._assignments.get(assignment_id)
+            if entry is None:
+                return None
+            return {
+                "id": entry.id,
+                "device_id": entry.device_id,
+                "task_id": entry.task["id"],
+                "start_time": entry.start_time,
+                "end_time": entry.end_time,
+                "status": entry.status,
+                "progress": entry.progress,
+            }
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Return counters of transitions, dispatch errors and database writes.
+        """
+        with self._lock:
+            return {
+                "active": len(self._assignments),
+                "timers": len(self._wheel),
+                "pending": len(self._pending),
+                **self.metrics,
+            }
@@ -0,0 +1,299 @@
+"""
+Live telemetry stream for the SwissAirDry platform.
+
+This module fans out device updates from the MQTT and BLE ingest paths to
+connected web clients as Server-Sent Events (SSE). Ingest runs in the leader
+process only; the other workers relay its events into their own stream (see
+TelemetryRelay), so a client gets the same updates from any worker.
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# Seconds between keep-alives on the relay feed while no events arrive
+STREAM_RELAY_HEARTBEAT = float(os.getenv("STREAM_RELAY_HEARTBEAT", 5))
+
+# Seconds between attempts to reach the leader's feed
+STREAM_RELAY_RETRY = float(os.getenv("STREAM_RELAY_RETRY", 2))
+
+# Global stream instance
+_telemetry_stream = None
+
+class TelemetryStream:
+    """
+    Thread-safe event buffer feeding Server-Sent Event subscribers.
+
+    Every published update gets a sequential event id and is kept in a bounded
+    ring buffer, so a reconnecting client can resume from its Last-Event-ID.
+    Event ``seq`` lives in slot ``seq % buffer_size``; each subscriber keeps
+    its own cursor and reads only the events published since, instead of
+    scanning the whole buffer on every wake-up.
+    Subscribers filter by device and topic and coalesce updates per device,
+    sending at most ``max_rate`` frames per second and device (last value wins).
+    """
+
+    def __init__(
+        self,
+        buffer_size: int = 2000,
+        max_rate: float = 2.0,
+        heartbeat: float = 15.0,
+        max_duration: float = 300.0
+    ):
+        """
+        Initialize the stream.
+
+        Args:
+            buffer_size: Number of events kept for Last-Event-ID resumption
+            max_rate: Default maximum frames per second and device
+            heartbeat: Seconds between keep-alive comments on idle streams
+            max_duration: Seconds after which a stream is closed so the client
+                reconnects (and releases the server worker in between)
+        """
+        self.max_rate = max_rate
+        self.heartbeat = heartbeat
+        self.max_duration = max_duration
+        # Event ids are prefixed with an epoch so ids from a previous process
+        # are never mistaken for positions in the current buffer
+        self.epoch = format(int(time.time()), "x")
+        self.buffer_size = buffer_size
+        self._events: List[Optional[tuple]] = [None] * buffer_size
+        self._seq = 0
+        self._condition = threading.Condition()
+
+    def publish(self, device_id: str, topic: str, data: Any, timestamp: Optional[float] = None) -> int:
+        """
+        Publish an update for a device.
+
+        Args:
+            device_id: Device identifier (device_id or BLE address)
+            topic: Event type, e.g. "telemetry" or "status"
+            data: JSON-serializable payload
+            timestamp: Time of the update (default: now); relayed events keep
+                the leader's timestamp
+
+        Returns:
+            int: Sequence number of the event
+        """
+        if timestamp is None:
+            timestamp = time.time()
+        with self._condition:
+            self._seq += 1
+            self._events[self._seq % self.buffer_size] = (self._seq, device_id, topic, data, timestamp)
+            self._condition.notify_all()
+            return self._seq
+
+    def tail(self, heartbeat: float = STREAM_RELAY_HEARTBEAT) -> Iterator[Optional[Dict[str, Any]]]:
+        """
+        Follow all events published from now on, unfiltered and uncoalesced.
+
+        This is the leader side of the relay feed.
+
+        Args:
+            heartbeat: Seconds after which an idle tail yields None
+
+        Yields:
+            Optional[Dict[str, Any]]: Events as publish() arguments, or None
+            as keep-alive
+        """
+        with self._condition:
+            cursor = self._seq
+
+        while True:
+            with self._condition:
+                if self._seq == cursor:
+                    self._condition.wait(timeout=heartbeat)
+                first = max(cursor + 1, self._seq - self.buffer_size + 1)
+                events = [self._events[seq % self.buffer_size] for seq in range(first, self._seq + 1)]
+                cursor = self._seq
+
+            if not events:
+                yield None
+            for _, device_id, topic, data, timestamp in events:
+                yield {"device_id": device_id, "topic": topic, "data": data, "timestamp": timestamp}
+
+    def _parse_event_id(self, last_event_id: Optional[str]) -> int:
+        """
+        Translate a Last-Event-ID header into a sequence number to resume after.
+        """
+        if last_event_id:
+            epoch, _, seq = last_event_id.partition("-")
+            if epoch == self.epoch and seq.isdigit():
+                return int(seq)
+        # Unknown or stale id: start with live events only
+        return self._seq
+
+    def subscribe(
+        self,
+        devices: Optional[Set[str]] = None,
+        topics: Optional[Set[str]] = None,
+        last_event_id: Optional[str] = None,
+        max_rate: Optional[float] = None
+    ) -> Iterator[str]:
+        """
+        Generate SSE frames for one client.
+
+        Args:
+            devices: Only forward events for these devices (None = all)
+            topics: Only forward these event types (None = all)
+            last_event_id: Resume after this event id
+            max_rate: Maximum frames per second and device
+
+        Yields:
+            str: Encoded SSE frames
+        """
+        rate = max_rate or self.max_rate
+        min_interval = 1.0 / rate if rate > 0 else 0.0
+
+        with self._condition:
+            cursor = self._parse_event_id(last_event_id)
+
+        pending: "OrderedDict[tuple, tuple]" = OrderedDict()
+        last_sent: Dict[str, float] = {}
+        started = time.monotonic()
+        last_frame = started
+
+        yield "retry: 3000\n\n"
+
+        while time.monotonic() - started < self.max_duration:
+            # Collect new events into the per-device/topic coalescing buffer
+            with self._condition:
+                first = max(cursor + 1, self._seq - self.buffer_size + 1)
+                if first > cursor + 1:
+                    logger.debug("Telemetry subscriber fell behind the buffer, events skipped")
+                events = [self._events[seq % self.buffer_size] for seq in range(first, self._seq + 1)]
+                cursor = self._seq
+
+            for event in events:
+                seq, device_id, topic, data, timestamp = event
+                if devices and device_id not in devices:
+                    continue
+                if topics and topic not in topics:
+                    continue
+                key = (device_id, topic)
+                pending.pop(key, None)
+                pending[key] = event
+
+            now = time.monotonic()
+            next_due = None
+            for key in list(pending):
+                device_id = key[0]
+                due = last_sent.get(device_id, 0.0) + min_interval
+                if due <= now:
+                    seq, _, topic, data, timestamp = pending.pop(key)
+                    last_sent[device_id] = now
+                    last_frame = now
+                    yield self._format(seq, device_id, topic, data, timestamp)
+                elif next_due is None or due < next_due:
+                    next_due = due
+
+            if now - last_frame >= self.heartbeat:
+                last_frame = now
+                yield ": keep-alive\n\n"
+
+            timeout = self.heartbeat - (now - last_frame)
+            if next_due is not None:
+                timeout = min(timeout, next_due - now)
+            with self._condition:
+                if self._seq == cursor:
+                    self._condition.wait(timeout=max(0.01, timeout))
+
+    def _format(self, seq: int, device_id: str, topic: str, data: Any, timestamp: float) -> str:
+        """
+        Encode one event as an SSE frame.
+        """
+        body = json.dumps(
+            {"device_id": device_id, "data": data, "timestamp": timestamp},
+            default=str
+        )
+        return f"id: {self.epoch}-{seq}\nevent: {topic}\ndata: {body}\n\n"
+
+class TelemetryRelay:
+    """
+    Republishes the leader's events into the stream of a follower process.
+
+    A background thread follows the leader's feed (see TelemetryStream.tail)
+    and publishes every event locally, so SSE subscribers of this worker see
+    the updates ingested elsewhere. While this process is the leader itself,
+    or no leader is reachable, the thread idles and retries.
+    """
+
+    def __init__(
+        self,
+        stream: TelemetryStream,
+        follow: Callable[[], Iterator[Optional[Dict[str, Any]]]],
+        is_local: Callable[[], bool],
+        retry: float = STREAM_RELAY_RETRY
+    ):
+        """
+        Initialize the relay.
+
+        Args:
+            stream: Local stream the events are published into
+            follow: Opens the leader's feed; yields events or None (keep-alive)
+                and raises once the leader is gone
+            is_local: Whether events are already published in this process
+            retry: Seconds between attempts to reach the leader
+        """
+        self.stream = stream
+        self.follow = follow
+        self.is_local = is_local
+        self.retry = retry
+        self.relayed = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """
+        Start relaying in a background thread.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="telemetry-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop relaying; returns after the current keep-alive interval at most.
+        """
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=STREAM_RELAY_HEARTBEAT + 1)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            if self.is_local():
+                self._stop.wait(self.retry)
+                continue
+            feed = None
+            try:
+                feed = self.follow()
+                for event in feed:
+                    if self._stop.is_set() or self.is_local():
+                        break
+                    if event is not None:
+                        self.stream.publish(**event)
+                        self.relayed += 1
+            except Exception as e:
+                logger.debug(f"Telemetry relay interrupted: {e}")
+                self._stop.wait(self.retry)
+            finally:
+                if feed is not None:
+                    feed.close()
+
+def get_telemetry_stream() -> TelemetryStream:
+    """
+    Get the global telemetry stream instance.
+    """
+    global _telemetry_stream
+    if _telemetry_stream is None:
+        _telemetry_stream = TelemetryStream()
+    return _telemetry_stream
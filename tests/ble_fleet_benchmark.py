@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+BLE-Lasttest mit einer virtuellen Geräteflotte.
+
+Dieses Skript startet den BLEService mit dem simulierten Backend (ble_fake)
+und misst ohne Bluetooth-Adapter: gefundene Geräte, Verbindungsaufbau,
+Benachrichtigungen pro Sekunde, Befehlsdurchsatz mit Latenz-Perzentilen und
+die Schreibrate der Sensordaten in die Datenbank. Ohne DATABASE_URL wird eine
+temporäre SQLite-Datenbank verwendet:
+
+python ble_fleet_benchmark.py --devices 200 --duration 30 --notify-rate 2 --disconnect-rate 0.01
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+# Projektverzeichnis (eine Ebene über tests/)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PROJECT_DIR)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="BLE-Lasttest mit virtueller Geräteflotte")
+    parser.add_argument("--devices", type=int, default=100, help="Anzahl virtueller Geräte (Standard: 100)")
+    parser.add_argument("--duration", type=float, default=20, help="Messdauer in Sekunden (Standard: 20)")
+    parser.add_argument("--notify-rate", type=float, default=1.0, help="Benachrichtigungen/s pro Verbindung (Standard: 1)")
+    parser.add_argument("--advert-rate", type=float, default=2.0, help="Advertisements/s pro Gerät (Standard: 2)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mittlere GATT-Latenz in Sekunden (Standard: 0.02)")
+    parser.add_argument("--disconnect-rate", type=float, default=0.0, help="Abbrüche/s pro Verbindung (Standard: 0)")
+    parser.add_argument("--connect-failure-rate", type=float, default=0.0, help="Anteil fehlschlagender Verbindungen")
+    parser.add_argument("--advertise-ratio", type=float, default=0.5, help="Anteil Geräte mit Messwerten im Advertisement")
+    parser.add_argument("--max-connections", type=int, default=8, help="Gleichzeitige Verbindungen (Standard: 8)")
+    parser.add_argument("--scan-interval", type=float, default=1.0, help="Verarbeitungsintervall pro Gerät in Sekunden")
+    parser.add_argument("--commands", type=int, default=500, help="Anzahl Steuerbefehle im Befehlstest (Standard: 500)")
+    parser.add_argument("--json", action="store_true", help="Ergebnisse zusätzlich als JSON ausgeben")
+    return parser.parse_args()
+
+
+def configure_environment(args):
+    """Setzt die Umgebung, bevor database und ble_service importiert werden."""
+    if "DATABASE_URL" not in os.environ:
+        path = os.path.join(tempfile.mkdtemp(prefix="ble-bench-"), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    os.environ["BLE_MAX_CONNECTIONS"] = str(args.max_connections)
+    os.environ["BLE_DEFAULT_SCAN_INTERVAL"] = str(args.scan_interval)
+    os.environ.setdefault("ASYNC_DB_ENABLED", "0")
+
+
+def percentile(values, pct):
+    """Berechnet ein Perzentil (nächster Rang) einer sortierten Liste."""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, int(round(pct / 100.0 * len(values))) - 1))
+    return values[index]
+
+
+async def run_commands(service, models, get_db, fleet, total):
+    """
+    Sendet Lüfterbefehle reihum an alle registrierten virtuellen Geräte.
+
+    Returns:
+        dict: Durchsatz, Latenz-Perzentile (ms) und Fehleranzahl
+    """
+    db = next(get_db())
+    try:
+        device_ids = [
+            device_id for device_id, address in
+            db.query(models.Device.device_id, models.Device.ble_address).all()
+            if address in fleet.peripherals
+        ]
+    finally:
+        db.close()
+    if not device_ids:
+        return {"commands": 0, "errors": 0, "per_second": 0.0, "p50": 0.0, "p95": 0.0, "max": 0.0}
+
+    latencies = []
+    errors = 0
+
+    async def one_command(index):
+        nonlocal errors
+        start = time.perf_counter()
+        ok = await service.send_command(device_ids[index % len(device_ids)], {"fan_speed": index % 101})
+        latencies.append((time.perf_counter() - start) * 1000.0)
+        if not ok:
+            errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_command(i) for i in range(total)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "commands": total,
+        "devices": len(device_ids),
+        "errors": errors,
+        "per_second": total / duration if duration > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "max": latencies[-1],
+        "mean": statistics.fmean(latencies),
+    }
+
+
+async def run_benchmark(args):
+    from database import engine, get_db
+    import models
+    from ble_service import BLEService
+    from ble_fake import VirtualFleet, use_fake_backend
+
+    models.Base.metadata.create_all(bind=engine)
+
+    fleet = VirtualFleet(
+        count=args.devices,
+        notify_rate=args.notify_rate,
+        advert_rate=args.advert_rate,
+        latency=args.latency,
+        disconnect_rate=args.disconnect_rate,
+        connect_failure_rate=args.connect_failure_rate,
+        advertise_ratio=args.advertise_ratio,
+    )
+    service = BLEService(scan_interval=1)
+    use_fake_backend(service, fleet)
+
+    received = 0
+
+    def on_sensor_data(address, data):
+        nonlocal received
+        received += 1
+
+    service.register_callback("sensor_data", on_sensor_data)
+
+    await service.start()
+    started = time.perf_counter()
+    await asyncio.sleep(args.duration)
+    elapsed = time.perf_counter() - started
+    sensor_rate = received / elapsed
+
+    commands = await run_commands(service, models, get_db, fleet, args.commands)
+    connections = service.connections.stats()
+    await service.stop()
+
+    db = next(get_db())
+    try:
+        stored = db.query(models.SensorReading).count()
+        registered = db.query(models.Device).count()
+    finally:
+        db.close()
+
+    readings = service.reading_writer.stats()
+    return {
+        "duration": elapsed,
+        "discovered": len(service.devices),
+        "registered": registered,
+        "sensor_messages": received,
+        "sensor_per_second": sensor_rate,
+        "stored_readings": stored,
+        "stored_per_second": stored / elapsed,
+        "readings": readings,
+        "connections": connections,
+        "commands": commands,
+        "command_queue": service.commands.stats(),
+        "presence": service.presence.stats(),
+        "fleet": fleet.stats(),
+    }
+
+
+def print_results(results):
+    """Gibt die wichtigsten Kennzahlen aus."""
+    fleet = results["fleet"]
+    connections = results["connections"]
+    readings = results["readings"]
+    commands = results["commands"]
+
+    print(f"\n=== Ergebnisse nach {results['duration']:.1f} s ===")
+    print(f"Geräte gefunden / registriert: {results['discovered']} / {results['registered']}")
+    print(
+        f"Verbindungen: {fleet['connects']} aufgebaut, {fleet['connect_failures']} fehlgeschlagen, "
+        f"{fleet['fault_disconnects']} Abbrüche, {connections.get('evictions', 0)} verdrängt"
+    )
+    print(f"Advertisements: {fleet['adverts']}, Benachrichtigungen: {fleet['notifications']}")
+    print(f"Sensordaten verarbeitet: {results['sensor_messages']} ({results['sensor_per_second']:.1f}/s)")
+    print(
+        f"Sensordaten gespeichert: {results['stored_readings']} ({results['stored_per_second']:.1f}/s), "
+        f"{readings['batches']} Stapel, Ø {readings['avg_write_ms']:.1f} ms, "
+        f"{readings['dropped']} verworfen"
+    )
+    print(
+        f"Befehle: {commands['commands']} an {commands.get('devices', 0)} Geräte, "
+        f"{commands['per_second']:.1f}/s, p50 {commands['p50']:.1f} ms, p95 {commands['p95']:.1f} ms, "
+        f"max {commands['max']:.1f} ms, {commands['errors']} Fehler"
+    )
+    queue = results["command_queue"]
+    print(
+        f"GATT-Schreibvorgänge: {queue['written']} ({queue['coalesced']} zusammengefasst, "
+        f"{queue['without_response']} ohne Bestätigung)"
+    )
+    presence = results["presence"]
+    print(
+        f"Anwesenheit: {presence['observations']} Beobachtungen, {presence['rows_written']} Zeilen "
+        f"in {presence['flushes']} Stapel-UPDATEs"
+    )
+
+
+def main():
+    args = parse_args()
+    configure_environment(args)
+
+    print("SwissAirDry BLE-Lasttest (virtuelle Flotte)")
+    print(
+        f"Geräte: {args.devices}, Dauer: {args.duration} s, Verbindungen: {args.max_connections}, "
+        f"Latenz: {args.latency * 1000:.0f} ms"
+    )
+
+    results = asyncio.run(run_benchmark(args))
+    print_results(results)
+
+    if args.json:
+        print(json.dumps(results, indent=2, default=str))
+    return 1 if results["commands"]["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+"""
+Gemeinsame Einrichtung der Tests.
+
+Die Tests laufen gegen eine temporäre SQLite-Datenbank und ohne asynchrone
+Engine; beides muss vor dem ersten Import von ``database`` gesetzt sein.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+_TEST_DB_DIR = tempfile.mkdtemp(prefix="swissairdry-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_TEST_DB_DIR, 'test.db')}"
+os.environ["DATABASE_REPLICA_URLS"] = ""
+os.environ["ASYNC_DB_ENABLED"] = "0"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+collect_ignore = [
+    # Skripte gegen einen laufenden Server bzw. Benchmarks, keine Unit-Tests
+    "test_ble_api.py",
+    "load_test_api.py",
+    "ble_fleet_benchmark.py",
+    "startup_benchmark.py",
+]
+
+
+@pytest.fixture
+def db_session():
+    """Leere Datenbank mit allen Tabellen; wird nach dem Test verworfen."""
+    import models
+    from database import SessionLocal, engine
+
+    models.Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+        models.Base.metadata.drop_all(bind=engine)
+
+
+@pytest.fixture
+def client(db_session):
+    """TestClient für den API-Router auf der leeren Testdatenbank."""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    import api
+
+    app = FastAPI()
+    app.include_router(api.router)
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Lasttest für die Hot-Endpunkte der SwissAirDry-API.
+
+Dieses Skript misst Anfragen pro Sekunde und Tail-Latenzen (p50/p95/p99) bei
+hoher Parallelität für die Endpunkte Messwert-Ingest, Messwert-Abfrage,
+Geräteliste und Systemstatus. Um synchrone und asynchrone Datenbankschicht zu
+vergleichen, den API-Server einmal mit ASYNC_DB_ENABLED=0 und einmal mit
+installiertem asyncpg starten und beide URLs angeben:
+
+python load_test_api.py --url http://localhost:8000 --compare http://localhost:8001
+"""
+
+import sys
+import math
+import time
+import json
+import argparse
+import statistics
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Standard-URL des API-Servers
+DEFAULT_API_URL = "http://localhost:8000"
+
+# Geprüfte Endpunkte: Name -> (Methode, Pfad, JSON-Body)
+SCENARIOS = {
+    "ingest": ("POST", "/devices/{device}/readings", {"temperature": 21.5, "humidity": 48.0, "fan_speed": 50}),
+    "readings": ("GET", "/devices/{device}/readings?limit=50", None),
+    "devices": ("GET", "/devices?limit=100", None),
+    "status": ("GET", "/system/status", None),
+}
+
+_thread_local = threading.local()
+
+
+def _session():
+    """Gibt eine Thread-lokale HTTP-Session mit Keep-Alive zurück."""
+    if not hasattr(_thread_local, "session"):
+        _thread_local.session = requests.Session()
+    return _thread_local.session
+
+
+def percentile(values, pct):
+    """Berechnet ein Perzentil (nächster Rang) einer sortierten Liste."""
+    if not values:
+        return 0.0
+    index = max(0, min(len(values) - 1, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[index]
+
+
+def ensure_device(api_url, device_id):
+    """Legt das Testgerät an, falls es noch nicht existiert."""
+    response = requests.get(f"{api_url}/devices/{device_id}")
+    if response.status_code == 404:
+        requests.post(
+            f"{api_url}/devices",
+            json={"device_id": device_id, "name": "Lasttest-Gerät", "type": "esp32"}
+        )
+
+
+def run_scenario(api_url, scenario, device_id, concurrency, total_requests):
+    """
+    Führt ein Szenario mit der angegebenen Parallelität aus.
+
+    Returns:
+        dict: Durchsatz, Latenz-Perzentile (ms) und Fehleranzahl
+    """
+    method, path, body = SCENARIOS[scenario]
+    url = api_url + path.format(device=device_id)
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one_request(_):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            response = _session().request(method, url, json=body, timeout=30)
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000.0
+        with lock:
+            latencies.append(elapsed)
+            if not ok:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one_request, range(total_requests)))
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": total_requests,
+        "errors": errors,
+        "rps": total_requests / duration if duration > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": latencies[-1] if latencies else 0.0,
+        "mean": statistics.fmean(latencies) if latencies else 0.0,
+    }
+
+
+def print_results(label, results):
+    """Gibt die Ergebnisse eines Laufs als Tabelle aus."""
+    print(f"\n=== {label} ===")
+    print(f"{'Szenario':<10} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9} {'Fehler':>7}")
+    for scenario, r in results.items():
+        print(
+            f"{scenario:<10} {r['rps']:>9.1f} {r['p50']:>9.1f} {r['p95']:>9.1f} "
+            f"{r['p99']:>9.1f} {r['max']:>9.1f} {r['errors']:>7}"
+        )
+
+
+def print_comparison(baseline, candidate):
+    """Gibt das Verhältnis zweier Läufe (Kandidat / Basis) aus."""
+    print("\n=== Vergleich (--compare gegenüber --url) ===")
+    print(f"{'Szenario':<10} {'req/s':>9} {'p99':>9}")
+    for scenario in baseline:
+        b, c = baseline[scenario], candidate[scenario]
+        rps_ratio = c["rps"] / b["rps"] if b["rps"] else 0.0
+        p99_ratio = c["p99"] / b["p99"] if b["p99"] else 0.0
+        print(f"{scenario:<10} {rps_ratio:>8.2f}x {p99_ratio:>8.2f}x")
+
+
+def run_all(api_url, scenarios, device_id, concurrency, total_requests):
+    """Führt alle ausgewählten Szenarien gegen einen Server aus."""
+    ensure_device(api_url, device_id)
+    # Kurzes Aufwärmen, damit Verbindungspools gefüllt sind
+    run_scenario(api_url, "status", device_id, min(concurrency, 8), 50)
+    return {
+        scenario: run_scenario(api_url, scenario, device_id, concurrency, total_requests)
+        for scenario in scenarios
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lasttest der SwissAirDry-API")
+    parser.add_argument("--url", default=DEFAULT_API_URL, help=f"API-URL (Standard: {DEFAULT_API_URL})")
+    parser.add_argument("--compare", help="Zweite API-URL zum Vergleich (z.B. Server mit async Engine)")
+    parser.add_argument("--device", default="loadtest_device", help="Geräte-ID für Tests (Standard: loadtest_device)")
+    parser.add_argument("--concurrency", type=int, default=200, help="Parallele Anfragen (Standard: 200)")
+    parser.add_argument("--requests", type=int, default=5000, help="Anfragen pro Szenario (Standard: 5000)")
+    parser.add_argument(
+        "--scenario", action="append", choices=sorted(SCENARIOS),
+        help="Nur bestimmte Szenarien ausführen (mehrfach angebbar)"
+    )
+    parser.add_argument("--json", action="store_true", help="Ergebnisse zusätzlich als JSON ausgeben")
+    args = parser.parse_args()
+
+    scenarios = args.scenario or list(SCENARIOS)
+
+    print("SwissAirDry API-Lasttest")
+    print(f"Parallelität: {args.concurrency}, Anfragen pro Szenario: {args.requests}")
+
+    baseline = run_all(args.url, scenarios, args.device, args.concurrency, args.requests)
+    print_results(args.url, baseline)
+
+    candidate = None
+    if args.compare:
+        candidate = run_all(args.compare, scenarios, args.device, args.concurrency, args.requests)
+        print_results(args.compare, candidate)
+        print_comparison(baseline, candidate)
+
+    if args.json:
+        print(json.dumps({"baseline": baseline, "candidate": candidate}, indent=2))
+
+    failed = sum(r["errors"] for r in baseline.values())
+    if candidate:
+        failed += sum(r["errors"] for r in candidate.values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
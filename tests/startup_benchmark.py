@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Startzeit-Messung für die SwissAirDry-Anwendung.
+
+Dieses Skript importiert die Einstiegsmodule (main, api) jeweils in einem
+frischen Python-Prozess mit ``-X importtime`` und gibt die Gesamt-Importzeit
+sowie die teuersten Module aus. Zusätzlich wird geprüft, welche optionalen
+Subsysteme (BLE, Cloudflare, Domain-Verwaltung) beim Import bereits geladen
+werden, obwohl sie erst bei Bedarf gebraucht werden.
+
+Mit --baseline-ref wird derselbe Stand eines Git-Commits (z.B. HEAD~1) in
+ein temporäres Verzeichnis exportiert und zum Vergleich gemessen:
+
+python startup_benchmark.py --runs 5 --baseline-ref HEAD~1
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# Projektverzeichnis (eine Ebene über tests/)
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Gemessene Einstiegsmodule
+DEFAULT_MODULES = ["main", "api"]
+
+# Subsysteme, die erst beim ersten Request bzw. bei Bedarf geladen werden sollen
+DEFERRED_MODULES = ["bleak", "ble_service", "cloudflare_manager", "domain_manager"]
+
+
+def measure_import(module, cwd, env):
+    """
+    Importiert ein Modul in einem neuen Prozess und wertet -X importtime aus.
+
+    Returns:
+        dict: Gesamtzeit (ms), Module nach kumulierter Zeit und geladene Subsysteme
+    """
+    probe = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", probe],
+        cwd=cwd, env=env, capture_output=True, text=True, timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Import von {module} fehlgeschlagen:\n{result.stderr[-2000:]}")
+
+    cumulative = {}
+    for line in result.stderr.splitlines():
+        # Format: "import time:  self [us] |  cumulative | imported package"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        name = parts[2].strip()
+        cumulative[name] = int(parts[1].strip()) / 1000.0
+
+    loaded = [m for m in result.stdout.strip().split(",") if m]
+    return {
+        "total_ms": cumulative.get(module, 0.0),
+        "modules": cumulative,
+        "loaded_deferred": loaded,
+    }
+
+
+def benchmark(cwd, modules, runs):
+    """Misst jedes Modul mehrfach und gibt Median und Details des letzten Laufs zurück."""
+    env = dict(os.environ)
+    # Keine Services starten und eine lokale Datenbank verwenden
+    env.setdefault("SWISSAIRDRY_START_SERVICES", "0")
+    env.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.gettempdir(), "startup_benchmark.db"))
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    results = {}
+    for module in modules:
+        samples = [measure_import(module, cwd, env) for _ in range(runs)]
+        results[module] = {
+            "median_ms": statistics.median(s["total_ms"] for s in samples),
+            "modules": samples[-1]["modules"],
+            "loaded_deferred": samples[-1]["loaded_deferred"],
+        }
+    return results
+
+
+def export_ref(ref, target):
+    """Exportiert einen Git-Stand des Projekts in ein Verzeichnis."""
+    archive = subprocess.run(
+        ["git", "archive", ref], cwd=PROJECT_DIR, capture_output=True, check=True
+    )
+    subprocess.run(["tar", "-x", "-C", target], input=archive.stdout, check=True)
+
+
+def print_results(label, results, top):
+    """Gibt die Ergebnisse eines Laufs aus."""
+    print(f"\n=== {label} ===")
+    for module, r in results.items():
+        print(f"{module}: {r['median_ms']:.1f} ms (Median)")
+        deferred = ", ".join(r["loaded_deferred"]) or "keine"
+        print(f"  beim Import geladene Subsysteme: {deferred}")
+        heaviest = sorted(
+            ((name, ms) for name, ms in r["modules"].items() if name != module),
+            key=lambda item: item[1], reverse=True
+        )[:top]
+        for name, ms in heaviest:
+            print(f"  {ms:>9.1f} ms  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startzeit-Messung der SwissAirDry-Anwendung")
+    parser.add_argument("--module", action="append", help="Zu messendes Modul (mehrfach angebbar, Standard: main, api)")
+    parser.add_argument("--runs", type=int, default=3, help="Messläufe pro Modul (Standard: 3)")
+    parser.add_argument("--top", type=int, default=10, help="Anzahl der teuersten Module (Standard: 10)")
+    parser.add_argument("--baseline-ref", help="Git-Referenz zum Vergleich (z.B. HEAD~1)")
+    parser.add_argument("--json", action="store_true", help="Ergebnisse zusätzlich als JSON ausgeben")
+    args = parser.parse_args()
+
+    modules = args.module or DEFAULT_MODULES
+
+    print("SwissAirDry Startzeit-Messung")
+    current = benchmark(PROJECT_DIR, modules, args.runs)
+    print_results("Arbeitsverzeichnis", current, args.top)
+
+    baseline = None
+    if args.baseline_ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            export_ref(args.baseline_ref, tmp)
+            baseline = benchmark(tmp, modules, args.runs)
+        print_results(args.baseline_ref, baseline, args.top)
+
+        print("\n=== Vergleich ===")
+        for module in modules:
+            b, c = baseline[module]["median_ms"], current[module]["median_ms"]
+            ratio = b / c if c else 0.0
+            print(f"{module:<10} {b:>9.1f} ms -> {c:>9.1f} ms ({ratio:.2f}x schneller)")
+
+    if args.json:
+        summary = lambda res: {m: {k: v for k, v in r.items() if k != "modules"} for m, r in res.items()}
+        print(json.dumps({"current": summary(current), "baseline": summary(baseline) if baseline else None}, indent=2))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""
+Tests für die Massen-Endpunkte der Geräte-API (api).
+
+Prüft die Bereitstellung vieler Geräte und das Konfigurations-Patch für
+ganze Flotten gegen SQLite; MQTT wird durch eine Aufzeichnung ersetzt:
+
+python -m pytest tests/test_api_devices.py
+"""
+
+import pytest
+
+import models
+from device_manager import get_device_manager
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Zeichnet die per MQTT veröffentlichten Konfigurationen auf."""
+    messages = []
+
+    def publish_many_sync(batch, retain=False, timeout=10.0):
+        messages.extend(batch)
+        return [True] * len(batch)
+
+    monkeypatch.setattr(get_device_manager().mqtt, "publish_many_sync", publish_many_sync)
+    return messages
+
+
+def device(device_id, device_type="esp32"):
+    return {"device_id": device_id, "name": f"Gerät {device_id}", "type": device_type}
+
+
+def test_bulk_create_reports_created_exists_duplicate(client, db_session):
+    assert client.post("/devices", json=device("old")).status_code == 201
+
+    response = client.post("/devices:batch", json={"devices": [
+        device("new-1"), device("old"), device("new-2", "esp8266"), device("new-1"),
+    ]})
+
+    assert response.status_code == 201
+    report = response.json()
+    assert [(item["device_id"], item["status"]) for item in report] == [
+        ("new-1", "created"), ("old", "exists"), ("new-2", "created"), ("new-1", "duplicate"),
+    ]
+    assert all(item["id"] for item in report if item["status"] == "created")
+    assert db_session.query(models.Device).count() == 3
+    # Jedes neue Gerät erhält seine Standardkonfiguration
+    configs = {
+        device_id: display_type
+        for device_id, display_type in db_session.query(models.Device.device_id, models.DeviceConfig.display_type)
+        .join(models.DeviceConfig, models.DeviceConfig.device_id == models.Device.id)
+    }
+    assert configs == {"old": "128px", "new-1": "128px", "new-2": "64px"}
+
+
+def test_bulk_create_rejects_oversized_request(client, monkeypatch):
+    import api
+
+    monkeypatch.setattr(api, "DEVICES_BULK_MAX_ITEMS", 2)
+    response = client.post("/devices:batch", json={"devices": [device(f"d{i}") for i in range(3)]})
+    assert response.status_code == 413
+
+
+def test_config_patch_updates_only_given_fields(client, db_session, published):
+    client.post("/devices:batch", json={"devices": [device("a"), device("b"), device("c", "sensor")]})
+    # Gerät ohne Konfiguration
+    db_session.add(models.Device(device_id="bare", name="bare", type="esp32"))
+    db_session.commit()
+
+    response = client.patch("/devices/config:batch", json={
+        "device_ids": ["a", "b", "bare", "ghost"],
+        "config": {"update_interval": 15},
+    })
+
+    assert response.status_code == 200
+    report = {item["device_id"]: item for item in response.json()}
+    assert {device_id: item["status"] for device_id, item in report.items()} == {
+        "a": "updated", "b": "updated", "bare": "no_config", "ghost": "not_found",
+    }
+    assert report["a"]["published"] and report["a"]["command_id"] == report["b"]["command_id"]
+
+    db_session.expire_all()
+    rows = dict(
+        db_session.query(models.Device.device_id, models.DeviceConfig)
+        .join(models.DeviceConfig, models.DeviceConfig.device_id == models.Device.id)
+        .all()
+    )
+    assert rows["a"].update_interval == 15 and rows["b"].update_interval == 15
+    assert rows["c"].update_interval == 60
+    # Nicht angegebene Felder bleiben unverändert
+    assert rows["a"].display_type == "128px" and rows["a"].ota_enabled is True
+
+    assert sorted(topic for topic, _ in published) == ["swissairdry/a/config", "swissairdry/b/config"]
+    assert all(payload["update_interval"] == 15 for _, payload in published)
+
+
+def test_config_patch_by_type_and_validation(client, published):
+    client.post("/devices:batch", json={"devices": [device("a"), device("s", "sensor")]})
+
+    response = client.patch("/devices/config:batch", json={
+        "device_type": "sensor",
+        "config": {"has_sensors": False},
+    })
+    assert [(item["device_id"], item["status"]) for item in response.json()] == [("s", "updated")]
+    assert [topic for topic, _ in published] == ["swissairdry/s/config"]
+
+    assert client.patch("/devices/config:batch", json={"config": {"has_sensors": False}}).status_code == 400
+    assert client.patch("/devices/config:batch", json={"device_type": "sensor", "config": {}}).status_code == 400
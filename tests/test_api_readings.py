@@ -0,0 +1,90 @@
+"""
+Tests für die Messwert-Endpunkte der API (api).
+
+Läuft mit dem FastAPI-TestClient gegen SQLite (siehe conftest.py):
+
+python -m pytest tests/test_api_readings.py
+"""
+
+import gzip
+import json
+from datetime import datetime
+
+import models
+from device_state import get_device_state_store
+
+
+def add_devices(db_session, *device_ids):
+    db_session.add_all(
+        models.Device(device_id=device_id, name=device_id, type="dryer") for device_id in device_ids
+    )
+    db_session.commit()
+
+
+def local_naive(value):
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return timestamp
+
+
+def test_batch_with_mixed_timezones(client, db_session):
+    """Gemischte Zeitzonen dürfen nach dem Commit keinen Fehler (und bei Wiederholung Duplikate) erzeugen."""
+    add_devices(db_session, "tz-1")
+    batch = [
+        {"device_id": "tz-1", "timestamp": "2026-03-01T10:00:00+02:00", "humidity": 50.0},
+        {"device_id": "tz-1", "timestamp": "2026-03-01T09:30:00", "humidity": 60.0},
+        {"device_id": "tz-1", "humidity": 70.0},
+    ]
+
+    response = client.post("/readings:batch", json=batch)
+
+    assert response.status_code == 200
+    assert response.json()["accepted"] == 3
+    assert db_session.query(models.SensorReading).count() == 3
+    # Der zuletzt angewendete Messwert ist der mit dem jüngsten Zeitpunkt
+    state = get_device_state_store().get("tz-1")
+    assert state["humidity"] == 70.0
+    assert state["telemetry_at"] > max(local_naive(item["timestamp"]) for item in batch[:2])
+
+
+def test_batch_gzip_and_unknown_devices(client, db_session):
+    add_devices(db_session, "gw-1", "gw-2")
+    batch = [
+        {"device_id": "gw-1", "temperature": 21.5},
+        {"device_id": "gw-2", "humidity": 48.0},
+        {"device_id": "gw-1", "humidity": 47.0},
+        {"device_id": "ghost", "humidity": 1.0},
+    ]
+
+    response = client.post(
+        "/readings:batch",
+        content=gzip.compress(json.dumps(batch).encode()),
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "accepted": 3,
+        "rejected": 1,
+        "unknown_devices": ["ghost"],
+        "per_device": {"gw-1": 2, "gw-2": 1},
+    }
+    assert db_session.query(models.SensorReading).count() == 3
+    assert all(device.is_online for device in db_session.query(models.Device))
+
+
+def test_batch_rejects_invalid_gzip_and_items(client, db_session):
+    response = client.post(
+        "/readings:batch",
+        content=b"not gzip",
+        headers={"Content-Type": "application/json", "Content-Encoding": "gzip"},
+    )
+    assert response.status_code == 400
+
+    response = client.post("/readings:batch", json=[{"device_id": "x", "humidity": "wet"}, {"humidity": 1}])
+    assert response.status_code == 422
+    # Alle ungültigen Einträge werden in einem Durchgang gemeldet
+    assert {error["loc"][0] for error in response.json()["detail"]} == {0, 1}
+    assert db_session.query(models.SensorReading).count() == 0
+
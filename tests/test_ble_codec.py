@@ -0,0 +1,221 @@
+"""
+Tests für den binären BLE-Nutzdaten-Codec (ble_codec).
+
+Prüft Round-Trips aller Nachrichtentypen, die JSON-Rückfallebene und die
+Robustheit des Referenz-Decoders gegenüber zufälligen und beschädigten Daten:
+
+python -m pytest tests/test_ble_codec.py
+"""
+
+import os
+import sys
+import json
+import random
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ble_codec import (  # noqa: E402
+    CODEC_VERSION,
+    MSG_COMMAND,
+    MSG_CONFIG,
+    MSG_SENSOR,
+    SCHEMAS,
+    CodecError,
+    decode,
+    decode_payload,
+    encode,
+    encode_payload,
+)
+
+SENSOR_MESSAGE = {
+    "temperature": -12.34,
+    "humidity": 55.5,
+    "pressure": 1013.2,
+    "fan_speed": 75,
+    "power_consumption": 1450.7,
+    "power": True,
+}
+
+COMMAND_MESSAGE = {
+    "action": "start_task",
+    "task_id": 42,
+    "name": "Trocknung Keller",
+    "duration": 480,
+    "fan_speed": 80,
+    "target_temperature": 22.5,
+    "target_humidity": 40.0,
+    "command_id": "9f1c2a7be0d44e0c8a51f3d2c6b7a8e9",
+}
+
+CONFIG_MESSAGE = {
+    "update_interval": 60,
+    "display_type": "128px",
+    "has_sensors": True,
+    "ota_enabled": False,
+    "ble_enabled": True,
+    "ble_advertise": True,
+    "ble_scan_interval": 30,
+}
+
+
+def _random_message(rng, msg_type):
+    """Erzeugt eine zufällige, gültige Nachricht für einen Nachrichtentyp."""
+    message = {}
+    for field, (_, kind) in SCHEMAS[msg_type].items():
+        if rng.random() < 0.3:
+            continue
+        if kind == "bool":
+            message[field] = rng.random() < 0.5
+        elif kind == "u8":
+            message[field] = rng.randint(0, 255)
+        elif kind == "u16":
+            message[field] = rng.randint(0, 65535)
+        elif kind == "u32":
+            message[field] = rng.randint(0, 2**32 - 1)
+        elif kind == "i16/100":
+            message[field] = rng.randint(-32768, 32767) / 100
+        elif kind == "u16/100":
+            message[field] = rng.randint(0, 65535) / 100
+        elif kind == "u32/10":
+            message[field] = rng.randint(0, 2**32 - 1) / 10
+        elif kind == "str":
+            message[field] = "".join(rng.choice("abcäöü XYZ-_0123") for _ in range(rng.randint(0, 40)))
+        elif kind == "hex":
+            message[field] = rng.randbytes(rng.randint(0, 20)).hex()
+        elif kind == "time":
+            message[field] = datetime.fromtimestamp(rng.randint(0, 2**31 - 1)).isoformat()
+    return message
+
+
+@pytest.mark.parametrize("msg_type, message", [
+    (MSG_SENSOR, SENSOR_MESSAGE),
+    (MSG_COMMAND, COMMAND_MESSAGE),
+    (MSG_CONFIG, CONFIG_MESSAGE),
+])
+def test_round_trip(msg_type, message):
+    frame = encode(msg_type, message)
+    assert decode(frame) == (msg_type, pytest.approx(message))
+
+
+def test_sensor_frame_fits_default_mtu():
+    # Standard-ATT-MTU 23 Byte = 20 Byte Nutzlast pro Benachrichtigung
+    frame = encode(MSG_SENSOR, {"temperature": 21.5, "humidity": 48.0, "fan_speed": 50})
+    assert len(frame) <= 20
+    assert len(frame) < len(json.dumps({"temperature": 21.5, "humidity": 48.0, "fan_speed": 50}))
+
+
+def test_timestamp_round_trip_to_seconds():
+    now = datetime.now().replace(microsecond=0)
+    _, message = decode(encode(MSG_COMMAND, {"power": True, "timestamp": now.isoformat()}))
+    assert message == {"power": True, "timestamp": now.isoformat()}
+
+
+def test_command_id_is_sent_as_raw_bytes():
+    command_id = "9f1c2a7be0d44e0c8a51f3d2c6b7a8e9"
+    frame = encode(MSG_CONFIG, {"update_interval": 30, "command_id": command_id})
+    # 16 Byte statt 32 Zeichen Text
+    assert len(frame) == 2 + 4 + 2 + 16
+    assert decode(frame) == (MSG_CONFIG, {"update_interval": 30, "command_id": command_id})
+    # Keine Hex-ID: Rückfall auf JSON statt Fehler
+    payload = encode_payload(MSG_COMMAND, {"power": True, "command_id": "abc"}, codec_version=CODEC_VERSION)
+    assert json.loads(payload) == {"power": True, "command_id": "abc"}
+
+
+def test_none_fields_are_omitted():
+    _, message = decode(encode(MSG_SENSOR, {"temperature": 20.0, "pressure": None}))
+    assert message == {"temperature": 20.0}
+
+
+def test_unknown_tags_are_skipped():
+    frame = encode(MSG_SENSOR, {"temperature": 20.0})
+    # Eintrag mit Tag 200 einer neueren Firmware
+    frame += bytes((200, 3, 1, 2, 3))
+    assert decode(frame) == (MSG_SENSOR, {"temperature": 20.0})
+
+
+@pytest.mark.parametrize("message", [
+    {"unknown_field": 1},
+    {"fan_speed": 256},
+    {"fan_speed": -1},
+    {"temperature": 400.0},
+    {"fan_speed": "schnell"},
+    {"name": "x" * 256},
+])
+def test_encode_rejects_invalid_messages(message):
+    msg_type = MSG_COMMAND if "name" in message else MSG_SENSOR
+    with pytest.raises(CodecError):
+        encode(msg_type, message)
+
+
+@pytest.mark.parametrize("frame", [
+    b"",
+    b"\xa1",
+    bytes((0xA0 | (CODEC_VERSION + 1), MSG_SENSOR)),
+    bytes((0xA0 | CODEC_VERSION, 99)),
+    bytes((0xA0 | CODEC_VERSION, MSG_SENSOR, 1)),
+    bytes((0xA0 | CODEC_VERSION, MSG_SENSOR, 1, 2, 0)),
+    bytes((0xA0 | CODEC_VERSION, MSG_SENSOR, 1, 1, 0)),
+    bytes((0xA0 | CODEC_VERSION, MSG_COMMAND, 5, 2, 0xC3, 0x28)),
+])
+def test_decode_rejects_malformed_frames(frame):
+    with pytest.raises(CodecError):
+        decode(frame)
+
+
+def test_json_fallback_without_negotiated_codec():
+    payload = encode_payload(MSG_COMMAND, {"fan_speed": 40}, codec_version=0)
+    assert json.loads(payload) == {"fan_speed": 40}
+    assert decode_payload(payload) == {"fan_speed": 40}
+
+
+def test_binary_with_negotiated_codec():
+    payload = encode_payload(MSG_COMMAND, {"fan_speed": 40}, codec_version=CODEC_VERSION)
+    assert payload[0] == 0xA0 | CODEC_VERSION
+    assert decode_payload(payload, MSG_COMMAND) == {"fan_speed": 40}
+
+
+def test_unencodable_message_falls_back_to_json():
+    message = {"fan_speed": 40, "custom": {"nested": True}}
+    payload = encode_payload(MSG_COMMAND, message, codec_version=CODEC_VERSION)
+    assert json.loads(payload) == message
+
+
+def test_decode_payload_checks_message_type():
+    with pytest.raises(CodecError):
+        decode_payload(encode(MSG_CONFIG, {"update_interval": 10}), MSG_SENSOR)
+
+
+@pytest.mark.parametrize("msg_type", [MSG_SENSOR, MSG_COMMAND, MSG_CONFIG])
+def test_fuzz_round_trip(msg_type):
+    rng = random.Random(msg_type)
+    for _ in range(500):
+        message = _random_message(rng, msg_type)
+        assert decode(encode(msg_type, message)) == (msg_type, pytest.approx(message))
+
+
+def test_fuzz_random_bytes_never_crash():
+    rng = random.Random(1234)
+    for _ in range(5000):
+        length = rng.randint(0, 48)
+        data = bytes(rng.randint(0, 255) for _ in range(length))
+        if rng.random() < 0.7:
+            # Gültigen Kopf erzwingen, damit der TLV-Parser erreicht wird
+            data = bytes((0xA0 | CODEC_VERSION, rng.choice((MSG_SENSOR, MSG_COMMAND, MSG_CONFIG)))) + data
+        try:
+            decode_payload(data)
+        except CodecError:
+            pass
+
+
+def test_fuzz_truncated_frames():
+    rng = random.Random(99)
+    for _ in range(200):
+        frame = encode(MSG_COMMAND, _random_message(rng, MSG_COMMAND))
+        for cut in range(len(frame)):
+            try:
+                decode(frame[:cut])
+            except CodecError:
+                pass
@@ -0,0 +1,38 @@
+"""
+Tests für die gebündelte BLE-Sensordaten-Speicherung (ble_reading_writer).
+
+Der Schreiber wird außerhalb eines Event-Loops erzeugt und danach in einem
+eigenen Loop betrieben, wie beim Start des BLE-Dienstes:
+
+python -m pytest tests/test_ble_reading_writer.py
+"""
+
+import asyncio
+
+import models
+from ble_reading_writer import BLEReadingWriter
+
+
+def test_queue_belongs_to_running_loop(db_session):
+    db_session.add(models.Device(device_id="ble-1", name="ble-1", type="sensor", ble_address="AA:BB"))
+    db_session.commit()
+    writer = BLEReadingWriter(max_queue=10, batch_size=5, flush_interval=0.05)
+    # Vor dem Start gibt es keine Warteschlange; Messwerte werden verworfen
+    writer.submit("AA:BB", {"humidity": 1.0})
+    assert writer.stats()["dropped"] == 1
+
+    async def run():
+        await writer.start()
+        for humidity in (40.0, 41.0, 42.0):
+            writer.submit("AA:BB", {"humidity": humidity})
+        writer.submit("CC:DD", {"humidity": 99.0})
+        await writer.stop()
+
+    # Zwei Loops hintereinander: jeder Start legt eine neue Warteschlange an
+    asyncio.run(run())
+    asyncio.run(run())
+
+    stats = writer.stats()
+    assert stats["written"] == 6 and stats["unknown_device"] == 2
+    assert stats["queue_depth"] == 0 and writer._queue is None
+    assert db_session.query(models.SensorReading).count() == 6
@@ -0,0 +1,159 @@
+"""
+Tests für die Datenbankzugriffe des BLE-Dienstes (ble_service).
+
+Scan-Intervalle, Verbindungspriorität, die Registrierung von Advertisement-
+und verbundenen Geräten, Adressauflösung und Konfiguration dürfen den
+BLE-Event-Loop nicht blockieren; alle Abfragen müssen im Datenbank-Thread
+laufen:
+
+python -m pytest tests/test_ble_service.py
+"""
+
+import asyncio
+import json
+import threading
+
+from bleak.backends.device import BLEDevice
+
+import ble_service
+import device_manager
+import models
+from ble_connections import PRIORITY_DEFAULT, PRIORITY_TASK
+from ble_service import BLEService
+from device_manager import get_device_manager
+
+
+def record_db_threads(monkeypatch):
+    """Zeichnet auf, in welchen Threads Datenbanksitzungen geöffnet werden."""
+    threads = []
+    get_db = ble_service.get_db
+
+    def recording_get_db():
+        threads.append(threading.current_thread().name)
+        return get_db()
+
+    monkeypatch.setattr(ble_service, "get_db", recording_get_db)
+    return threads
+
+
+def test_device_cache_and_priority_off_loop(db_session, monkeypatch):
+    task = models.Task(name="Trocknung")
+    busy = models.Device(device_id="busy", name="busy", type="dryer", ble_address="AA:01")
+    idle = models.Device(device_id="idle", name="idle", type="dryer", ble_address="AA:02")
+    db_session.add_all([task, busy, idle])
+    db_session.flush()
+    db_session.add_all([
+        models.DeviceConfig(device_id=busy.id, ble_scan_interval=30),
+        models.TaskAssignment(device_id=busy.id, task_id=task.id, status="running"),
+        models.TaskAssignment(device_id=idle.id, task_id=task.id, status="completed"),
+    ])
+    db_session.commit()
+    threads = record_db_threads(monkeypatch)
+    service = BLEService()
+
+    async def run():
+        await service._refresh_device_cache()
+        return threading.current_thread().name, service._connection_priority("AA:01"), service._connection_priority("AA:02")
+
+    loop_thread, busy_priority, idle_priority = asyncio.run(run())
+
+    assert service._scan_intervals == {"AA:01": 30.0}
+    assert (busy_priority, idle_priority) == (PRIORITY_TASK, PRIORITY_DEFAULT)
+    assert threads and loop_thread not in threads
+
+
+def test_advertising_device_registered_off_loop(db_session, monkeypatch):
+    threads = record_db_threads(monkeypatch)
+    service = BLEService()
+
+    async def run():
+        service._register_advertising_device(BLEDevice("AA:BB:CC:00:00:01", "Sensor", None))
+        await asyncio.get_running_loop().run_in_executor(service._db_executor, lambda: None)
+        await asyncio.sleep(0)
+        return threading.current_thread().name
+
+    loop_thread = asyncio.run(run())
+
+    assert "AA:BB:CC:00:00:01" in service._registered_addresses
+    assert threads and loop_thread not in threads
+    device = db_session.query(models.Device).filter_by(ble_address="AA:BB:CC:00:00:01").one()
+    assert device.device_id == "ble_AABBCC000001" and device.name == "Sensor"
+
+
+def test_failed_registration_is_retried(monkeypatch):
+    service = BLEService()
+    monkeypatch.setattr(service, "_store_advertising_device", lambda address, name: False)
+
+    async def run():
+        service._register_advertising_device(BLEDevice("AA:BB", None, None))
+        await asyncio.get_running_loop().run_in_executor(service._db_executor, lambda: None)
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert "AA:BB" not in service._registered_addresses
+
+
+class InfoClient:
+    """Verbundener Client, der nur die Geräteinformationen liefert."""
+
+    def __init__(self, info):
+        self.info = info
+
+    async def read_gatt_char(self, char_uuid):
+        return json.dumps(self.info).encode()
+
+
+def test_connected_device_and_config_stored_off_loop(db_session, monkeypatch):
+    threads = record_db_threads(monkeypatch)
+    service = BLEService()
+    sent = []
+
+    async def submit(address, message, require_ack, channel="command"):
+        sent.append((address, channel, message["update_interval"]))
+        return True
+
+    monkeypatch.setattr(service.commands, "submit", submit)
+    info = {"device_id": "dryer-7", "name": "Trockner 7", "type": "dryer", "firmware_version": "2.1"}
+
+    async def run():
+        await service._register_device_in_db(InfoClient(info), BLEDevice("AA:07", "Trockner", None))
+        service._device_addresses.clear()
+        updated = await service.update_config("dryer-7", {"update_interval": 15})
+        return threading.current_thread().name, updated
+
+    loop_thread, updated = asyncio.run(run())
+
+    assert updated and sent == [("AA:07", "config", 15)]
+    # Registrierung, Adressauflösung und Konfiguration im Datenbank-Thread
+    assert len(threads) == 3 and loop_thread not in threads
+    device = db_session.query(models.Device).filter_by(device_id="dryer-7").one()
+    assert (device.ble_address, device.firmware_version, device.config.update_interval) == ("AA:07", "2.1", 15)
+    assert service._device_addresses == {"dryer-7": "AA:07"}
+
+
+def test_connected_callback_updates_db_off_loop(db_session, monkeypatch):
+    db_session.add(models.Device(device_id="dryer-8", name="Trockner 8", type="dryer", ble_address="AA:08"))
+    db_session.commit()
+    threads = []
+    get_db = device_manager.get_db
+
+    def recording_get_db():
+        threads.append(threading.current_thread().name)
+        return get_db()
+
+    monkeypatch.setattr(device_manager, "get_db", recording_get_db)
+    manager = get_device_manager()
+    service = BLEService()
+    monkeypatch.setattr(manager, "_ble_service", service)
+
+    async def run():
+        manager._handle_ble_device_connected(BLEDevice("AA:08", "Trockner", None), None)
+        await asyncio.get_running_loop().run_in_executor(service._db_executor, lambda: None)
+        return threading.current_thread().name
+
+    loop_thread = asyncio.run(run())
+
+    assert threads and loop_thread not in threads
+    db_session.expire_all()
+    assert db_session.query(models.Device).filter_by(device_id="dryer-8").one().is_online
+    assert manager.states.get("dryer-8")["ble_address"] == "AA:08"
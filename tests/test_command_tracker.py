@@ -0,0 +1,133 @@
+"""
+Tests für die Verfolgung von Befehlsbestätigungen (command_tracker).
+
+Zeitrad und Latenzen laufen über eine Testuhr; ``expire`` wird direkt
+aufgerufen statt über den Hintergrund-Thread:
+
+python -m pytest tests/test_command_tracker.py
+"""
+
+import asyncio
+
+import ble_service
+from ble_service import BLEService
+from command_tracker import CommandTracker
+from device_manager import get_device_manager
+from leader_election import LeaderUnavailable, get_leader_election
+
+
+class Clock:
+    """Monotone Testuhr in Sekunden."""
+
+    def __init__(self):
+        self.seconds = 1000.0
+
+    def __call__(self):
+        return self.seconds
+
+    def advance(self, seconds):
+        self.seconds += seconds
+
+
+def make_tracker(**kwargs):
+    clock = Clock()
+    return CommandTracker(tick=0.5, clock=clock, **kwargs), clock
+
+
+def test_ack_matches_by_id_and_latest_kind():
+    tracker, clock = make_tracker()
+    tracker.track("group-1", {"a": "dryer", "b": "sensor"}, "group")
+    tracker.track("ctl-1", {"a": "dryer"}, "control")
+    tracker.track("ctl-2", {"a": "dryer"}, "control")
+    clock.advance(0.25)
+
+    assert tracker.ack("b", "group-1") == "group"
+    # Ohne ID gilt die Bestätigung dem neuesten offenen Befehl dieser Art
+    assert tracker.ack("a", kind="control", status="error", message="busy") == "control"
+    assert tracker.ack("a", "unknown") is None
+    assert tracker.ack("b", "group-1") is None
+
+    group = tracker.status("group-1")
+    assert group["counts"] == {"pending": 1, "success": 1} and not group["complete"]
+    assert group["members"]["b"]["latency_ms"] == 250.0
+    assert tracker.status("ctl-2")["members"]["a"] == {"status": "error", "latency_ms": 250.0, "message": "busy"}
+    assert tracker.status("ctl-1")["members"]["a"]["status"] == "pending"
+    assert tracker.status("missing") is None
+    assert tracker.metrics == {"tracked": 4, "acked": 1, "errors": 1, "timeouts": 0, "unmatched": 2}
+
+
+def test_unanswered_commands_expire_through_wheel():
+    tracker, clock = make_tracker(timeout=2.0)
+    tracker.track("cfg-1", {"a": "dryer", "b": "dryer"}, "config")
+    tracker.ack("a", "cfg-1")
+
+    clock.advance(1.5)
+    assert tracker.expire() == []
+
+    clock.advance(1.0)
+    assert tracker.expire() == [("cfg-1", "b")]
+    state = tracker.wait("cfg-1", timeout=0)
+    assert state["complete"] and state["counts"] == {"success": 1, "timeout": 1}
+    # Eine verspätete Bestätigung zählt nicht mehr
+    assert tracker.ack("b", kind="config") is None
+    stats = tracker.stats()
+    assert stats["pending"] == 0 and stats["timeouts"] == 1
+    assert stats["by_device_type"]["dryer"]["timeouts"] == 1
+
+
+def test_latency_histogram_buckets():
+    tracker, clock = make_tracker()
+    for number, seconds in enumerate((0.003, 0.007, 0.04, 40.0)):
+        tracker.track(f"cmd-{number}", {"a": "dryer"}, "command", transport="ble")
+        clock.advance(seconds)
+        tracker.ack("a", f"cmd-{number}")
+
+    histogram = tracker.stats()["by_transport"]["ble"]
+    assert histogram["count"] == 4 and histogram["max_ms"] == 40000.0
+    buckets = {bound: count for bound, count in histogram["buckets"].items() if count}
+    assert buckets == {"le_5": 1, "le_10": 1, "le_50": 1, "le_inf": 1}
+    assert (histogram["p50_ms"], histogram["p95_ms"]) == (10.0, 40000.0)
+    assert tracker.stats()["by_device_type"]["dryer"]["buckets"] == histogram["buckets"]
+
+
+def test_ble_commands_carry_tracked_id(monkeypatch):
+    service = BLEService()
+    sent = []
+
+    async def submit(address, message, require_ack, channel="command"):
+        sent.append(message)
+        return True
+
+    monkeypatch.setattr(service.commands, "submit", submit)
+    monkeypatch.setattr(ble_service, "get_command_tracker", lambda: tracker)
+    tracker = CommandTracker()
+
+    command = {"power": True}
+    assert asyncio.run(service._tracked_submit("ble-1", "control", "AA:01", command, True))
+
+    command_id = sent[0]["command_id"]
+    assert sent == [{"power": True, "command_id": command_id}] and command == {"power": True}
+    assert tracker.status(command_id)["members"]["ble-1"]["status"] == "success"
+    assert tracker.status(command_id)["transport"] == "ble"
+
+
+def test_followers_without_leader_send_untracked(monkeypatch):
+    manager = get_device_manager()
+    tracker = CommandTracker()
+    monkeypatch.setattr(manager, "commands", tracker)
+
+    def unreachable(command, timeout=None, **args):
+        raise LeaderUnavailable("kein Leader")
+
+    monkeypatch.setattr(get_leader_election(), "call", unreachable)
+
+    # Ohne eigene Ingest-Zuständigkeit kämen weder Bestätigungen noch Abläufe an
+    untracked = manager.track_command({"a": "dryer"}, "control")
+    assert tracker.status(untracked) is None and tracker.stats()["pending"] == 0
+
+    tracker.start()
+    try:
+        tracked = manager.track_command({"a": "dryer"}, "control")
+    finally:
+        tracker.stop()
+    assert tracker.status(tracked)["members"]["a"]["status"] == "pending"
@@ -0,0 +1,122 @@
+"""
+Tests für Gerätegruppen (device_groups) und Gruppenbefehle.
+
+Läuft mit dem FastAPI-TestClient gegen SQLite; MQTT wird durch eine
+Aufzeichnung ersetzt, Bestätigungen laufen über den MQTT-Handler des
+Gerätemanagers und werden mit ``flush`` direkt geschrieben:
+
+python -m pytest tests/test_device_groups.py
+"""
+
+import pytest
+
+import device_groups
+import models
+from device_groups import GroupAckRecorder
+from device_manager import get_device_manager
+
+
+@pytest.fixture
+def published(monkeypatch):
+    """Zeichnet Einzel- und Batch-Veröffentlichungen per MQTT auf."""
+    messages = []
+    mqtt = get_device_manager().mqtt
+
+    def publish_sync(topic, payload, retain=False):
+        messages.append((topic, payload))
+
+    def publish_many_sync(batch, retain=False, timeout=10.0):
+        messages.extend(batch)
+        return [True] * len(batch)
+
+    monkeypatch.setattr(mqtt, "publish_sync", publish_sync)
+    monkeypatch.setattr(mqtt, "publish_many_sync", publish_many_sync)
+    return messages
+
+
+def add_devices(client, *device_ids):
+    client.post("/devices:batch", json={"devices": [
+        {"device_id": device_id, "name": device_id, "type": "esp32"} for device_id in device_ids
+    ]})
+
+
+def configs(published):
+    return {topic.split("/")[1]: payload["groups"] for topic, payload in published if topic.endswith("/config")}
+
+
+def test_membership_changes_push_group_lists(client, published):
+    add_devices(client, "a", "b", "c")
+    client.post("/groups", json={"group_id": "site-1", "name": "Baustelle", "device_ids": ["a", "b"]})
+    client.post("/groups", json={"group_id": "room-1", "name": "Keller", "kind": "room", "device_ids": ["b"]})
+    assert configs(published) == {"a": ["site-1"], "b": ["room-1", "site-1"]}
+
+    # Nur beigetretene und ausgetretene Geräte erhalten eine neue Konfiguration
+    published.clear()
+    response = client.put("/groups/site-1/members", json={"device_ids": ["b", "c"]})
+    assert response.json()["device_ids"] == ["b", "c"]
+    assert configs(published) == {"a": [], "c": ["site-1"]}
+
+    published.clear()
+    client.delete("/groups/room-1")
+    assert configs(published) == {"b": ["site-1"]}
+
+
+def test_group_command_stores_pending_member_rows(client, db_session, published):
+    add_devices(client, "a", "b")
+    client.post("/groups", json={"group_id": "site-1", "name": "Baustelle", "device_ids": ["a", "b"]})
+    published.clear()
+
+    response = client.post("/groups/site-1/control/power", params={"state": True})
+
+    assert response.status_code == 200
+    command_id = response.json()["command_id"]
+    assert response.json()["members"] == 2
+    assert published == [("swissairdry/group/site-1/control", published[0][1])]
+    assert published[0][1]["power"] is True and published[0][1]["command_id"] == command_id
+    rows = db_session.query(models.GroupCommandAck.device_id, models.GroupCommandAck.status).all()
+    assert sorted(rows) == [("a", "pending"), ("b", "pending")]
+
+
+def test_acks_only_update_pending_members(client, published):
+    add_devices(client, "a", "b", "c")
+    client.post("/groups", json={"group_id": "site-1", "name": "Baustelle", "device_ids": ["a", "b", "c"]})
+    command_id = client.post("/groups/site-1/control/fan", params={"speed": 40}).json()["command_id"]
+    manager = get_device_manager()
+
+    manager._handle_control_ack("swissairdry/a/control/ack", {"command_id": command_id})
+    manager._handle_control_ack(
+        "swissairdry/b/control/ack", {"command_id": command_id, "status": "error", "message": "Motor blockiert"},
+    )
+    assert manager.group_acks.flush() == 2
+    # Eine spätere Bestätigung überschreibt die erste nicht
+    manager._handle_control_ack("swissairdry/b/control/ack", {"command_id": command_id})
+    manager.group_acks.flush()
+
+    state = client.get(f"/groups/site-1/commands/{command_id}").json()
+    assert state["counts"] == {"success": 1, "error": 1, "pending": 1}
+    acks = {ack["device_id"]: ack for ack in state["acks"]}
+    assert acks["b"]["status"] == "error" and acks["b"]["message"] == "Motor blockiert"
+    assert acks["a"]["acked_at"] and acks["c"]["acked_at"] is None
+
+
+def test_recorder_keeps_first_ack_and_requeues_failed_flush(db_session, monkeypatch):
+    recorder = GroupAckRecorder()
+    recorder.record("a", "cmd-1", status="error")
+    recorder.record("a", "cmd-1")
+    recorder.record("b", "cmd-1")
+
+    class FailingSession:
+        def execute(self, statement, rows):
+            raise RuntimeError("Datenbank nicht erreichbar")
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(device_groups, "get_db", lambda: iter([FailingSession()]))
+    assert recorder.flush() == 0
+    stats = recorder.stats()
+    assert stats["pending"] == 2 and stats["received"] == 3 and stats["failed"] == 2
+    assert recorder._pending[("cmd-1", "a")]["b_status"] == "error"
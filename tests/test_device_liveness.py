@@ -0,0 +1,112 @@
+"""
+Tests für die Online-/Offline-Erkennung (device_liveness).
+
+Das Zeitrad läuft über eine Testuhr; ``tick`` und ``flush`` werden direkt
+aufgerufen, die Änderungen landen in SQLite:
+
+python -m pytest tests/test_device_liveness.py
+"""
+
+import models
+from device_liveness import LivenessTracker
+
+
+class Clock:
+    """Monotone Testuhr in Sekunden."""
+
+    def __init__(self):
+        self.seconds = 1000.0
+
+    def __call__(self):
+        return self.seconds
+
+    def advance(self, seconds):
+        self.seconds += seconds
+
+
+def make_tracker():
+    clock = Clock()
+    tracker = LivenessTracker(missed_heartbeats=3, default_interval=10, clock=clock)
+    changes = []
+    tracker.add_listener(lambda device_id, online: changes.append((device_id, online)))
+    return tracker, clock, changes
+
+
+def add_device(db_session, device_id, is_online=False, update_interval=None):
+    device = models.Device(device_id=device_id, name=device_id, type="esp32", is_online=is_online)
+    db_session.add(device)
+    db_session.flush()
+    if update_interval:
+        db_session.add(models.DeviceConfig(device_id=device.id, update_interval=update_interval))
+    db_session.commit()
+
+
+def online_flags(db_session):
+    db_session.expire_all()
+    return dict(db_session.query(models.Device.device_id, models.Device.is_online))
+
+
+def test_missed_heartbeats_flip_device_offline():
+    tracker, clock, changes = make_tracker()
+    tracker.heartbeat("a")
+    tracker.heartbeat("b")
+    tracker.set_interval("b", 60)
+
+    clock.advance(25)
+    tracker.heartbeat("a")
+    # Das neue Intervall gilt erst ab dem nächsten Heartbeat
+    clock.advance(5)
+    assert tracker.tick() == ["b"]
+    tracker.heartbeat("b")
+    clock.advance(60)
+    assert tracker.tick() == ["a"]
+    clock.advance(119)
+    assert tracker.tick() == []
+    clock.advance(1)
+    assert tracker.tick() == ["b"]
+
+    assert changes == [("a", True), ("b", True), ("b", False), ("b", True), ("a", False), ("b", False)]
+    assert not tracker.is_online("a") and tracker.stats()["timeouts"] == 3
+
+
+def test_flush_writes_changes_in_one_batch(db_session):
+    for device_id in ("a", "b", "c"):
+        add_device(db_session, device_id, is_online=device_id == "c")
+    tracker, clock, changes = make_tracker()
+
+    tracker.heartbeat("a")
+    tracker.heartbeat("b")
+    tracker.heartbeat("c")
+    tracker.offline("b")
+    tracker.offline("ghost")
+
+    assert tracker.flush() == 3
+    assert online_flags(db_session) == {"a": True, "b": False, "c": True}
+    assert tracker.flush() == 0
+    stats = tracker.stats()
+    assert (stats["flushes"], stats["rows_written"], stats["went_offline"]) == (1, 3, 1)
+
+
+def test_start_after_idle_period_keeps_devices_online(db_session):
+    add_device(db_session, "a", is_online=True, update_interval=600)
+    add_device(db_session, "b", is_online=True)
+    add_device(db_session, "c")
+    tracker, clock, changes = make_tracker()
+
+    # Der Worker wird erst nach zwei Stunden Leader
+    clock.advance(7200)
+    tracker.start()
+    clock.advance(1)
+    try:
+        assert tracker.tick() == []
+    finally:
+        tracker.stop()
+    assert tracker.is_online("a") and tracker.is_online("b")
+
+    # Geräte aus der Datenbank erhalten eine volle Frist ab dem Start
+    clock.advance(29)
+    assert tracker.tick() == ["b"]
+    clock.advance(1770)
+    assert tracker.tick() == ["a"]
+    tracker.flush()
+    assert online_flags(db_session) == {"a": False, "b": False, "c": False}
@@ -0,0 +1,91 @@
+"""
+Tests für die Geräte-Log-Aufnahme (device_logs) und die Schema-Ergänzung
+der Log-Spalten (models.upgrade_schema).
+
+python -m pytest tests/test_device_logs.py
+"""
+
+import time
+
+from sqlalchemy import create_engine, inspect, text
+
+import models
+from database import SessionLocal
+from device_logs import RATE_LIMITED_MESSAGE, DeviceLogIngestor
+
+WINDOW = 0.05
+
+
+def stored(db_session, message):
+    db_session.expire_all()
+    return sorted(
+        row.count for row in db_session.query(models.DeviceLog).filter_by(message=message)
+    )
+
+
+def test_closed_window_keeps_unwritten_repeats(db_session):
+    db_session.add(models.Device(device_id="dev-1", name="dev-1", type="dryer"))
+    db_session.commit()
+    ingestor = DeviceLogIngestor(SessionLocal, window=WINDOW, default_sampling={})
+
+    ingestor.submit("dev-1", "error", "Sensor defekt")
+    ingestor.flush()
+    ingestor.submit("dev-1", "error", "Sensor defekt")
+    ingestor.submit("dev-1", "error", "Sensor defekt")
+    time.sleep(WINDOW * 2)
+    # Neues Fenster, bevor die Wiederholungen geschrieben wurden
+    assert ingestor.submit("dev-1", "error", "Sensor defekt") == "accepted"
+    # Ein nie geschriebenes Fenster geht ebenfalls nicht verloren
+    ingestor.submit("dev-1", "error", "Lüfter blockiert")
+    time.sleep(WINDOW * 2)
+    ingestor.submit("dev-1", "error", "Lüfter blockiert")
+    assert ingestor.stats()["closed_groups"] == 2
+
+    ingestor.flush()
+
+    assert stored(db_session, "Sensor defekt") == [1, 3]
+    assert stored(db_session, "Lüfter blockiert") == [1, 1]
+    assert ingestor.stats()["closed_groups"] == 0
+
+
+def test_closed_rate_limit_window_is_written(db_session):
+    db_session.add(models.Device(device_id="dev-1", name="dev-1", type="dryer"))
+    db_session.commit()
+    ingestor = DeviceLogIngestor(SessionLocal, rate=0, burst=1, window=WINDOW, default_sampling={})
+
+    assert ingestor.submit("dev-1", "info", "Zeile 0") == "accepted"
+    assert ingestor.submit("dev-1", "info", "Zeile 1") == "rate_limited"
+    ingestor.flush()
+    ingestor.submit("dev-1", "info", "Zeile 2")
+    time.sleep(WINDOW * 2)
+    ingestor.submit("dev-1", "info", "Zeile 3")
+    ingestor.flush()
+
+    assert stored(db_session, RATE_LIMITED_MESSAGE) == [1, 2]
+
+
+def test_upgrade_schema_adds_log_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE device_logs (id INTEGER PRIMARY KEY, device_id INTEGER, "
+            "timestamp DATETIME NOT NULL, level VARCHAR(10) NOT NULL, message TEXT NOT NULL)"
+        ))
+        conn.execute(text("CREATE TABLE device_configs (id INTEGER PRIMARY KEY, device_id INTEGER UNIQUE)"))
+        conn.execute(text(
+            "INSERT INTO device_logs (device_id, timestamp, level, message) "
+            "VALUES (1, '2026-01-01 10:00:00.000000', 'info', 'alt')"
+        ))
+
+    models.upgrade_schema(engine)
+    # Ein zweiter Start ändert nichts mehr
+    models.upgrade_schema(engine)
+
+    columns = {column["name"] for column in inspect(engine).get_columns("device_logs")}
+    assert {"count", "first_seen", "last_seen"} <= columns
+    assert "log_sampling" in {column["name"] for column in inspect(engine).get_columns("device_configs")}
+    with engine.connect() as conn:
+        row = conn.execute(text("SELECT count, first_seen, last_seen, timestamp FROM device_logs")).one()
+    assert row.count == 1 and row.first_seen == row.last_seen == row.timestamp
+    assert inspect(engine).has_table("task_assignments")
+    engine.dispose()
@@ -0,0 +1,59 @@
+"""
+Tests für den Gerätezustandsspeicher (device_state).
+
+Vergleicht ``query`` mit einer einfachen Referenz über alle Filter- und
+Seitenkombinationen, auch nach Änderungen und Löschungen:
+
+python -m pytest tests/test_device_state.py
+"""
+
+import random
+
+from device_state import DeviceStateStore
+
+
+def reference(store, device_type=None, is_online=None, device_ids=None, skip=0, limit=None):
+    states = [store.get(device_id) for device_id in sorted(store._states)]
+    result = [
+        state for state in states
+        if state["id"] is not None
+        and (device_type is None or state["type"] == device_type)
+        and (is_online is None or state["is_online"] == is_online)
+        and (device_ids is None or state["device_id"] in device_ids)
+    ]
+    end = None if limit is None else skip + limit
+    return [state["device_id"] for state in result[skip:end]]
+
+
+def build_store(rng, count=300):
+    store = DeviceStateStore()
+    for number in rng.sample(range(10000), count):
+        device_id = f"dev-{number:05d}"
+        store.upsert(device_id, id=number, type=rng.choice(["dryer", "sensor", "fan"]))
+        if rng.random() < 0.5:
+            store.update_telemetry(device_id, {"humidity": 50.0})
+    # Geräte ohne Datenbankzeile bleiben standardmäßig unsichtbar
+    store.update_telemetry("unregistered", {"humidity": 10.0})
+    return store
+
+
+def test_query_matches_reference():
+    rng = random.Random(3)
+    store = build_store(rng)
+    some_ids = set(rng.sample(sorted(store._states), 20))
+    for _ in range(3):
+        for device_type in (None, "dryer", "fan", "missing"):
+            for is_online in (None, True, False):
+                for device_ids in (None, some_ids):
+                    for skip, limit in ((0, None), (0, 10), (25, 7), (1000, 5)):
+                        kwargs = dict(device_type=device_type, is_online=is_online, device_ids=device_ids)
+                        result = [state["device_id"] for state in store.query(skip=skip, limit=limit, **kwargs)]
+                        assert result == reference(store, skip=skip, limit=limit, **kwargs)
+        # Änderungen und Löschungen müssen den sortierten Index nachführen
+        for device_id in rng.sample(sorted(store._states), 30):
+            if rng.random() < 0.5:
+                store.remove(device_id)
+            else:
+                store.set_online(device_id, rng.random() < 0.5)
+        store.upsert(f"dev-new-{rng.randint(0, 999)}", id=1, type="fan")
+    assert store._order == sorted(store._states)
@@ -0,0 +1,140 @@
+"""
+Tests für die Verarbeitung von Discovery-Nachrichten (discovery).
+
+Der Coalescer schreibt mit ``flush`` direkt gegen SQLite (ON CONFLICT),
+ohne Hintergrund-Thread:
+
+python -m pytest tests/test_discovery.py
+"""
+
+import threading
+
+import models
+from database import SessionLocal
+from device_manager import get_device_manager
+from discovery import DiscoveryCoalescer, WelcomeScheduler
+
+
+def discovery(device_id, **fields):
+    return {"device_id": device_id, "type": "esp32", **fields}
+
+
+def test_unchanged_payloads_are_skipped_by_hash(db_session):
+    coalescer = DiscoveryCoalescer(SessionLocal)
+    assert coalescer.submit(discovery("a", firmware_version="1.0", uptime=5))
+    assert coalescer.flush() == 1
+
+    # Flüchtige Felder ändern den Hash nicht
+    assert not coalescer.submit(discovery("a", firmware_version="1.0", uptime=900, rssi=-70))
+    assert coalescer.submit(discovery("a", firmware_version="1.1"))
+    assert not coalescer.submit(discovery("a", firmware_version="1.1"))
+    assert not coalescer.submit({"device_id": "b"})
+    coalescer.flush()
+
+    # Nach ``forget`` wird dieselbe Nachricht erneut geschrieben
+    coalescer.forget("a")
+    assert coalescer.submit(discovery("a", firmware_version="1.1"))
+    assert coalescer.stats() == {
+        "queued": 1, "received": 5, "unchanged": 2, "coalesced": 0, "stored": 2, "batches": 2, "failed": 0,
+    }
+
+
+def test_upsert_coalesces_and_keeps_stored_values(db_session):
+    db_session.add(models.Device(device_id="old", name="Umbenannt", type="esp32", mac_address="AA:BB"))
+    db_session.commit()
+    stored = []
+    coalescer = DiscoveryCoalescer(SessionLocal, batch_size=2, on_stored=stored.extend)
+
+    coalescer.submit(discovery("old", name="Werksname", firmware_version="1.0"))
+    coalescer.submit(discovery("new", firmware_version="1.0"))
+    coalescer.submit(discovery("new", firmware_version="2.0", ip_address="10.0.0.7"))
+    coalescer.submit(discovery("third", type="sensor"))
+
+    assert coalescer.flush() == 3
+    assert coalescer.stats()["coalesced"] == 1
+    devices = {device.device_id: device for device in db_session.query(models.Device)}
+    # Name und Typ nur beim Anlegen, fehlende Felder behalten ihren Wert
+    assert (devices["old"].name, devices["old"].mac_address, devices["old"].firmware_version) == ("Umbenannt", "AA:BB", "1.0")
+    assert (devices["new"].firmware_version, devices["new"].ip_address) == ("2.0", "10.0.0.7")
+    assert devices["third"].name == "SwissAirDry sensor-third" and devices["third"].is_online
+    assert {row["device_id"]: row["id"] for row in stored} == {
+        device_id: device.id for device_id, device in devices.items()
+    }
+
+
+def test_failed_batch_is_requeued(db_session):
+    class FailingSession:
+        def get_bind(self):
+            raise RuntimeError("Datenbank nicht erreichbar")
+
+        def rollback(self):
+            pass
+
+        def close(self):
+            pass
+
+    sessions = [FailingSession()]
+    coalescer = DiscoveryCoalescer(lambda: sessions.pop() if sessions else SessionLocal())
+    coalescer.submit(discovery("a", firmware_version="1.0"))
+    coalescer.submit(discovery("b", firmware_version="1.0"))
+
+    assert coalescer.flush() == 0
+    assert coalescer.stats()["queued"] == 2 and coalescer.stats()["failed"] == 2
+    # Eine neuere Nachricht ersetzt den gescheiterten Stand, der Hash bleibt offen
+    assert coalescer.submit(discovery("a", firmware_version="1.1"))
+    assert coalescer.flush() == 2
+    versions = dict(db_session.query(models.Device.device_id, models.Device.firmware_version))
+    assert versions == {"a": "1.1", "b": "1.0"}
+    assert not coalescer.submit(discovery("b", firmware_version="1.0"))
+
+
+def test_welcomes_are_deduplicated_and_sent():
+    sent = []
+    done = threading.Event()
+
+    def publish(device_id):
+        sent.append(device_id)
+        if len(sent) == 2:
+            done.set()
+
+    scheduler = WelcomeScheduler(publish, rate=1000, jitter=0)
+    assert scheduler.schedule("a")
+    assert not scheduler.schedule("a")
+    assert scheduler.schedule("b")
+    scheduler.start()
+    try:
+        assert done.wait(5)
+    finally:
+        scheduler.stop()
+    assert sorted(sent) == ["a", "b"]
+    assert scheduler.stats() == {"pending": 0, "scheduled": 2, "sent": 2, "deduplicated": 1}
+
+
+def test_unchanged_discovery_is_still_welcomed(monkeypatch):
+    manager = get_device_manager()
+    welcomed = []
+    monkeypatch.setattr(manager.welcomes, "schedule", welcomed.append)
+    monkeypatch.setattr(manager.discovery, "submit", lambda payload: False)
+
+    manager._handle_discovery("swissairdry/a/discovery", {"type": "esp32"})
+    manager._handle_discovery("swissairdry/a/discovery", "kein JSON")
+
+    assert welcomed == ["a"]
+
+
+def test_app_only_updates_states_and_leaves_writes_to_bridge(db_session):
+    manager = get_device_manager()
+    db_session.add(models.Device(device_id="app-known", name="Bekannt", type="esp32"))
+    db_session.commit()
+    known_id = db_session.query(models.Device.id).scalar()
+    manager.states.upsert("app-known", id=known_id, name="Bekannt", type="esp32")
+
+    manager.discovery.submit(discovery("app-known", firmware_version="3.0"))
+    manager.discovery.submit(discovery("app-new", firmware_version="1.0"))
+    assert manager.discovery.flush() == 2
+
+    # Die MQTT-Bridge ist der einzige Schreiber
+    assert db_session.query(models.Device).count() == 1
+    known, new = manager.states.get("app-known"), manager.states.get("app-new")
+    assert (known["id"], known["firmware_version"], known["is_online"]) == (known_id, "3.0", True)
+    assert new["id"] is None and new["name"] == "SwissAirDry esp32-app-new"
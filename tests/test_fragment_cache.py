@@ -0,0 +1,89 @@
+"""
+Tests für den Fragment-Cache der Weboberfläche (fragment_cache).
+
+Prüft die Invalidierung nach ORM-, Core- und Bulk-Schreibzugriffen auf die
+Geräte gegen SQLite:
+
+python -m pytest tests/test_fragment_cache.py
+"""
+
+from sqlalchemy import bindparam, insert, update
+
+import models
+from database import SessionLocal
+from fragment_cache import FragmentCache
+
+
+class Renders:
+    """Zählt die Aufrufe der Render-Funktion."""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.count = 0
+
+    def __call__(self):
+        self.count += 1
+        return f"<table>{self.count}</table>"
+
+    def get(self):
+        return self.cache.get_or_render("device_table", self)
+
+
+def make_cache():
+    cache = FragmentCache(ttl=3600)
+    cache.register_model_invalidation(models.Device, "device_table")
+    renders = Renders(cache)
+    renders.get()
+    return cache, renders
+
+
+def test_orm_writes_invalidate_after_commit(db_session):
+    cache, renders = make_cache()
+    session = SessionLocal()
+    try:
+        session.add(models.Device(device_id="a", name="a", type="esp32"))
+        session.flush()
+        # Vor dem Commit bleibt das Fragment gültig
+        assert renders.get() == "<table>1</table>"
+        session.commit()
+        assert renders.get() == "<table>2</table>"
+
+        session.add(models.SensorReading(device_id=session.query(models.Device).one().id, humidity=50.0))
+        session.commit()
+        assert renders.get() == "<table>2</table>"
+    finally:
+        session.close()
+
+
+def test_core_and_bulk_writes_invalidate(db_session):
+    cache, renders = make_cache()
+    devices = models.Device.__table__
+    statements = [
+        (insert(models.Device), [{"device_id": "a", "name": "a", "type": "esp32"}]),
+        (
+            update(devices).where(devices.c.device_id == bindparam("b_device_id")).values(is_online=True),
+            [{"b_device_id": "a"}],
+        ),
+        (update(models.Device).where(models.Device.device_id == "a").values(name="Trockner"), None),
+    ]
+    for number, (statement, rows) in enumerate(statements, start=2):
+        session = SessionLocal()
+        try:
+            session.execute(statement, rows)
+            session.commit()
+        finally:
+            session.close()
+        assert renders.get() == f"<table>{number}</table>"
+
+
+def test_rollback_keeps_fragment(db_session):
+    cache, renders = make_cache()
+    session = SessionLocal()
+    try:
+        session.execute(insert(models.Device), [{"device_id": "a", "name": "a", "type": "esp32"}])
+        session.rollback()
+        session.execute(insert(models.Task), [{"name": "Trocknung", "duration_minutes": 10}])
+        session.commit()
+    finally:
+        session.close()
+    assert renders.get() == "<table>1</table>"
@@ -0,0 +1,349 @@
+"""
+Tests für den Aufgabenplaner (task_scheduler).
+
+Zeitrad und Wanduhr laufen über eine gemeinsame Testuhr; ``tick`` wird
+direkt aufgerufen statt über den Hintergrund-Thread:
+
+python -m pytest tests/test_task_scheduler.py
+"""
+
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy.orm import Query
+
+import models
+from database import SessionLocal
+from device_manager import get_device_manager
+from task_scheduler import TaskScheduler, task_fields
+
+START = datetime(2026, 3, 1, 8, 0)
+
+
+class Clock:
+    """Monotone Uhr und Wanduhr, die gemeinsam vorgestellt werden."""
+
+    def __init__(self):
+        self.seconds = 1000.0
+        self.wall = START
+
+    def monotonic(self):
+        return self.seconds
+
+    def now(self):
+        return self.wall
+
+    def advance(self, seconds):
+        self.seconds += seconds
+        self.wall += timedelta(seconds=seconds)
+
+
+class Dispatch:
+    """Zeichnet gesendete Befehle auf; ``fail`` lässt die nächsten Sendungen scheitern."""
+
+    def __init__(self):
+        self.sent = []
+        self.fail = 0
+
+    def __call__(self, messages):
+        results = []
+        for device_id, command in messages:
+            ok = self.fail <= 0
+            self.fail -= 1
+            if ok:
+                self.sent.append((device_id, command["action"], command["assignment_id"]))
+            results.append(ok)
+        return results
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def dispatch():
+    return Dispatch()
+
+
+@pytest.fixture
+def scheduler(clock, dispatch):
+    return TaskScheduler(dispatch, tick=1.0, clock=clock.monotonic, now=clock.now)
+
+
+def add_assignment(db_session, device_id="dev-1", status="scheduled", start=START, minutes=10, **task_args):
+    device = db_session.query(models.Device).filter_by(device_id=device_id).first()
+    if device is None:
+        device = models.Device(device_id=device_id, name=device_id, type="dryer")
+        db_session.add(device)
+    task = models.Task(name="Trocknung", duration_minutes=minutes, **task_args)
+    db_session.add(task)
+    db_session.flush()
+    assignment = models.TaskAssignment(
+        device_id=device.id, task_id=task.id, status=status,
+        start_time=start, end_time=start + timedelta(minutes=minutes),
+    )
+    db_session.add(assignment)
+    db_session.commit()
+    return assignment, task
+
+
+def stored(db_session, assignment):
+    db_session.expire_all()
+    row = db_session.get(models.TaskAssignment, assignment.id)
+    return row.status, row.progress
+
+
+def test_start_and_stop_at_their_times(db_session, scheduler, clock, dispatch):
+    assignment, task = add_assignment(db_session, start=START + timedelta(seconds=30))
+    changes = []
+    scheduler.add_listener(lambda device_id, snapshot: changes.append((device_id, snapshot["status"])))
+    scheduler.add(assignment.id, "dev-1", task_fields(task), assignment.start_time, assignment.end_time)
+
+    clock.advance(29)
+    assert scheduler.tick() == 0
+    clock.advance(1)
+    assert scheduler.tick() == 1
+    assert dispatch.sent == [("dev-1", "start_task", assignment.id)]
+    assert scheduler.get(assignment.id)["status"] == "running"
+
+    clock.advance(10 * 60)
+    assert scheduler.tick() == 1
+    assert dispatch.sent[-1] == ("dev-1", "stop_task", assignment.id)
+    assert scheduler.get(assignment.id) is None
+    assert changes == [("dev-1", "running"), ("dev-1", "completed")]
+
+    # Beide Übergänge in einem Stapel, der letzte gewinnt
+    assert scheduler.flush() == 1
+    assert stored(db_session, assignment) == ("completed", 100)
+    assert scheduler.stats()["timers"] == 0
+
+
+def test_failed_start_is_retried_until_the_slot_ends(db_session, scheduler, clock, dispatch, monkeypatch):
+    monkeypatch.setattr("task_scheduler.TASK_DISPATCH_RETRY", 60)
+    retried, _ = add_assignment(db_session, start=START + timedelta(seconds=1), minutes=10)
+    given_up, _ = add_assignment(db_session, device_id="dev-2", start=START + timedelta(seconds=1), minutes=1)
+    fields = {"id": 1, "name": "Trocknung", "duration_minutes": 10, "fan_speed": 50}
+    scheduler.add(retried.id, "dev-1", fields, retried.start_time, retried.end_time)
+    scheduler.add(given_up.id, "dev-2", fields, given_up.start_time, given_up.end_time)
+
+    dispatch.fail = 2
+    clock.advance(1)
+    assert scheduler.tick() == 0
+    # Zu wenig Restzeit für einen weiteren Versuch
+    assert scheduler.get(given_up.id) is None
+    assert scheduler.get(retried.id)["status"] == "scheduled"
+
+    clock.advance(59)
+    assert scheduler.tick() == 0
+    clock.advance(1)
+    assert scheduler.tick() == 1
+    assert dispatch.sent == [("dev-1", "start_task", retried.id)]
+    scheduler.flush()
+    assert stored(db_session, retried) == ("running", 0)
+    assert stored(db_session, given_up) == ("failed", 0)
+    assert scheduler.stats()["dispatch_errors"] == 2
+
+
+def test_load_recovers_past_due_rows(db_session, scheduler, clock, dispatch):
+    # Start verpasst, Zeitfenster noch offen: sofort starten
+    late, _ = add_assignment(db_session, start=START - timedelta(minutes=2))
+    # Zeitfenster ohne Start abgelaufen
+    missed, _ = add_assignment(db_session, start=START - timedelta(minutes=20))
+    # Lief beim Ausfall und ist inzwischen zu Ende
+    overdue, _ = add_assignment(db_session, status="running", start=START - timedelta(minutes=20))
+    # Läuft noch und endet planmäßig
+    running, _ = add_assignment(db_session, status="running", start=START - timedelta(minutes=5))
+    done, _ = add_assignment(db_session, status="completed", start=START - timedelta(minutes=5))
+
+    assert scheduler.load() == 4
+    assert scheduler.load() == 0
+    assert scheduler.get(missed.id) is None and scheduler.get(done.id) is None
+
+    clock.advance(1)
+    scheduler.tick()
+    assert sorted(dispatch.sent) == sorted([
+        ("dev-1", "start_task", late.id),
+        ("dev-1", "stop_task", overdue.id),
+    ])
+    clock.advance(5 * 60)
+    scheduler.tick()
+    assert dispatch.sent[-1] == ("dev-1", "stop_task", running.id)
+
+    scheduler.flush()
+    assert stored(db_session, late)[0] == "running"
+    assert stored(db_session, missed)[0] == "failed"
+    assert stored(db_session, overdue) == ("completed", 100)
+    assert stored(db_session, running) == ("completed", 100)
+
+
+def test_failed_flush_is_retried(db_session, scheduler, clock, monkeypatch):
+    assignment, task = add_assignment(db_session)
+    scheduler.add(assignment.id, "dev-1", task_fields(task), assignment.start_time, assignment.end_time, started=True)
+
+    def execute(*args, **kwargs):
+        raise RuntimeError("Schreibfehler")
+
+    def failing_db():
+        db = SessionLocal()
+        db.execute = execute
+        try:
+            yield db
+        finally:
+            db.close()
+
+    with monkeypatch.context() as patch:
+        patch.setattr("task_scheduler.get_db", failing_db)
+        assert scheduler.flush() == 0
+    assert scheduler.stats()["pending"] == 1
+    assert scheduler.stats()["write_errors"] == 1
+    assert stored(db_session, assignment) == ("scheduled", 0)
+
+    # Der nächste Flush holt den Übergang nach
+    assert scheduler.flush() == 1
+    assert stored(db_session, assignment) == ("running", 0)
+
+    # Schlägt er erneut fehl, ersetzt ein neuerer Übergang den gepufferten
+    with monkeypatch.context() as patch:
+        patch.setattr("task_scheduler.get_db", failing_db)
+        clock.advance(5 * 60)
+        assert scheduler.observe("dev-1", {}) == 1
+        assert scheduler.flush() == 0
+    clock.advance(5 * 60)
+    scheduler.tick()
+    assert scheduler.flush() == 1
+    assert stored(db_session, assignment) == ("completed", 100)
+
+
+def test_assign_task_with_offset_aware_start(db_session, monkeypatch):
+    manager = get_device_manager()
+    added = []
+    monkeypatch.setattr(manager.tasks, "add", lambda *args, **kwargs: added.append(args))
+    db_session.add(models.Device(device_id="tz-dev", name="tz-dev", type="dryer"))
+    task = models.Task(name="Trocknung", duration_minutes=30)
+    db_session.add(task)
+    db_session.commit()
+
+    start = (datetime.now(timezone.utc) + timedelta(hours=1)).replace(microsecond=0)
+    assert asyncio.run(manager.assign_task_to_device("tz-dev", task.id, start)) is True
+
+    expected = start.astimezone().replace(tzinfo=None)
+    db_session.expire_all()
+    row = db_session.query(models.TaskAssignment).one()
+    assert row.start_time == expected and row.end_time == expected + timedelta(minutes=30)
+    (assignment_id, device_id, _, start_time, end_time), = added
+    assert (assignment_id, device_id, start_time) == (row.id, "tz-dev", expected)
+
+
+def start_running(scheduler, minutes=100, target_humidity=40.0):
+    fields = {"id": 1, "name": "Trocknung", "duration_minutes": minutes, "fan_speed": 50, "target_humidity": target_humidity}
+    scheduler.add(7, "dev-1", fields, START, START + timedelta(minutes=minutes), started=True)
+    snapshots = []
+    scheduler.add_listener(lambda device_id, snapshot: snapshots.append(snapshot))
+    return snapshots
+
+
+def test_humidity_is_smoothed(scheduler, monkeypatch):
+    monkeypatch.setattr("task_scheduler.TASK_HUMIDITY_SMOOTHING", 0.3)
+    snapshots = start_running(scheduler)
+
+    # Der erste Messwert ist der Ausgangswert und ändert nichts
+    assert scheduler.observe("dev-1", {"humidity": 80.0}) == 0
+    assert scheduler.observe("dev-1", {"humidity": 60.0}) == 1
+    # 80 + 0.3 * (60 - 80) = 74, also 6 von 40 Prozentpunkten bis zum Ziel
+    assert snapshots[-1]["humidity"] == pytest.approx(74.0)
+    assert snapshots[-1]["progress"] == 15
+    # Ungültige Werte werden ignoriert
+    assert scheduler.observe("dev-1", {"humidity": "nass"}) == 0
+    assert scheduler.observe("dev-1", {"humidity": True}) == 0
+    assert scheduler.observe("dev-2", {"humidity": 10.0}) == 0
+
+
+def test_progress_never_decreases(scheduler, clock, monkeypatch):
+    monkeypatch.setattr("task_scheduler.TASK_HUMIDITY_SMOOTHING", 0.3)
+    snapshots = start_running(scheduler)
+    scheduler.observe("dev-1", {"humidity": 80.0})
+    scheduler.observe("dev-1", {"humidity": 60.0})
+
+    # Die Feuchte steigt wieder: der Fortschritt bleibt stehen
+    assert scheduler.observe("dev-1", {"humidity": 95.0}) == 0
+    assert scheduler.get(7)["progress"] == 15
+
+    # Ohne Feuchte zählt die verstrichene Zeit
+    clock.advance(30 * 60)
+    assert scheduler.observe("dev-1", {"temperature": 20.0}) == 1
+    assert scheduler.get(7)["progress"] == 30
+    # Vor dem Abschluss höchstens 99
+    clock.advance(100 * 60)
+    scheduler.observe("dev-1", {})
+    assert scheduler.get(7)["progress"] == 99
+    progress = [snapshot["progress"] for snapshot in snapshots]
+    assert progress == sorted(progress)
+
+
+def test_target_confirmations_stop_early(scheduler, clock, dispatch, monkeypatch):
+    monkeypatch.setattr("task_scheduler.TASK_HUMIDITY_SMOOTHING", 0.3)
+    monkeypatch.setattr("task_scheduler.TASK_TARGET_CONFIRMATIONS", 3)
+    snapshots = start_running(scheduler, target_humidity=40.0)
+    scheduler.observe("dev-1", {"humidity": 45.0})
+
+    # Geglättet: 40.5, 37.35 (1), 35.1 (2), dann ein Ausreißer auf 42.6 (zurück auf 0)
+    for humidity in (30.0, 30.0, 30.0, 60.0):
+        scheduler.observe("dev-1", {"humidity": humidity})
+        clock.advance(1)
+        assert scheduler.tick() == 0
+
+    # 38.8 (1), 36.2 (2), 34.3 (3): Ziel bestätigt
+    for humidity in (30.0, 30.0):
+        scheduler.observe("dev-1", {"humidity": humidity})
+    clock.advance(1)
+    assert scheduler.tick() == 0
+    scheduler.observe("dev-1", {"humidity": 30.0})
+    clock.advance(1)
+    assert scheduler.tick() == 1
+
+    assert dispatch.sent == [("dev-1", "stop_task", 7)]
+    assert snapshots[-1]["status"] == "completed" and snapshots[-1]["progress"] == 100
+    assert scheduler.get(7) is None
+    assert scheduler.stats()["targets_reached"] == 1
+
+
+def test_start_after_idle_period_waits_for_start_time(db_session, scheduler, clock, dispatch):
+    """Ein erst nach langer Pause gewählter Leader darf geplante Starts nicht vorziehen."""
+    clock.advance(2 * 3600)
+    assignment, _ = add_assignment(db_session, start=clock.wall + timedelta(hours=1))
+
+    assert scheduler.load() == 1
+    clock.advance(1)
+    assert scheduler.tick() == 0
+    clock.advance(3598)
+    assert scheduler.tick() == 0
+    clock.advance(1)
+    assert scheduler.tick() == 1
+    assert dispatch.sent == [("dev-1", "start_task", assignment.id)]
+
+
+def test_load_skips_assignments_finished_during_query(db_session, scheduler, clock, dispatch, monkeypatch):
+    assignment, task = add_assignment(db_session, status="running", start=START - timedelta(minutes=5))
+    scheduler.add(assignment.id, "dev-1", task_fields(task), assignment.start_time, assignment.end_time, started=True)
+    query_all = Query.all
+
+    def racing_all(query):
+        # Nachdem die Zeilen gelesen sind, endet die Aufgabe und wird geschrieben
+        rows = query_all(query)
+        monkeypatch.setattr(Query, "all", query_all)
+        clock.advance(5 * 60)
+        scheduler.tick()
+        scheduler.flush()
+        return rows
+
+    monkeypatch.setattr(Query, "all", racing_all)
+    assert scheduler.load() == 0
+    assert dispatch.sent == [("dev-1", "stop_task", assignment.id)]
+    assert stored(db_session, assignment) == ("completed", 100)
+
+    clock.advance(60)
+    scheduler.tick()
+    assert dispatch.sent == [("dev-1", "stop_task", assignment.id)]
+    assert scheduler.get(assignment.id) is None
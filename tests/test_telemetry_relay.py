@@ -0,0 +1,97 @@
+"""
+Tests für die Weiterleitung des Live-Telemetriestroms zwischen Workern.
+
+Ein per fork gestarteter Leader-Prozess veröffentlicht Ereignisse; der
+Testprozess ist Follower und muss sie über den Befehls-Socket der
+Leader-Wahl an seine eigenen SSE-Abonnenten weitergeben (Datei-Sperre,
+wie unter SQLite):
+
+python -m pytest tests/test_telemetry_relay.py
+"""
+
+import json
+import multiprocessing
+import time
+
+import pytest
+
+from leader_election import LeaderElection
+from telemetry_stream import TelemetryRelay, TelemetryStream
+
+
+def run_leader(runtime_dir, ready):
+    election = LeaderElection(runtime_dir=runtime_dir, heartbeat=0.2)
+    stream = TelemetryStream()
+    election.register_feed("stream_events", lambda: stream.tail(heartbeat=0.2))
+    election.start()
+    assert election.is_leader
+    ready.set()
+    number = 0
+    while True:
+        number += 1
+        stream.publish("leader-dev", "telemetry", {"n": number})
+        time.sleep(0.05)
+
+
+def next_event(subscription, deadline=5.0):
+    started = time.monotonic()
+    for frame in subscription:
+        if frame.startswith("id: "):
+            lines = frame.splitlines()
+            return lines[1][7:], json.loads(lines[2][6:])
+        assert time.monotonic() - started < deadline, "kein Ereignis empfangen"
+
+
+@pytest.fixture
+def leader_process(tmp_path):
+    context = multiprocessing.get_context("fork")
+    ready = context.Event()
+    process = context.Process(target=run_leader, args=(str(tmp_path), ready), daemon=True)
+    process.start()
+    assert ready.wait(10)
+    yield process
+    if process.is_alive():
+        process.kill()
+    process.join(5)
+
+
+def test_follower_relays_leader_events(tmp_path, leader_process):
+    election = LeaderElection(runtime_dir=str(tmp_path), heartbeat=0.2)
+    election.start()
+    stream = TelemetryStream(max_rate=0, heartbeat=0.1, max_duration=10)
+    relay = TelemetryRelay(stream, lambda: election.follow("stream_events", timeout=1), lambda: election.is_leader, retry=0.1)
+    try:
+        assert not election.is_leader
+        relay.start()
+
+        subscription = stream.subscribe(topics={"telemetry"})
+        topic, body = next_event(subscription)
+        assert topic == "telemetry" and body["device_id"] == "leader-dev"
+        first = body["data"]["n"]
+        _, body = next_event(subscription)
+        assert body["data"]["n"] > first
+
+        # Nach dem Ausfall übernimmt der Follower; seine eigenen Ereignisse bleiben lokal
+        leader_process.kill()
+        leader_process.join(5)
+        deadline = time.monotonic() + 5
+        while not election.is_leader:
+            assert time.monotonic() < deadline, "keine Übernahme"
+            time.sleep(0.05)
+        relayed = relay.relayed
+        stream.publish("local-dev", "telemetry", {"n": 0})
+        while True:
+            _, body = next_event(subscription)
+            if body["device_id"] == "local-dev":
+                break
+        time.sleep(0.3)
+        assert relay.relayed == relayed
+    finally:
+        relay.stop()
+        election.stop()
+
+
+def test_follow_unknown_feed_is_rejected(tmp_path, leader_process):
+    election = LeaderElection(runtime_dir=str(tmp_path), heartbeat=0.2)
+    with pytest.raises(RuntimeError, match="Unknown feed"):
+        next(election.follow("missing", timeout=1))
@@ -0,0 +1,54 @@
+"""
+Tests für den Live-Telemetriestrom (telemetry_stream).
+
+Prüft die Wiederaufnahme per Last-Event-ID über den Ringpuffer, auch wenn
+ein Abonnent hinter den Puffer zurückgefallen ist:
+
+python -m pytest tests/test_telemetry_stream.py
+"""
+
+import json
+
+from telemetry_stream import TelemetryStream
+
+
+def frames(subscription, count):
+    """Liest ``count`` Ereignis-Frames und überspringt Retry und Keep-alive."""
+    result = []
+    for frame in subscription:
+        if frame.startswith("id: "):
+            lines = frame.splitlines()
+            result.append((lines[0][4:], lines[1][7:], json.loads(lines[2][6:])))
+            if len(result) == count:
+                return result
+    return result
+
+
+def test_resume_reads_only_new_events():
+    stream = TelemetryStream(buffer_size=4, max_rate=0, heartbeat=0.05, max_duration=5)
+    for number in range(1, 7):
+        stream.publish(f"dev-{number}", "telemetry", {"n": number})
+
+    # Ereignis 2 ist bereits überschrieben, der Puffer hält nur 3 bis 6
+    subscription = stream.subscribe(last_event_id=f"{stream.epoch}-1")
+    received = frames(subscription, 4)
+    assert [event_id for event_id, _, _ in received] == [f"{stream.epoch}-{n}" for n in range(3, 7)]
+
+    stream.publish("dev-1", "status", {"online": True})
+    stream.publish("dev-1", "telemetry", {"n": 7})
+    (event_id, topic, body), = frames(subscription, 1)
+    assert event_id == f"{stream.epoch}-7" and topic == "status" and body["data"] == {"online": True}
+
+
+def test_filters_and_unknown_event_id():
+    stream = TelemetryStream(buffer_size=8, max_rate=0, heartbeat=0.05, max_duration=5)
+    stream.publish("old", "telemetry", {})
+
+    # Unbekannte Epoche: nur Live-Ereignisse
+    subscription = stream.subscribe(devices={"a"}, topics={"task"}, last_event_id="0-1")
+    next(subscription)
+    stream.publish("a", "telemetry", {"n": 1})
+    stream.publish("b", "task", {"n": 2})
+    stream.publish("a", "task", {"n": 3})
+    (_, topic, body), = frames(subscription, 1)
+    assert (topic, body["device_id"], body["data"]) == ("task", "a", {"n": 3})
@@ -0,0 +1,116 @@
+"""
+Tests für das hierarchische Timing-Wheel (timing_wheel).
+
+Vergleicht die Ablaufzeitpunkte mit einer einfachen Referenz, auch für
+Fristen jenseits der obersten Ebene:
+
+python -m pytest tests/test_timing_wheel.py
+"""
+
+import os
+import sys
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from timing_wheel import TimingWheel  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_wheel(**kwargs):
+    clock = FakeClock()
+    return TimingWheel(clock=clock, **kwargs), clock
+
+
+def test_expires_after_delay():
+    wheel, clock = make_wheel()
+    wheel.schedule("a", 5)
+    clock.now = 4.5
+    assert wheel.advance() == []
+    clock.now = 5.0
+    assert wheel.advance() == ["a"]
+    assert "a" not in wheel
+
+
+def test_reschedule_replaces_timer():
+    wheel, clock = make_wheel()
+    wheel.schedule("a", 3)
+    clock.now = 2
+    wheel.advance()
+    wheel.schedule("a", 3)
+    clock.now = 4
+    assert wheel.advance() == []
+    clock.now = 5
+    assert wheel.advance() == ["a"]
+    assert len(wheel) == 0
+
+
+def test_cancel():
+    wheel, clock = make_wheel()
+    wheel.schedule("a", 2)
+    assert wheel.cancel("a")
+    assert not wheel.cancel("a")
+    clock.now = 10
+    assert wheel.advance() == []
+
+
+def test_remaining():
+    wheel, clock = make_wheel()
+    wheel.schedule("a", 10)
+    clock.now = 4
+    assert wheel.remaining("a") == 6
+    assert wheel.remaining("b") is None
+
+
+def test_matches_reference_across_levels():
+    """Kleine Ebenen erzwingen Kaskaden und Fristen über den Gesamtbereich hinaus."""
+    wheel, clock = make_wheel(bits=3, levels=3)
+    rng = random.Random(7)
+    deadlines = {}
+    for _ in range(5000):
+        step = rng.choice([1, 1, 2, 5])
+        clock.now += step
+        for key in wheel.advance():
+            # Weder zu früh noch später als der erste Tick nach der Frist
+            assert clock.now - step < deadlines.pop(key) <= clock.now
+        for key, deadline in deadlines.items():
+            assert deadline > clock.now, key
+        for _ in range(rng.randint(0, 3)):
+            key = rng.randint(0, 200)
+            delay = rng.choice([1, 7, 40, 300, 2000])
+            wheel.schedule(key, delay)
+            deadlines[key] = clock.now + delay
+        if rng.random() < 0.2:
+            key = rng.randint(0, 200)
+            wheel.cancel(key)
+            deadlines.pop(key, None)
+    assert len(wheel) == len(deadlines)
+
+
+def test_schedule_after_idle_period():
+    """Ein lange nicht weitergeschaltetes Rad darf neue Timer nicht vorzeitig ablaufen lassen."""
+    wheel, clock = make_wheel()
+    clock.now = 7200
+    wheel.schedule("a", 3600)
+    clock.now = 7201
+    assert wheel.advance() == []
+    assert wheel.remaining("a") == 3599
+
+    # Auch wenn noch alte Timer auf dem Weg liegen
+    wheel, clock = make_wheel()
+    wheel.schedule("old", 10)
+    clock.now = 7200
+    wheel.schedule("new", 3600)
+    clock.now = 7201
+    assert wheel.advance() == ["old"]
+    clock.now = 10799
+    assert wheel.advance() == []
+    clock.now = 10800
+    assert wheel.advance() == ["new"]
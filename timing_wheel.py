@@ -0,0 +1,158 @@
+"""
+Hierarchical timing wheel for the SwissAirDry platform.
+
+Keeps large numbers of timeouts (device heartbeats, pending acknowledgements)
+with O(1) scheduling and cancellation. Advancing the wheel only touches the
+slot of the current tick plus an occasional cascade from a coarser level, so
+the cost per tick does not depend on how many timers are pending.
+"""
+import time
+import threading
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+class TimingWheel:
+    """
+    Thread-safe hierarchical timing wheel keyed by arbitrary hashable keys.
+
+    Level 0 has one slot per tick; each further level covers ``slots`` times
+    the range of the level below. A timer is placed on the lowest level whose
+    range still distinguishes its deadline from the current tick and moves
+    down a level ("cascades") whenever the wheel below wraps around. Each key
+    has at most one timer; scheduling a key again replaces its timer.
+    """
+
+    def __init__(
+        self,
+        tick: float = 1.0,
+        bits: int = 6,
+        levels: int = 4,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        """
+        Initialize the wheel.
+
+        Args:
+            tick: Resolution in seconds
+            bits: log2 of the number of slots per level
+            levels: Number of levels; deadlines beyond the range of the top
+                level are kept there and re-placed on every rotation
+            clock: Monotonic time source in seconds
+        """
+        self.tick = tick
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._levels = levels
+        self._clock = clock
+        self._origin = clock()
+        self._current = 0
+        self._wheel: List[List[Dict[Hashable, int]]] = [
+            [{} for _ in range(1 << bits)] for _ in range(levels)
+        ]
+        self._timers: Dict[Hashable, Tuple[int, int, int]] = {}  # key -> (level, slot, deadline)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._timers)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._timers
+
+    def _place(self, key: Hashable, deadline: int) -> None:
+        # Lowest level on which deadline and current tick share all higher digits
+        level = max(0, ((deadline ^ self._current).bit_length() - 1) // self._bits)
+        level = min(level, self._levels - 1)
+        slot = (deadline >> (level * self._bits)) & self._mask
+        self._wheel[level][slot][key] = deadline
+        self._timers[key] = (level, slot, deadline)
+
+    def _remove(self, key: Hashable) -> Optional[int]:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return None
+        level, slot, deadline = timer
+        del self._wheel[level][slot][key]
+        return deadline
+
+    def schedule(self, key: Hashable, delay: float) -> None:
+        """
+        Start or restart the timer of a key.
+
+        The deadline counts from the clock, not from the last ``advance``, so
+        a wheel that sat idle (e.g. in a worker that was not the leader) does
+        not expire new timers early on its next advance.
+
+        Args:
+            key: Timer key
+            delay: Seconds until the timer expires (rounded up to whole ticks)
+        """
+        ticks = max(1, -int(-delay // self.tick))
+        with self._lock:
+            self._remove(key)
+            now = int((self._clock() - self._origin) // self.tick)
+            if now > self._current and not self._timers:
+                # Nothing can expire on the way, skip the idle ticks at once
+                self._current = now
+            self._place(key, max(now, self._current) + ticks)
+
+    def cancel(self, key: Hashable) -> bool:
+        """
+        Cancel the timer of a key.
+
+        Returns:
+            bool: True if a timer was pending
+        """
+        with self._lock:
+            return self._remove(key) is not None
+
+    def remaining(self, key: Hashable) -> Optional[float]:
+        """
+        Return the seconds until a key expires, or None if no timer is pending.
+        """
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                return None
+            return max(0.0, self._origin + timer[2] * self.tick - self._clock())
+
+    def advance(self, now: Optional[float] = None) -> List[Hashable]:
+        """
+        Advance the wheel to the current time and collect the expired timers.
+
+        Args:
+            now: Time of the clock to advance to (default: now)
+
+        Returns:
+            List[Hashable]: Keys whose timers expired, in deadline order
+        """
+        now = self._clock() if now is None else now
+        target = int((now - self._origin) // self.tick)
+        expired: List[Hashable] = []
+        with self._lock:
+            while self._current < target:
+                if not self._timers:
+                    self._current = target
+                    break
+                self._current += 1
+                self._cascade()
+                slot = self._wheel[0][self._current & self._mask]
+                if slot:
+                    expired.extend(slot)
+                    for key in slot:
+                        del self._timers[key]
+                    slot.clear()
+        return expired
+
+    def _cascade(self) -> None:
+        # Coarser levels first, so re-placed timers can land in the finer slots
+        # that are cascaded next
+        current = self._current
+        for level in range(self._levels - 1, 0, -1):
+            if current & ((1 << (level * self._bits)) - 1):
+                continue
+            slot = self._wheel[level][(current >> (level * self._bits)) & self._mask]
+            if not slot:
+                continue
+            timers = list(slot.items())
+            slot.clear()
+            for key, deadline in timers:
+                self._place(key, deadline)